@@ -0,0 +1 @@
+# Benchmarks of the ingest and serving paths, see run_benchmarks.py
@@ -0,0 +1,416 @@
+# Benchmarks of the ingest and serving paths on synthetic filings
+#
+# Run from the repository root:
+#   python -m benchmarks.run_benchmarks                 compare with the stored baselines
+#   python -m benchmarks.run_benchmarks --save          store the results as the new baselines
+#   python -m benchmarks.run_benchmarks --mongo         push and read a real mongod (CI_MONGO_URI)
+#   python -m benchmarks.run_benchmarks --layout single_collection   DB cases on the other storage layout
+#   python -m benchmarks.run_benchmarks parse_10k       run only some cases
+# Every case runs in its own process so that its peak RSS is its own. The exit code is
+# 1 when a case is slower or bigger than its baseline by more than the tolerance
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import (Callable,
+                    Dict,
+                    List,
+                    Tuple,
+                    )
+from benchmarks.synthetic_filing import (generate_filing,
+                                         write_ticker_filings,
+                                         )
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+# Ticker (collection) used for the DB cases, dropped afterwards with --mongo
+BENCH_TICKER = 'zzbench'
+
+
+class _StubCollection:
+    """
+    In memory stand-in of a pymongo collection with the calls the code under test
+    makes, so the DB cases measure our side of the driver without a server
+    """
+
+    def __init__(self):
+        self.documents: List[dict] = []
+        self.name = BENCH_TICKER
+
+    def create_index(self, *args, **kwargs):
+        return kwargs.get('name')
+
+    def bulk_write(self, requests, ordered=True):
+        class Result:
+            upserted_count = len(requests)
+            modified_count = 0
+            matched_count = 0
+        return Result()
+
+    def find(self, query=None, projection=None):
+        return iter(self.documents)
+
+
+def _stub_client(documents: List[dict]) -> Dict[str, Dict[str, _StubCollection]]:
+    """
+    :return: client[db][collection] holding the collection of the ticker in the
+             storage layout of CI_MONGO_STORAGE_LAYOUT with the documents
+    :rtype: dict
+    """
+    from ci_rest_api_server.support_libs.extractor.StorageLayout import StorageLayout
+    collection = _StubCollection()
+    collection.documents = documents
+    return {'10-K': {StorageLayout.from_env().collection_name(BENCH_TICKER): collection}}
+
+
+def _mongo_client():
+    from ci_rest_api_server.support_libs.extractor.SharedMongoClient import SharedMongoClient
+    return SharedMongoClient.get()
+
+
+def _drop_bench_ticker(client):
+    """
+    Removes the records of the benchmark ticker from a real mongod
+    """
+    from ci_rest_api_server.support_libs.extractor.StorageLayout import StorageLayout
+    layout = StorageLayout.from_env()
+    if layout.single_collection:
+        client['10-K'][layout.collection_name(BENCH_TICKER)].delete_many(layout.ticker_filter(BENCH_TICKER))
+    else:
+        client['10-K'].drop_collection(BENCH_TICKER)
+
+
+def _year_documents(years: int) -> List[dict]:
+    from ci_rest_api_server.support_libs.extractor.P10kParser import Parse10KForm
+    from ci_rest_api_server.support_libs.extractor.StorageLayout import StorageLayout
+    layout = StorageLayout.from_env()
+    return [layout.document_fields(BENCH_TICKER,
+                                   dict({field: 10 ** 11 + index
+                                         for index, field in enumerate(Parse10KForm.FACT_FIELDS)},
+                                        **{'filing-type': '10-K', 'filing-year': 2010 + year,
+                                           'ticker': BENCH_TICKER}))
+            for year in range(years)]
+
+
+def prepare_inputs(workdir: str,
+                   options: argparse.Namespace):
+    """
+    Writes the synthetic filings of all the cases, once and in the parent process so
+    that generating them counts neither in the timings nor in the peak RSS of a case
+    """
+    from ci_rest_api_server.support_libs.extractor.FilingHandle import FilingHandle
+    for file_name, inline in (('filing_inline.txt', True), ('filing.txt', False)):
+        filing = generate_filing(size_bytes=options.size_mb * 1024 * 1024,
+                                 tag_density=options.tag_density,
+                                 inline=inline)
+        with open(os.path.join(workdir, file_name), 'wb') as file:
+            file.write(filing)
+    # filing.txt as stored by EdgarDownloader with compression
+    for compression in FilingHandle.COMPRESSED_SUFFIXES.values():
+        with open(os.path.join(workdir, 'filing.txt' + FilingHandle.suffix_of(compression)), 'wb') as file:
+            file.write(FilingHandle.compress(filing, compression))
+    write_ticker_filings(workdir, BENCH_TICKER, list(range(2018 - options.years + 1, 2019)),
+                         size_bytes=options.size_mb * 1024 * 1024,
+                         tag_density=options.tag_density)
+
+
+# Each case loads its inputs from workdir and returns the function to time and its cleanup
+
+def case_header(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    Form type and year sniffing of a filing, done for every file of every ingest
+    """
+    from ci_rest_api_server.support_libs.extractor.GFormParse import GeneralFormParser
+    path = os.path.join(workdir, 'filing.txt')
+    return lambda: GeneralFormParser.get_form_type_and_filing_year(path), lambda: None
+
+
+def case_header_gzip(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    Header sniffing of a gzip stored filing, only its start is decompressed
+    """
+    from ci_rest_api_server.support_libs.extractor.GFormParse import GeneralFormParser
+    path = os.path.join(workdir, 'filing.txt.gz')
+    return lambda: GeneralFormParser.get_form_type_and_filing_year(path), lambda: None
+
+
+def case_import_app(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    Startup of an API process: import of the app in a fresh interpreter, whose import
+    graph must not reach the ingestion stack (python -X importtime lists it)
+    """
+    import subprocess
+    command = [sys.executable, '-c', 'import ci_rest_api_server.app']
+    return lambda: subprocess.run(command, check=True), lambda: None
+
+
+def case_log_records(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    10000 debug records of a hot loop through the extractor logger, as seen by the
+    thread logging them (the listener thread writes the file)
+    """
+    os.environ['CI_EXTRACTOR_LOG'] = os.path.join(workdir, 'Extractor.log')
+    from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+
+    def log_records():
+        for index in range(10000):
+            logger.debug("Skipping non integer value %r for %s", str(index), 'us-gaap:assets')
+    return log_records, lambda: None
+
+
+def _case_parse_10k(workdir: str, options: argparse.Namespace, inline: bool,
+                    file_name: str = 'filing.txt') -> Tuple[Callable, Callable]:
+    from ci_rest_api_server.support_libs.extractor.P10kParser import Parse10KForm
+    path = os.path.join(workdir, 'filing_inline.txt' if inline else file_name)
+    parser = Parse10KForm()
+    return lambda: parser.get_form_data(file_path=path, year=2018, ticker='aapl'), lambda: None
+
+
+def case_parse_10k(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    Fact extraction of one 10-K with an EX-101.INS instance
+    """
+    return _case_parse_10k(workdir, options, inline=False)
+
+
+def case_parse_10k_inline(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    Fact extraction of one inline XBRL 10-K
+    """
+    return _case_parse_10k(workdir, options, inline=True)
+
+
+def case_parse_10k_gzip(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    Fact extraction of the parse_10k filing stored gzip compressed
+    """
+    return _case_parse_10k(workdir, options, inline=False, file_name='filing.txt.gz')
+
+
+def case_parse_10k_zstd(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    Fact extraction of the parse_10k filing stored zstd compressed
+    """
+    return _case_parse_10k(workdir, options, inline=False, file_name='filing.txt.zst')
+
+
+def case_parse_form(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    All the years of a ticker, header sniffing and extraction, in this process
+    """
+    from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+    extractor = ExtractParseForms(workdir)
+    return lambda: extractor.parse_form(BENCH_TICKER, '10-K', workers=options.workers), lambda: None
+
+
+def case_push_to_db(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    Bulk upsert of the years of a ticker
+    """
+    from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+    from ci_rest_api_server.support_libs.extractor.FinancialFacts import FinancialFacts
+    records = [FinancialFacts.from_dict(document['data']) for document in _year_documents(options.years)]
+    extractor = ExtractParseForms(workdir)
+    if options.mongo:
+        client = _mongo_client()
+        cleanup = lambda: _drop_bench_ticker(client)
+    else:
+        stub = _stub_client([])
+        extractor.open_db_connection = lambda db_name, collection_name: stub[db_name][collection_name]
+        cleanup = lambda: None
+    return lambda: extractor.push_to_db(records), cleanup
+
+
+def _case_route(workdir: str, options: argparse.Namespace, cold: bool) -> Tuple[Callable, Callable]:
+    from unittest import mock
+    from ci_rest_api_server.app import (app,
+                                        response_cache,
+                                        )
+    from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+    documents = _year_documents(options.years)
+    if options.mongo:
+        client = _mongo_client()
+        ExtractParseForms('None').push_to_db([document['data'] for document in documents])
+        cleanup = lambda: _drop_bench_ticker(client)
+    else:
+        patcher = mock.patch('ci_rest_api_server.support_libs.extractor.SharedMongoClient.SharedMongoClient.get',
+                             return_value=_stub_client(documents))
+        patcher.start()
+        cleanup = patcher.stop
+    test_client = app.test_client()
+
+    def get_ticker():
+        if cold:
+            response_cache.clear()
+        response = test_client.get(f'/security/10-k/{BENCH_TICKER}/',
+                                   headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200, response.status_code
+    return get_ticker, cleanup
+
+
+def case_route_cold(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    GET /security/10-k/<ticker>/ with an empty response cache: DB read, json and compression
+    """
+    return _case_route(workdir, options, cold=True)
+
+
+def case_route_warm(workdir: str, options: argparse.Namespace) -> Tuple[Callable, Callable]:
+    """
+    GET /security/10-k/<ticker>/ served from the response cache
+    """
+    return _case_route(workdir, options, cold=False)
+
+
+CASES = {name[len('case_'):]: case for name, case in sorted(globals().items())
+         if name.startswith('case_')}
+
+
+def _peak_rss_mb() -> float:
+    # linux keeps ru_maxrss across exec so a spawned child would report the peak of its
+    # parent, the high water mark of /proc belongs to the address space of the child
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def _run_case(name: str,
+              workdir: str,
+              options: argparse.Namespace,
+              results: 'multiprocessing.Queue'):
+    """
+    Child process body: builds the case, runs it once to warm up then times the repeats
+    """
+    # read by ExtractParseForms when the case creates it
+    os.environ['CI_MONGO_STORAGE_LAYOUT'] = options.layout
+    try:
+        run, cleanup = CASES[name](workdir, options)
+        try:
+            run()
+            timings = []
+            for _ in range(options.repeat):
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+        finally:
+            cleanup()
+        results.put({'median_ms': round(statistics.median(timings) * 1000, 3),
+                     'min_ms': round(min(timings) * 1000, 3),
+                     'peak_rss_mb': round(_peak_rss_mb(), 1)})
+    except BaseException as err:
+        results.put({'error': repr(err)})
+        raise
+
+
+def run_cases(names: List[str],
+              options: argparse.Namespace) -> Dict[str, dict]:
+    """
+    :return: case name to its median and min time and peak RSS
+    :rtype: dict
+    """
+    workdir = tempfile.mkdtemp(prefix='ci_benchmarks_')
+    # a fresh interpreter per case, nothing allocated by a case is seen by the next one
+    context = multiprocessing.get_context('spawn')
+    case_results = {}
+    try:
+        prepare_inputs(workdir, options)
+        for name in names:
+            queue = context.Queue()
+            process = context.Process(target=_run_case, args=(name, workdir, options, queue))
+            process.start()
+            case_results[name] = queue.get()
+            process.join()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return case_results
+
+
+def compare(case_results: Dict[str, dict],
+            baselines: Dict[str, dict],
+            tolerance: float,
+            min_delta: float = 1.0) -> List[str]:
+    """
+    :param min_delta: smaller differences (ms or MB) are noise whatever the tolerance
+    :type min_delta: float
+    :return: one message per case slower or bigger than its baseline by more than tolerance
+    :rtype: List[str]
+    """
+    regressions = []
+    for name, result in case_results.items():
+        baseline = baselines.get(name)
+        if baseline is None or 'error' in result:
+            continue
+        for metric in ('median_ms', 'peak_rss_mb'):
+            if (result[metric] > baseline[metric] * (1 + tolerance)
+                    and result[metric] - baseline[metric] > min_delta):
+                regressions.append(f"{name}: {metric} {result[metric]} > baseline {baseline[metric]} "
+                                   f"+{tolerance:.0%}")
+    return regressions
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks of the ingest and serving paths')
+    parser.add_argument('cases', nargs='*',
+                        help=f"cases to run, all by default: {', '.join(sorted(CASES))}")
+    parser.add_argument('--size-mb', type=int, default=10, help='size of each synthetic filing')
+    parser.add_argument('--tag-density', type=float, default=2.0, help='XBRL facts per KB of filing')
+    parser.add_argument('--years', type=int, default=10, help='filings per ticker')
+    parser.add_argument('--workers', type=int, default=1, help='parse_form worker processes')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per case')
+    parser.add_argument('--mongo', action='store_true', help='use the mongod of CI_MONGO_URI instead of a stub')
+    parser.add_argument('--layout', default=os.environ.get('CI_MONGO_STORAGE_LAYOUT') or 'per_ticker',
+                        choices=('per_ticker', 'single_collection'), help='storage layout of the DB cases')
+    parser.add_argument('--baselines', default=BASELINES_PATH, help='baselines json file')
+    parser.add_argument('--save', action='store_true', help='store the results as the baselines')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before failing')
+    parser.add_argument('--min-delta', type=float, default=1.0,
+                        help='ms or MB over the baseline always allowed, for the sub millisecond cases')
+    options = parser.parse_args(argv)
+
+    names = options.cases or sorted(CASES)
+    unknown = set(names) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases {sorted(unknown)}")
+    case_results = run_cases(names, options)
+    try:
+        with open(options.baselines) as file:
+            baselines = json.load(file)
+    except FileNotFoundError:
+        baselines = {}
+
+    print(f"{'case':<18}{'median ms':>12}{'min ms':>12}{'peak RSS MB':>14}{'baseline ms':>14}")
+    for name, result in case_results.items():
+        if 'error' in result:
+            print(f"{name:<18}  failed {result['error']}")
+            continue
+        baseline_ms = baselines.get(name, {}).get('median_ms', '-')
+        print(f"{name:<18}{result['median_ms']:>12}{result['min_ms']:>12}{result['peak_rss_mb']:>14}{baseline_ms:>14}")
+
+    if options.save:
+        baselines.update({name: result for name, result in case_results.items() if 'error' not in result})
+        with open(options.baselines, 'w') as file:
+            json.dump(baselines, file, indent=1, sort_keys=True)
+            file.write('\n')
+        print(f"Saved baselines to {options.baselines}")
+        return 0
+    regressions = compare(case_results, baselines, options.tolerance, options.min_delta)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    failed = any('error' in result for result in case_results.values())
+    return 1 if regressions or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+# Generator of synthetic SEC full submission files for benchmarks and offline tests
+import os
+import random
+from typing import (Dict,
+                    List,
+                    Optional,
+                    )
+from ci_rest_api_server.support_libs.extractor.P10kParser import Parse10KForm
+
+# Lines of the primary html document and of the uuencoded exhibits used as filler
+_HTML_LINE = (b'<p style="font-family:Helvetica;font-size:10pt">The Company designs, manufactures and '
+              b'markets mobile communication and media devices and personal computers.</p>\n')
+_UUENCODED_LINE = b'M' + b'4' * 60 + b'\n'
+
+
+def fact_value(field: str,
+               year: int) -> int:
+    """
+    Value of a requested fact in the synthetic filings, known to the benchmark checks
+    :param field: field name e.g assets
+    :type field: str
+    :param year: year of the context
+    :type year: int
+    :return: the value written in the filing
+    :rtype: int
+    """
+    return (sum(field.encode()) * 1000003 + year) * 1000
+
+
+def generate_filing(size_bytes: int = 10 * 1024 * 1024,
+                    tag_density: float = 2.0,
+                    year: int = 2018,
+                    form_type: str = '10-K',
+                    inline: bool = False,
+                    seed: int = 0,
+                    fields: Optional[List[str]] = None) -> bytes:
+    """
+    Builds a full submission .txt file shaped like the EDGAR ones: the SEC header, the
+    html primary document, uuencoded graphics and the XBRL instance (EX-101.INS) or,
+    with inline, the facts tagged inside the primary document.
+    Every requested field is reported for the year and the year before, with segment
+    (Member) contexts and many facts no parser asks for around them. The contexts end
+    on September 30 of their year and are defined with the usd unit before the facts
+    :param size_bytes: approximate size of the whole file
+    :type size_bytes: int
+    :param tag_density: XBRL facts per KB of the file
+    :type tag_density: float
+    :param year: fiscal year of the report, the filing is dated a month after its end
+    :type year: int
+    :param form_type: 10-K or 10-Q (reporting fiscal Q2)
+    :type form_type: str
+    :param inline: facts as ix:nonFraction tags of the primary document
+    :type inline: bool
+    :param seed: random seed, the same arguments always give the same bytes
+    :type seed: int
+    :param fields: requested fields written with fact_value(), default Parse10KForm.FACT_FIELDS
+    :type fields: List[str]
+    :return: the file content
+    :rtype: bytes
+    """
+    rng = random.Random(seed)
+    fields = list(fields if fields is not None else Parse10KForm.FACT_FIELDS)
+    quarter = 'Q4' if form_type == '10-K' else 'Q2'
+    contexts = [f'FI{year}{quarter}', f'FI{year - 1}Q4']
+    fact_count = max(int(size_bytes / 1024 * tag_density), 2 * len(fields))
+    facts: List[bytes] = []
+    for index in range(fact_count):
+        if index < 2 * len(fields):
+            name = fields[index // 2]
+            context = contexts[index % 2]
+            value = fact_value(name, int(context[2:6]))
+        else:
+            # segment values and elements nobody extracts
+            name = rng.choice(fields) if rng.random() < 0.3 else f'otherelement{rng.randrange(5000)}'
+            context = f'{rng.choice(contexts)}_us-gaap_StatementBusinessSegmentsAxis_Segment{rng.randrange(20)}Member'
+            value = rng.randrange(1, 10 ** 12)
+        facts.append(_fact(name, context, value, inline))
+    if inline:
+        facts.append(f'<ix:nonNumeric name="dei:DocumentPeriodEndDate" contextRef="{contexts[0]}">'
+                     f'{year}-09-30</ix:nonNumeric>\n'.encode())
+    else:
+        facts.append(f'<dei:DocumentPeriodEndDate contextRef="{contexts[0]}">'
+                     f'{year}-09-30</dei:DocumentPeriodEndDate>\n'.encode())
+    if form_type == '10-Q':
+        for name, value in (('DocumentFiscalYearFocus', year), ('DocumentFiscalPeriodFocus', quarter)):
+            if inline:
+                facts.append(f'<ix:nonNumeric name="dei:{name}" contextRef="{contexts[0]}">'
+                             f'{value}</ix:nonNumeric>\n'.encode())
+            else:
+                facts.append(f'<dei:{name} contextRef="{contexts[0]}">{value}</dei:{name}>\n'.encode())
+    rng.shuffle(facts)
+    definitions = (b''.join(_context(context, segment)
+                            for context in contexts for segment in [None] + list(range(20)))
+                   + b'<xbrli:unit id="usd"><xbrli:measure>iso4217:USD</xbrli:measure></xbrli:unit>\n')
+
+    # the parsers take the year of the filing date as the year of the data
+    filed_as_of = f'{year}1105'
+    accession = f'0000320193-{year % 100:02d}-{rng.randrange(1000):06d}'
+    parts = [
+        f'<SEC-DOCUMENT>{accession}.txt : {filed_as_of}\n'
+        f'<SEC-HEADER>{accession}.hdr.sgml : {filed_as_of}\n'
+        f'ACCESSION NUMBER:\t\t{accession}\n'
+        f'CONFORMED SUBMISSION TYPE:\t{form_type}\n'
+        f'PUBLIC DOCUMENT COUNT:\t\t4\n'
+        f'CONFORMED PERIOD OF REPORT:\t{year}0930\n'
+        f'FILED AS OF DATE:\t\t{filed_as_of}\n'
+        f'</SEC-HEADER>\n'.encode()
+    ]
+    fact_bytes = sum(len(fact) for fact in facts)
+    filler_bytes = max(size_bytes - fact_bytes - 2048, 0)
+    html_lines = _lines(_HTML_LINE, filler_bytes // 2)
+    primary = [b'<html><body>\n']
+    if inline:
+        primary.append(b'<ix:header><ix:resources>' + definitions + b'</ix:resources></ix:header>\n')
+        # spread the tagged facts over the text like a real inline filing
+        lines_per_fact = html_lines // len(facts)
+        for fact in facts:
+            primary.append(lines_per_fact * _HTML_LINE)
+            primary.append(b'<p>' + fact + b'</p>\n')
+        primary.append((html_lines - lines_per_fact * len(facts)) * _HTML_LINE)
+    else:
+        primary.append(html_lines * _HTML_LINE)
+    primary.append(b'</body></html>\n')
+    parts.append(_document(form_type, f'{accession}_primary.htm', b''.join(primary)))
+    parts.append(_document('GRAPHIC', 'logo.jpg',
+                           b'begin 644 logo.jpg\n' + _lines(_UUENCODED_LINE, filler_bytes // 2) * _UUENCODED_LINE
+                           + b'end\n'))
+    if not inline:
+        parts.append(_document('EX-101.INS', f'aapl-{year}0930.xml',
+                               b'<?xml version="1.0" encoding="utf-8"?>\n<xbrli:xbrl>\n'
+                               + definitions + b''.join(facts) + b'</xbrli:xbrl>\n',
+                               xbrl=True))
+    parts.append(b'</SEC-DOCUMENT>\n')
+    return b''.join(parts)
+
+
+def _lines(line: bytes,
+           size: int) -> int:
+    return max(size // len(line), 0)
+
+
+def _context(context: str,
+             segment: Optional[int]) -> bytes:
+    """
+    :param context: id of the context of the period e.g FI2018Q4
+    :type context: str
+    :param segment: business segment of a table context, None for the period context
+    :type segment: int
+    :return: the xbrli:context of the instant of the period, for the segment if given
+    :rtype: bytes
+    """
+    member = ''
+    if segment is not None:
+        context = f'{context}_us-gaap_StatementBusinessSegmentsAxis_Segment{segment}Member'
+        member = (f'<xbrli:segment><xbrldi:explicitMember dimension="us-gaap:StatementBusinessSegmentsAxis">'
+                  f'aapl:Segment{segment}Member</xbrldi:explicitMember></xbrli:segment>')
+    return (f'<xbrli:context id="{context}"><xbrli:entity>'
+            f'<xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier>{member}'
+            f'</xbrli:entity><xbrli:period><xbrli:instant>{context[2:6]}-09-30</xbrli:instant>'
+            f'</xbrli:period></xbrli:context>\n').encode()
+
+
+def _fact(name: str,
+          context: str,
+          value: int,
+          inline: bool) -> bytes:
+    element = f'us-gaap:{name}'
+    if inline:
+        return (f'<ix:nonFraction name="{element}" contextRef="{context}" unitRef="usd" '
+                f'decimals="-6" scale="0" format="ixt:numdotdecimal">{value:,}</ix:nonFraction>\n').encode()
+    return f'<{element} contextRef="{context}" unitRef="usd" decimals="-6">{value}</{element}>\n'.encode()
+
+
+def _document(document_type: str,
+              filename: str,
+              text: bytes,
+              xbrl: bool = False) -> bytes:
+    if xbrl:
+        text = b'<XBRL>\n' + text + b'</XBRL>\n'
+    return (f'<DOCUMENT>\n<TYPE>{document_type}\n<SEQUENCE>1\n<FILENAME>{filename}\n<TEXT>\n'.encode()
+            + text + b'</TEXT>\n</DOCUMENT>\n')
+
+
+def write_ticker_filings(path_to_save_file: str,
+                         ticker: str,
+                         years: List[int],
+                         form_type: str = '10-K',
+                         **generator_args) -> Dict[int, str]:
+    """
+    Writes one synthetic filing per year in the folder layout of the downloader
+    path_to_save_file/<ticker>/<form type>/<accession number>.txt
+    :param path_to_save_file: root folder of the filings
+    :type path_to_save_file: str
+    :param ticker: ticker symbol
+    :type ticker: str
+    :param years: fiscal years to write
+    :type years: List[int]
+    :param form_type: 10-K or 10-Q
+    :type form_type: str
+    :param generator_args: generate_filing() arguments
+    :return: year to path of its filing
+    :rtype: dict
+    """
+    folder = os.path.join(path_to_save_file, ticker.lower(), form_type.lower())
+    os.makedirs(folder, exist_ok=True)
+    paths = {}
+    for year in years:
+        path = os.path.join(folder, f'0000320193-{year % 100:02d}-{year:06d}.txt')
+        with open(path, 'wb') as file:
+            file.write(generate_filing(year=year, form_type=form_type, seed=year, **generator_args))
+        paths[year] = path
+    return paths
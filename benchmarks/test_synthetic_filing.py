@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from benchmarks.synthetic_filing import (fact_value,
+                                         generate_filing,
+                                         write_ticker_filings,
+                                         )
+from benchmarks.run_benchmarks import compare
+from ci_rest_api_server.support_libs.extractor.GFormParse import GeneralFormParser
+from ci_rest_api_server.support_libs.extractor.P10kParser import Parse10KForm
+
+
+class TestSyntheticFiling(unittest.TestCase):
+    def setUp(self) -> None:
+        self.folder = tempfile.mkdtemp(prefix='test_synthetic_filing_')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_generate_filing(self):
+        """
+        Same arguments give the same bytes, close to the requested size
+        """
+        filing = generate_filing(size_bytes=256 * 1024)
+        self.assertEqual(filing, generate_filing(size_bytes=256 * 1024))
+        self.assertAlmostEqual(len(filing), 256 * 1024, delta=16 * 1024)
+
+    def test_parsed_values(self):
+        """
+        The parsers find the values of fact_value() in plain and inline filings
+        """
+        parser = Parse10KForm()
+        for inline in (False, True):
+            path = os.path.join(self.folder, f'filing_{inline}.txt')
+            with open(path, 'wb') as file:
+                file.write(generate_filing(size_bytes=128 * 1024, year=2016, inline=inline))
+            self.assertEqual(GeneralFormParser.get_form_type_and_filing_year(path), ('10-K', 2016))
+            form_data = parser.get_form_data(file_path=path, year=2016, ticker='zzbench')
+            for field in Parse10KForm.FACT_FIELDS:
+                self.assertEqual(form_data[field], fact_value(field, 2016), msg=f'{field} inline={inline}')
+
+    def test_write_ticker_filings(self):
+        paths = write_ticker_filings(self.folder, 'ZZBENCH', [2017, 2018], form_type='10-Q',
+                                     size_bytes=64 * 1024)
+        self.assertEqual(sorted(paths), [2017, 2018])
+        for year, path in paths.items():
+            self.assertEqual(os.path.dirname(path), os.path.join(self.folder, 'zzbench', '10-q'))
+            self.assertEqual(GeneralFormParser.get_form_type_and_filing_year(path), ('10-Q', year))
+
+    def test_compare(self):
+        """
+        Only differences over both the tolerance and the noise floor are regressions
+        """
+        baselines = {'fast': {'median_ms': 0.1, 'peak_rss_mb': 50.0},
+                     'slow': {'median_ms': 100.0, 'peak_rss_mb': 50.0}}
+        results = {'fast': {'median_ms': 0.5, 'peak_rss_mb': 50.5},
+                   'slow': {'median_ms': 140.0, 'peak_rss_mb': 50.0},
+                   'new': {'median_ms': 1.0, 'peak_rss_mb': 50.0}}
+        regressions = compare(results, baselines, tolerance=0.25, min_delta=1.0)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('slow', regressions[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,59 @@
-from .support_libs.extractor.IExtractDBPush import ExtractParseForms
+# exports the API's of the package, each one is imported on first use (see LazyExports)
+from .support_libs.LazyExports import LazyExports
 
-from .support_libs.extractor.GFormParse import (
-    GeneralFormParser,
-)
+LazyExports.install(__name__, {
+    'ExtractParseForms': '.support_libs.extractor.IExtractDBPush',
 
-from .support_libs.extractor.P10kParser import (
-    Parse10KForm,
-)
+    'ExtractDBPull': '.support_libs.extractor.ExtractDBPull',
 
-from .support_libs.extractor.P10QParser import (
-    Parse10QForm,
-)
\ No newline at end of file
+    'GeneralFormParser': '.support_libs.extractor.GFormParse',
+
+    'Parse10KForm': '.support_libs.extractor.P10kParser',
+
+    'Parse10QForm': '.support_libs.extractor.P10QParser',
+
+    'XbrlFactExtractor': '.support_libs.extractor.XbrlFactExtractor',
+
+    'SubmissionDocument': '.support_libs.extractor.SubmissionSplitter',
+    'SubmissionSplitter': '.support_libs.extractor.SubmissionSplitter',
+
+    'FilingHandle': '.support_libs.extractor.FilingHandle',
+
+    'SharedMongoClient': '.support_libs.extractor.SharedMongoClient',
+
+    'CacheEntry': '.support_libs.server.ResponseCache',
+    'ResponseCache': '.support_libs.server.ResponseCache',
+
+    'make_cached_response': '.support_libs.server.HttpCaching',
+    'negotiate_encoding': '.support_libs.server.HttpCaching',
+
+    'DownloadResult': '.support_libs.extractor.EdgarDownloader',
+    'EdgarDownloader': '.support_libs.extractor.EdgarDownloader',
+    'RequestsTransport': '.support_libs.extractor.EdgarDownloader',
+    'TokenBucket': '.support_libs.extractor.EdgarDownloader',
+    'TransportError': '.support_libs.extractor.EdgarDownloader',
+
+    'FilingManifest': '.support_libs.extractor.FilingManifest',
+
+    'FactSchema': '.support_libs.extractor.FinancialFacts',
+    'FinancialFacts': '.support_libs.extractor.FinancialFacts',
+
+    'FinancialRatios': '.support_libs.extractor.FinancialRatios',
+
+    'Histogram': '.support_libs.extractor.StageMetrics',
+    'MetricsRegistry': '.support_libs.extractor.StageMetrics',
+
+    'StorageLayout': '.support_libs.extractor.StorageLayout',
+
+    'Predicate': '.support_libs.extractor.ScreenQuery',
+    'ScreenQuery': '.support_libs.extractor.ScreenQuery',
+
+    'IngestJobQueue': '.support_libs.extractor.IngestJobQueue',
+    'LeaseLostError': '.support_libs.extractor.IngestJobQueue',
+
+    'IngestWorker': '.support_libs.extractor.IngestWorker',
+
+    'Backfill': '.support_libs.extractor.Backfill',
+    'BackfillCheckpoint': '.support_libs.extractor.Backfill',
+    'BackfillProgress': '.support_libs.extractor.Backfill',
+})
\ No newline at end of file
@@ -1,15 +1,158 @@
 # Flask backend app file
 import os
+import re
+import time
+from typing import (Callable,
+                    Optional,
+                    )
 from flask import (
     Flask,
+    Response,
+    g,
+    jsonify,
     make_response,
     request,
+    stream_with_context,
 )
 from bson import json_util
-from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+# read path only, the ingestion stack (secedgar, parsers, numpy) is never imported here
+from ci_rest_api_server.support_libs.extractor.ExtractDBPull import (ExtractDBPull,
+                                                                    RATIOS_DB,
+                                                                    )
+from ci_rest_api_server.support_libs.server.ResponseCache import ResponseCache
+from ci_rest_api_server.support_libs.server.HttpCaching import make_cached_response
+from ci_rest_api_server.support_libs.extractor.ScreenQuery import ScreenQuery
+from ci_rest_api_server.support_libs.extractor.IngestJobQueue import (JOB_STATES,
+                                                                     IngestJobQueue,
+                                                                     )
+from ci_rest_api_server.support_libs.extractor.StageMetrics import (METRICS,
+                                                                   REQUEST_SECONDS,
+                                                                   ProcessSnapshots,
+                                                                   ticker_class,
+                                                                   time_stage,
+                                                                   )
 
 app = Flask(__name__)
 
+# Serialized ticker responses, filings change at most once a quarter. The pushes of the
+# other processes (IngestWorker, Backfill) are seen within CI_CACHE_CHECK_SECONDS
+response_cache = ResponseCache(max_entries=int(os.environ.get('CI_CACHE_MAX_ENTRIES', 1024)),
+                               max_bytes=int(os.environ.get('CI_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+                               ttl_seconds=float(os.environ.get('CI_CACHE_TTL_SECONDS', 3600)),
+                               check_seconds=float(os.environ.get('CI_CACHE_CHECK_SECONDS', 1)))
+# drop the cached response of a ticker as soon as it is pushed again in this process
+ExtractDBPull.add_push_listener(response_cache.invalidate)
+# /metrics and /cache/stats/ sum the worker processes sharing CI_METRICS_DIR (set by
+# gunicorn.conf.py), without it they only count the process serving the scrape
+metrics_snapshots = None
+if os.environ.get('CI_METRICS_DIR'):
+    metrics_snapshots = ProcessSnapshots(os.environ['CI_METRICS_DIR'],
+                                         flush_seconds=float(os.environ.get('CI_METRICS_FLUSH_SECONDS', 5)))
+    metrics_snapshots.add_source('metrics', METRICS.snapshot)
+    metrics_snapshots.add_source('cache', response_cache.stats)
+    metrics_snapshots.start()
+# Upper bound of tickers in one batch request
+MAX_BATCH_TICKERS = int(os.environ.get('CI_MAX_BATCH_TICKERS', 50))
+# Matches per page of a screen, by default and at most
+SCREEN_PAGE_SIZE = int(os.environ.get('CI_SCREEN_PAGE_SIZE', 100))
+MAX_SCREEN_PAGE_SIZE = int(os.environ.get('CI_MAX_SCREEN_PAGE_SIZE', 1000))
+# Filings per ingestion job, same safe limit as ExtractParseForms.pull_ticker_symbol()
+MAX_JOB_YEARS = 15
+TICKER_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9.\-]{0,9}')
+# Queue of the ingestion jobs (see IngestJobQueue), opened by the first job request
+_job_queue: Optional[IngestJobQueue] = None
+
+
+def job_queue() -> IngestJobQueue:
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = IngestJobQueue.from_env()
+    return _job_queue
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request_latency(response):
+    """
+    Records the latency of every request, labeled by its route (not its path, the
+    tickers would make too many series) and the class of its ticker
+    """
+    start = g.pop('request_start', None)
+    if start is not None:
+        view_args = request.view_args or {}
+        REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                endpoint=request.url_rule.rule if request.url_rule is not None else 'unmatched',
+                                method=request.method,
+                                status=str(response.status_code),
+                                ticker_class=ticker_class(view_args.get('ticker_symbol')))
+    return response
+
+
+def int_arg(name: str) -> Optional[int]:
+    """
+    Reads an optional integer query argument, unlike args.get(type=int) a bad value is
+    reported as an error instead of being silently ignored
+    :param name: query argument name
+    :type name: str
+    :return: value or None when the argument is missing
+    :rtype: int
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} expects an integer, got {value!r}") from None
+
+
+def cached_ticker_response(form_type: str,
+                           ticker_symbol: str,
+                           pull: Optional[Callable[[ExtractDBPull], dict]] = None):
+    """
+    Response with all the data of a ticker for a form type, served from the response cache
+    :param form_type: SEC form type which is also the DB name e.g 10-k
+    :type form_type: str
+    :param ticker_symbol: sec ticker symbol for the company, e.g Apple = appl
+    :type ticker_symbol: str
+    :param pull: reads the data from the DB, defaults to pull_from_db() of form_type
+    :type pull: Callable
+    :return: the response
+    :rtype: flask.Response
+    """
+    def load_ticker_data() -> bytes:
+        # Get the data from the DB
+        data_get_obj = ExtractDBPull.from_db()
+        if pull is not None:
+            returned_dict = pull(data_get_obj)
+        else:
+            returned_dict = data_get_obj.pull_from_db(ticker=ticker_symbol,
+                                                      db_name=form_type)
+        with time_stage('serialize', form_type, ticker_symbol):
+            return json_util.dumps(returned_dict).encode()
+
+    def push_version():
+        # any push of the ticker, from any process, changes it
+        return ExtractDBPull.from_db().pull_push_version(form_type, ticker_symbol)
+
+    try:
+        cached_response = response_cache.get_or_load(ResponseCache.key(form_type, ticker_symbol),
+                                                     load_ticker_data,
+                                                     version=push_version)
+    except Exception as err:
+        # logger.exception(f"Unable to find ticker {ticker_symbol} err:{err}")
+        return make_response(f"Opps ticker: {ticker_symbol} data not found {err}",
+                             501)
+    # logger.debug(f"Success data returned for ticker: {ticker_symbol}")
+    # answers conditional GETs with 304 and sends a precomputed compressed body
+    return make_cached_response(cached_response,
+                                request)
+
+
 @app.route("/security/10-k/<string:ticker_symbol>/",
            methods=['GET'])
 def get_10k_ticker_data(ticker_symbol):
@@ -20,19 +163,249 @@ def get_10k_ticker_data(ticker_symbol):
              the client
     :rtype: dictionary
     """
-    # Get the data from the DB
-    data_get_obj = ExtractParseForms.from_db()
+    return cached_ticker_response('10-k', ticker_symbol)
+
+
+@app.route("/security/10-k/<string:ticker_symbol>/ratios/",
+           methods=['GET'])
+def get_10k_ticker_ratios(ticker_symbol):
+    """
+    Ratios precomputed at ingest (see ExtractParseForms.refresh_ratios()) with the
+    percentile of the ticker among all the tickers for each ratio and year
+    :param ticker_symbol: specifices the sec ticker symbol for the company, e.g Apple = appl
+    :type str:
+    :return: {"ticker", "years", "ratios": {name: [..]}, "percentiles": {name: [..]},
+              "peers": {name: [tickers ranked per year]}}
+    :rtype: dictionary
+    """
+    return cached_ticker_response(RATIOS_DB,
+                                  ticker_symbol,
+                                  pull=lambda data_get_obj: data_get_obj.pull_ratios_from_db(ticker_symbol))
+
+
+@app.route("/security/10-q/<string:ticker_symbol>/",
+           methods=['GET'])
+def get_10q_ticker_data(ticker_symbol):
+    """
+    :param ticker_symbol: specifices the sec ticker symbol for the company, e.g Apple = appl
+    :type str:
+    :return: the quarterly data of the security keyed by year and fiscal quarter
+             e.g {"2018-Q3": {...}}
+    :rtype: dictionary
+    """
+    return cached_ticker_response('10-q', ticker_symbol)
+
+
+@app.route("/security/10-k/",
+           methods=['GET'])
+def get_10k_batch_data():
+    """
+    Data of many tickers in one request, e.g
+    /security/10-k/?tickers=aapl,msft&fields=assets,liabilities&from_year=2015&to_year=2020
+    The fields and the year range are applied by the DB query and the tickers are
+    fetched concurrently
+    :return: {"data": {ticker: {year: fields}}, "errors": {ticker: message}}
+    :rtype: dictionary
+    """
+    tickers = [ticker for ticker in request.args.get('tickers', '').split(',') if ticker]
+    fields = [field for field in request.args.get('fields', '').split(',') if field] or None
+    if not tickers:
+        return make_response("Opps no tickers requested, use ?tickers=aapl,msft",
+                             400)
+    if len(tickers) > MAX_BATCH_TICKERS:
+        return make_response(f"Opps at most {MAX_BATCH_TICKERS} tickers per request",
+                             400)
     try:
-        returned_dict = data_get_obj.pull_from_db(ticker=ticker_symbol,
-                                                  db_name='10-k')
-    except Exception as err:
-        # logger.exception(f"Unable to find ticker {ticker_symbol} err:{err}")
-        return make_response(f"Opps ticker: {ticker_symbol} data not found {err}",
-                             501)
-    # logger.debug(f"Success data returned for ticker: {ticker_symbol}")
-    return make_response(json_util.dumps(returned_dict),
+        from_year = int_arg('from_year')
+        to_year = int_arg('to_year')
+        data_get_obj = ExtractDBPull.from_db()
+        returned_dict, errors = data_get_obj.pull_many_from_db(tickers,
+                                                               db_name='10-k',
+                                                               fields=fields,
+                                                               from_year=from_year,
+                                                               to_year=to_year)
+    except ValueError as err:
+        return make_response(f"Opps bad request {err}",
+                             400)
+    with time_stage('serialize', '10-k', None):
+        body = json_util.dumps({'data': returned_dict,
+                                'errors': errors})
+    return make_response(body,
                          200)
 
+
+@app.route("/screen/<string:form_type>/",
+           methods=['GET'])
+def get_screen(form_type):
+    """
+    Tickers and years whose fields match all the predicates, e.g
+    /screen/10-k/?where=goodwill>0.3*assets,assets>=1e9&from_year=2021&to_year=2021&fields=goodwill,assets
+    The screen runs in the DB (see ScreenQuery) and the matches are streamed as
+    newline delimited json in ticker and year order, limit per page. The last line is
+    {"next": cursor} and /screen/...&after=cursor returns the next page, next is null
+    on the last page
+    :param form_type: 10-k or 10-q
+    :type str:
+    :return: one {"ticker", "filing-year", fields...} per line then {"next": ..}
+    :rtype: application/x-ndjson
+    """
+    if form_type.lower() not in ('10-k', '10-q'):
+        return make_response(f"Opps unknown form type {form_type}",
+                             404)
+    where = [predicate for argument in request.args.getlist('where')
+             for predicate in argument.split(',') if predicate]
+    fields = [field for field in request.args.get('fields', '').split(',') if field] or None
+    try:
+        limit = int_arg('limit')
+        if limit is None:
+            limit = SCREEN_PAGE_SIZE
+        if not 0 < limit <= MAX_SCREEN_PAGE_SIZE:
+            raise ValueError(f"limit has to be between 1 and {MAX_SCREEN_PAGE_SIZE}")
+        screen = ScreenQuery.parse(where,
+                                   from_year=int_arg('from_year'),
+                                   to_year=int_arg('to_year'),
+                                   fields=fields)
+        after = request.args.get('after')
+        if after:
+            ScreenQuery.parse_cursor(after)
+    except ValueError as err:
+        return make_response(f"Opps bad request {err}",
+                             400)
+    data_get_obj = ExtractDBPull.from_db()
+
+    def stream_matches():
+        last_row = None
+        next_cursor = None
+        try:
+            # one more than the page tells whether there is a next page
+            for count, row in enumerate(data_get_obj.screen_from_db(form_type, screen, limit + 1, after)):
+                if count == limit:
+                    next_cursor = ScreenQuery.cursor_of(last_row)
+                    break
+                last_row = row
+                yield json_util.dumps(row) + '\n'
+        except Exception as err:
+            # the status is already sent, the error ends the stream instead of the cursor
+            yield json_util.dumps({'next': None, 'error': str(err)}) + '\n'
+            return
+        yield json_util.dumps({'next': next_cursor}) + '\n'
+
+    return Response(stream_with_context(stream_matches()),
+                    mimetype='application/x-ndjson')
+
+
+@app.route("/jobs/<string:form_type>/<string:ticker_symbol>/",
+           methods=['POST'])
+def post_ingest_job(form_type, ticker_symbol):
+    """
+    Queues a refresh (download, parse and push) of the filings of a ticker, run by an
+    IngestWorker process, e.g POST /jobs/10-k/aapl/?years=10
+    A ticker already queued or running for the form type is not queued again, its
+    job answers this request too
+    :param form_type: 10-k or 10-q
+    :type str:
+    :param ticker_symbol: specifices the sec ticker symbol for the company, e.g Apple = appl
+    :type str:
+    :return: the job, 202 when it was queued and 200 for the job already active,
+             poll its state at the Location
+    :rtype: dictionary
+    """
+    if form_type.lower() not in ('10-k', '10-q'):
+        return make_response(f"Opps unknown form type {form_type}",
+                             404)
+    try:
+        if not TICKER_PATTERN.fullmatch(ticker_symbol):
+            raise ValueError(f"invalid ticker {ticker_symbol!r}")
+        years = int_arg('years')
+        if years is None:
+            years = 10
+        if not 0 < years <= MAX_JOB_YEARS:
+            raise ValueError(f"years has to be between 1 and {MAX_JOB_YEARS}")
+    except ValueError as err:
+        return make_response(f"Opps bad request {err}",
+                             400)
+    job, created = job_queue().enqueue(ticker_symbol, form_type, years)
+    response = jsonify(job)
+    response.status_code = 202 if created else 200
+    response.headers['Location'] = f"/jobs/{job['id']}/"
+    return response
+
+
+@app.route("/jobs/<int:job_id>/",
+           methods=['GET'])
+def get_ingest_job(job_id):
+    """
+    :param job_id: id of the job returned when it was queued
+    :type int:
+    :return: the job: state (queued, running, done or failed), seconds of its
+             download, parse and db_push stages, push counts and error
+    :rtype: dictionary
+    """
+    job = job_queue().get(job_id)
+    if job is None:
+        return make_response(f"Opps job {job_id} not found",
+                             404)
+    return jsonify(job)
+
+
+@app.route("/jobs/",
+           methods=['GET'])
+def get_ingest_jobs():
+    """
+    :return: {"jobs": [..]} the most recent jobs first, ?state=queued|running|done|failed
+             and ?limit= (100 by default) select them
+    :rtype: dictionary
+    """
+    state = request.args.get('state')
+    try:
+        if state is not None and state not in JOB_STATES:
+            raise ValueError(f"state has to be one of {JOB_STATES}")
+        limit = int_arg('limit')
+        if limit is None:
+            limit = 100
+        if not 0 < limit <= MAX_SCREEN_PAGE_SIZE:
+            raise ValueError(f"limit has to be between 1 and {MAX_SCREEN_PAGE_SIZE}")
+    except ValueError as err:
+        return make_response(f"Opps bad request {err}",
+                             400)
+    return jsonify({'jobs': job_queue().jobs(state, limit)})
+
+
+@app.route("/cache/stats/",
+           methods=['GET'])
+def get_cache_stats():
+    """
+    Summed over the worker processes when they share CI_METRICS_DIR, each worker has
+    its own cache so the limits and the size are the totals of the workers too
+    :return: hit, miss and eviction counters of the response cache, used to size it,
+             and the number of workers counted
+    :rtype: dictionary
+    """
+    if metrics_snapshots is None:
+        return jsonify(dict(response_cache.stats(), workers=1))
+    cache_stats = {}
+    snapshots = metrics_snapshots.read('cache')
+    for worker_stats in snapshots:
+        for name, value in worker_stats.items():
+            cache_stats[name] = cache_stats.get(name, 0) + value
+    cache_stats['workers'] = len(snapshots)
+    return jsonify(cache_stats)
+
+
+@app.route("/metrics",
+           methods=['GET'])
+def get_metrics():
+    """
+    Latency histograms of the download, header, parse, db_push, db_read and serialize
+    stages and of the requests, for Prometheus to scrape. Summed over the worker
+    processes when they share CI_METRICS_DIR, a scrape lands on any one of them
+    :return: the metrics in the Prometheus text exposition format
+    :rtype: text
+    """
+    registry = METRICS if metrics_snapshots is None else METRICS.merged(metrics_snapshots.read('metrics'))
+    return Response(registry.render(),
+                    mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def hello():
     # TODO(rahul): Just remove this default root later when container work is stabalized
@@ -0,0 +1,52 @@
+# Production server settings of the REST API, used by the Dockerfile:
+#   python3 -m gunicorn --config gunicorn.conf.py
+# Every value can be overridden with the environment variable next to it.
+#
+# The default worker class is gevent: each worker process serves its requests on
+# greenlets and pymongo, made cooperative by the gevent monkey patching of the worker,
+# waits on Mongo without blocking a thread. A worker holds up to
+# CI_SERVER_WORKER_CONNECTIONS concurrent requests, their DB reads share the pool of the
+# SharedMongoClient of the worker (CI_MONGO_MAX_POOL_SIZE) and the ones over it queue
+# for at most CI_MONGO_WAIT_QUEUE_TIMEOUT_MS. CI_SERVER_WORKER_CLASS=sync or gthread
+# gives the blocking modes back, e.g to debug without the patching.
+# Each worker has its own metrics and response cache, they write snapshots in
+# CI_METRICS_DIR which /metrics and /cache/stats/ sum, whichever worker gets the scrape.
+# NOTE: This file is read by the gunicorn master, it must not import the app: the
+#       gevent workers patch the standard library before they import it
+import glob
+import multiprocessing
+import os
+import tempfile
+
+# ci_rest_api_server is imported as a package, from the folder above this one
+pythonpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+wsgi_app = 'ci_rest_api_server.app:app'
+
+bind = os.environ.get('CI_SERVER_BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+worker_class = os.environ.get('CI_SERVER_WORKER_CLASS', 'gevent')
+# CPU bound work (json, compression) scales with processes, the waits with greenlets
+workers = int(os.environ.get('CI_SERVER_WORKERS', multiprocessing.cpu_count()))
+worker_connections = int(os.environ.get('CI_SERVER_WORKER_CONNECTIONS', 1000))
+# only used by the gthread worker class
+threads = int(os.environ.get('CI_SERVER_THREADS', 8))
+backlog = int(os.environ.get('CI_SERVER_BACKLOG', 2048))
+timeout = int(os.environ.get('CI_SERVER_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('CI_SERVER_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('CI_SERVER_KEEPALIVE', 5))
+# recycle workers now and then, jitter keeps them from restarting together
+max_requests = int(os.environ.get('CI_SERVER_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('CI_SERVER_MAX_REQUESTS_JITTER', 0))
+# each worker builds its own response cache and Mongo client, never share them by forking
+preload_app = False
+# the workers inherit it from the master
+os.environ.setdefault('CI_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'ci_rest_api_metrics'))
+
+
+def on_starting(server):
+    # the snapshots of the previous run would be counted again
+    for path in glob.glob(os.path.join(os.environ['CI_METRICS_DIR'], '*.json*')):
+        os.remove(path)
+
+accesslog = os.environ.get('CI_SERVER_ACCESS_LOG', None)
+errorlog = '-'
+loglevel = os.environ.get('CI_SERVER_LOG_LEVEL', 'info')
@@ -0,0 +1,50 @@
+# Package exports imported on first use, so that importing one module of the package
+# (e.g the app and its read path) does not import every module the package exports
+import importlib
+import sys
+import types
+from typing import Dict
+
+
+class LazyExports(types.ModuleType):
+    """
+    Module type of a package whose exports are resolved on first access, e.g
+        LazyExports.install(__name__, {'ScreenQuery': '.ScreenQuery'})
+    imports the ScreenQuery module only when ScreenQuery is read from the package,
+    by an attribute access or a "from package import ScreenQuery"
+    An exported name always resolves to the export, as with "from .X import X": the
+    module X loaded by another import does not replace the class X on the package
+    """
+
+    @classmethod
+    def install(cls, name: str,
+                exports: Dict[str, str]):
+        """
+        :param name: __name__ of the package
+        :type name: str
+        :param exports: exported name: module defining it, relative to the package
+        :type exports: Dict[str, str]
+        """
+        package = sys.modules[name]
+        package.__class__ = cls
+        package.__dict__['_exports'] = dict(exports)
+
+    def __getattr__(self, name):
+        # only called for names not in the package yet
+        exports = self.__dict__.get('_exports', {})
+        if name not in exports:
+            raise AttributeError(f"module {self.__name__!r} has no attribute {name!r}")
+        value = getattr(importlib.import_module(exports[name], self.__name__), name)
+        self.__dict__[name] = value
+        return value
+
+    def __setattr__(self, name, value):
+        # the import system binds a submodule on its package once loaded, an export
+        # of the same name (the class of the module) keeps the name
+        if (isinstance(value, types.ModuleType) and name in self.__dict__.get('_exports', {})
+                and value.__name__ == f"{self.__name__}.{name}"):
+            return
+        super().__setattr__(name, value)
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(self.__dict__.get('_exports', {})))
@@ -1,17 +1,62 @@
-# exports the API's from the supporting libs
-from .extractor.IExtractDBPush import (
-    logger,
-    ExtractParseForms,
-)
-
-from .extractor.GFormParse import (
-    GeneralFormParser,
-)
-
-from .extractor.P10kParser import (
-    Parse10KForm,
-)
-
-from .extractor.P10QParser import (
-    Parse10QForm,
-)
\ No newline at end of file
+# exports the API's from the supporting libs, each one is imported on first use (see LazyExports)
+from .LazyExports import LazyExports
+
+LazyExports.install(__name__, {
+    'logger': '.extractor.ExtractorLogger',
+    'log_context': '.extractor.ExtractorLogger',
+
+    'ExtractParseForms': '.extractor.IExtractDBPush',
+
+    'ExtractDBPull': '.extractor.ExtractDBPull',
+
+    'GeneralFormParser': '.extractor.GFormParse',
+
+    'Parse10KForm': '.extractor.P10kParser',
+
+    'Parse10QForm': '.extractor.P10QParser',
+
+    'XbrlFactExtractor': '.extractor.XbrlFactExtractor',
+
+    'SubmissionDocument': '.extractor.SubmissionSplitter',
+    'SubmissionSplitter': '.extractor.SubmissionSplitter',
+
+    'FilingHandle': '.extractor.FilingHandle',
+
+    'SharedMongoClient': '.extractor.SharedMongoClient',
+
+    'CacheEntry': '.server.ResponseCache',
+    'ResponseCache': '.server.ResponseCache',
+
+    'make_cached_response': '.server.HttpCaching',
+    'negotiate_encoding': '.server.HttpCaching',
+
+    'DownloadResult': '.extractor.EdgarDownloader',
+    'EdgarDownloader': '.extractor.EdgarDownloader',
+    'RequestsTransport': '.extractor.EdgarDownloader',
+    'TokenBucket': '.extractor.EdgarDownloader',
+    'TransportError': '.extractor.EdgarDownloader',
+
+    'FilingManifest': '.extractor.FilingManifest',
+
+    'FactSchema': '.extractor.FinancialFacts',
+    'FinancialFacts': '.extractor.FinancialFacts',
+
+    'FinancialRatios': '.extractor.FinancialRatios',
+
+    'Histogram': '.extractor.StageMetrics',
+    'MetricsRegistry': '.extractor.StageMetrics',
+
+    'StorageLayout': '.extractor.StorageLayout',
+
+    'Predicate': '.extractor.ScreenQuery',
+    'ScreenQuery': '.extractor.ScreenQuery',
+
+    'IngestJobQueue': '.extractor.IngestJobQueue',
+    'LeaseLostError': '.extractor.IngestJobQueue',
+
+    'IngestWorker': '.extractor.IngestWorker',
+
+    'Backfill': '.extractor.Backfill',
+    'BackfillCheckpoint': '.extractor.Backfill',
+    'BackfillProgress': '.extractor.Backfill',
+})
\ No newline at end of file
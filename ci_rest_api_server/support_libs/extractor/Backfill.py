@@ -0,0 +1,533 @@
+# Checkpointed (re)load of many tickers, download -> parse -> push as a pipeline e.g
+# python -m ci_rest_api_server.support_libs.extractor.Backfill sp500.txt /data/sec-reports --years 10
+import argparse
+import json
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import (Callable,
+                    Dict,
+                    List,
+                    Optional,
+                    TextIO,
+                    )
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import (log_context,
+                                                                      logger,
+                                                                      )
+from ci_rest_api_server.support_libs.extractor.EdgarDownloader import EdgarDownloader
+from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+from ci_rest_api_server.support_libs.extractor.StageMetrics import serve_metrics
+
+# Ends the threads of a stage
+_END = object()
+
+
+def read_tickers(path: str) -> List[str]:
+    """
+    :param path: ticker list file, tickers separated by new lines, spaces or commas,
+                 # starts a comment
+    :type path: str
+    :return: the lower case tickers in file order, without duplicates
+    :rtype: List[str]
+    """
+    tickers = {}
+    with open(path) as file:
+        for line in file:
+            for ticker in line.split('#', 1)[0].replace(',', ' ').split():
+                tickers[ticker.lower()] = None
+    return list(tickers)
+
+
+class BackfillCheckpoint:
+    """
+    Outcome of every ticker of a backfill, written to a json file as soon as a ticker
+    ends so that a crashed or stopped run resumes with the tickers not done yet:
+    {"10-K": {"aapl": {"state": "done", "counts": {..}, "seconds": {..}}, ..}}
+    Failed tickers are kept with their error and run again by the next run
+    """
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, path: str,
+                 entries: Optional[Dict[str, Dict[str, dict]]] = None):
+        """
+        :param path: json file of the checkpoint
+        :type path: str
+        :param entries: form type to ticker to its outcome
+        :type entries: dict
+        """
+        self.path = path
+        self._entries = entries if entries is not None else {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: str) -> 'BackfillCheckpoint':
+        """
+        :param path: json file of the checkpoint, missing for a new backfill
+        :type path: str
+        :return: the checkpoint
+        :rtype: BackfillCheckpoint
+        """
+        try:
+            with open(path) as file:
+                return cls(path, json.load(file))
+        except FileNotFoundError:
+            return cls(path)
+
+    def is_done(self, ticker: str,
+                form_type: str) -> bool:
+        return self._entries.get(form_type, {}).get(ticker, {}).get('state') == self.DONE
+
+    def record(self, ticker: str,
+               form_type: str,
+               counts: Optional[Dict[str, int]] = None,
+               seconds: Optional[Dict[str, float]] = None,
+               error: Optional[str] = None):
+        """
+        Records the end of a ticker, failed when error is set, and writes the file
+        through a temporary file so a crash never leaves a truncated checkpoint behind
+        """
+        entry = {'state': self.FAILED if error is not None else self.DONE,
+                 'counts': counts or {},
+                 'seconds': {stage: round(value, 3) for stage, value in (seconds or {}).items()},
+                 'finished': time.time()}
+        if error is not None:
+            entry['error'] = error
+        with self._lock:
+            self._entries.setdefault(form_type, {})[ticker] = entry
+            temp_path = self.path + '.part'
+            with open(temp_path, 'w') as file:
+                json.dump(self._entries, file, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+
+    def failed(self, form_type: str) -> Dict[str, str]:
+        """
+        :return: ticker to error of the failed tickers of the form type
+        :rtype: dict
+        """
+        return {ticker: entry.get('error', '')
+                for ticker, entry in self._entries.get(form_type, {}).items()
+                if entry['state'] == self.FAILED}
+
+    def __repr__(self):
+        return f"BackfillCheckpoint({self.path!r}, {sum(map(len, self._entries.values()))} tickers)"
+
+
+class BackfillProgress:
+    """
+    Filings, bytes and busy seconds of every stage of a backfill, shared by its threads.
+    line() gives the rates since the previous line, summary() the totals of the run
+    """
+    STAGES = ('download', 'parse', 'db_push')
+
+    def __init__(self, tickers: int,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param tickers: tickers to run
+        :type tickers: int
+        :param clock: seconds, monotonic
+        :type clock: Callable
+        """
+        self.tickers = tickers
+        self.done = 0
+        self.failed = 0
+        self.filings = dict.fromkeys(self.STAGES, 0)
+        self.bytes = dict.fromkeys(self.STAGES, 0)
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.counts = {'downloaded': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._start = clock()
+        self._last = (self._start, dict(self.filings), dict(self.bytes))
+
+    def add(self, stage: str,
+            filings: int,
+            size: int,
+            seconds: float):
+        """
+        :param stage: one of STAGES
+        :type stage: str
+        :param filings: filings through the stage
+        :type filings: int
+        :param size: bytes of the filings
+        :type size: int
+        :param seconds: time the stage took for them
+        :type seconds: float
+        """
+        with self._lock:
+            self.filings[stage] += filings
+            self.bytes[stage] += size
+            self.seconds[stage] += seconds
+
+    def finish_ticker(self, counts: Optional[Dict[str, int]] = None,
+                      failed: bool = False):
+        with self._lock:
+            if failed:
+                self.failed += 1
+            else:
+                self.done += 1
+            for key, value in (counts or {}).items():
+                if key in self.counts:
+                    self.counts[key] += value
+
+    @staticmethod
+    def _rates(filings: int,
+               size: int,
+               seconds: float) -> str:
+        seconds = max(seconds, 1e-9)
+        return f"{filings / seconds:.1f} filings/s {size / seconds / 1e6:.2f} MB/s"
+
+    def line(self) -> str:
+        """
+        :return: the live progress, rates since the previous line
+        :rtype: str
+        """
+        with self._lock:
+            now = self._clock()
+            last_time, last_filings, last_bytes = self._last
+            self._last = (now, dict(self.filings), dict(self.bytes))
+            rates = ' | '.join(f"{stage} " + self._rates(self.filings[stage] - last_filings[stage],
+                                                         self.bytes[stage] - last_bytes[stage],
+                                                         now - last_time)
+                               for stage in self.STAGES)
+            return (f"[{now - self._start:7.0f}s] {self.done + self.failed}/{self.tickers} tickers"
+                    f" ({self.failed} failed) | {rates}")
+
+    def summary(self) -> str:
+        """
+        :return: totals of the run, the rates of a stage are over the whole run and
+                 over the time the stage was busy
+        :rtype: str
+        """
+        with self._lock:
+            elapsed = self._clock() - self._start
+            lines = [f"Backfill of {self.tickers} tickers in {elapsed:.1f}s: {self.done} done, {self.failed} failed",
+                     "Filings " + ', '.join(f"{key} {value}" for key, value in self.counts.items())]
+            for stage in self.STAGES:
+                lines.append(f"{stage:>9}: {self.filings[stage]} filings {self.bytes[stage] / 1e6:.2f} MB,"
+                             f" {self._rates(self.filings[stage], self.bytes[stage], elapsed)} overall,"
+                             f" {self.seconds[stage]:.1f}s busy")
+            return '\n'.join(lines)
+
+    def __repr__(self):
+        return f"BackfillProgress({self.done + self.failed}/{self.tickers} tickers)"
+
+
+class Backfill:
+    """
+    Loads the filings of many tickers with the three stages in their own threads,
+    connected by bounded queues so that one ticker downloads while another parses
+    and a third is pushed:
+    download: tickers downloading at the same time, sharing the EdgarDownloader and its
+              SEC rate limit. Filings already on disk are not downloaded again
+    parse: tickers parsing at the same time, their filings parsed by a shared process
+           pool of that many workers. Only the new filings of the FilingManifest of
+           the ticker are parsed (see ExtractParseForms.new_forms())
+    push: tickers pushed at the same time, one bulk write each
+    A ticker is recorded in the BackfillCheckpoint when its push is done or any stage
+    failed, so it is the unit of restart: a new run skips the tickers done and runs
+    the others again, their downloaded filings and pushed manifest entries included
+    """
+
+    def __init__(self, path_to_save_file: str,
+                 checkpoint: BackfillCheckpoint,
+                 form_type: str = '10-K',
+                 years: int = 10,
+                 download_workers: int = 4,
+                 parse_workers: int = 2,
+                 push_workers: int = 2,
+                 downloader: Optional[EdgarDownloader] = None,
+                 extractor: Optional[ExtractParseForms] = None):
+        """
+        :param path_to_save_file: root folder of the saved filings
+        :type path_to_save_file: str
+        :param checkpoint: done tickers are skipped, every ticker is recorded in it
+        :type checkpoint: BackfillCheckpoint
+        :param form_type: SEC form type e.g 10-K
+        :type form_type: str
+        :param years: filings downloaded per ticker
+        :type years: int
+        :param download_workers: tickers downloading at the same time
+        :type download_workers: int
+        :param parse_workers: parse processes, 1 parses in the parse thread
+        :type parse_workers: int
+        :param push_workers: tickers pushed at the same time
+        :type push_workers: int
+        :param downloader: defaults to an EdgarDownloader of path_to_save_file
+        :type downloader: EdgarDownloader
+        :param extractor: defaults to an ExtractParseForms of path_to_save_file
+        :type extractor: ExtractParseForms
+        """
+        self.path_to_save_file = path_to_save_file
+        self.checkpoint = checkpoint
+        self.form_type = form_type.upper()
+        self.years = years
+        self.download_workers = download_workers
+        self.parse_workers = parse_workers
+        self.push_workers = push_workers
+        self.downloader = downloader if downloader is not None else EdgarDownloader(path_to_save_file,
+                                                                                    workers=download_workers)
+        self.extractor = extractor if extractor is not None else ExtractParseForms(path_to_save_file)
+        self.progress: Optional[BackfillProgress] = None
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._stopping = threading.Event()
+
+    def _fail(self, ticker: str,
+              stage: str,
+              err: Exception,
+              seconds: Dict[str, float]):
+        logger.exception("Backfill of %s %s failed in %s", ticker, self.form_type, stage)
+        self.checkpoint.record(ticker, self.form_type, seconds=seconds, error=f"{stage}: {type(err).__name__}: {err}")
+        self.progress.finish_ticker(failed=True)
+
+    def _download(self, ticker: str) -> Optional[dict]:
+        if self._stopping.is_set():
+            # left out of the checkpoint, the next run starts with it
+            return None
+        seconds = {}
+        start = time.perf_counter()
+        try:
+            result = self.downloader.download([(ticker, self.form_type)], count=self.years)[(ticker, self.form_type)]
+            seconds['download'] = time.perf_counter() - start
+            self.progress.add('download', len(result.paths), sum(map(os.path.getsize, result.paths)),
+                              seconds['download'])
+            if result.error is not None:
+                # the files downloaded are kept, the next run only downloads the others
+                raise result.error
+        except Exception as err:
+            seconds.setdefault('download', time.perf_counter() - start)
+            self._fail(ticker, 'download', err, seconds)
+            return None
+        return {'ticker': ticker, 'seconds': seconds, 'counts': {'downloaded': len(result.paths)}}
+
+    def _parse(self, item: dict) -> Optional[dict]:
+        ticker, seconds = item['ticker'], item['seconds']
+        start = time.perf_counter()
+        try:
+            manifest, jobs, skipped = self.extractor.new_forms(ticker, self.form_type)
+            parsed_forms = self.extractor.parse_files(jobs, 1, self._executor) if jobs else []
+            seconds['parse'] = time.perf_counter() - start
+            size = sum(os.path.getsize(file) for _, file, _ in jobs)
+            self.progress.add('parse', len(jobs), size, seconds['parse'])
+        except Exception as err:
+            seconds['parse'] = time.perf_counter() - start
+            self._fail(ticker, 'parse', err, seconds)
+            return None
+        item['counts']['skipped'] = skipped
+        item.update(manifest=manifest, jobs=jobs, parsed_forms=parsed_forms, size=size)
+        return item
+
+    def _push(self, item: dict):
+        ticker, seconds, counts = item['ticker'], item['seconds'], item['counts']
+        start = time.perf_counter()
+        try:
+            records = [record for record in item['parsed_forms'] if record is not None]
+            if records:
+                counts.update(self.extractor.push_to_db(records))
+            if item['jobs']:
+                self.extractor.record_new_forms(item['manifest'], item['jobs'], item['parsed_forms'])
+            seconds['db_push'] = time.perf_counter() - start
+            self.progress.add('db_push', len(item['jobs']), item['size'], seconds['db_push'])
+        except Exception as err:
+            seconds['db_push'] = time.perf_counter() - start
+            self._fail(ticker, 'db_push', err, seconds)
+            return
+        self.checkpoint.record(ticker, self.form_type, counts=counts, seconds=seconds)
+        self.progress.finish_ticker(counts)
+        logger.info("Backfilled %s %s %s", ticker, self.form_type, counts)
+
+    def _stage(self, work: Callable[[object], Optional[dict]],
+               inbox: queue.Queue,
+               outbox: Optional[queue.Queue]):
+        while True:
+            item = inbox.get()
+            if item is _END:
+                return
+            ticker = item if isinstance(item, str) else item['ticker']
+            with log_context(ticker=ticker, form_type=self.form_type):
+                result = work(item)
+            if result is not None and outbox is not None:
+                outbox.put(result)
+
+    def _run_stage(self, name: str,
+                   threads: int,
+                   work: Callable[[object], Optional[dict]],
+                   inbox: queue.Queue,
+                   outbox: Optional[queue.Queue]) -> List[threading.Thread]:
+        stage_threads = [threading.Thread(target=self._stage,
+                                          args=(work, inbox, outbox),
+                                          name=f"backfill_{name}_{index}")
+                         for index in range(threads)]
+        for thread in stage_threads:
+            thread.start()
+        return stage_threads
+
+    def run(self, tickers: List[str],
+            progress_seconds: float = 10.0,
+            output: Optional[TextIO] = None,
+            refresh_ratios: Optional[bool] = None) -> BackfillProgress:
+        """
+        Runs the tickers not done in the checkpoint. The ratios and percentiles of the
+        10-K tickers are refreshed once at the end, not per ticker since every ticker
+        moves the percentiles of the others
+        :param tickers: ticker symbols
+        :type tickers: List[str]
+        :param progress_seconds: seconds between the live progress lines
+        :type progress_seconds: float
+        :param output: where the progress lines go, defaults to stdout
+        :type output: TextIO
+        :param refresh_ratios: True refreshes the ratios even when no 10-K record
+                               changed, False never does, None when records changed
+        :type refresh_ratios: bool
+        :return: the progress of the run, see BackfillProgress.summary()
+        :rtype: BackfillProgress
+        """
+        output = output or sys.stdout
+        pending = [ticker for ticker in tickers if not self.checkpoint.is_done(ticker, self.form_type)]
+        if len(pending) < len(tickers):
+            print(f"Resuming, {len(tickers) - len(pending)} tickers already done in {self.checkpoint.path}",
+                  file=output, flush=True)
+        self.progress = BackfillProgress(len(pending))
+        tickers_queue = queue.Queue()
+        for ticker in pending:
+            tickers_queue.put(ticker)
+        # bounded so the downloads do not run far ahead of the parsing, nor the parsed
+        # records pile up in memory ahead of the pushes
+        parse_queue = queue.Queue(maxsize=2 * self.parse_workers)
+        push_queue = queue.Queue(maxsize=2 * self.push_workers)
+        started_pool = self.start_parse_pool()
+        reported = threading.Event()
+
+        def report():
+            while not reported.wait(progress_seconds):
+                print(self.progress.line(), file=output, flush=True)
+        reporter = threading.Thread(target=report, name='backfill_progress', daemon=True)
+        reporter.start()
+        stages = [(self._run_stage('download', self.download_workers, self._download, tickers_queue, parse_queue),
+                   parse_queue, self.parse_workers),
+                  (self._run_stage('parse', self.parse_workers, self._parse, parse_queue, push_queue),
+                   push_queue, self.push_workers),
+                  (self._run_stage('push', self.push_workers, self._push, push_queue, None),
+                   None, 0)]
+        for _ in range(self.download_workers):
+            tickers_queue.put(_END)
+        try:
+            # the next stage ends once its queue is drained of what this one gave it
+            for stage_threads, next_queue, next_threads in stages:
+                for thread in stage_threads:
+                    while thread.is_alive():
+                        try:
+                            thread.join(0.5)
+                        except KeyboardInterrupt:
+                            self.stop()
+                            print("Stopping, the tickers in flight finish first", file=output, flush=True)
+                for _ in range(next_threads):
+                    next_queue.put(_END)
+        finally:
+            reported.set()
+            if started_pool:
+                self.shutdown_parse_pool()
+        print(self.progress.summary(), file=output, flush=True)
+        if refresh_ratios is None:
+            refresh_ratios = bool(self.progress.counts['inserted'] or self.progress.counts['updated'])
+        if refresh_ratios and self.form_type == '10-K':
+            try:
+                ratios = self.extractor.refresh_ratios()
+                print(f"Ratios of {len(ratios)} tickers refreshed", file=output, flush=True)
+            except Exception as err:
+                # the pushed records are checkpointed, only the ratios have to be refreshed again
+                logger.exception("Ratios refresh failed after the backfill of %s", self.form_type)
+                print(f"Ratios refresh failed, run with --ratios to retry: {type(err).__name__}: {err}",
+                      file=output, flush=True)
+        return self.progress
+
+    def start_parse_pool(self) -> bool:
+        """
+        Forks the parse processes shared by all the tickers. It has to run before any
+        thread of the process starts, a fork copies the locks other threads hold. run()
+        starts the pool when the caller did not
+        :return: True when the pool was started by this call
+        :rtype: bool
+        """
+        if self.parse_workers < 2 or self._executor is not None:
+            return False
+        self._executor = self.extractor.parse_pool(self.parse_workers)
+        # the pool forks its workers now, not when the first filing is parsed
+        self._executor.submit(int).result()
+        return True
+
+    def shutdown_parse_pool(self):
+        """
+        Ends the processes of start_parse_pool()
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def stop(self):
+        """
+        The tickers not downloading yet are left for the next run
+        """
+        self._stopping.set()
+
+    def __repr__(self):
+        return (f"Backfill({self.path_to_save_file!r}, {self.checkpoint!r}, form_type={self.form_type!r},"
+                f" download_workers={self.download_workers}, parse_workers={self.parse_workers},"
+                f" push_workers={self.push_workers})")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='(Re)loads the filings of every ticker of a list, resumable')
+    parser.add_argument('tickers_file', help='ticker symbols separated by new lines, spaces or commas')
+    parser.add_argument('path_to_save_file', help='root folder of the saved filings')
+    parser.add_argument('--form-type', default='10-K', choices=('10-K', '10-Q'), type=str.upper)
+    parser.add_argument('--years', type=int, default=10, help='filings downloaded per ticker')
+    parser.add_argument('--download-workers', type=int, default=4, help='tickers downloading at the same time')
+    parser.add_argument('--parse-workers', type=int, default=2, help='parse processes')
+    parser.add_argument('--push-workers', type=int, default=2, help='tickers pushed at the same time')
+    parser.add_argument('--checkpoint', help='defaults to <path_to_save_file>/backfill-<form type>.json')
+    parser.add_argument('--restart', action='store_true', help='run the tickers done by an earlier run again')
+    parser.add_argument('--progress-seconds', type=float, default=10.0, help='seconds between the progress lines')
+    parser.add_argument('--ratios', action='store_true',
+                        help='recompute the ratios and percentiles of the 10-K tickers at the end even when'
+                             ' no record changed')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve the stage metrics of the backfill at :<port>/metrics for Prometheus')
+    options = parser.parse_args(argv)
+    if min(options.download_workers, options.parse_workers, options.push_workers, options.years) < 1:
+        parser.error("--years and the workers of every stage have to be at least 1")
+    checkpoint_path = options.checkpoint or os.path.join(options.path_to_save_file,
+                                                         f"backfill-{options.form_type.lower()}.json")
+    checkpoint = BackfillCheckpoint(checkpoint_path) if options.restart else BackfillCheckpoint.load(checkpoint_path)
+    backfill = Backfill(options.path_to_save_file,
+                        checkpoint,
+                        form_type=options.form_type,
+                        years=options.years,
+                        download_workers=options.download_workers,
+                        parse_workers=options.parse_workers,
+                        push_workers=options.push_workers)
+    # a stopped container lets the tickers in flight finish and checkpoint
+    signal.signal(signal.SIGTERM, lambda signum, frame: backfill.stop())
+    backfill.start_parse_pool()
+    try:
+        # the metrics server thread starts after the fork of the parse processes
+        if options.metrics_port is not None:
+            serve_metrics(options.metrics_port)
+        backfill.run(read_tickers(options.tickers_file), options.progress_seconds,
+                     refresh_ratios=options.ratios or None)
+    finally:
+        backfill.shutdown_parse_pool()
+    failed = checkpoint.failed(backfill.form_type)
+    if failed:
+        print(f"{len(failed)} failed tickers, run again to retry them:")
+    for ticker, error in sorted(failed.items()):
+        print(f"  {ticker}: {error}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,342 @@
+# Concurrent, rate limited download of SEC EDGAR filings for many tickers
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import (ThreadPoolExecutor,
+                                as_completed,
+                                )
+from typing import (Dict,
+                    Iterable,
+                    List,
+                    Optional,
+                    Tuple,
+                    )
+import requests
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+from ci_rest_api_server.support_libs.extractor.StageMetrics import time_stage
+from ci_rest_api_server.support_libs.extractor.FilingHandle import FilingHandle
+
+
+class TransportError(Exception):
+    """
+    A request to EDGAR failed, status is the HTTP status or None for network errors
+    """
+    # too many requests and server side errors are worth another try
+    RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, message: str,
+                 status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status in self.RETRYABLE_STATUSES
+
+
+class RequestsTransport:
+    """
+    Default transport, a pooled requests session to EDGAR. Any object with the same
+    get() method can be given to EdgarDownloader instead, e.g to run the pipeline
+    against a local stand-in server in tests
+    """
+
+    def __init__(self, user_agent: Optional[str] = None,
+                 timeout: float = 30,
+                 pool_size: int = 16):
+        """
+        :param user_agent: SEC requires a declared user agent with a contact address
+        :type user_agent: str
+        :param timeout: seconds to wait for a response
+        :type timeout: float
+        :param pool_size: connections kept open to the server
+        :type pool_size: int
+        """
+        self._timeout = timeout
+        self._session = requests.Session()
+        self._session.headers['User-Agent'] = user_agent or os.environ.get('CI_EDGAR_USER_AGENT',
+                                                                           'Name (email)')
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                                pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def get(self, url: str,
+            params: Optional[dict] = None) -> bytes:
+        """
+        :param url: absolute url
+        :type url: str
+        :param params: query parameters
+        :type params: dict
+        :return: body of the response
+        :rtype: bytes
+        """
+        try:
+            response = self._session.get(url, params=params, timeout=self._timeout)
+        except requests.RequestException as err:
+            raise TransportError(f"GET {url} failed: {err}") from err
+        if response.status_code != 200:
+            raise TransportError(f"GET {url} returned {response.status_code}",
+                                 status=response.status_code)
+        return response.content
+
+    def __repr__(self):
+        return "RequestsTransport()"
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket, every request to EDGAR takes a token so that all the
+    download threads together stay under the SEC fair access limit
+    """
+
+    def __init__(self, rate: float,
+                 capacity: Optional[float] = None):
+        """
+        :param rate: tokens added per second
+        :type rate: float
+        :param capacity: max burst, defaults to a single request. A burst is on top of
+                         the rate, a bucket of one second worth of tokens would allow
+                         twice the rate in its first second
+        :type capacity: float
+        """
+        self._rate = rate
+        self._capacity = capacity if capacity is not None else 1
+        # a single token at start, the first second never goes over the rate
+        self._tokens = min(self._capacity, 1)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token, blocks until one is available
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_seconds = (1 - self._tokens) / self._rate
+            time.sleep(wait_seconds)
+
+    def __repr__(self):
+        return f"TokenBucket(rate={self._rate}, capacity={self._capacity})"
+
+
+class DownloadResult:
+    """
+    Outcome of the download of one (ticker, form type)
+    """
+    __slots__ = ('ticker', 'form_type', 'paths', 'skipped', 'error')
+
+    def __init__(self, ticker: str,
+                 form_type: str):
+        self.ticker = ticker
+        self.form_type = form_type
+        # files written by this run
+        self.paths: List[str] = []
+        # files already on disk from an earlier run
+        self.skipped: List[str] = []
+        self.error: Optional[BaseException] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self):
+        return (f"DownloadResult({self.ticker!r}, {self.form_type!r}, paths={len(self.paths)}, "
+                f"skipped={len(self.skipped)}, error={self.error!r})")
+
+
+class EdgarDownloader:
+    """
+    Downloads the full submission .txt filings of many tickers and form types at once.
+    The filing lists and the filings themselves are fetched by a pool of threads which
+    share one token bucket so the SEC limit of 10 requests per second is respected
+    globally. Failed requests are retried with exponential backoff, a ticker which
+    still fails is reported in its DownloadResult and does not stop the others.
+    Files are saved with the same layout as secedgar:
+    path_to_save_file/<ticker>/<form type>/<accession number>.txt
+    with a .gz or .zst suffix when the filings are stored compressed, which the
+    parsers read transparently (see FilingHandle)
+    """
+    _FILING_HREF_PATTERN = re.compile(rb'<filingHREF>\s*([^<\s]+)\s*</filingHREF>', re.IGNORECASE)
+    # filings listed per page of the EDGAR company browse
+    _PAGE_SIZE = 100
+
+    def __init__(self, path_to_save_file: str,
+                 transport: Optional[object] = None,
+                 requests_per_second: float = 10,
+                 workers: int = 8,
+                 max_retries: int = 4,
+                 backoff_seconds: float = 0.5,
+                 base_url: Optional[str] = None,
+                 compression: Optional[str] = None):
+        """
+        :param path_to_save_file: root folder of the saved filings
+        :type path_to_save_file: str
+        :param transport: object with a get(url, params) -> bytes method, defaults to
+                          RequestsTransport
+        :type transport: object
+        :param requests_per_second: global request budget
+        :type requests_per_second: float
+        :param workers: number of download threads
+        :type workers: int
+        :param max_retries: retries of a failed request before giving up
+        :type max_retries: int
+        :param backoff_seconds: wait before the first retry, doubled for each retry
+        :type backoff_seconds: float
+        :param base_url: EDGAR server, defaults to CI_EDGAR_BASE_URL or www.sec.gov
+        :type base_url: str
+        :param compression: gzip or zstd to store the filings compressed, defaults to
+                            CI_FILING_COMPRESSION or plain text
+        :type compression: str
+        """
+        self._path_to_save_file = path_to_save_file
+        self._transport = transport if transport is not None else RequestsTransport(pool_size=workers)
+        self._bucket = TokenBucket(requests_per_second)
+        self._workers = workers
+        self._max_retries = max_retries
+        self._backoff_seconds = backoff_seconds
+        base_url = base_url or os.environ.get('CI_EDGAR_BASE_URL', 'https://www.sec.gov/')
+        self._browse_url = base_url.rstrip('/') + '/cgi-bin/browse-edgar'
+        self._compression = compression or os.environ.get('CI_FILING_COMPRESSION') or None
+        # fail before any download on an unknown or unavailable compression
+        self._suffix = FilingHandle.suffix_of(self._compression)
+        if self._compression is not None:
+            FilingHandle.compress(b'', self._compression)
+
+    def _get(self, url: str,
+             params: Optional[dict] = None) -> bytes:
+        """
+        Rate limited GET with retries
+        """
+        attempt = 0
+        while True:
+            self._bucket.acquire()
+            try:
+                return self._transport.get(url, params)
+            except TransportError as err:
+                if not err.retryable or attempt >= self._max_retries:
+                    raise
+                # full jitter keeps the retrying threads from hitting EDGAR in step
+                wait_seconds = self._backoff_seconds * (2 ** attempt) * random.uniform(0.5, 1.0)
+                logger.warning(
+                    f"Retrying {url} in {wait_seconds:.2f}s err:{err}")
+                time.sleep(wait_seconds)
+                attempt += 1
+
+    def list_filing_urls(self, ticker: str,
+                         form_type: str,
+                         count: int) -> List[str]:
+        """
+        Gets the urls of the latest full submission files of a ticker
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param form_type: SEC form type e.g 10-K
+        :type form_type: str
+        :param count: max number of filings
+        :type count: int
+        :return: urls of the .txt files, latest first
+        :rtype: List[str]
+        """
+        params = {
+            'action': 'getcompany',
+            'CIK': ticker.lower(),
+            'type': form_type.upper(),
+            'owner': 'include',
+            'output': 'xml',
+            'count': min(count, self._PAGE_SIZE),
+            'start': 0,
+        }
+        links = []
+        while len(links) < count:
+            page = self._FILING_HREF_PATTERN.findall(self._get(self._browse_url, dict(params)))
+            links.extend(link.decode('ascii') for link in page)
+            if len(page) < params['count']:
+                # last page
+                break
+            params['start'] += len(page)
+        # index page links look like .../0000320193-18-000145-index.htm
+        return [link[:link.rfind('-')] + '.txt' for link in links[:count]]
+
+    def _download_filing(self, url: str,
+                         folder: str,
+                         result: DownloadResult):
+        """
+        Saves one filing, files already on disk are not downloaded again
+        """
+        plain_path = os.path.join(folder, url.rsplit('/', 1)[-1])
+        # a filing already saved plain or compressed is not downloaded again
+        for suffix in ('',) + tuple(FilingHandle.COMPRESSED_SUFFIXES):
+            if os.path.exists(plain_path + suffix) and os.path.getsize(plain_path + suffix) > 0:
+                result.skipped.append(plain_path + suffix)
+                return
+        path = plain_path + self._suffix
+        # includes the wait for the rate limit, it is part of what a download costs
+        with time_stage('download', result.form_type, result.ticker):
+            data = self._get(url)
+            if self._compression is not None:
+                data = FilingHandle.compress(data, self._compression)
+            # write then rename so that a crash never leaves a partial filing behind
+            temp_path = path + '.part'
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        result.paths.append(path)
+
+    def download(self, jobs: Iterable[Tuple[str, str]],
+                 count: int = 10) -> Dict[Tuple[str, str], DownloadResult]:
+        """
+        Downloads the filings of every (ticker, form type) job, the filings of a job
+        are queued as soon as its list is known so listing and downloading overlap
+        :param jobs: (ticker, form type) pairs e.g [('aapl', '10-K'), ('msft', '10-Q')]
+        :type jobs: Iterable[Tuple[str, str]]
+        :param count: max number of filings per job
+        :type count: int
+        :return: result of every job
+        :rtype: dict
+        """
+        results = {(ticker, form_type): DownloadResult(ticker, form_type)
+                   for ticker, form_type in jobs}
+        with ThreadPoolExecutor(max_workers=self._workers,
+                                thread_name_prefix='edgar_download') as executor:
+            list_futures = {executor.submit(self.list_filing_urls, ticker, form_type, count): (ticker, form_type)
+                            for ticker, form_type in results}
+            download_futures = {}
+            for list_future in as_completed(list_futures):
+                result = results[list_futures[list_future]]
+                try:
+                    urls = list_future.result()
+                    if not urls:
+                        raise ValueError("No filings available.")
+                except Exception as err:
+                    logger.error(
+                        f"Unable to list {result.form_type} filings of {result.ticker} err:{err}")
+                    result.error = err
+                    continue
+                folder = os.path.join(self._path_to_save_file, result.ticker.lower(), result.form_type.lower())
+                os.makedirs(folder, exist_ok=True)
+                for url in urls:
+                    download_futures[executor.submit(self._download_filing, url, folder, result)] = result
+            for download_future in as_completed(download_futures):
+                result = download_futures[download_future]
+                try:
+                    download_future.result()
+                except Exception as err:
+                    logger.error(
+                        f"Unable to download a {result.form_type} filing of {result.ticker} err:{err}")
+                    # keep the first error, the other files of the ticker still download
+                    if result.error is None:
+                        result.error = err
+        for result in results.values():
+            logger.info("Download finished %s", result)
+        return results
+
+    def __repr__(self):
+        return f"EdgarDownloader({self._path_to_save_file!r}, workers={self._workers}, compression={self._compression})"
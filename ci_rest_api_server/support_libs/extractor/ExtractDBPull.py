@@ -0,0 +1,377 @@
+# Read side of the extracted data in Mongo DB, used by the REST API.
+# It only needs pymongo: the EDGAR download and the parsing stack are imported by
+# IExtractDBPush, whose ExtractParseForms adds the push side to this class
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import (Callable,
+                    Dict,
+                    Iterator,
+                    List,
+                    Mapping,
+                    Optional,
+                    Tuple,
+                    )
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+from ci_rest_api_server.support_libs.extractor.SharedMongoClient import SharedMongoClient
+from ci_rest_api_server.support_libs.extractor.StageMetrics import time_stage
+from ci_rest_api_server.support_libs.extractor.StorageLayout import StorageLayout
+
+# Every year of a ticker is one document, the filing year is its unique key
+YEAR_KEY = 'data.filing-year'
+# Quarterly forms (10-Q) have one document per year and fiscal quarter
+QUARTER_KEY = 'data.filing-quarter'
+QUARTERLY_FORMS = ('10-Q',)
+# Ratios of every ticker computed from the 10-K data, one document per ticker
+RATIOS_DB = '10-K-RATIOS'
+RATIOS_COLLECTION = 'ratios'
+# Version of the data of every form type and ticker, bumped by the pushes of every
+# process so the API processes see the pushes of IngestWorker and Backfill too
+PUSH_VERSIONS_DB = 'push-versions'
+PUSH_VERSIONS_COLLECTION = 'versions'
+# Extracted field names (e.g assets, filing-year) allowed in projections
+FIELD_NAME_PATTERN = re.compile(r'[a-z][a-z0-9\-]*')
+
+
+class ExtractDBPull:
+    """
+    Pulls the extracted data of the tickers from Mongo DB: all the years of a ticker,
+    many tickers at once, cross ticker screens and the precomputed ratios. Every form
+    type is a DB and the tickers are laid out in it as set by StorageLayout
+    NOTE: Use the from_db() constructor, it shares the process wide SharedMongoClient
+    """
+    # Used by consumer to pull data from DB only
+    # Reason for use: opening and closing connections to Mongp DB are expensive the time
+    # consuming, this will make the operation fast by keeping the connection open for 
+    # fast requests. It is the process wide SharedMongoClient, also used to push data
+    _client_handle_pull_db = None
+    # Called with (form type, ticker) after a ticker is pushed, e.g to drop cached responses
+    _push_listeners: List[Callable[[str, str], None]] = []
+    # Threads used to query many tickers at once, created on first use
+    _pull_executor: Optional[ThreadPoolExecutor] = None
+    _pull_executor_lock = threading.Lock()
+
+    def __init__(self, storage_layout: Optional[StorageLayout] = None):
+        """
+        :param storage_layout: how the tickers are stored in the DB, defaults to
+                               CI_MONGO_STORAGE_LAYOUT (see StorageLayout)
+        :type storage_layout: StorageLayout
+        """
+        self.storage_layout = storage_layout or StorageLayout.from_env()
+
+    @classmethod
+    def add_push_listener(cls, listener: Callable[[str, str], None]):
+        """
+        Registers a callback run with (form type, ticker) every time a ticker is pushed
+        :param listener: callback
+        :type listener: Callable[[str, str], None]
+        """
+        cls._push_listeners.append(listener)
+
+    @classmethod
+    def from_db(cls, storage_layout: Optional[StorageLayout] = None):
+        # the shared client is only created once, every request reuses its pool
+        cls._client_handle_pull_db: "MongoClient" = SharedMongoClient.get()
+        return cls(storage_layout)
+
+    @staticmethod
+    def record_key(record: Mapping) -> str:
+        """
+        :param record: extracted form data
+        :type record: FinancialFacts or dict
+        :return: key of the record in the pulled data e.g 2018 or 2018-Q3 for quarterly forms
+        :rtype: str
+        """
+        if record.get('filing-quarter'):
+            return f"{record['filing-year']}-Q{record['filing-quarter']}"
+        return str(record['filing-year'])
+
+    @staticmethod
+    def build_pull_query(fields: Optional[List[str]] = None,
+                         from_year: Optional[int] = None,
+                         to_year: Optional[int] = None) -> Tuple[dict, Optional[dict]]:
+        """
+        Builds the Mongo filter and projection of a pull so that only the requested
+        years and fields leave the DB
+        :param fields: extracted fields to return, None returns every field
+        :type fields: List[str]
+        :param from_year: first filing year to return (inclusive)
+        :type from_year: int
+        :param to_year: last filing year to return (inclusive)
+        :type to_year: int
+        :return: filter, projection
+        :rtype: Tuple[dict, dict]
+        """
+        query = {}
+        year_range = {}
+        if from_year is not None:
+            year_range['$gte'] = from_year
+        if to_year is not None:
+            year_range['$lte'] = to_year
+        if year_range:
+            query[YEAR_KEY] = year_range
+        projection = None
+        if fields:
+            for field in fields:
+                # field names end up in the query, never let operators or paths through
+                if not FIELD_NAME_PATTERN.fullmatch(field):
+                    raise ValueError(f"Invalid field name: {field!r}")
+            # the year and quarter are always needed to key the records
+            projection = {'_id': 0, YEAR_KEY: 1, QUARTER_KEY: 1}
+            projection.update({'data.' + field: 1 for field in fields})
+        return query, projection
+
+    def pull_from_db(self,
+                     ticker: str,
+                     db_name: str,
+                     fields: Optional[List[str]] = None,
+                     from_year: Optional[int] = None,
+                     to_year: Optional[int] = None):
+        """
+        Returns all the data typically 10 years history for a given ticker symbol and 
+        DB type. Note DB type is Mongo DB type. Records are keyed by year e.g '2018'
+        or by year and fiscal quarter for 10-Q e.g '2018-Q3'
+        NOTE: To use this function use alternative constructor which is the data pulling 
+              constructor 
+        :param ticker: Company for which data is needed eg. 'aapl', 'csco'
+        :type ticker: str
+        :param db_name: This is the DB type for mongo DB, can have values like 10-K, 10-Q
+                        these are the form types, each DB type = SEC form type 
+        :type db_name: str
+        :param fields: only return these fields (and the filing year), default is all
+        :type fields: List[str]
+        :param from_year: only return years from this one (inclusive)
+        :type from_year: int
+        :param to_year: only return years up to this one (inclusive)
+        :type to_year: int
+        :return: a collection of dictionaries for all years 
+        :rtype: dict
+        """
+        data_from_db = {}
+        try:
+            query, projection = self.build_pull_query(fields, from_year, to_year)
+            year_range = bool(query)
+            query.update(self.storage_layout.ticker_filter(ticker))
+            # remember this is a pull connection, has to be independent of push connection 
+            db = self._client_handle_pull_db[db_name.upper()]
+            collection = db[self.storage_layout.collection_name(ticker.lower())]
+            # Get all the records for this collection, filtered and projected by the DB
+            with time_stage('db_read', db_name, ticker):
+                db_cursor = collection.find(query, projection)
+                for item in db_cursor:
+                    key = self.record_key(item['data'])
+                    # store as key: str(year) or year-Qn for 10-Q , value: all the extracted fields
+                    data_from_db[key] = item['data']
+            # the records just read are the count, no need for a collection scan
+            logger.debug("%s %s %s %s %s %s",
+                         "collection:",
+                         ticker.lower(),
+                         "has",
+                         len(data_from_db),
+                         " records in DB:",
+                         db_name.upper())
+            if not data_from_db and not year_range:
+                # collections only exist once a ticker is pushed
+                raise LookupError(f"No records for ticker {ticker} in DB {db_name.upper()}")
+        except Exception as err:
+            logger.exception("%s %s %s %s %s %s",
+                             "Unable to extract ticker :",
+                             ticker,
+                             "from db type:",
+                             db_name,
+                             " Error: ",
+                             err)
+            raise err
+
+        logger.info("%s %s %s %s",
+                    "Extracted data for ticker : ",
+                    ticker,
+                    "from DB : ",
+                    db_name)
+        return data_from_db
+
+    @classmethod
+    def _get_pull_executor(cls) -> ThreadPoolExecutor:
+        """
+        :return: the thread pool shared by all the multi ticker pulls of the process
+        :rtype: ThreadPoolExecutor
+        """
+        if cls._pull_executor is None:
+            with cls._pull_executor_lock:
+                if cls._pull_executor is None:
+                    cls._pull_executor = ThreadPoolExecutor(
+                        max_workers=int(os.environ.get('CI_DB_READ_WORKERS', 16)),
+                        thread_name_prefix='pull_from_db')
+        return cls._pull_executor
+
+    def pull_many_from_db(self,
+                          tickers: List[str],
+                          db_name: str,
+                          fields: Optional[List[str]] = None,
+                          from_year: Optional[int] = None,
+                          to_year: Optional[int] = None) -> Tuple[Dict[str, dict], Dict[str, str]]:
+        """
+        pull_from_db() for many tickers at once, the tickers are queried concurrently
+        over the shared connection pool and a failing ticker does not fail the others
+        :param tickers: Companies for which data is needed eg. ['aapl', 'csco']
+        :type tickers: List[str]
+        :param db_name: Mongo DB type (SEC form type) e.g 10-K
+        :type db_name: str
+        :param fields: only return these fields (and the filing year), default is all
+        :type fields: List[str]
+        :param from_year: only return years from this one (inclusive)
+        :type from_year: int
+        :param to_year: only return years up to this one (inclusive)
+        :type to_year: int
+        :return: ticker to its data as returned by pull_from_db(), ticker to error message
+        :rtype: Tuple[dict, dict]
+        """
+        # fail fast on bad fields instead of once per ticker
+        query, projection = self.build_pull_query(fields, from_year, to_year)
+        if self.storage_layout.single_collection:
+            return self._pull_many_from_collection(tickers, db_name, query, projection)
+        futures = {ticker: self._get_pull_executor().submit(self.pull_from_db,
+                                                            ticker,
+                                                            db_name,
+                                                            fields,
+                                                            from_year,
+                                                            to_year)
+                   for ticker in tickers}
+        data_from_db, errors = {}, {}
+        for ticker, future in futures.items():
+            try:
+                data_from_db[ticker] = future.result()
+            except Exception as err:
+                errors[ticker] = str(err)
+        return data_from_db, errors
+
+    def _pull_many_from_collection(self, tickers: List[str],
+                                   db_name: str,
+                                   query: dict,
+                                   projection: Optional[dict]) -> Tuple[Dict[str, dict], Dict[str, str]]:
+        """
+        pull_many_from_db() of the single_collection layout: one query over the
+        compound (ticker, year) index for all the tickers
+        """
+        layout = self.storage_layout
+        year_range = bool(query)
+        requested = {ticker.lower(): ticker for ticker in tickers}
+        query = dict(query, **layout.tickers_filter(tickers))
+        if projection is not None:
+            projection = dict(projection, **{layout.TICKER_KEY: 1})
+        data_from_db: Dict[str, dict] = {ticker: {} for ticker in tickers}
+        errors = {}
+        try:
+            collection = self._client_handle_pull_db[db_name.upper()][layout.FILINGS_COLLECTION]
+            with time_stage('db_read', db_name, None):
+                for item in collection.find(query, projection):
+                    ticker = requested.get(item[layout.TICKER_KEY])
+                    if ticker is not None:
+                        data_from_db[ticker][self.record_key(item['data'])] = item['data']
+        except Exception as err:
+            logger.exception(f"Unable to extract tickers {tickers} from db type: {db_name} Error: {err}")
+            return {}, {ticker: str(err) for ticker in tickers}
+        if not year_range:
+            for ticker in tickers:
+                if not data_from_db[ticker]:
+                    del data_from_db[ticker]
+                    errors[ticker] = str(LookupError(f"No records for ticker {ticker} in DB {db_name.upper()}"))
+        logger.info("Extracted data for %s tickers from DB : %s", len(data_from_db), db_name)
+        return data_from_db, errors
+
+    def screen_from_db(self, db_name: str,
+                       screen: 'ScreenQuery',
+                       limit: int,
+                       after: Optional[str] = None) -> Iterator[dict]:
+        """
+        Runs a cross ticker screen in the DB, see ScreenQuery. The single_collection
+        layout answers it with one aggregation over the (ticker, year) index, the
+        per_ticker layout with one aggregation per ticker collection in ticker order
+        NOTE: To use this function use alternative constructor which is the data pulling
+              constructor
+        :param db_name: form type e.g 10-K
+        :type db_name: str
+        :param screen: predicates, years and fields of the screen
+        :type screen: ScreenQuery
+        :param limit: most matches returned
+        :type limit: int
+        :param after: cursor of the last match of the previous page, see ScreenQuery.cursor_of()
+        :type after: str
+        :return: matches in ticker and year order as {'ticker', 'filing-year', fields...}
+        :rtype: Iterator[dict]
+        """
+        layout = self.storage_layout
+        after_key = screen.parse_cursor(after) if after else None
+        quarterly = db_name.upper() in QUARTERLY_FORMS
+        db = self._client_handle_pull_db[db_name.upper()]
+        if layout.single_collection:
+            with time_stage('db_read', db_name, None):
+                cursor = db[layout.FILINGS_COLLECTION].aggregate(screen.pipeline(limit,
+                                                                                 quarterly=quarterly,
+                                                                                 ticker_key=layout.TICKER_KEY,
+                                                                                 after=after_key))
+            for item in cursor:
+                yield dict(item['data'], ticker=item[layout.TICKER_KEY])
+            return
+        for ticker in layout.tickers(self._client_handle_pull_db, db_name):
+            if after_key is not None and ticker.lower() < after_key[0]:
+                continue
+            ticker_after = after_key if after_key is not None and ticker.lower() == after_key[0] else None
+            with time_stage('db_read', db_name, ticker):
+                cursor = db[ticker].aggregate(screen.pipeline(limit,
+                                                              quarterly=quarterly,
+                                                              after=ticker_after))
+            for item in cursor:
+                yield dict(item['data'], ticker=ticker.lower())
+                limit -= 1
+            if limit <= 0:
+                return
+
+    def pull_ratios_from_db(self, ticker: str) -> dict:
+        """
+        Returns the stored ratios of a ticker with its percentile among all the tickers
+        NOTE: To use this function use alternative constructor which is the data pulling
+              constructor
+        :param ticker: Company for which data is needed eg. 'aapl', 'csco'
+        :type ticker: str
+        :return: {'ticker', 'years', 'ratios': {name: [..]}, 'percentiles': {name: [..]},
+                  'peers': {name: [..]}}
+        :rtype: dict
+        """
+        with time_stage('db_read', RATIOS_DB, ticker):
+            document = self._client_handle_pull_db[RATIOS_DB][RATIOS_COLLECTION].find_one({'ticker': ticker.lower()},
+                                                                                          {'_id': 0})
+        if document is None:
+            raise LookupError(f"No ratios for ticker {ticker}")
+        logger.info("Extracted ratios for ticker : %s", ticker)
+        return document
+
+    @staticmethod
+    def push_version_id(form_type: str,
+                        ticker: str) -> str:
+        """
+        :return: _id of the push version document of a form type and ticker e.g 10-K/aapl
+        :rtype: str
+        """
+        return f"{form_type.upper()}/{ticker.lower()}"
+
+    def pull_push_version(self, form_type: str,
+                          ticker: str) -> int:
+        """
+        Version of the data of a ticker, any push of it (from any process) changes it
+        NOTE: To use this function use alternative constructor which is the data pulling
+              constructor
+        :param form_type: SEC form type which is also the DB name e.g 10-k, or RATIOS_DB
+        :type form_type: str
+        :param ticker: ticker symbol
+        :type ticker: str
+        :return: the version, 0 when the ticker was never pushed
+        :rtype: int
+        """
+        document = self._client_handle_pull_db[PUSH_VERSIONS_DB][PUSH_VERSIONS_COLLECTION].find_one(
+            {'_id': self.push_version_id(form_type, ticker)}, {'version': 1})
+        return document['version'] if document is not None else 0
+
+    def __repr__(self):
+        return f"ExtractDBPull({self.storage_layout!r})"
@@ -0,0 +1,236 @@
+# Logger shared by the extractor and server modules, it imports nothing of the package
+# so that every module (read path included) can use it without loading the ingestion stack
+# The calling threads only put the records in a queue: a listener thread formats them
+# and writes them to the console and to the log file, as JSON lines in the file
+import atexit
+import contextvars
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import (datetime,
+                      timezone,
+                      )
+from logging.handlers import (QueueHandler,
+                              QueueListener,
+                              )
+from typing import (Dict,
+                    Optional,
+                    Tuple,
+                    )
+
+# Fields of the records set by log_context(), e.g by time_stage() around every stage
+CONTEXT_FIELDS = ('stage', 'form_type', 'ticker')
+_log_context: contextvars.ContextVar = contextvars.ContextVar('extractor_log_context', default=None)
+
+
+@contextmanager
+def log_context(**fields: Optional[str]):
+    """
+    Adds the fields to every record logged by the with block (in its thread) e.g
+    with log_context(stage='parse', ticker='aapl'):
+    :param fields: stage, form_type and/or ticker
+    """
+    current = _log_context.get()
+    token = _log_context.set(dict(current, **fields) if current else fields)
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: time, level, logger, message, the fields of
+    log_context() and of extra=, dropped (debug records of the same call site
+    sampled out before this one, see DebugSampler) and the traceback if any
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+        }
+        for field in CONTEXT_FIELDS + ('dropped',):
+            value = getattr(record, field, None)
+            if value is not None:
+                line[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            line['exc'] = record.exc_text
+        return json.dumps(line, default=str)
+
+
+class LogContextFilter(logging.Filter):
+    """
+    Copies the fields of log_context() onto the record, in the thread logging it
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _log_context.get()
+        if context:
+            for field, value in context.items():
+                if getattr(record, field, None) is None:
+                    setattr(record, field, value)
+        return True
+
+
+class DebugSampler:
+    """
+    Rate limit of the debug records per call site (code and line): a site logging in
+    a hot loop (per tag, per file) keeps at most rate records per second, the number
+    of records dropped since the last one kept is its 'dropped' field
+    """
+
+    def __init__(self, rate: float = 0.0):
+        """
+        :param rate: records per second and call site, 0 keeps every record
+        :type rate: float
+        """
+        self.rate = rate
+        self._lock = threading.Lock()
+        # call site: [tokens, time of the last refill, records dropped]
+        self._sites: Dict[Tuple[object, int], list] = {}
+
+    def admit(self, site: Tuple[object, int]) -> Optional[int]:
+        """
+        :param site: code object and line of the call
+        :type site: Tuple[object, int]
+        :return: None to drop the record, else the records dropped since the last one kept
+        :rtype: int
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._sites.get(site)
+            if bucket is None:
+                bucket = self._sites[site] = [self.rate, now, 0]
+            # bucket of one second of records, refilled continuously
+            bucket[0] = min(self.rate, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return None
+            bucket[0] -= 1
+            dropped, bucket[2] = bucket[2], 0
+        return dropped
+
+
+class SampledLogger(logging.LoggerAdapter):
+    """
+    The logger of the modules: debug() drops the records over the rate of the
+    sampler before anything is built for them (the record, its caller lookup),
+    the other levels go straight to the logger
+    """
+
+    def __init__(self, logger: logging.Logger,
+                 sampler: DebugSampler):
+        super().__init__(logger, None)
+        self.sampler = sampler
+
+    def process(self, msg, kwargs):
+        # the extra= of the call is kept, the context fields come from LogContextFilter
+        return msg, kwargs
+
+    def debug(self, msg, *args, **kwargs):
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return
+        if self.sampler.rate:
+            caller = sys._getframe(1)
+            dropped = self.sampler.admit((caller.f_code, caller.f_lineno))
+            if dropped is None:
+                return
+            if dropped:
+                kwargs['extra'] = dict(kwargs.get('extra') or {}, dropped=dropped)
+        # the record is attributed to the caller of this method
+        kwargs.setdefault('stacklevel', 2)
+        self.logger._log(logging.DEBUG, msg, args, **kwargs)
+
+
+class _ListenerQueueHandler(QueueHandler):
+    """
+    Hands the records to the listener thread as they are: the message is only
+    formatted there, and only for the records the handlers keep, so the arguments
+    of a record must not be changed after the call that logs it. The listener is
+    started by the first record of the process, a forked child (e.g a parse worker)
+    starts its own since the thread of its parent does not exist in it
+    """
+
+    def __init__(self, *handlers: logging.Handler):
+        super().__init__(queue.SimpleQueue())
+        self.handlers = handlers
+        self.listener: Optional[QueueListener] = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        # a fork while another thread holds the lock would leave it locked in the child
+        os.register_at_fork(after_in_child=self._reset_start_lock)
+
+    def _reset_start_lock(self):
+        self._start_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the record stays in this process, no need to format and pickle it
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self._pid != os.getpid():
+            self.start()
+        self.queue.put_nowait(record)
+
+    def start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self.queue = queue.SimpleQueue()
+            self.listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+            self.listener.start()
+            self._pid = os.getpid()
+        # runs before logging.shutdown() (registered first) closes the handlers
+        atexit.register(self.stop)
+        if 'multiprocessing' in sys.modules:
+            # the processes of multiprocessing end with os._exit(), atexit does not run
+            import multiprocessing.util
+            multiprocessing.util.Finalize(None, self.stop, exitpriority=0)
+
+    def stop(self):
+        """
+        Writes the records still queued then ends the listener thread
+        """
+        with self._start_lock:
+            if self.listener is not None and self._pid == os.getpid():
+                self.listener.stop()
+            self.listener = None
+            self._pid = None
+
+
+# set logging file name and non-root names, the name is the one of the module which
+# used to own the logger so the existing log lines and filters are unchanged
+base_logger = logging.getLogger('ci_rest_api_server.support_libs.extractor.IExtractDBPush')
+# CI_LOG_LEVEL=INFO skips the debug records before anything is built for them
+base_logger.setLevel(os.environ.get('CI_LOG_LEVEL', 'DEBUG').upper())
+
+# Setup the console handler
+console_handler = logging.StreamHandler()
+console_handler.setLevel(logging.WARNING)
+
+# Set up the file handler for the log file , log everything there as JSON lines
+# delay: the file is only opened by the first record, importing a module opens nothing
+file_handler = logging.FileHandler(os.environ.get('CI_EXTRACTOR_LOG', '../Extractor.log'),
+                                   delay=True)
+file_handler.setFormatter(JsonFormatter())
+
+# Both handlers are behind the queue, no file write happens in a parse or request thread
+queue_handler = _ListenerQueueHandler(console_handler, file_handler)
+queue_handler.addFilter(LogContextFilter())
+base_logger.addHandler(queue_handler)
+
+# CI_LOG_DEBUG_RATE: debug records per second kept from each call site, 0 keeps all
+logger = SampledLogger(base_logger, DebugSampler(float(os.environ.get('CI_LOG_DEBUG_RATE', 0))))
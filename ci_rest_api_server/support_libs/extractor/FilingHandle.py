@@ -0,0 +1,216 @@
+# Read once access to a saved SEC filing shared by the header sniffer and form parsers
+import gzip
+import mmap
+from typing import (BinaryIO,
+                    Iterator,
+                    Optional,
+                    Union,
+                    )
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+from ci_rest_api_server.support_libs.extractor.SubmissionSplitter import SubmissionSplitter
+
+try:
+    import zstandard
+except ImportError:
+    # zstandard is optional, gzip compressed filings are always readable
+    zstandard = None
+
+
+class FilingHandle:
+    """
+    Memory maps a filing once so that the SEC header sniffing and the form parsing
+    work on the same zero copy buffer instead of each reading the whole file into
+    its own string. Use it as a context manager so the map is released after parsing
+    e.g
+        with FilingHandle(path) as filing:
+            form_type, year = GeneralFormParser.get_form_type_and_filing_year(filing)
+    Filings stored compressed (.txt.gz or .txt.zst, see EdgarDownloader) are read
+    through streaming decompression instead: the header only decompresses the start
+    of the file and xbrl_document() keeps only the XBRL document of the submission
+    """
+    # the SEC header fields we sniff are always in the first 2000 characters
+    HEADER_PREFIX_SIZE = 2000
+    # file name suffix of the compressed filings: compression name
+    COMPRESSED_SUFFIXES = {
+        '.gz': 'gzip',
+        '.zst': 'zstd',
+    }
+    # Size of each block decompressed from a compressed filing
+    _CHUNK_SIZE = 1 << 20
+
+    def __init__(self, file_path: str):
+        """
+        Opens and maps the file, errors like FileNotFoundError are raised to the caller
+        :param file_path: path of the filing
+        :type file_path: str
+        """
+        self._file_path = file_path
+        self._compression = self.compression_of(file_path)
+        if self._compression == 'zstd' and zstandard is None:
+            raise RuntimeError(f"zstandard is needed to read {file_path}")
+        self._file = open(file_path, 'rb')
+        self._buffer: Optional[Union[mmap.mmap, bytes]] = None
+        self._header: Optional[str] = None
+        if self._compression is None:
+            try:
+                self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files cannot be mapped
+                self._buffer = b''
+
+    @classmethod
+    def compression_of(cls, file_path: str) -> Optional[str]:
+        """
+        :param file_path: path of a filing
+        :type file_path: str
+        :return: gzip or zstd for the compressed filings, None for plain text
+        :rtype: str
+        """
+        for suffix, compression in cls.COMPRESSED_SUFFIXES.items():
+            if file_path.endswith(suffix):
+                return compression
+        return None
+
+    @staticmethod
+    def compress(data: bytes,
+                 compression: str) -> bytes:
+        """
+        :param data: content of a filing
+        :type data: bytes
+        :param compression: gzip or zstd
+        :type compression: str
+        :return: the data in the format read back by FilingHandle
+        :rtype: bytes
+        """
+        if compression == 'gzip':
+            return gzip.compress(data, compresslevel=6)
+        if compression == 'zstd':
+            if zstandard is None:
+                raise RuntimeError("zstandard is needed to store zstd compressed filings")
+            return zstandard.ZstdCompressor(level=10).compress(data)
+        raise ValueError(f"Unknown compression {compression!r}, use gzip or zstd")
+
+    @classmethod
+    def suffix_of(cls, compression: Optional[str]) -> str:
+        """
+        :param compression: gzip, zstd or None
+        :type compression: str
+        :return: suffix added to the file name of a filing stored with this compression
+        :rtype: str
+        """
+        if compression is None:
+            return ''
+        for suffix, name in cls.COMPRESSED_SUFFIXES.items():
+            if name == compression:
+                return suffix
+        raise ValueError(f"Unknown compression {compression!r}, use gzip or zstd")
+
+    @property
+    def file_path(self) -> str:
+        """
+        :return: path of the filing
+        :rtype: str
+        """
+        return self._file_path
+
+    @property
+    def compression(self) -> Optional[str]:
+        """
+        :return: gzip or zstd for a compressed filing, None for plain text
+        :rtype: str
+        """
+        return self._compression
+
+    def _stream(self) -> BinaryIO:
+        """
+        :return: decompressing reader of the file, from its start
+        :rtype: BinaryIO
+        """
+        self._file.seek(0)
+        if self._compression == 'gzip':
+            return gzip.GzipFile(fileobj=self._file, mode='rb')
+        return zstandard.ZstdDecompressor().stream_reader(self._file, closefd=False)
+
+    def chunks(self) -> Iterator[bytes]:
+        """
+        :return: the whole filing, decompressed block by block
+        :rtype: Iterator[bytes]
+        """
+        if self._compression is None:
+            for offset in range(0, len(self._buffer), self._CHUNK_SIZE):
+                yield self._buffer[offset:offset + self._CHUNK_SIZE]
+            return
+        with self._stream() as stream:
+            while True:
+                chunk = stream.read(self._CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+
+    @property
+    def buffer(self) -> Union[mmap.mmap, bytes]:
+        """
+        :return: the whole filing, it is never copied. A compressed filing is
+                 decompressed in memory on first access, prefer xbrl_document()
+        :rtype: mmap.mmap
+        """
+        if self._buffer is None:
+            self._buffer = b''.join(self.chunks())
+        return self._buffer
+
+    def header(self, size: int = HEADER_PREFIX_SIZE) -> str:
+        """
+        :param size: number of bytes to read from the start of the file
+        :type size: int
+        :return: bounded prefix of the file holding the SEC header
+        :rtype: str
+        """
+        if self._buffer is not None:
+            return self._buffer[:size].decode('latin-1')
+        if self._header is None or len(self._header) < size:
+            prefix = b''
+            with self._stream() as stream:
+                # a read can return less than asked before the end of the data
+                while len(prefix) < size:
+                    chunk = stream.read(size - len(prefix))
+                    if not chunk:
+                        break
+                    prefix += chunk
+            self._header = prefix.decode('latin-1')
+        return self._header[:size]
+
+    def xbrl_document(self, form_type: str) -> Optional[memoryview]:
+        """
+        :param form_type: SEC form type of the submission e.g 10-K
+        :type form_type: str
+        :return: the document holding the XBRL facts, see SubmissionSplitter.xbrl_document()
+        :rtype: memoryview
+        """
+        if self._buffer is not None:
+            return SubmissionSplitter(self._buffer).xbrl_document(form_type)
+        return SubmissionSplitter.xbrl_document_from_stream(self.chunks(), form_type)
+
+    def close(self):
+        """
+        Unmaps and closes the file
+        """
+        if isinstance(self._buffer, mmap.mmap) and not self._buffer.closed:
+            try:
+                self._buffer.close()
+            except BufferError:
+                # a view on the map is still alive (e.g held by a traceback), the
+                # map is released when that view is garbage collected
+                logger.debug("Map of %s still in use, leaving it to the gc", self._file_path)
+        self._file.close()
+
+    def __enter__(self) -> 'FilingHandle':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.buffer)
+
+    def __repr__(self):
+        return f"FilingHandle({self._file_path!r})"
@@ -0,0 +1,151 @@
+# Persistent record of the filings already parsed and pushed, per ticker and form type
+import json
+import os
+from typing import (Dict,
+                    Optional,
+                    Tuple,
+                    )
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+
+
+class FilingManifest:
+    """
+    Keeps, for every filing of a <ticker>/<form type> folder, the size and mtime of
+    the file it was parsed from, its form type and year (the header fields) and the
+    version of the parser used. The ingest uses it to parse and push only the filings
+    which are new, changed on disk or parsed by an older parser, so a quarterly
+    refresh costs one filing per ticker instead of ten years of parsing.
+    The manifest is a json file in the folder of the filings, keyed by accession number
+    """
+    FILE_NAME = 'manifest.json'
+
+    def __init__(self, folder: str,
+                 entries: Optional[Dict[str, dict]] = None):
+        """
+        :param folder: folder of the filings, e.g path_to_save_file/aapl/10-k
+        :type folder: str
+        :param entries: accession number to its entry
+        :type entries: dict
+        """
+        self._folder = folder
+        self._entries = entries if entries is not None else {}
+
+    @classmethod
+    def load(cls, folder: str) -> 'FilingManifest':
+        """
+        Loads the manifest of a folder, a missing or unreadable manifest is empty which
+        means every filing gets parsed again
+        :param folder: folder of the filings
+        :type folder: str
+        :return: the manifest
+        :rtype: FilingManifest
+        """
+        path = os.path.join(folder, cls.FILE_NAME)
+        try:
+            with open(path) as file:
+                entries = json.load(file)
+        except FileNotFoundError:
+            entries = {}
+        except (ValueError, OSError) as err:
+            logger.warning(
+                f"Ignoring unreadable manifest {path} err:{err}")
+            entries = {}
+        return cls(folder, entries)
+
+    @staticmethod
+    def accession_number(file_path: str) -> str:
+        """
+        :param file_path: path of a filing e.g .../0000320193-18-000145.txt
+        :type file_path: str
+        :return: accession number of the filing e.g 0000320193-18-000145
+        :rtype: str
+        """
+        return os.path.basename(file_path).split('.', 1)[0]
+
+    @staticmethod
+    def _file_state(file_path: str) -> Dict[str, int]:
+        stat = os.stat(file_path)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+    def _unchanged_entry(self, file_path: str) -> Optional[dict]:
+        """
+        :return: entry of the filing if the file did not change since it was recorded
+        :rtype: dict
+        """
+        entry = self._entries.get(self.accession_number(file_path))
+        if entry is None:
+            return None
+        try:
+            file_state = self._file_state(file_path)
+        except OSError:
+            return None
+        if entry['size'] != file_state['size'] or entry['mtime_ns'] != file_state['mtime_ns']:
+            return None
+        return entry
+
+    def is_current(self, file_path: str,
+                   parser_version: int) -> bool:
+        """
+        :param file_path: path of a filing
+        :type file_path: str
+        :param parser_version: version of the parser which would parse it now
+        :type parser_version: int
+        :return: True if the filing was pushed from the same file by the same parser
+        :rtype: bool
+        """
+        entry = self._unchanged_entry(file_path)
+        return entry is not None and entry['parser_version'] == parser_version
+
+    def header(self, file_path: str) -> Optional[Tuple[str, int]]:
+        """
+        Header fields recorded for the filing, valid as long as the file did not change
+        :param file_path: path of a filing
+        :type file_path: str
+        :return: form type, year of filing or None if unknown
+        :rtype: Tuple[str, int]
+        """
+        entry = self._unchanged_entry(file_path)
+        if entry is None:
+            return None
+        return entry['form_type'], entry['filing_year']
+
+    def record(self, file_path: str,
+               form_type: str,
+               filing_year: int,
+               parser_version: int):
+        """
+        Records a filing once its data is in the DB, call save() to persist
+        :param file_path: path of the filing
+        :type file_path: str
+        :param form_type: form type from the header
+        :type form_type: str
+        :param filing_year: year of filing from the header
+        :type filing_year: int
+        :param parser_version: version of the parser used
+        :type parser_version: int
+        """
+        entry = self._file_state(file_path)
+        entry.update({'form_type': form_type,
+                      'filing_year': filing_year,
+                      'parser_version': parser_version})
+        self._entries[self.accession_number(file_path)] = entry
+
+    def save(self):
+        """
+        Writes the manifest, through a temporary file so a crash never leaves a
+        truncated manifest behind
+        """
+        path = os.path.join(self._folder, self.FILE_NAME)
+        temp_path = path + '.part'
+        with open(temp_path, 'w') as file:
+            json.dump(self._entries, file, indent=1, sort_keys=True)
+        os.replace(temp_path, path)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, file_path: str) -> bool:
+        return self.accession_number(file_path) in self._entries
+
+    def __repr__(self):
+        return f"FilingManifest({self._folder!r}, {len(self._entries)} filings)"
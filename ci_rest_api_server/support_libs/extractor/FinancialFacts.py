@@ -0,0 +1,181 @@
+# Compact in memory record of the facts extracted from one filing
+from array import array
+from collections.abc import Mapping
+from typing import (Dict,
+                    Iterable,
+                    Iterator,
+                    Optional,
+                    Tuple,
+                    Union,
+                    )
+
+
+class FactSchema:
+    """
+    Ordered names of the numeric fields of a record, shared by every record of the
+    same form type. Records only hold their values, the name to position lookup
+    lives here once. Schemas are interned: the same fields always give the same
+    instance, also after a round trip through pickle to a worker process
+    """
+    __slots__ = ('fields', 'field_index')
+    _schemas: Dict[Tuple[str, ...], 'FactSchema'] = {}
+
+    def __init__(self, fields: Tuple[str, ...]):
+        self.fields = fields
+        self.field_index = {field: index for index, field in enumerate(fields)}
+
+    @classmethod
+    def get(cls, fields: Iterable[str]) -> 'FactSchema':
+        """
+        :param fields: names of the numeric fields, in storage order
+        :type fields: Iterable[str]
+        :return: the shared schema of these fields
+        :rtype: FactSchema
+        """
+        fields = tuple(fields)
+        schema = cls._schemas.get(fields)
+        if schema is None:
+            schema = cls._schemas.setdefault(fields, cls(fields))
+        return schema
+
+    def __reduce__(self):
+        return FactSchema.get, (self.fields,)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def __repr__(self):
+        return f"FactSchema({len(self.fields)} fields)"
+
+
+class FinancialFacts(Mapping):
+    """
+    Facts of one filing: the numeric fields are an int64 array laid out by a shared
+    FactSchema and the filing type, ticker, year and quarter are plain attributes.
+    A record weighs a few hundred bytes against a few kilobytes for the same data in
+    a dict, so the full history of many tickers fits in memory for batch jobs.
+    It reads like the dict it replaces ({'assets': .., 'filing-year': .., ...}), only
+    the edges (DB writes, json) convert it with to_dict(). A field the filing does not
+    report is left out of the keys (a bit of present is set per field found) so that
+    it is not mistaken for a reported 0
+    """
+    __slots__ = ('schema', 'values', 'present', 'filing_type', 'ticker', 'filing_year', 'filing_quarter')
+    # Keys of the record which are not in the schema, in output order
+    _META_KEYS = ('filing-type', 'filing-year', 'filing-quarter', 'ticker')
+
+    def __init__(self, schema: FactSchema,
+                 filing_type: str,
+                 ticker: str,
+                 filing_year: int,
+                 filing_quarter: Optional[int] = None):
+        """
+        Record without any numeric field yet
+        :param schema: numeric fields of the record
+        :type schema: FactSchema
+        :param filing_type: SEC form type e.g 10-K
+        :type filing_type: str
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param filing_year: year of filing
+        :type filing_year: int
+        :param filing_quarter: fiscal quarter for quarterly forms, None for yearly ones
+        :type filing_quarter: int
+        """
+        self.schema = schema
+        self.values = array('q', bytes(8 * len(schema)))
+        # bit i set once the field i of the schema has a value
+        self.present = 0
+        self.filing_type = filing_type
+        self.ticker = ticker
+        self.filing_year = filing_year
+        self.filing_quarter = filing_quarter
+
+    @classmethod
+    def from_dict(cls, record: dict,
+                  schema: Optional[FactSchema] = None) -> 'FinancialFacts':
+        """
+        Builds a record from its dict form e.g a document read from the DB
+        :param record: extracted form data
+        :type record: dict
+        :param schema: numeric fields, defaults to the numeric fields of the dict
+        :type schema: FactSchema
+        :return: the compact record
+        :rtype: FinancialFacts
+        """
+        if schema is None:
+            schema = FactSchema.get(key for key in record if key not in cls._META_KEYS)
+        facts = cls(schema,
+                    record['filing-type'],
+                    record['ticker'],
+                    record['filing-year'],
+                    record.get('filing-quarter'))
+        facts.update((key, value) for key, value in record.items()
+                     if key in schema.field_index)
+        return facts
+
+    def _meta(self, key: str) -> Union[str, int, None]:
+        if key == 'filing-type':
+            return self.filing_type
+        if key == 'filing-year':
+            return self.filing_year
+        if key == 'filing-quarter':
+            return self.filing_quarter
+        return self.ticker
+
+    def __getitem__(self, key: str) -> Union[str, int]:
+        index = self.schema.field_index.get(key)
+        if index is not None:
+            if self.present >> index & 1:
+                return self.values[index]
+            raise KeyError(key)
+        if key in self._META_KEYS:
+            value = self._meta(key)
+            if value is not None:
+                return value
+        raise KeyError(key)
+
+    def __setitem__(self, key: str,
+                    value: int):
+        """
+        Sets a numeric field, the other keys are set through their attribute
+        """
+        try:
+            index = self.schema.field_index[key]
+        except KeyError:
+            raise KeyError(f"{key} is not a field of the record") from None
+        self.values[index] = value
+        self.present |= 1 << index
+
+    def update(self, facts: Union[dict, Iterable[Tuple[str, int]]]):
+        """
+        Sets many numeric fields e.g the facts found by the XbrlFactExtractor
+        :param facts: field to value
+        :type facts: dict or iterable of pairs
+        """
+        items = facts.items() if isinstance(facts, Mapping) else facts
+        for key, value in items:
+            self[key] = value
+
+    def __iter__(self) -> Iterator[str]:
+        present = self.present
+        for index, field in enumerate(self.schema.fields):
+            if present >> index & 1:
+                yield field
+        for key in self._META_KEYS:
+            if self._meta(key) is not None:
+                yield key
+
+    def __len__(self) -> int:
+        return bin(self.present).count('1') + 3 + (self.filing_quarter is not None)
+
+    def to_dict(self) -> dict:
+        """
+        :return: dict form of the record, for BSON and json
+        :rtype: dict
+        """
+        return dict(self.items())
+
+    def __repr__(self):
+        period = self.filing_year if self.filing_quarter is None else f"{self.filing_year}-Q{self.filing_quarter}"
+        return (f"FinancialFacts({self.filing_type!r}, {self.ticker!r}, {period},"
+                f" {bin(self.present).count('1')}/{len(self.schema)} fields)")
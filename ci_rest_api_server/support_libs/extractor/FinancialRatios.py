@@ -0,0 +1,187 @@
+# Cross sectional financial ratios of every ticker and year, computed with numpy
+from typing import (Iterator,
+                    List,
+                    Mapping,
+                    Optional,
+                    Tuple,
+                    )
+import numpy as np
+
+
+class FinancialRatios:
+    """
+    Computes the ratios of all the tickers and years of a form type at once. The
+    extracted fields are laid out in a (field, ticker, year) cube so that every ratio
+    is a single array expression over the whole universe, and the percentile of each
+    ticker among its peers is ranked per year across the ticker axis.
+    The parsers leave the facts a filing does not report out of its record (see
+    FinancialFacts), they are NaN here so that a ratio without data is None instead
+    of a misleading 0. A reported 0 stays 0 (a 0 denominator gives None too)
+    """
+    # Fields read from the DB, see Parse10KForm.FACT_FIELDS
+    INPUT_FIELDS = (
+        'assets',
+        'assetscurrent',
+        'liabilities',
+        'liabilitiescurrent',
+        'longtermdebtcurrent',
+        'longtermdebtnoncurrent',
+        'netincomeloss',
+        'shorttermborrowings',
+        'stockholdersequity',
+    )
+    # Debt facts, a company without debt reports none of them so missing counts as 0
+    _DEBT_FIELDS = ('longtermdebtcurrent', 'longtermdebtnoncurrent', 'shorttermborrowings')
+    RATIOS = (
+        'current_ratio',
+        'debt_to_equity',
+        'liabilities_to_equity',
+        'return_on_equity',
+        'return_on_assets',
+        'assets_growth',
+        'equity_growth',
+        'assets_cagr_3y',
+    )
+    # Years of the trailing compound annual growth rates
+    CAGR_YEARS = 3
+
+    def __init__(self, tickers: List[str],
+                 years: List[int],
+                 values: np.ndarray):
+        """
+        :param tickers: tickers of the second axis of values
+        :type tickers: List[str]
+        :param years: consecutive years of the third axis of values
+        :type years: List[int]
+        :param values: facts shaped (INPUT_FIELDS, tickers, years), NaN when missing
+        :type values: np.ndarray
+        """
+        self.tickers = list(tickers)
+        self.years = list(years)
+        self._ticker_index = {ticker: index for index, ticker in enumerate(self.tickers)}
+        self.ratios = self._compute_ratios(values)
+        self.percentiles, self.peers = self._compute_percentiles(self.ratios)
+
+    @classmethod
+    def from_records(cls, data: Mapping[str, Mapping[str, Mapping]]) -> 'FinancialRatios':
+        """
+        Builds the fact cube from the records of many tickers
+        :param data: ticker to its records by key, as returned by pull_many_from_db()
+        :type data: dict
+        :return: the ratios of the universe of tickers
+        :rtype: FinancialRatios
+        """
+        tickers = sorted(data)
+        record_years = [record['filing-year'] for records in data.values() for record in records.values()]
+        # a continuous year axis keeps year over year growth a plain shift of the axis
+        years = list(range(min(record_years), max(record_years) + 1)) if record_years else []
+        values = np.full((len(cls.INPUT_FIELDS), len(tickers), len(years)), np.nan)
+        for ticker_index, ticker in enumerate(tickers):
+            for record in data[ticker].values():
+                year_index = record['filing-year'] - years[0]
+                values[:, ticker_index, year_index] = [np.nan if record.get(field) is None else record[field]
+                                                       for field in cls.INPUT_FIELDS]
+        return cls(tickers, years, values)
+
+    def _compute_ratios(self, values: np.ndarray) -> np.ndarray:
+        """
+        :param values: facts shaped (INPUT_FIELDS, tickers, years)
+        :type values: np.ndarray
+        :return: ratios shaped (RATIOS, tickers, years)
+        :rtype: np.ndarray
+        """
+        facts = dict(zip(self.INPUT_FIELDS, values))
+        debt = np.nansum([facts[field] for field in self._DEBT_FIELDS], axis=0)
+        assets = facts['assets']
+        equity = facts['stockholdersequity']
+        ratios = np.full((len(self.RATIOS),) + assets.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratios[0] = facts['assetscurrent'] / facts['liabilitiescurrent']
+            ratios[1] = debt / equity
+            ratios[2] = facts['liabilities'] / equity
+            ratios[3] = facts['netincomeloss'] / equity
+            ratios[4] = facts['netincomeloss'] / assets
+            ratios[5, :, 1:] = assets[:, 1:] / assets[:, :-1] - 1
+            ratios[6, :, 1:] = equity[:, 1:] / equity[:, :-1] - 1
+            span = self.CAGR_YEARS
+            if assets.shape[1] > span:
+                growth = assets[:, span:] / assets[:, :-span]
+                # no compound rate from or to a negative base
+                growth[growth <= 0] = np.nan
+                ratios[7, :, span:] = growth ** (1 / span) - 1
+        # zero denominators give infinities, they are missing values too
+        ratios[~np.isfinite(ratios)] = np.nan
+        return ratios
+
+    @staticmethod
+    def _compute_percentiles(ratios: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Mid rank percentile of every ticker among the tickers with a value for the
+        same ratio and year, ties share the same percentile
+        :param ratios: ratios shaped (RATIOS, tickers, years)
+        :type ratios: np.ndarray
+        :return: percentiles in [0, 100] shaped like ratios, NaN without a value, and
+                 the number of tickers ranked shaped (RATIOS, years)
+        :rtype: Tuple[np.ndarray, np.ndarray]
+        """
+        if not ratios.size:
+            return np.full(ratios.shape, np.nan), np.zeros((ratios.shape[0], ratios.shape[2]), dtype=int)
+        # one row of peers per ratio and year, all the rows ranked by one sort
+        rows = np.moveaxis(ratios, 1, -1).reshape(-1, ratios.shape[1])
+        order = np.argsort(rows, axis=1, kind='stable')
+        ranked = np.take_along_axis(rows, order, axis=1)
+        positions = np.arange(rows.shape[1])
+        # ties form runs of the sorted rows, (NaN never equals itself, it is sorted last)
+        starts = np.ones(ranked.shape, dtype=bool)
+        starts[:, 1:] = ranked[:, 1:] != ranked[:, :-1]
+        ends = np.ones(ranked.shape, dtype=bool)
+        ends[:, :-1] = starts[:, 1:]
+        # peers below a value, and at or below it, are the start and end of its run
+        below = np.maximum.accumulate(np.where(starts, positions, 0), axis=1)
+        at_or_below = np.minimum.accumulate(np.where(ends, positions + 1, rows.shape[1])[:, ::-1], axis=1)[:, ::-1]
+        mid_ranks = np.empty(ranked.shape)
+        np.put_along_axis(mid_ranks, order, below + at_or_below, axis=1)
+        peers = (~np.isnan(rows)).sum(axis=1, keepdims=True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percentiles = 100 * mid_ranks / (2 * peers)
+        percentiles[np.isnan(rows)] = np.nan
+        return (np.moveaxis(percentiles.reshape(ratios.shape[0], ratios.shape[2], ratios.shape[1]), -1, 1),
+                peers.reshape(ratios.shape[0], ratios.shape[2]))
+
+    @staticmethod
+    def _as_list(values: np.ndarray) -> List[Optional[float]]:
+        return [None if np.isnan(value) else round(float(value), 6) for value in values]
+
+    def ticker_document(self, ticker: str) -> dict:
+        """
+        Ratios and percentiles of a ticker, one value per year, ready for BSON and json
+        :param ticker: ticker symbol
+        :type ticker: str
+        :return: {'ticker', 'years', 'ratios': {name: [..]}, 'percentiles': {name: [..]},
+                  'peers': {name: [tickers ranked for the percentile of the year]}}
+        :rtype: dict
+        """
+        ticker_index = self._ticker_index[ticker]
+        return {
+            'ticker': ticker,
+            'years': self.years,
+            'peers': {name: self.peers[ratio_index].tolist() for ratio_index, name in enumerate(self.RATIOS)},
+            'ratios': {name: self._as_list(self.ratios[ratio_index, ticker_index])
+                       for ratio_index, name in enumerate(self.RATIOS)},
+            'percentiles': {name: self._as_list(self.percentiles[ratio_index, ticker_index])
+                            for ratio_index, name in enumerate(self.RATIOS)},
+        }
+
+    def documents(self) -> Iterator[Tuple[str, dict]]:
+        """
+        :return: (ticker, ticker_document()) of every ticker
+        :rtype: Iterator[Tuple[str, dict]]
+        """
+        for ticker in self.tickers:
+            yield ticker, self.ticker_document(ticker)
+
+    def __len__(self) -> int:
+        return len(self.tickers)
+
+    def __repr__(self):
+        return f"FinancialRatios({len(self.tickers)} tickers, {len(self.years)} years)"
@@ -1,9 +1,18 @@
 # This class implements the composition pattern
-from typing import Tuple
+from typing import (Tuple,
+                    Union,
+                    Optional,
+                    )
 import re
+import time
+from ci_rest_api_server.support_libs.extractor.FilingHandle import FilingHandle
 from ci_rest_api_server.support_libs.extractor.P10kParser import Parse10KForm
 from ci_rest_api_server.support_libs.extractor.P10QParser import Parse10QForm
-import ci_rest_api_server.support_libs.extractor.IExtractDBPush
+from ci_rest_api_server.support_libs.extractor.StageMetrics import (STAGE_SECONDS,
+                                                                   ticker_class,
+                                                                   time_stage,
+                                                                   )
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
 
 
 class GeneralFormParser:
@@ -11,6 +20,12 @@ class GeneralFormParser:
     Extracts data from SEC text files, based on form type correct data is extracted and
     returned as a dictionary to caller
     """
+    # Bump when a change of the parsers changes the extracted data, filings recorded in
+    # a FilingManifest with an older version are parsed again by the next ingest
+    PARSER_VERSION = 4
+    # compiled once, the header of every filing is matched against these
+    _FORM_TYPE_PATTERN = re.compile(r'CONFORMED SUBMISSION TYPE:\s+([0-9]+)\-([a-zA-Z]+)')
+    _DATE_FILED_PATTERN = re.compile(r'FILED AS OF DATE:\s+([0-9]+)')
 
     def __init__(self):
         """
@@ -20,54 +35,62 @@ class GeneralFormParser:
             '10-K': Parse10KForm(),
             '10-Q': Parse10QForm(),
         }
-        # Stores the composed object
-        self._form_operator = None
-        self._extracted_form_data = {}
+        # NOTE: No per filing state is kept here, the same instance can parse many filings
+        #       and is cheap to pickle to worker processes
 
     @staticmethod
-    def get_form_type_and_filing_year(file_path: str) -> Tuple[str, int]:
+    def get_form_type_and_filing_year(filing: Union[str, FilingHandle]) -> Tuple[str, int]:
         """
         Method extracts form type and form filing year
-        :param file_path: path of file to extract information
-        :type file_path: string
+        :param filing: path of file to extract information or an open filing handle,
+                       only the header prefix of the file is read
+        :type filing: string or FilingHandle
         :return: form type, year of filing
         :rtype: Tuple[str, int]
         """
-        ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.debug(f"Opening file: {file_path} for parsing")
+        start = time.perf_counter()
+        file_path = filing.file_path if isinstance(filing, FilingHandle) else filing
+        logger.debug("Opening file: %s for parsing", file_path)
         try:
-            with open(file_path) as file:
-                file_contents = file.read()
+            if isinstance(filing, FilingHandle):
+                file_contents = filing.header()
+            else:
+                with FilingHandle(file_path) as filing_handle:
+                    file_contents = filing_handle.header()
         except Exception as error:
-            ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.exception(f"Unexpected error opening file:{file_path} Err-{error}")
+            logger.exception(f"Unexpected error opening file:{file_path} Err-{error}")
             raise error
 
-        form_type_pattern = re.compile(r'CONFORMED SUBMISSION TYPE:\s+([0-9]+)\-([a-zA-Z]+)')
-        date_filed_type_pattern = re.compile(r'FILED AS OF DATE:\s+([0-9]+)')
-
         # no need to take the whole file as the form type is in the first 2000 chars
-        form_matches = form_type_pattern.search(file_contents[0:2000])
+        form_matches = GeneralFormParser._FORM_TYPE_PATTERN.search(file_contents)
         # group 1 = form type numeric , group(2) is the form type alphabet(s)
         try:
             extracted_form_type = form_matches.group(1) + "-" + form_matches.group(2)
         except AttributeError as ae:
-            ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.exception(f"Unable to get form type :{file_path} Err-{ae}")
+            logger.exception(f"Unable to get form type :{file_path} Err-{ae}")
         # Get filing date
-        date_filed_matches = date_filed_type_pattern.search(file_contents[0:2000])
-        ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.debug(f"Form matches {form_matches} date matches {date_filed_matches}")
+        date_filed_matches = GeneralFormParser._DATE_FILED_PATTERN.search(file_contents)
+        logger.debug("Form matches %s date matches %s", form_matches, date_filed_matches)
         extracted_year_filed = 0
         try:
             # get only the first 4 digits as it denotes the year
             extracted_year_filed = int(date_filed_matches.group(1)[:4])
         except ValueError as ve:
-            ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.exception(f"Unable to get filing year:{file_path} Err-{ve}")
-        ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.info(f"Extracted form type: {extracted_form_type} year: {extracted_year_filed}")
+            logger.exception(f"Unable to get filing year:{file_path} Err-{ve}")
+        logger.info("Extracted form type: %s year: %s", extracted_form_type, extracted_year_filed)
+        # observed once the form type is known, the ticker is not known at this point
+        STAGE_SECONDS.observe(time.perf_counter() - start,
+                              stage='header',
+                              form_type=extracted_form_type,
+                              ticker_class=ticker_class(None))
         return (extracted_form_type,
                 extracted_year_filed)
 
     def extract_form_data(self, file_path: str,
                           form_type: str,
                           year_of_filing: int,
-                          ticker: str) -> dict:
+                          ticker: str,
+                          filing_handle: Optional[FilingHandle] = None) -> Optional[dict]:
         """
         Based on Form type extracts data and sends back as a dict
 
@@ -79,27 +102,29 @@ class GeneralFormParser:
         :type form_type: type of SEC form
         :param ticker: ticker symbol
         :type ticker: string
-        :return: Key value pairs extracted form form data
+        :param filing_handle: already open handle of the file, avoids reading it again
+        :type filing_handle: FilingHandle
+        :return: Key value pairs extracted form form data, None when the form parser
+                 skipped the filing
         :rtype: dict
         """
-        logtime_data = {}
         try:
-            self._form_operator = self.__form_types_inventory.get(form_type)
-            ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.debug(f"Form class from mapping {self._form_operator.__class__.__name__}")
-            self._extracted_form_data = self._form_operator.get_form_data(file_path=file_path,
-                                                                          year=year_of_filing,
-                                                                          ticker=ticker,
-                                                                          log_time=logtime_data)
+            form_operator = self.__form_types_inventory.get(form_type)
+            logger.debug("Form class from mapping %s", type(form_operator).__name__)
+            with time_stage('parse', form_type, ticker):
+                extracted_form_data = form_operator.get_form_data(file_path=file_path,
+                                                                  year=year_of_filing,
+                                                                  ticker=ticker,
+                                                                  filing_handle=filing_handle)
         except Exception as err:
-            ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.exception(f"Form extraction failed for {file_path} "
+            logger.exception(f"Form extraction failed for {file_path} "
                              f"form type: {form_type} year:{year_of_filing}")
-            ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.warning(f"Unable to extract form data for {file_path}")
+            logger.warning(f"Unable to extract form data for {file_path}")
             raise err
         finally:
             # TODO: Remove the file after parsing is good to save space
-            ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.debug(f"Exectution time is {logtime_data}")
             pass
-        return self._extracted_form_data
+        return extracted_form_data
 
     def __repr__(self):
         return "GeneralFormParser()"
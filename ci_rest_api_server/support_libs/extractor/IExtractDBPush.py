@@ -10,17 +10,26 @@
 # It's used to pull the txt files on form type basis
 #  "PEP 8 unto thyself, not unto others. Brilliant."
 # - By Raymond hettengier
-from typing import (List,
-                    Any,
+from typing import (Callable,
+                    List,
                     Dict,
+                    Mapping,
+                    Optional,
+                    Tuple,
                     )
 import os
 import re
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-import logging
-from pymongo import MongoClient
+from pymongo import (MongoClient,
+                     ReplaceOne,
+                     UpdateOne,
+                     )
 import pymongo
-from pymongo.errors import (ConnectionFailure,
+from pymongo.errors import (BulkWriteError,
+                            ConnectionFailure,
+                            OperationFailure,
                             WriteError,
                             WriteConcernError,
                             )
@@ -33,26 +42,49 @@ from secedgar.utils.exceptions import (EDGARQueryError,
                                        FilingTypeError,
                                        )
 from ci_rest_api_server.support_libs.extractor.GFormParse import GeneralFormParser
+from ci_rest_api_server.support_libs.extractor.FilingHandle import FilingHandle
+from ci_rest_api_server.support_libs.extractor.SharedMongoClient import SharedMongoClient
+from ci_rest_api_server.support_libs.extractor.FilingManifest import FilingManifest
+from ci_rest_api_server.support_libs.extractor.FinancialFacts import FinancialFacts
+from ci_rest_api_server.support_libs.extractor.FinancialRatios import FinancialRatios
+from ci_rest_api_server.support_libs.extractor.StageMetrics import (METRICS,
+                                                                   time_stage,
+                                                                   )
+from ci_rest_api_server.support_libs.extractor.StorageLayout import StorageLayout
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+from ci_rest_api_server.support_libs.extractor.ExtractDBPull import (ExtractDBPull,
+                                                                    FIELD_NAME_PATTERN,
+                                                                    PUSH_VERSIONS_COLLECTION,
+                                                                    PUSH_VERSIONS_DB,
+                                                                    QUARTER_KEY,
+                                                                    QUARTERLY_FORMS,
+                                                                    RATIOS_COLLECTION,
+                                                                    RATIOS_DB,
+                                                                    YEAR_KEY,
+                                                                    )
+from ci_rest_api_server.support_libs.extractor.EdgarDownloader import (DownloadResult,
+                                                                      EdgarDownloader,
+                                                                      )
 
-# set logging file name and non-root names
-# TODO: Improve the logger to write to Json files also, this will help in data analytics
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+# Unique indexes of the year documents, see YEAR_KEY and QUARTER_KEY
+YEAR_INDEX_NAME = 'unique_filing_year'
+QUARTER_INDEX_NAME = 'unique_filing_year_quarter'
+DUPLICATE_KEY_ERROR_CODE = 11000
 
-# Set up the formatter
-formatter = logging.Formatter('%(asctime)s:%(levelname)s:%(name)s:%(message)s')
-# Setup the console handler
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.WARNING)
-logger.addHandler(console_handler)
 
-# Set up the file handler for the log file , log everything there
-file_handler = logging.FileHandler('../Extractor.log')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+class _RecordKeys:
+    """
+    Keys of the records as a log argument, only listed when the log record is written
+    """
+
+    def __init__(self, records: List[Mapping]):
+        self.records = records
+
+    def __str__(self):
+        return str([ExtractDBPull.record_key(record) for record in self.records])
 
 
-class ExtractParseForms:
+class ExtractParseForms(ExtractDBPull):
     # TODO : Add repr to class
     """
     Description: This class is a Interface type class for the producer side of
@@ -68,26 +100,37 @@ class ExtractParseForms:
                 eg : form 10k = DB type form10k in MongoDB
                      each company ticker symbol is a collection
                      each year is a row or document in the collection
+                     (or one collection for all the tickers, see StorageLayout)
+                 The reads of the data are inherited from ExtractDBPull
     """
-    # Used by consumer to pull data from DB only
-    # Reason for use: opening and closing connections to Mongp DB are expensive the time
-    # consuming, this will make the operation fast by keeping the connection open for 
-    # fast requests
-    _client_handle_pull_db = None
+    # File names of the saved filings, plain text or compressed
+    _FILING_SUFFIXES = ('txt',) + tuple('.txt' + suffix for suffix in FilingHandle.COMPRESSED_SUFFIXES)
+    # The parser of the process, built once and reused for every filing (see form_parser())
+    _form_parser: Optional[GeneralFormParser] = None
 
     def __init__(self,
-                 path_to_save_file: str):
+                 path_to_save_file: str,
+                 storage_layout: Optional[StorageLayout] = None):
+        """
+        :param path_to_save_file: root folder of the saved filings
+        :type path_to_save_file: str
+        :param storage_layout: how the tickers are stored in the DB, defaults to
+                               CI_MONGO_STORAGE_LAYOUT (see StorageLayout)
+        :type storage_layout: StorageLayout
+        """
         self.__path_to_save_file = path_to_save_file
         self.__form_to_enum_mapper = {
             '10-K': FilingType.FILING_10K,
             '10-Q': FilingType.FILING_10Q,
         }
+        super().__init__(storage_layout)
         self.client_handle = None
 
     @classmethod
-    def from_db(cls):
-        cls._client_handle_pull_db: "MongoClient" = pymongo.MongoClient("mongodb://localhost:27017/")
-        return cls('None')
+    def from_db(cls, storage_layout: Optional[StorageLayout] = None):
+        # the shared client is only created once, every request reuses its pool
+        cls._client_handle_pull_db: "MongoClient" = SharedMongoClient.get()
+        return cls('None', storage_layout)
 
     def pull_ticker_symbol(self, ticker_symbol: str,
                            form_type: str,
@@ -124,10 +167,11 @@ class ExtractParseForms:
                     self.__path_to_save_file)
 
         try:
-            my_filings = Filing(cik_lookup=ticker_symbol.lower(),
-                                filing_type=self.__form_to_enum_mapper[form_type],
-                                count=years_to_pull)
-            my_filings.save(self.__path_to_save_file)
+            with time_stage('download', form_type, ticker_symbol):
+                my_filings = Filing(cik_lookup=ticker_symbol.lower(),
+                                    filing_type=self.__form_to_enum_mapper[form_type],
+                                    count=years_to_pull)
+                my_filings.save(self.__path_to_save_file)
         except EDGARQueryError as eq:
             logger.exception(f"Unable to get data from EDGAR Webpage for {ticker_symbol}"
                              f"Err-msg: {eq.args}")
@@ -148,6 +192,47 @@ class ExtractParseForms:
             logger.exception(f"Unexpected Error for {ticker_symbol} Err-msg: {e.args}")
             raise
 
+    def pull_ticker_symbols(self, tickers: List[str],
+                            form_types: List[str],
+                            years_to_pull: int = 10,
+                            workers: int = 8,
+                            transport: Optional[object] = None,
+                            compression: Optional[str] = None) -> Dict[Tuple[str, str], DownloadResult]:
+        """
+        Pulls the filings of many tickers and form types concurrently, with a global
+        rate limit of the SEC fair access policy, into the same folder structure as
+        pull_ticker_symbol(). A ticker which fails does not stop the others, check the
+        error of its result
+        :param tickers: Company ticker symbols as per SEC filings
+        :type tickers: List[str]
+        :param form_types: SEC form types e.g ['10-K', '10-Q']
+        :type form_types: List[str]
+        :param years_to_pull: No of years user has requested a pull for
+        :type years_to_pull: integer
+        :param workers: number of download threads
+        :type workers: int
+        :param transport: see EdgarDownloader, defaults to requests to EDGAR
+        :type transport: object
+        :param compression: gzip or zstd to store the filings compressed, see EdgarDownloader
+        :type compression: str
+        :return: result per (ticker, form type)
+        :rtype: dict
+        """
+        # same safe limit as pull_ticker_symbol(), structured data starts around 2005
+        if datetime.today().year - years_to_pull < 2005:
+            years_to_pull = 15
+        for form_type in form_types:
+            if form_type not in self.__form_to_enum_mapper:
+                raise FilingTypeError(f"Invalid filing type {form_type}")
+        downloader = EdgarDownloader(self.__path_to_save_file,
+                                     transport=transport,
+                                     workers=workers,
+                                     compression=compression)
+        return downloader.download([(ticker, form_type)
+                                    for ticker in tickers
+                                    for form_type in form_types],
+                                   count=years_to_pull)
+
     @staticmethod
     def file_sort_year_wise(value: str) -> int:
         """
@@ -157,8 +242,9 @@ class ExtractParseForms:
         :return: 2 digit year
         :rtype: integer
         """
-        # pattern here is filernumber-year-submissioncode.txt
-        pattern = re.compile(r'(\d+\-)(\d+)(\-\d+)(\.txt)')
+        # pattern here is filernumber-year-submissioncode.txt, .txt.gz or .txt.zst when
+        # the filing is stored compressed
+        pattern = re.compile(r'(\d+\-)(\d+)(\-\d+)(\.txt)(\.gz|\.zst)?')
         # Extract year only
         matches = pattern.sub(r'\2', value)
         return int(matches)
@@ -181,11 +267,18 @@ class ExtractParseForms:
         second_level_path = first_level_path + '/' + form_type.lower()
         if ticker in set_list_of_files:
             if os.path.exists(second_level_path):
-                # list all the file with txt extension and ignore all other type of files
+                # list all the file with txt extension, plain or compressed (see
+                # FilingHandle), and ignore all other type of files
                 with os.scandir(second_level_path) as file_it:
                     for file in file_it:
-                        if file.name.endswith('txt'):
+                        if file.name.endswith(self._FILING_SUFFIXES):
                             final_file_list.append(file.name)
+                # a filing stored both plain and compressed (e.g while compressing the
+                # old ones) is parsed once, from the plain file which needs no decompression
+                names = set(final_file_list)
+                final_file_list = [name for name in final_file_list
+                                   if not (FilingHandle.compression_of(name)
+                                           and name[:name.rfind('.')] in names)]
             else:
                 logger.critical("%s <%s>",
                                 "Unable to find form path:",
@@ -209,9 +302,117 @@ class ExtractParseForms:
                            for file in final_file_list]
         return final_file_list
 
+    @classmethod
+    def form_parser(cls) -> GeneralFormParser:
+        """
+        :return: the parser of this process, it keeps no per filing state so every
+                 filing (and thread) of the process shares it
+        :rtype: GeneralFormParser
+        """
+        if ExtractParseForms._form_parser is None:
+            ExtractParseForms._form_parser = GeneralFormParser()
+        return ExtractParseForms._form_parser
+
+    @staticmethod
+    def _init_parse_worker():
+        """
+        Initializer of the parse processes: builds the parser of the worker once, before
+        its first filing, and drops the stage timings copied from the parent by the fork
+        """
+        METRICS.drain()
+        ExtractParseForms._form_parser = GeneralFormParser()
+
+    @staticmethod
+    def parse_pool(workers: int) -> ProcessPoolExecutor:
+        """
+        :param workers: number of parse processes
+        :type workers: int
+        :return: process pool for parse_files(), each worker with its own parser
+        :rtype: ProcessPoolExecutor
+        """
+        return ProcessPoolExecutor(max_workers=workers,
+                                   initializer=ExtractParseForms._init_parse_worker)
+
+    @staticmethod
+    def parse_filing(file_path: str,
+                     ticker: str,
+                     header: Optional[Tuple[str, int]] = None) -> Optional[FinancialFacts]:
+        """
+        Parses a single filing of any supported form type with the parser of the
+        process (see form_parser()), this is safe to run in a worker process
+        :param file_path: path of the filing
+        :type file_path: str
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param header: form type and year of filing when already known (e.g from the
+                       FilingManifest), the header is not sniffed again then
+        :type header: Tuple[str, int]
+        :return: the fields extracted from the filing, None for a filing the parser
+                 skipped (e.g a 10-Q whose fiscal quarter is unknown)
+        :rtype: FinancialFacts
+        """
+        parser_operator = ExtractParseForms.form_parser()
+        # the file is mapped once and shared by the header sniffing and the parser
+        with FilingHandle(file_path) as filing_handle:
+            if header is None:
+                header = parser_operator.get_form_type_and_filing_year(filing_handle)
+            form_type, year_filed = header
+
+            form_data_extracted = parser_operator.extract_form_data(file_path,
+                                                                    form_type,
+                                                                    year_filed,
+                                                                    ticker,
+                                                                    filing_handle=filing_handle)
+        logger.debug("Parsed %s and year %s", form_type, year_filed)
+        return form_data_extracted
+
+    @staticmethod
+    def _parse_filing_in_worker(file_path: str,
+                                ticker: str,
+                                header: Optional[Tuple[str, int]] = None) -> Tuple[FinancialFacts, dict]:
+        """
+        parse_filing() in a worker process, the stage timings recorded by the worker
+        go back with the record so the parent process can merge them
+        :return: the fields extracted from the filing, METRICS.drain() of the worker
+        :rtype: Tuple[FinancialFacts, dict]
+        """
+        # a worker of a pool without _init_parse_worker() starts with a copy of the
+        # parent timings, they are not its own
+        METRICS.drain()
+        form_data_extracted = ExtractParseForms.parse_filing(file_path, ticker, header)
+        return form_data_extracted, METRICS.drain()
+
+    def parse_files(self, jobs: List[Tuple[str, str, Optional[Tuple[str, int]]]],
+                    workers: int,
+                    executor: Optional[ProcessPoolExecutor] = None) -> List[Optional[FinancialFacts]]:
+        """
+        Parses (ticker, file path, known header) jobs, in a process pool with more than
+        one worker as parsing is CPU bound
+        :param executor: process pool shared by many calls (see parse_pool()), used
+                         instead of a pool of workers processes per call
+        :return: the parsed records in the order of the jobs, None for the skipped filings
+        :rtype: List[dict]
+        """
+        if executor is None and workers > 1 and len(jobs) > 1:
+            with self.parse_pool(workers) as executor:
+                return self.parse_files(jobs, workers, executor)
+        if executor is not None:
+            # map gives back the results in the order of the jobs, not of completion
+            parsed_forms = []
+            for form_data_extracted, worker_metrics in executor.map(self._parse_filing_in_worker,
+                                                                    [file for _, file, _ in jobs],
+                                                                    [ticker for ticker, _, _ in jobs],
+                                                                    [header for _, _, header in jobs]):
+                METRICS.merge(worker_metrics)
+                parsed_forms.append(form_data_extracted)
+            return parsed_forms
+        return [self.parse_filing(file, ticker, header)
+                for ticker, file, header in jobs]
+
     def parse_form(self,
                    ticker: str,
-                   form_type: str) -> list:
+                   form_type: str,
+                   workers: int = 1) -> list:
         """
         Parses the needed form and retunrs a dictionary of all fields needed on per
         form type
@@ -219,26 +420,153 @@ class ExtractParseForms:
         :type ticker: str
         :param form_type: type of SEC form
         :type form_type: str
-        :return: a list of all the dictionaries which are extracted per year
+        :param workers: number of processes parsing the filings, 1 parses in this process
+        :type workers: int
+        :return: a list of all the records (dict like FinancialFacts) which are
+                 extracted per year
         :rtype: list
         """
+        return self.parse_forms([ticker], form_type, workers)[ticker]
+
+    def parse_forms(self,
+                    tickers: List[str],
+                    form_type: str,
+                    workers: int = 1) -> Dict[str, list]:
+        """
+        Parses the needed form for many tickers, with more than one worker the filings
+        of all the tickers are spread over a process pool as parsing is CPU bound
+        :param tickers: ticker symbols
+        :type tickers: List[str]
+        :param form_type: type of SEC form
+        :type form_type: str
+        :param workers: number of processes parsing the filings, 1 parses in this process
+        :type workers: int
+        :return: ticker to the list of records extracted per year, in year order
+        :rtype: dict
+        """
         # 1. This is a common method for all form types
         # 2. Uses OOP compostion to figure out form type and extracts information from that form
-        ret_dict_list: List[Dict[Any, Any]] = []
-        parser_operator = GeneralFormParser()
-        for file in self.prepare_list_of_files(ticker,
-                                               form_type):
-            form_type, year_filed = parser_operator.get_form_type_and_filing_year(file)
+        jobs = [(ticker, file, None)
+                for ticker in tickers
+                for file in self.prepare_list_of_files(ticker,
+                                                       form_type)]
+        parsed_forms = self.parse_files(jobs, workers)
+        # create a list of dict's per ticker which will contain all years
+        ret_dict_lists: Dict[str, List[FinancialFacts]] = {ticker: [] for ticker in tickers}
+        for (ticker, _, _), form_data_extracted in zip(jobs, parsed_forms):
+            if form_data_extracted is not None:
+                ret_dict_lists[ticker].append(form_data_extracted)
+        for ret_dict_list in ret_dict_lists.values():
+            # files are sorted year wise already, a stable sort keeps that order for ties
+            ret_dict_list.sort(key=lambda record: (record['filing-year'],
+                                                   record.get('filing-quarter', 0)))
+        return ret_dict_lists
 
-            form_data_extracted = parser_operator.extract_form_data(file,
-                                                                    form_type,
-                                                                    year_filed,
-                                                                    ticker)
-            logger.debug(f"Parsed {form_type} and year {year_filed}")
-            # create a list of dict's which will contain all years
-            ret_dict_list.append(form_data_extracted.copy())
+    def new_forms(self,
+                  ticker: str,
+                  form_type: str) -> Tuple[FilingManifest, List[Tuple[str, str, Optional[Tuple[str, int]]]], int]:
+        """
+        The filings of a ticker which are not in the FilingManifest of the ticker folder,
+        changed on disk or were parsed by an older parser
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param form_type: type of SEC form
+        :type form_type: str
+        :return: the manifest, the (ticker, file path, known header) parse jobs of the
+                 filings and the count of filings which are current
+        :rtype: tuple
+        """
+        files = self.prepare_list_of_files(ticker, form_type)
+        # the manifest lives next to the filings, see prepare_list_of_files()
+        manifest = FilingManifest.load(self.__path_to_save_file + '/' + ticker.lower() + '/' + form_type.lower())
+        parser_version = GeneralFormParser.PARSER_VERSION
+        jobs = [(ticker, file, manifest.header(file))
+                for file in files
+                if not manifest.is_current(file, parser_version)]
+        return manifest, jobs, len(files) - len(jobs)
 
-        return ret_dict_list
+    @staticmethod
+    def record_new_forms(manifest: FilingManifest,
+                         jobs: List[Tuple[str, str, Optional[Tuple[str, int]]]],
+                         parsed_forms: List[Optional[FinancialFacts]]):
+        """
+        Records the filings of new_forms() in their manifest, once their push succeeded.
+        The filings skipped by the parser are not recorded, the next ingest tries again
+        :param manifest: manifest returned by new_forms()
+        :type manifest: FilingManifest
+        :param jobs: parse jobs returned by new_forms()
+        :type jobs: list
+        :param parsed_forms: the records parsed from the jobs, in the same order
+        :type parsed_forms: list
+        """
+        for (_, file, _), form_data_extracted in zip(jobs, parsed_forms):
+            if form_data_extracted is None:
+                continue
+            manifest.record(file,
+                            form_data_extracted['filing-type'],
+                            form_data_extracted['filing-year'],
+                            GeneralFormParser.PARSER_VERSION)
+        manifest.save()
+
+    def ingest_new_forms(self,
+                         ticker: str,
+                         form_type: str,
+                         workers: int = 1,
+                         timings: Optional[Dict[str, float]] = None,
+                         refresh_ratios: bool = False,
+                         before_push: Optional[Callable[[], None]] = None,
+                         executor: Optional[ProcessPoolExecutor] = None) -> Dict[str, int]:
+        """
+        Incremental parse and push of a ticker: only the filings of new_forms() are
+        parsed and pushed. The manifest is updated once the push succeeded so a failed
+        run is simply retried by the next one
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param form_type: type of SEC form
+        :type form_type: str
+        :param workers: number of processes parsing the filings
+        :type workers: int
+        :param timings: filled with the seconds of the parse and db_push stages
+        :type timings: dict
+        :param refresh_ratios: True refreshes the ratios (see refresh_ratios()) when the
+                               push changed 10-K records. The refresh recomputes every
+                               ticker, the callers ingesting many tickers leave it
+                               False and refresh once at the end
+        :type refresh_ratios: bool
+        :param before_push: called right before the push, raising aborts the ingest
+                            e.g when the job running it was claimed by another worker
+        :type before_push: Callable
+        :param executor: process pool shared by the ingests of a long running process
+                         (see parse_pool()), used instead of a pool of workers per call
+        :type executor: ProcessPoolExecutor
+        :return: push counts (see push_to_db()) and the count of skipped filings
+        :rtype: dict
+        """
+        manifest, jobs, skipped = self.new_forms(ticker, form_type)
+        ingest_counts = {'inserted': 0, 'updated': 0, 'unchanged': 0,
+                         'skipped': skipped}
+        if not jobs:
+            logger.info("No new %s filings for ticker %s", form_type, ticker)
+            return ingest_counts
+        start = time.perf_counter()
+        parsed_forms = self.parse_files(jobs, workers, executor)
+        parsed = time.perf_counter()
+        records = [record for record in parsed_forms if record is not None]
+        if before_push is not None:
+            before_push()
+        if records:
+            ingest_counts.update(self.push_to_db(records))
+        if timings is not None:
+            timings['parse'] = parsed - start
+            timings['db_push'] = time.perf_counter() - parsed
+        self.record_new_forms(manifest, jobs, parsed_forms)
+        logger.info("Ingested %s new %s filings for ticker %s %s", len(jobs), form_type, ticker, dict(ingest_counts))
+        if refresh_ratios and form_type.upper() == '10-K' and (ingest_counts['inserted'] or ingest_counts['updated']):
+            start = time.perf_counter()
+            self.refresh_ratios()
+            if timings is not None:
+                timings['ratios'] = time.perf_counter() - start
+        return ingest_counts
 
     def open_db_connection(self, name_of_db: str,
                            name_of_collection: str) -> 'MongoClient':
@@ -247,10 +575,8 @@ class ExtractParseForms:
         the SEC form type 10-K, 10Q etc. The collection name is the ticker symbol
         which is the stock symbol for a particular company listed on the S&P 500
         Important Note: This method is only used when pushing data to Mongo DB
-                        After the data push this connection is closed. This was done
-                        as opening and tearing connections to Mongo DB is expensive but
-                        this method will be called one in a quater or year depending on
-                        form type so that expense is ok for now
+                        The process wide SharedMongoClient is used so the pushes of
+                        all the tickers of a refresh go over the same connection pool
         :param name_of_db: is the SEC form type like 10-k, 10-q etc
         :type name_of_db: str
         :param name_of_collection: Is the SEC ticker symbol eg aapl, msft, amzn
@@ -259,7 +585,8 @@ class ExtractParseForms:
         :rtype: Mongo DB connection handle type - MongoClient
         """
         try:
-            self.client_handle = pymongo.MongoClient("mongodb://localhost:27017/")
+            if self.client_handle is None:
+                self.client_handle = SharedMongoClient.get()
             db = self.client_handle[name_of_db]
             collection_handle = db[name_of_collection]
         except ConnectionFailure as cf:
@@ -269,93 +596,251 @@ class ExtractParseForms:
             logger.exception(e)
             raise
 
-        logger.debug(f"DB {name_of_db} and collection:{name_of_collection} connected")
+        logger.debug("DB %s and collection:%s connected", name_of_db, name_of_collection)
         return collection_handle
 
+    def close_db_connection(self):
+        """
+        Releases the push connection of open_db_connection(), the shared client itself
+        stays open for the other users in the process (see SharedMongoClient.close())
+        """
+        if self.client_handle is not None:
+            self.client_handle = None
+            logger.info("Released MongoDB connection")
+
+    @staticmethod
+    def record_filter(record: Mapping) -> dict:
+        """
+        :param record: extracted form data
+        :type record: FinancialFacts or dict
+        :return: query matching the document of the record, by year and for quarterly
+                 forms by fiscal quarter too
+        :rtype: dict
+        """
+        if 'filing-quarter' in record:
+            return {YEAR_KEY: record['filing-year'], QUARTER_KEY: record['filing-quarter']}
+        return {YEAR_KEY: record['filing-year']}
+
+    @staticmethod
+    def ensure_year_index(collection: 'pymongo.collection.Collection',
+                          quarterly: bool = False,
+                          key_prefix: Tuple[str, ...] = ()):
+        """
+        Creates the unique index on filing year (and quarter for quarterly forms) which
+        makes the pushes idempotent. Collections filled before the index existed can
+        hold the same year more than once, those duplicates are dropped (keeping the
+        last pushed one) first
+        :param collection: collection of a ticker
+        :type collection: pymongo.collection.Collection
+        :param quarterly: True for the collections of quarterly forms e.g 10-Q
+        :type quarterly: bool
+        :param key_prefix: keys in front of the year e.g the ticker when the collection
+                           holds many tickers (see StorageLayout.index_prefix())
+        :type key_prefix: Tuple[str, ...]
+        """
+        prefix_keys = [(key, pymongo.ASCENDING) for key in key_prefix]
+        if quarterly:
+            index_keys = prefix_keys + [(YEAR_KEY, pymongo.ASCENDING), (QUARTER_KEY, pymongo.ASCENDING)]
+            index_name = QUARTER_INDEX_NAME
+            group_key = {'year': '$' + YEAR_KEY, 'quarter': '$' + QUARTER_KEY}
+        else:
+            index_keys = prefix_keys + [(YEAR_KEY, pymongo.ASCENDING)]
+            index_name = YEAR_INDEX_NAME
+            group_key = '$' + YEAR_KEY
+        if key_prefix:
+            # e.g unique_ticker_filing_year
+            index_name = 'unique_' + '_'.join(key_prefix) + index_name[len('unique'):]
+            group_key = dict({key: '$' + key for key in key_prefix},
+                             **(group_key if quarterly else {'year': group_key}))
+        try:
+            collection.create_index(index_keys,
+                                    unique=True,
+                                    name=index_name)
+        except OperationFailure as of:
+            if of.code != DUPLICATE_KEY_ERROR_CODE:
+                raise
+            logger.warning(f"Dropping duplicate years in collection:{collection.name} to build the {index_name} index")
+            duplicates = collection.aggregate([
+                {'$sort': {'_id': pymongo.ASCENDING}},
+                {'$group': {'_id': group_key, 'ids': {'$push': '$_id'}}},
+                {'$match': {'ids.1': {'$exists': True}}},
+            ])
+            for duplicate in duplicates:
+                # _id grows with insertion time, keep the most recent document
+                collection.delete_many({'_id': {'$in': duplicate['ids'][:-1]}})
+            collection.create_index(index_keys,
+                                    unique=True,
+                                    name=index_name)
+
     def push_to_db(self,
-                   list_of_dicts: list):
+                   list_of_dicts: list) -> Dict[str, int]:
         """
         This pushes the extracted data for the company to the DB
-        :param list_of_dicts: list of all dict value pulled from the form
+        All the years of the ticker are sent as one bulk write of upserts keyed by
+        the filing year (and quarter for 10-Q), so pushing the same data again does not
+        create duplicates
+        :param list_of_dicts: list of all the records (FinancialFacts or dict) pulled
+                              from the form
         :type list_of_dicts: list 
-        :return: None
-        :rtype: None
+        :return: count of inserted, updated and unchanged year documents
+        :rtype: dict
         """
         db_name = list_of_dicts[0]['filing-type']
         collection_name = list_of_dicts[0]['ticker']
-        logger.info(f'Connecting to DB:{db_name} collection:{collection_name}')
+        layout = self.storage_layout
+        logger.info('Connecting to DB:%s collection:%s', db_name, layout.collection_name(collection_name))
         collection = self.open_db_connection(db_name,
-                                             collection_name)
-        for record in list_of_dicts:
-            try:
-                collection.insert_one({'data': record})
-            except (WriteError, WriteConcernError,) as werr:
-                logger.warning(f"Unable to write data for ticker symbol:{collection_name} "
-                               f"in {db_name} year:{record['filing-year']} err:{werr}")
-                raise
-            except Exception as err:
-                logger.exception(err)
-                raise
-            finally:
-                # remember to close connection, this is expensive than keeping connection open
-                # push operations will be once in a year and not rapid so we should close conneciton
-                self.client_handle.close()
-                logger.info("Closing MongoDB connection")
+                                             layout.collection_name(collection_name))
+        # records only become dicts here, at the edge with BSON
+        upserts = [UpdateOne(dict(layout.ticker_filter(collection_name), **self.record_filter(record)),
+                             {'$set': layout.document_fields(collection_name, dict(record))},
+                             upsert=True)
+                   for record in list_of_dicts]
+        try:
+            with time_stage('db_push', db_name, collection_name):
+                self.ensure_year_index(collection,
+                                       quarterly='filing-quarter' in list_of_dicts[0],
+                                       key_prefix=tuple(layout.index_prefix()))
+                result = collection.bulk_write(upserts, ordered=False)
+        except (BulkWriteError, WriteError, WriteConcernError,) as werr:
+            logger.warning(f"Unable to write data for ticker symbol:{collection_name} "
+                           f"in {db_name} err:{werr}")
+            raise
+        except Exception as err:
+            logger.exception(err)
+            raise
 
-            logger.info(f"Pushed ticker symbol {collection_name} "
-                        f"year:{record['filing-year']} data in DB")
+        self._notify_push(db_name, [collection_name])
+        push_counts = {
+            'inserted': result.upserted_count,
+            'updated': result.modified_count,
+            # matched documents which already had the same data are not modified
+            'unchanged': result.matched_count - result.modified_count,
+        }
+        # the years are only listed when the record is written
+        logger.info("Pushed ticker symbol %s years:%s data in DB %s", collection_name,
+                    _RecordKeys(list_of_dicts), dict(push_counts))
+        return push_counts
 
-    def pull_from_db(self,
-                     ticker: str,
-                     db_name: str):
+    def migrate_storage_layout(self, db_name: str,
+                               source: StorageLayout,
+                               target: StorageLayout,
+                               drop_source: bool = False,
+                               batch_size: int = 1000) -> Dict[str, int]:
         """
-        Returns all the data typically 10 years history for a given ticker symbol and 
-        DB type. Note DB type is Mongo DB type
-        NOTE: To use this function use alternative constructor which is the data pulling 
-              constructor 
-        :param ticker: Company for which data is needed eg. 'aapl', 'csco'
-        :type ticker: str
-        :param db_name: This is the DB type for mongo DB, can have values like 10-K, 10-Q
-                        these are the form types, each DB type = SEC form type 
+        Copies the records of every ticker of a form type from one storage layout to the
+        other with idempotent upserts, so an interrupted migration is simply run again.
+        The source records are only dropped once every ticker was copied and counted
+        :param db_name: form type e.g 10-K
         :type db_name: str
-        :return: a collection of dictionaries for all years 
+        :param source: layout the records are in
+        :type source: StorageLayout
+        :param target: layout to copy them to
+        :type target: StorageLayout
+        :param drop_source: drop the source collections after the copy
+        :type drop_source: bool
+        :param batch_size: upserts per bulk write
+        :type batch_size: int
+        :return: count of tickers and records copied, inserted, updated and unchanged
         :rtype: dict
         """
-        data_from_db = {}
+        if self.client_handle is None:
+            self.client_handle = SharedMongoClient.get()
+        db = self.client_handle[db_name]
+        migration_counts = {'tickers': 0, 'records': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0}
+        tickers = source.tickers(self.client_handle, db_name)
+        for ticker in tickers:
+            source_collection = db[source.collection_name(ticker)]
+            target_collection = db[target.collection_name(ticker)]
+            records = [item['data'] for item in source_collection.find(source.ticker_filter(ticker),
+                                                                       {'_id': 0, 'data': 1})]
+            if not records:
+                continue
+            self.ensure_year_index(target_collection,
+                                   quarterly='filing-quarter' in records[0],
+                                   key_prefix=tuple(target.index_prefix()))
+            for start in range(0, len(records), batch_size):
+                result = target_collection.bulk_write(
+                    [UpdateOne(dict(target.ticker_filter(ticker), **self.record_filter(record)),
+                               {'$set': target.document_fields(ticker, record)},
+                               upsert=True)
+                     for record in records[start:start + batch_size]],
+                    ordered=False)
+                migration_counts['inserted'] += result.upserted_count
+                migration_counts['updated'] += result.modified_count
+                migration_counts['unchanged'] += result.matched_count - result.modified_count
+            copied = target_collection.count_documents(target.ticker_filter(ticker))
+            if copied < len(records):
+                raise RuntimeError(f"Only {copied} of the {len(records)} records of {ticker} "
+                                   f"are in the {target.name} layout of {db_name}")
+            migration_counts['tickers'] += 1
+            migration_counts['records'] += len(records)
+            logger.info("Migrated %s records of %s in %s to %s", len(records), ticker, db_name, target.name)
+        if drop_source:
+            for collection_name in sorted({source.collection_name(ticker) for ticker in tickers}):
+                db.drop_collection(collection_name)
+            logger.warning(f"Dropped the {source.name} records of {db_name}")
+        return migration_counts
+
+    def _notify_push(self, db_name: str,
+                     tickers: List[str]):
+        """
+        Bumps the push version of the pushed tickers, which the API processes compare
+        with the version of their cached responses (see ResponseCache.get_or_load()),
+        then runs the push listeners of this process
+        :param db_name: form type e.g 10-K, or RATIOS_DB
+        :type db_name: str
+        :param tickers: the pushed tickers
+        :type tickers: List[str]
+        """
         try:
-            # remember this is a pull connection, has to be independent of push connection 
-            db = self._client_handle_pull_db[db_name.upper()]
-            collection_info = db.validate_collection(ticker.lower())
-            logger.debug("%s %s %s %s %s %s",
-                         "collection:",
-                         ticker.lower(),
-                         "has",
-                         collection_info['nrecords'],
-                         " records in DB:",
-                         db_name.upper())
-            collection = db[ticker.lower()]
-            # Get all the records for this collection
-            db_cursor = collection.find({})
-            for item in db_cursor:
-                key = str(item['data']['filing-year'])
-                # store as key: str(year) , value: all the extracted fields
-                data_from_db[key] = item['data']
+            self.client_handle[PUSH_VERSIONS_DB][PUSH_VERSIONS_COLLECTION].bulk_write(
+                [UpdateOne({'_id': self.push_version_id(db_name, ticker)}, {'$inc': {'version': 1}}, upsert=True)
+                 for ticker in tickers],
+                ordered=False)
         except Exception as err:
-            logger.exception("%s %s %s %s %s %s",
-                             "Unable to extract ticker :",
-                             ticker,
-                             "from db type:",
-                             db_name,
-                             " Error: ",
-                             err)
-            raise err
-
-        logger.info("%s %s %s %s",
-                    "Extracted data for ticker : ",
-                    ticker,
-                    "from DB : ",
-                    db_name)
-        return data_from_db
+            # the data is pushed, the responses cached by the API expire with their TTL
+            logger.exception(f"Unable to bump the push versions of {db_name} {tickers} err:{err}")
+        for ticker in tickers:
+            for listener in self._push_listeners:
+                try:
+                    listener(db_name, ticker)
+                except Exception as err:
+                    logger.exception(f"Push listener {listener} failed for {ticker} err:{err}")
+
+    def refresh_ratios(self) -> FinancialRatios:
+        """
+        Computes the ratios and peer percentiles of every ticker in the 10-K DB and
+        stores them, one document per ticker, so that serving them is a single read.
+        Percentiles depend on the whole universe so this runs once an ingest of all
+        the tickers is done, not per ticker
+        :return: the computed ratios
+        :rtype: FinancialRatios
+        """
+        if self.client_handle is None:
+            self.client_handle = SharedMongoClient.get()
+        tickers = self.storage_layout.tickers(self.client_handle, '10-K')
+        # the years of every ticker are read concurrently, with only the needed fields
+        self._client_handle_pull_db = self.client_handle
+        data, errors = self.pull_many_from_db(tickers,
+                                              '10-K',
+                                              fields=list(FinancialRatios.INPUT_FIELDS))
+        for ticker, error in errors.items():
+            logger.warning(f"Ratios skip ticker {ticker} err:{error}")
+        ratios = FinancialRatios.from_records(data)
+        if not len(ratios):
+            logger.warning("No 10-K data to compute ratios from")
+            return ratios
+        collection = self.client_handle[RATIOS_DB][RATIOS_COLLECTION]
+        collection.create_index([('ticker', pymongo.ASCENDING)],
+                                unique=True,
+                                name='unique_ticker')
+        collection.bulk_write([ReplaceOne({'ticker': ticker}, document, upsert=True)
+                               for ticker, document in ratios.documents()],
+                              ordered=False)
+        self._notify_push(RATIOS_DB, ratios.tickers)
+        logger.info("Stored ratios of %s tickers for years %s", len(ratios), ratios.years)
+        return ratios
 
 
 if __name__ == '__main__':
@@ -364,7 +849,8 @@ if __name__ == '__main__':
     obj.pull_ticker_symbol('nvda', '10-K', 10)
     ticker_data_list = obj.parse_form('nvda', '10-K')
     print(ticker_data_list)
-    obj.push_to_db(ticker_data_list)
+    print(obj.push_to_db(ticker_data_list))
+    obj.close_db_connection()
 #    Data pulling code test=================
     obj = ExtractParseForms.from_db()
     returned_dict = obj.pull_from_db(ticker='nvda', db_name='10-k')
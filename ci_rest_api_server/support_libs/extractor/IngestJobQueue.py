@@ -0,0 +1,262 @@
+# Persistent queue of the ingestion jobs, shared by the API processes which enqueue the
+# refreshes and the IngestWorker processes which run them. Standard library only (sqlite3)
+# so that the API can enqueue without importing the ingestion stack
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import (Iterator,
+                    List,
+                    Optional,
+                    Tuple,
+                    )
+
+# States of a job, queued and running are the active ones
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+JOB_STATES = (QUEUED, RUNNING, DONE, FAILED)
+
+
+class LeaseLostError(Exception):
+    """
+    The running job is owned by another worker now, its lease expired
+    """
+
+
+class IngestJobQueue:
+    """
+    Refresh jobs of a (ticker, form type) in a SQLite file e.g
+        queue = IngestJobQueue.from_env()
+        job, created = queue.enqueue('aapl', '10-K')
+    A (ticker, form type) has at most one active (queued or running) job, enforced by
+    a partial unique index: enqueueing it again returns that job instead of a new one,
+    so the same refresh never runs twice in parallel. Workers claim the oldest queued
+    job and own it as long as they beat its lease, the job of a worker which died is
+    claimed again once its lease expired, at most MAX_ATTEMPTS times.
+    Every call opens its own connection: the queue is shared by threads, greenlets
+    and processes, WAL lets them read while one of them writes
+    """
+    MAX_ATTEMPTS = 3
+    _DB_ENV = 'CI_JOB_DB'
+    _LEASE_ENV = 'CI_JOB_LEASE_SECONDS'
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+        ' ticker TEXT NOT NULL,'
+        ' form_type TEXT NOT NULL,'
+        ' years INTEGER NOT NULL,'
+        ' state TEXT NOT NULL,'
+        # enqueue requests answered by this job, the first one included
+        ' requests INTEGER NOT NULL DEFAULT 1,'
+        ' attempts INTEGER NOT NULL DEFAULT 0,'
+        ' worker TEXT,'
+        ' created REAL NOT NULL,'
+        ' started REAL,'
+        ' heartbeat REAL,'
+        ' finished REAL,'
+        # JSON stage: seconds and push counts
+        " stages TEXT NOT NULL DEFAULT '{}',"
+        ' counts TEXT,'
+        ' error TEXT)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS unique_active_job ON jobs (ticker, form_type)'
+        f" WHERE state IN ('{QUEUED}', '{RUNNING}')",
+        'CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, id)',
+    )
+
+    def __init__(self, path: str,
+                 lease_seconds: float = 900.0):
+        """
+        :param path: SQLite file of the queue, created with its table if missing
+        :type path: str
+        :param lease_seconds: a running job without a heartbeat for that long is
+                              claimed again, the worker is considered dead
+        :type lease_seconds: float
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            # stored in the file, readers no longer wait for the writer
+            connection.execute('PRAGMA journal_mode=WAL')
+        finally:
+            connection.close()
+        with self._transaction() as connection:
+            for statement in self._SCHEMA:
+                connection.execute(statement)
+
+    @classmethod
+    def from_env(cls) -> 'IngestJobQueue':
+        """
+        :return: the queue at CI_JOB_DB (default ../ingest_jobs.sqlite, next to the
+                 extractor log) with the lease of CI_JOB_LEASE_SECONDS
+        :rtype: IngestJobQueue
+        """
+        return cls(os.environ.get(cls._DB_ENV, '../ingest_jobs.sqlite'),
+                   float(os.environ.get(cls._LEASE_ENV, 900)))
+
+    @contextmanager
+    def _transaction(self, write: bool = True) -> Iterator[sqlite3.Connection]:
+        """
+        Connection in a transaction, a write transaction takes the lock upfront so its
+        reads see what it writes over (no lost update between processes)
+        """
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        try:
+            connection.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        finally:
+            connection.close()
+
+    @staticmethod
+    def _job(row: Optional[sqlite3.Row]) -> Optional[dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job['stages'] = json.loads(job['stages'])
+        job['counts'] = json.loads(job['counts']) if job['counts'] is not None else None
+        return job
+
+    def enqueue(self, ticker: str,
+                form_type: str,
+                years: int = 10) -> Tuple[dict, bool]:
+        """
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param form_type: SEC form type e.g 10-K
+        :type form_type: str
+        :param years: years of filings to download
+        :type years: int
+        :return: the job and True, or the active job of the ticker and form type and False
+        :rtype: Tuple[dict, bool]
+        """
+        ticker = ticker.lower()
+        form_type = form_type.upper()
+        with self._transaction() as connection:
+            active = connection.execute('SELECT id FROM jobs WHERE ticker = ? AND form_type = ? AND state IN (?, ?)',
+                                        (ticker, form_type, QUEUED, RUNNING)).fetchone()
+            if active is not None:
+                connection.execute('UPDATE jobs SET requests = requests + 1 WHERE id = ?', (active['id'],))
+                job_id, created = active['id'], False
+            else:
+                job_id = connection.execute('INSERT INTO jobs (ticker, form_type, years, state, created)'
+                                            ' VALUES (?, ?, ?, ?, ?)',
+                                            (ticker, form_type, years, QUEUED, time.time())).lastrowid
+                created = True
+            return self._job(connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()), created
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """
+        :param worker: name of the worker, it has to give it back with the job updates
+        :type worker: str
+        :return: the oldest queued job (or running job of an expired lease) now running
+                 for the worker, None when there is nothing to run
+        :rtype: dict
+        """
+        now = time.time()
+        expired = now - self.lease_seconds
+        with self._transaction() as connection:
+            # the jobs of dead workers which used all their attempts end here
+            connection.execute('UPDATE jobs SET state = ?, finished = ?, error = ?'
+                               ' WHERE state = ? AND heartbeat < ? AND attempts >= ?',
+                               (FAILED, now, f"Worker lease expired {self.MAX_ATTEMPTS} times",
+                                RUNNING, expired, self.MAX_ATTEMPTS))
+            row = connection.execute('SELECT id FROM jobs WHERE state = ? OR (state = ? AND heartbeat < ?)'
+                                     ' ORDER BY id LIMIT 1',
+                                     (QUEUED, RUNNING, expired)).fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE jobs SET state = ?, worker = ?, started = ?, heartbeat = ?,'
+                               ' attempts = attempts + 1 WHERE id = ?',
+                               (RUNNING, worker, now, now, row['id']))
+            return self._job(connection.execute('SELECT * FROM jobs WHERE id = ?', (row['id'],)).fetchone())
+
+    def heartbeat(self, job_id: int,
+                  worker: str) -> bool:
+        """
+        Renews the lease of the worker on its running job
+        :return: False when the job is no longer running for this worker
+        :rtype: bool
+        """
+        with self._transaction() as connection:
+            return connection.execute('UPDATE jobs SET heartbeat = ? WHERE id = ? AND state = ? AND worker = ?',
+                                      (time.time(), job_id, RUNNING, worker)).rowcount == 1
+
+    def record_stage(self, job_id: int,
+                     worker: str,
+                     stage: str,
+                     seconds: float) -> bool:
+        """
+        Adds the duration of a stage to the job and renews the lease of the worker
+        :return: False when the job is no longer running for this worker
+        :rtype: bool
+        """
+        with self._transaction() as connection:
+            row = connection.execute('SELECT stages FROM jobs WHERE id = ? AND state = ? AND worker = ?',
+                                     (job_id, RUNNING, worker)).fetchone()
+            if row is None:
+                return False
+            stages = json.loads(row['stages'])
+            stages[stage] = round(stages.get(stage, 0.0) + seconds, 6)
+            connection.execute('UPDATE jobs SET stages = ?, heartbeat = ? WHERE id = ?',
+                               (json.dumps(stages), time.time(), job_id))
+            return True
+
+    def finish(self, job_id: int,
+               worker: str,
+               counts: Optional[dict] = None,
+               error: Optional[str] = None) -> bool:
+        """
+        Ends the job, done or failed when error is set
+        :param counts: push counts of the job
+        :type counts: dict
+        :param error: why the job failed
+        :type error: str
+        :return: False when the job is no longer running for this worker
+        :rtype: bool
+        """
+        with self._transaction() as connection:
+            return connection.execute('UPDATE jobs SET state = ?, finished = ?, counts = ?, error = ?'
+                                      ' WHERE id = ? AND state = ? AND worker = ?',
+                                      (FAILED if error is not None else DONE, time.time(),
+                                       json.dumps(counts) if counts is not None else None, error,
+                                       job_id, RUNNING, worker)).rowcount == 1
+
+    def get(self, job_id: int) -> Optional[dict]:
+        """
+        :return: the job, None when it does not exist
+        :rtype: dict
+        """
+        with self._transaction(write=False) as connection:
+            return self._job(connection.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def jobs(self, state: Optional[str] = None,
+             limit: int = 100) -> List[dict]:
+        """
+        :param state: only the jobs in this state, see JOB_STATES
+        :type state: str
+        :param limit: most recent jobs returned
+        :type limit: int
+        :return: the jobs, newest first
+        :rtype: List[dict]
+        """
+        if state is not None and state not in JOB_STATES:
+            raise ValueError(f"Unknown job state {state!r}, use one of {JOB_STATES}")
+        with self._transaction(write=False) as connection:
+            if state is None:
+                rows = connection.execute('SELECT * FROM jobs ORDER BY id DESC LIMIT ?', (limit,))
+            else:
+                rows = connection.execute('SELECT * FROM jobs WHERE state = ? ORDER BY id DESC LIMIT ?',
+                                          (state, limit))
+            return [self._job(row) for row in rows]
+
+    def __repr__(self):
+        return f"IngestJobQueue({self.path!r}, lease_seconds={self.lease_seconds!r})"
@@ -0,0 +1,322 @@
+# Runs the refresh jobs of the IngestJobQueue, off the request path of the API e.g
+# python -m ci_rest_api_server.support_libs.extractor.IngestWorker /data/sec-reports --threads 2
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import (List,
+                    Optional,
+                    )
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import (log_context,
+                                                                      logger,
+                                                                      )
+from ci_rest_api_server.support_libs.extractor.EdgarDownloader import EdgarDownloader
+from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+from ci_rest_api_server.support_libs.extractor.IngestJobQueue import (IngestJobQueue,
+                                                                     LeaseLostError,
+                                                                     )
+from ci_rest_api_server.support_libs.extractor.StageMetrics import serve_metrics
+
+
+class _JobLease:
+    """
+    Renews the lease of a worker on its running job from a thread until the job ends e.g
+        with _JobLease(queue, job['id'], worker, 300) as lease:
+            ...
+            lease.check()
+    """
+
+    def __init__(self, queue: IngestJobQueue,
+                 job_id: int,
+                 worker: str,
+                 heartbeat_seconds: float):
+        """
+        :param queue: queue of the job
+        :type queue: IngestJobQueue
+        :param job_id: the running job
+        :type job_id: int
+        :param worker: name the job was claimed with
+        :type worker: str
+        :param heartbeat_seconds: seconds between the renewals, well under the lease
+        :type heartbeat_seconds: float
+        """
+        self.queue = queue
+        self.job_id = job_id
+        self.worker = worker
+        self.heartbeat_seconds = heartbeat_seconds
+        self._ended = threading.Event()
+        self._lost = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name=f"job_lease_{job_id}", daemon=True)
+
+    def __enter__(self) -> '_JobLease':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._ended.set()
+        self._thread.join()
+
+    def _beat(self):
+        while not self._ended.wait(self.heartbeat_seconds):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker):
+                    self._lost.set()
+                    return
+            except Exception:
+                # e.g the queue file is locked for too long, the next beat tries again
+                logger.exception("Lease of job %s could not be renewed", self.job_id)
+
+    def check(self):
+        """
+        Renews the lease, to run right before a step another owner of the job must not
+        repeat (the push, the end of the job)
+        :raises LeaseLostError: when the job is no longer running for this worker
+        """
+        if self._lost.is_set() or not self.queue.heartbeat(self.job_id, self.worker):
+            self._lost.set()
+            raise LeaseLostError(f"Job {self.job_id} is no longer running for {self.worker}")
+
+
+class IngestWorker:
+    """
+    Claims the jobs of the queue and runs each one as download (EdgarDownloader), then
+    incremental parse and push of the new filings (ExtractParseForms.ingest_new_forms()).
+    A thread renews the lease of the worker on the job while it runs, the job is given
+    up before the push or its end once another worker claimed it (the lease expired,
+    e.g a stalled worker). The time of every stage is recorded on the job as it ends.
+    A failed job keeps its error, enqueueing the ticker again retries it.
+    The threads share one downloader, so they share its rate limit of the SEC fair
+    access policy, and one parse pool created before they start (see run()).
+    The pushes bump the push version of the tickers, the API processes drop their
+    cached responses when they see it change (see ResponseCache.get_or_load())
+    """
+
+    def __init__(self, queue: IngestJobQueue,
+                 path_to_save_file: str,
+                 threads: int = 1,
+                 parse_workers: int = 1,
+                 poll_seconds: float = 2.0,
+                 downloader: Optional[EdgarDownloader] = None,
+                 name: Optional[str] = None,
+                 heartbeat_seconds: Optional[float] = None):
+        """
+        :param queue: the jobs to run
+        :type queue: IngestJobQueue
+        :param path_to_save_file: root folder of the saved filings
+        :type path_to_save_file: str
+        :param threads: jobs run at the same time
+        :type threads: int
+        :param parse_workers: processes parsing the filings of a job
+        :type parse_workers: int
+        :param poll_seconds: wait before looking for a job again when the queue is empty
+        :type poll_seconds: float
+        :param downloader: defaults to an EdgarDownloader of path_to_save_file
+        :type downloader: EdgarDownloader
+        :param name: name of the worker on its jobs, defaults to host:pid
+        :type name: str
+        :param heartbeat_seconds: seconds between the renewals of the lease of a running
+                                  job, defaults to a third of the lease of the queue
+        :type heartbeat_seconds: float
+        """
+        self.queue = queue
+        self.path_to_save_file = path_to_save_file
+        self.threads = threads
+        self.parse_workers = parse_workers
+        self.poll_seconds = poll_seconds
+        self.downloader = downloader if downloader is not None else EdgarDownloader(path_to_save_file)
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.heartbeat_seconds = heartbeat_seconds if heartbeat_seconds is not None else queue.lease_seconds / 3
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # set by the jobs changing 10-K records, see refresh_ratios()
+        self._ratios_dirty = threading.Event()
+        self._ratios_lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def run_job(self, job: dict,
+                worker: str) -> bool:
+        """
+        :param job: job claimed by the worker
+        :type job: dict
+        :param worker: name the job was claimed with
+        :type worker: str
+        :return: True when the job is done, False when it failed or was lost to another worker
+        :rtype: bool
+        """
+        ticker, form_type = job['ticker'], job['form_type']
+        with log_context(ticker=ticker, form_type=form_type), \
+                _JobLease(self.queue, job['id'], worker, self.heartbeat_seconds) as lease:
+            try:
+                start = time.perf_counter()
+                result = self.downloader.download([(ticker, form_type)], count=job['years'])[(ticker, form_type)]
+                if not self.queue.record_stage(job['id'], worker, 'download', time.perf_counter() - start):
+                    raise LeaseLostError(f"Job {job['id']} is no longer running for {worker}")
+                if result.error is not None:
+                    raise result.error
+                timings = {}
+                counts = ExtractParseForms(self.path_to_save_file).ingest_new_forms(ticker,
+                                                                                    form_type,
+                                                                                    workers=self.parse_workers,
+                                                                                    timings=timings,
+                                                                                    before_push=lease.check,
+                                                                                    executor=self._executor)
+                for stage, seconds in timings.items():
+                    self.queue.record_stage(job['id'], worker, stage, seconds)
+                lease.check()
+            except LeaseLostError:
+                # the job is the other worker's now, its state is left to it
+                logger.warning("Job %s of %s %s was claimed by another worker", job['id'], ticker, form_type)
+                return False
+            except Exception as err:
+                logger.exception("Job %s of %s %s failed", job['id'], ticker, form_type)
+                self.queue.finish(job['id'], worker, error=f"{type(err).__name__}: {err}")
+                return False
+            counts['downloaded'] = len(result.paths)
+            if form_type == '10-K' and (counts.get('inserted') or counts.get('updated')):
+                self._ratios_dirty.set()
+            return self.queue.finish(job['id'], worker, counts=counts)
+
+    def run_pending(self, worker: Optional[str] = None) -> int:
+        """
+        Runs the queued jobs in this thread until the queue is empty, then refreshes
+        the ratios if the jobs changed 10-K records
+        :return: number of jobs run
+        :rtype: int
+        """
+        worker = worker or self.name
+        runs = 0
+        while not self._stopping.is_set():
+            job = self.queue.claim(worker)
+            if job is None:
+                break
+            self.run_job(job, worker)
+            runs += 1
+        self.refresh_ratios()
+        return runs
+
+    def refresh_ratios(self) -> bool:
+        """
+        Refreshes the ratios of the 10-K tickers (ExtractParseForms.refresh_ratios())
+        once for all the jobs which changed records since the last refresh: a refresh
+        recomputes the whole universe, so it is not run per job. A thread finding
+        another one refreshing leaves it to it, the jobs ending meanwhile are refreshed
+        after the next drain of the queue
+        :return: True when the ratios were refreshed
+        :rtype: bool
+        """
+        if not self._ratios_dirty.is_set() or not self._ratios_lock.acquire(blocking=False):
+            return False
+        try:
+            self._ratios_dirty.clear()
+            try:
+                ExtractParseForms(self.path_to_save_file).refresh_ratios()
+            except Exception:
+                self._ratios_dirty.set()
+                logger.exception("Ratios refresh failed, it is retried after the next drain of the queue")
+                return False
+            return True
+        finally:
+            self._ratios_lock.release()
+
+    def _work(self, worker: str):
+        while not self._stopping.is_set():
+            try:
+                if not self.run_pending(worker):
+                    self._stopping.wait(self.poll_seconds)
+            except Exception:
+                # e.g the queue file is locked for too long, try again later
+                logger.exception("Worker %s could not claim a job", worker)
+                self._stopping.wait(self.poll_seconds)
+
+    def run(self):
+        """
+        Runs the jobs with the threads of the worker until stop()
+        """
+        started_pool = self.start_parse_pool()
+        try:
+            workers = [threading.Thread(target=self._work,
+                                        args=(f"{self.name}/{index}",),
+                                        name=f"ingest_worker_{index}")
+                       for index in range(self.threads)]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        finally:
+            if started_pool:
+                self.shutdown_parse_pool()
+
+    def start_parse_pool(self) -> bool:
+        """
+        Forks the parse processes shared by all the jobs. It has to run before any
+        thread of the process starts (job threads, lease heartbeats, metrics server), a
+        fork copies the locks other threads hold. run() starts the pool when the caller
+        did not
+        :return: True when the pool was started by this call
+        :rtype: bool
+        """
+        if self.parse_workers < 2 or self._executor is not None:
+            return False
+        self._executor = ExtractParseForms.parse_pool(self.parse_workers)
+        # the pool forks its workers now, not when the first filing is parsed
+        self._executor.submit(int).result()
+        return True
+
+    def shutdown_parse_pool(self):
+        """
+        Ends the processes of start_parse_pool()
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def stop(self):
+        """
+        The threads end after their running job
+        """
+        self._stopping.set()
+
+    def __repr__(self):
+        return (f"IngestWorker({self.queue!r}, {self.path_to_save_file!r}, threads={self.threads!r},"
+                f" heartbeat_seconds={self.heartbeat_seconds!r})")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Runs the ingestion jobs queued by the API (POST /jobs/...)')
+    parser.add_argument('path_to_save_file', help='root folder of the saved filings')
+    parser.add_argument('--threads', type=int, default=1, help='jobs run at the same time')
+    parser.add_argument('--parse-workers', type=int, default=1, help='processes parsing the filings of a job')
+    parser.add_argument('--poll-seconds', type=float, default=2.0, help='wait when the queue is empty')
+    parser.add_argument('--once', action='store_true', help='run the queued jobs then exit')
+    parser.add_argument('--metrics-port', type=int,
+                        help='serve the stage metrics of the worker at :<port>/metrics for Prometheus')
+    options = parser.parse_args(argv)
+    worker = IngestWorker(IngestJobQueue.from_env(),
+                          options.path_to_save_file,
+                          threads=options.threads,
+                          parse_workers=options.parse_workers,
+                          poll_seconds=options.poll_seconds)
+    worker.start_parse_pool()
+    try:
+        # the metrics server thread starts after the fork of the parse processes
+        if options.metrics_port is not None:
+            serve_metrics(options.metrics_port)
+        if options.once:
+            print(f"Ran {worker.run_pending()} jobs")
+            return 0
+        # a stopped container finishes its running jobs, the queued ones wait for the next worker
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
+    finally:
+        worker.shutdown_parse_pool()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
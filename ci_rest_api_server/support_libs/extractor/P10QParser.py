@@ -1,4 +1,89 @@
-class Parse10QForm:
-    def __init__(self):
-        pass
+import re
+from typing import (Optional,
+                    Tuple,
+                    )
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+from ci_rest_api_server.support_libs.extractor.P10kParser import Parse10KForm
+from ci_rest_api_server.support_libs.extractor.FilingHandle import FilingHandle
+from ci_rest_api_server.support_libs.extractor.FinancialFacts import FinancialFacts
 
+
+class Parse10QForm(Parse10KForm):
+    """
+    Will parse the SEC form 10Q which is the quarterly report filed for the first
+    three fiscal quarters of the year (the 4th quarter is covered by the 10K).
+    The same balance sheet tags as the 10K are extracted by the same single pass
+    XbrlFactExtractor, along with the fiscal year and period of the report so that
+    every record is keyed by (filing-year, filing-quarter) of the fiscal calendar of
+    the company, whatever month its fiscal year ends in
+    """
+    _FORM_TYPE = '10-Q'
+    # Fiscal year and period of the report e.g 2018 and Q2, filed by every XBRL filer
+    _DOCUMENT_FIELDS = ('dei:DocumentFiscalYearFocus', 'dei:DocumentFiscalPeriodFocus')
+    _FISCAL_YEAR_PATTERN = re.compile(r'([0-9]{4})')
+    _FISCAL_PERIOD_PATTERN = re.compile(r'Q([1-4])', re.IGNORECASE)
+
+    def get_form_data(self,
+                      file_path: str,
+                      year: int,
+                      ticker: str,
+                      **kwargs: object) -> Optional[FinancialFacts]:
+        """
+        Same as Parse10KForm.get_form_data(), keyed by the fiscal year and quarter of
+        the report
+        :return: extracted tag values, None when the fiscal year or quarter of the
+                 report is unknown: the record could not be told apart from the other
+                 quarters of the ticker
+        :rtype: FinancialFacts
+        """
+        form_data = super().get_form_data(file_path, year, ticker, **kwargs)
+        if form_data.filing_quarter is None:
+            logger.warning(f"Skipping file:{file_path} of {ticker}, unable to resolve its fiscal year and quarter")
+            return None
+        return form_data
+
+    def _extract_xbrl_facts(self, filing_handle: FilingHandle,
+                            year: int) -> dict:
+        """
+        Extracts the needed tags from the XBRL document of the filing and resolves the
+        fiscal year and quarter it reports
+        :param filing_handle: open handle of the filing
+        :type filing_handle: FilingHandle
+        :param year: year for the data needed
+        :type year: int
+        :return: values of the tags found in the filing, with its filing-year and
+                 filing-quarter when they are known
+        :rtype: dict
+        """
+        extracted_facts = super()._extract_xbrl_facts(filing_handle, year)
+        fiscal_period = self.resolve_fiscal_period(extracted_facts.pop('documentfiscalyearfocus', None),
+                                                   extracted_facts.pop('documentfiscalperiodfocus', None))
+        if fiscal_period is not None:
+            extracted_facts['filing-year'], extracted_facts['filing-quarter'] = fiscal_period
+        return extracted_facts
+
+    @classmethod
+    def resolve_fiscal_period(cls, fiscal_year: Optional[str],
+                              fiscal_period: Optional[str]) -> Optional[Tuple[int, int]]:
+        """
+        Fiscal year and quarter of a report, both from the dei facts so they are of the
+        same calendar. The calendar quarter of the header period of report is not used
+        as a fallback, it differs from the fiscal one when the fiscal year does not end
+        in december
+        :param fiscal_year: value of dei:DocumentFiscalYearFocus e.g 2018, None if missing
+        :type fiscal_year: str
+        :param fiscal_period: value of dei:DocumentFiscalPeriodFocus e.g Q1, None if missing
+        :type fiscal_period: str
+        :return: year and quarter 1 to 4, None when either is unknown
+        :rtype: Tuple[int, int]
+        """
+        if not fiscal_year or not fiscal_period:
+            return None
+        year_matches = cls._FISCAL_YEAR_PATTERN.fullmatch(fiscal_year.strip())
+        period_matches = cls._FISCAL_PERIOD_PATTERN.fullmatch(fiscal_period.strip())
+        if year_matches is None or period_matches is None:
+            return None
+        return int(year_matches.group(1)), int(period_matches.group(1))
+
+    def __repr__(self):
+        return "Parse10QForm()"
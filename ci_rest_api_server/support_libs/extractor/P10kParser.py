@@ -1,27 +1,9 @@
-from typing import (Dict,
-                    Any,
-                    Union,
-                    )
-from bs4 import BeautifulSoup
-import time
-import ci_rest_api_server.support_libs.extractor.IExtractDBPush
-
-
-# TODO: Move this to a central location to measure time for function execution using decorators
-def timeit(method):
-    def timed(*args, **kw):
-        ts = time.time()
-        result = method(*args, **kw)
-        te = time.time()
-        if 'log_time' in kw:
-            name = kw.get('log_name', method.__name__.upper())
-            kw['log_time'][name] = int((te - ts) * 1000)
-        else:
-            print('%r  %2.2f ms' %
-                  (method.__name__, (te - ts) * 1000))
-        return result
-
-    return timed
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+from ci_rest_api_server.support_libs.extractor.XbrlFactExtractor import XbrlFactExtractor
+from ci_rest_api_server.support_libs.extractor.FilingHandle import FilingHandle
+from ci_rest_api_server.support_libs.extractor.FinancialFacts import (FactSchema,
+                                                                     FinancialFacts,
+                                                                     )
 
 
 class Parse10KForm:
@@ -29,65 +11,72 @@ class Parse10KForm:
     Will parse the SEC form 10K which is a yearly generated form on per company
     and per year basis. 10K forms are submitted by all companies at Q4 end
     Here we are trying to get specific tags from the form 10 k, this extraction is
-    performed using beautifulsoup as this is static html data
+    performed in a single pass over the document by the XbrlFactExtractor
     """
-    _needed_tags: Dict[Union[str, Any], Union[int, Any]]
+    # SEC form type of the records
+    _FORM_TYPE = '10-K'
+    # Numeric fields of the records, each is filled from the us-gaap element of the same name
+    FACT_FIELDS = (
+        'accountspayablecurrent',
+        'accountsreceivablenetcurrent',
+        'accruedincometaxescurrent',
+        'accruedincometaxesnoncurrent',
+        'accumulatedothercomprehensiveincomelossnetoftax',
+        'assets',
+        'assetscurrent',
+        'availableforsalesecuritiescurrent',
+        'cashandcashequivalentsatcarryingvalue',
+        'cashcashequivalentsandshortterminvestments',
+        'commonstocksincludingadditionalpaidincapital',
+        'contractwithcustomerliabilitycurrent',
+        'contractwithcustomerliabilitynoncurrent',
+        'deferredrevenuecurrent',
+        'deferredrevenuenoncurrent',
+        'deferredtaxassetsliabilitiesnetcurrent',
+        'deferredtaxliabilitiesnoncurrent',
+        'depositsreceivedforsecuritiesloanedatcarryingvalue',
+        'employeerelatedliabilitiescurrent',
+        'finitelivedintangibleassetsnet',
+        'goodwill',
+        'inventorynet',
+        'liabilities',
+        'liabilitiesandstockholdersequity',
+        'liabilitiescurrent',
+        'longtermdebtcurrent',
+        'longtermdebtnoncurrent',
+        'longterminvestments',
+        'netincomeloss',
+        'operatingleaseliabilitynoncurrent',
+        'operatingleaserightofuseasset',
+        'otherassetscurrent',
+        'otherassetsnoncurrent',
+        'otherliabilitiescurrent',
+        'otherliabilitiesnoncurrent',
+        'propertyplantandequipmentnet',
+        'retainedearningsaccumulateddeficit',
+        'shorttermborrowings',
+        'shortterminvestments',
+        'stockholdersequity',
+    )
+    # Document level (dei) facts read in the same pass as the financial facts
+    _DOCUMENT_FIELDS = ()
 
     def __init__(self):
         """
-        Init the needed fields to 0 for parsing in 10K form
+        Builds the shared schema of the records and the extractor of their fields
+        NOTE: No per filing state is kept, every call to get_form_data fills its own
+              FinancialFacts record so the parser can be shared across years or
+              pickled to worker processes
         """
-        self._needed_tags = {
-            'accountspayablecurrent': 0,
-            'accountsreceivablenetcurrent': 0,
-            'accruedincometaxescurrent': 0,
-            'accruedincometaxesnoncurrent': 0,
-            'accumulatedothercomprehensiveincomelossnetoftax': 0,
-            'assets': 0,
-            'assetscurrent': 0,
-            'availableforsalesecuritiescurrent': 0,
-            'cashandcashequivalentsatcarryingvalue': 0,
-            'cashcashequivalentsandshortterminvestments': 0,
-            'commonstocksincludingadditionalpaidincapital': 0,
-            'contractwithcustomerliabilitycurrent': 0,
-            'contractwithcustomerliabilitynoncurrent': 0,
-            'deferredrevenuecurrent': 0,
-            'deferredrevenuenoncurrent': 0,
-            'deferredtaxassetsliabilitiesnetcurrent': 0,
-            'deferredtaxliabilitiesnoncurrent': 0,
-            'depositsreceivedforsecuritiesloanedatcarryingvalue': 0,
-            'employeerelatedliabilitiescurrent': 0,
-            'finitelivedintangibleassetsnet': 0,
-            'filing-type': '10-K',
-            'filing-year': 0,
-            'goodwill': 0,
-            'inventorynet': 0,
-            'liabilities': 0,
-            'liabilitiesandstockholdersequity': 0,
-            'liabilitiescurrent': 0,
-            'longtermdebtcurrent': 0,
-            'longtermdebtnoncurrent': 0,
-            'longterminvestments': 0,
-            'operatingleaseliabilitynoncurrent': 0,
-            'operatingleaserightofuseasset': 0,
-            'otherassetscurrent': 0,
-            'otherassetsnoncurrent': 0,
-            'otherliabilitiescurrent': 0,
-            'otherliabilitiesnoncurrent': 0,
-            'propertyplantandequipmentnet': 0,
-            'retainedearningsaccumulateddeficit': 0,
-            'shorttermborrowings': 0,
-            'shortterminvestments': 0,
-            'stockholdersequity': 0,
-            'ticker': 'NONE'
-        }
+        self._schema = FactSchema.get(self.FACT_FIELDS)
+        self._fact_extractor = XbrlFactExtractor(self._schema.fields,
+                                                 document_fields=self._DOCUMENT_FIELDS)
 
-    @timeit
     def get_form_data(self,
                       file_path: str,
                       year: int,
                       ticker: str,
-                      **kwargs: object) -> dict:
+                      **kwargs: object) -> FinancialFacts:
         """
         Common interface function to parse the 10k SEC form data with specific tag extraction
 
@@ -100,46 +89,60 @@ class Parse10KForm:
         :type kwargs: can take mutiple args
         :param ticker: ticker symbol
         :type ticker: string
-        :return: dict of extracted tag values
-        :rtype: dict
+        :param filing_handle: (kwargs) already open FilingHandle of file_path, when
+                              given the file is not read again
+        :type filing_handle: FilingHandle
+        :return: extracted tag values, the fields missing from the filing are left out
+        :rtype: FinancialFacts
         """
+        filing_handle = kwargs.get('filing_handle')
         try:
-            with open(file_path) as file:
-                file_contents = file.read()
+            owned_handle = FilingHandle(file_path) if filing_handle is None else None
         except Exception as error:
-            ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.exception(f"Unexpected error opening file:{file_path} Err-{error}")
+            logger.exception(f"Unexpected error opening file:{file_path} Err-{error}")
             raise error
-        # open as Beautiful soup object and get the data for each tag
-        form_10_k_bs_obj = BeautifulSoup(file_contents, 'lxml')
-        for element in self._needed_tags:
-            # all tags are part of XBRL format where they are always present
-            search_string = "us-gaap:" + element
-            for tag in form_10_k_bs_obj.find_all(search_string):
-                if tag is not None:
-                    # TODO: Find an effecient way to do this string search or
-                    #       see if converting this to a generator get better time performance
-                    #       see what tag is and then create a generator to filter data out from tag
-                    # We want current year and ignore any table data associated is discarded
-                    # "Member" helps ignore table values, "contextref" is the main tag
-                    if str(year) in tag['contextref'] and 'Member' not in tag['contextref']:
-                        # from the main tag get the data for that year
-                        self._needed_tags[element] = int(tag.text)
-                else:
-                    ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.debug(f"Unable to get data for {search_string}")
-        # Add the filing year also as we do not extract it above
-        self._needed_tags['filing-year'] = year
+        try:
+            extracted_facts = self._extract_xbrl_facts(owned_handle or filing_handle, year)
+        finally:
+            if owned_handle is not None:
+                owned_handle.close()
         # Since beautiful soup cant be used as this not tag based using regex
         # pattern 1 - ticker_type_pattern = re.compile(r'>(\w+)</dei:TradingSymbol>')
         # pattern 1 breaks for some companies
         # ticker_type_pattern = re.compile(r'under the symbol(\s+)?(\W+)?(\w+)')
         # ticker_matches = ticker_type_pattern.search(file_contents)
-        self._needed_tags['ticker'] = ticker
-        ci_rest_api_server.support_libs.extractor.IExtractDBPush.logger.info(f"Completed extraction for year {year} | file: {file_path} "
-                    f"| ticker:{self._needed_tags['ticker']}")
-        return self._needed_tags
+        # The ticker is not extracted above, it comes from the caller as does the filing
+        # year unless the parser resolved the fiscal year of the report (10-Q)
+        form_data = FinancialFacts(self._schema,
+                                   self._FORM_TYPE,
+                                   ticker,
+                                   extracted_facts.pop('filing-year', year),
+                                   extracted_facts.pop('filing-quarter', None))
+        form_data.update(extracted_facts)
+        logger.info("Completed extraction for year %s | file: %s | ticker:%s",
+                    form_data.filing_year, file_path, form_data['ticker'])
+        return form_data
+
+    def _extract_xbrl_facts(self, filing_handle: FilingHandle,
+                            year: int) -> dict:
+        """
+        Extracts the needed tags from the XBRL document of the filing
+        :param filing_handle: open handle of the filing
+        :type filing_handle: FilingHandle
+        :param year: year for the data needed
+        :type year: int
+        :return: values of the tags found in the filing
+        :rtype: dict
+        """
+        # only the XBRL instance of the submission is parsed, exhibits and images are skipped
+        # compressed filings are decompressed as a stream, keeping that document only
+        xbrl_document = filing_handle.xbrl_document(self._FORM_TYPE)
+        if xbrl_document is None:
+            logger.warning(f"No XBRL data in file:{filing_handle.file_path}")
+            return {}
+        with xbrl_document:
+            # single walk over the document, each tag is routed to its field by a dict lookup
+            return self._fact_extractor.extract(xbrl_document, year)
 
     def __repr__(self):
         return "Parse10KForm()"
-
-
-
@@ -0,0 +1,205 @@
+# Cross ticker screens over the extracted fields, compiled to a Mongo aggregation pipeline
+import re
+from typing import (List,
+                    NamedTuple,
+                    Optional,
+                    Tuple,
+                    )
+from ci_rest_api_server.support_libs.extractor.ExtractDBPull import (ExtractDBPull,
+                                                                    FIELD_NAME_PATTERN,
+                                                                    QUARTER_KEY,
+                                                                    YEAR_KEY,
+                                                                    )
+
+
+class Predicate(NamedTuple):
+    """
+    field operator value, or field operator value * other when other is set
+    e.g goodwill > 0.3 * assets
+    """
+    field: str
+    operator: str
+    value: float
+    other: Optional[str] = None
+
+
+class ScreenQuery:
+    """
+    Predicates over the extracted fields of the records of a year range, e.g
+        ScreenQuery.parse(['goodwill>0.3*assets', 'assets>=1e9'], from_year=2021, to_year=2021)
+    selects the tickers whose goodwill exceeds 30% of their assets in 2021. The whole
+    screen runs in the DB as one $match, sorted like the unique (ticker,) year index
+    so the matches stream out of the index in order without a blocking sort, and pages
+    are cut with a cursor on that order instead of skipping the previous pages.
+    A record without a numeric value for a field of a predicate never matches it
+    """
+    # text operator: Mongo operator
+    OPERATORS = {
+        '>=': '$gte',
+        '<=': '$lte',
+        '!=': '$ne',
+        '==': '$eq',
+        '=': '$eq',
+        '>': '$gt',
+        '<': '$lt',
+    }
+    _NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+    # same as FIELD_NAME_PATTERN, the fields of the predicates end up in the query
+    _FIELD = r'[a-z][a-z0-9\-]*'
+    # field op number | field op field | field op number*field
+    _PREDICATE_PATTERN = re.compile(
+        rf'\s*(?P<field>{_FIELD})\s*(?P<operator>>=|<=|!=|==|=|>|<)\s*'
+        rf'(?:(?P<factor>{_NUMBER})\s*\*\s*(?P<scaled>{_FIELD})|(?P<other>{_FIELD})|(?P<value>{_NUMBER}))\s*')
+
+    def __init__(self, predicates: List[Predicate],
+                 from_year: Optional[int] = None,
+                 to_year: Optional[int] = None,
+                 fields: Optional[List[str]] = None):
+        """
+        :param predicates: all of them have to match
+        :type predicates: List[Predicate]
+        :param from_year: first filing year screened (inclusive)
+        :type from_year: int
+        :param to_year: last filing year screened (inclusive)
+        :type to_year: int
+        :param fields: fields returned with the matches, defaults to the fields of the predicates
+        :type fields: List[str]
+        """
+        self.predicates = list(predicates)
+        self.from_year = from_year
+        self.to_year = to_year
+        if fields is None:
+            fields = []
+            for predicate in self.predicates:
+                for field in (predicate.field, predicate.other):
+                    if field is not None and field not in fields:
+                        fields.append(field)
+        self.fields = list(fields)
+
+    @classmethod
+    def parse(cls, where: List[str],
+              from_year: Optional[int] = None,
+              to_year: Optional[int] = None,
+              fields: Optional[List[str]] = None) -> 'ScreenQuery':
+        """
+        :param where: predicates e.g ['goodwill>0.3*assets', 'assets>=1e9']
+        :type where: List[str]
+        :return: the screen, ValueError for a predicate or field it cannot read
+        :rtype: ScreenQuery
+        """
+        predicates = []
+        for text in where:
+            match = cls._PREDICATE_PATTERN.fullmatch(text)
+            if match is None:
+                raise ValueError(f"Invalid predicate {text!r}, use e.g goodwill>0.3*assets or assets>=1e9")
+            if match['value'] is not None:
+                predicate = Predicate(match['field'], cls.OPERATORS[match['operator']], float(match['value']))
+            elif match['scaled'] is not None:
+                predicate = Predicate(match['field'], cls.OPERATORS[match['operator']],
+                                      float(match['factor']), match['scaled'])
+            else:
+                predicate = Predicate(match['field'], cls.OPERATORS[match['operator']], 1.0, match['other'])
+            predicates.append(predicate)
+        for field in fields or ():
+            # field names end up in the query, never let operators or paths through
+            if not FIELD_NAME_PATTERN.fullmatch(field):
+                raise ValueError(f"Invalid field name: {field!r}")
+        if from_year is not None and to_year is not None and from_year > to_year:
+            raise ValueError(f"from_year {from_year} is after to_year {to_year}")
+        return cls(predicates, from_year, to_year, fields)
+
+    def match_filter(self) -> List[dict]:
+        """
+        :return: clauses of the $match of the years and the predicates
+        :rtype: List[dict]
+        """
+        clauses = []
+        year_range = {}
+        if self.from_year is not None:
+            year_range['$gte'] = self.from_year
+        if self.to_year is not None:
+            year_range['$lte'] = self.to_year
+        if year_range:
+            clauses.append({YEAR_KEY: year_range})
+        for predicate in self.predicates:
+            path = 'data.' + predicate.field
+            if predicate.other is None:
+                clauses.append({path: {'$type': 'number', predicate.operator: predicate.value}})
+                continue
+            other = '$data.' + predicate.other
+            if predicate.value != 1.0:
+                other = {'$multiply': [predicate.value, other]}
+            clauses.append({path: {'$type': 'number'},
+                            'data.' + predicate.other: {'$type': 'number'},
+                            '$expr': {predicate.operator: ['$' + path, other]}})
+        return clauses
+
+    @staticmethod
+    def parse_cursor(after: str) -> Tuple[str, int, Optional[int]]:
+        """
+        :param after: the cursor of the last match of the previous page e.g aapl:2018 or aapl:2018-Q3
+        :type after: str
+        :return: ticker, year, fiscal quarter or None
+        :rtype: Tuple[str, int, int]
+        """
+        ticker, separator, record_key = after.rpartition(':')
+        year, _, quarter = record_key.partition('-Q')
+        try:
+            if not separator or not ticker:
+                raise ValueError
+            return ticker.lower(), int(year), int(quarter) if quarter else None
+        except ValueError:
+            raise ValueError(f"Invalid cursor {after!r}, use the next value of the previous page") from None
+
+    @staticmethod
+    def cursor_of(row: dict) -> str:
+        """
+        :param row: a match of the screen
+        :type row: dict
+        :return: the cursor of the page after it
+        :rtype: str
+        """
+        record_key = ExtractDBPull.record_key(row)
+        return f"{row['ticker']}:{record_key}"
+
+    def pipeline(self, limit: int,
+                 quarterly: bool = False,
+                 ticker_key: Optional[str] = None,
+                 after: Optional[Tuple[str, int, Optional[int]]] = None) -> List[dict]:
+        """
+        :param limit: matches returned
+        :type limit: int
+        :param quarterly: the records are keyed by year and fiscal quarter e.g 10-Q
+        :type quarterly: bool
+        :param ticker_key: field of the ticker when the collection holds many tickers,
+                           None for the collection of a single ticker
+        :type ticker_key: str
+        :param after: parse_cursor() of the previous page, only the matches after it are returned
+        :type after: Tuple[str, int, int]
+        :return: the aggregation pipeline of the screen
+        :rtype: List[dict]
+        """
+        sort_keys = [YEAR_KEY]
+        if quarterly:
+            sort_keys.append(QUARTER_KEY)
+        clauses = self.match_filter()
+        if ticker_key is not None:
+            sort_keys.insert(0, ticker_key)
+        if after is not None:
+            ticker, year, quarter = after
+            after_values = ([ticker] if ticker_key is not None else []) + [year] + ([quarter or 0] if quarterly else [])
+            # lexicographic "greater than" over the sort keys, the same order as the index
+            clauses.append({'$or': [dict(zip(sort_keys[:position], after_values[:position]),
+                                         **{sort_keys[position]: {'$gt': after_values[position]}})
+                                    for position in range(len(sort_keys))]})
+        projection = {'_id': 0, YEAR_KEY: 1, QUARTER_KEY: 1}
+        if ticker_key is not None:
+            projection[ticker_key] = 1
+        projection.update({'data.' + field: 1 for field in self.fields})
+        return [{'$match': {'$and': clauses} if clauses else {}},
+                {'$sort': {key: 1 for key in sort_keys}},
+                {'$limit': limit},
+                {'$project': projection}]
+
+    def __repr__(self):
+        return f"ScreenQuery({self.predicates!r}, from_year={self.from_year!r}, to_year={self.to_year!r})"
@@ -0,0 +1,107 @@
+# Process wide Mongo DB client shared by the read (API) and write (ingest) paths
+import os
+import threading
+from typing import (Any,
+                    Dict,
+                    Optional,
+                    )
+import pymongo
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+
+
+class SharedMongoClient:
+    """
+    MongoClient is thread safe and keeps its own connection pool, so one client per
+    process is all we need. Creating a client per request means a new pool, a new
+    server discovery and new TCP/auth handshakes every time, which dominated the
+    latency of the API. The client is created lazily on first use with the pool
+    sizing and timeouts below, every value can be overridden with the environment
+    variable next to it or with configure() before the first use
+    """
+    # setting name of MongoClient: (environment variable, default value)
+    _SETTINGS = {
+        'maxPoolSize': ('CI_MONGO_MAX_POOL_SIZE', 100),
+        'minPoolSize': ('CI_MONGO_MIN_POOL_SIZE', 0),
+        'maxIdleTimeMS': ('CI_MONGO_MAX_IDLE_TIME_MS', 300000),
+        'waitQueueTimeoutMS': ('CI_MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000),
+        'connectTimeoutMS': ('CI_MONGO_CONNECT_TIMEOUT_MS', 5000),
+        'serverSelectionTimeoutMS': ('CI_MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000),
+        'socketTimeoutMS': ('CI_MONGO_SOCKET_TIMEOUT_MS', 30000),
+    }
+    _URI_ENV = 'CI_MONGO_URI'
+    _DEFAULT_URI = "mongodb://localhost:27017/"
+
+    _client: Optional[pymongo.MongoClient] = None
+    _overrides: Dict[str, Any] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def settings(cls) -> Dict[str, Any]:
+        """
+        :return: the uri and keyword arguments the client is (or will be) built with
+        :rtype: dict
+        """
+        client_settings = {'host': os.environ.get(cls._URI_ENV, cls._DEFAULT_URI)}
+        for name, (env_name, default) in cls._SETTINGS.items():
+            client_settings[name] = int(os.environ.get(env_name, default))
+        client_settings.update(cls._overrides)
+        return client_settings
+
+    @classmethod
+    def configure(cls, **overrides: Any):
+        """
+        Overrides client settings (e.g host, maxPoolSize) in code, the shared client
+        is rebuilt on next use if it already exists
+        :param overrides: MongoClient keyword arguments
+        :type overrides: Any
+        """
+        with cls._lock:
+            cls._overrides = dict(overrides)
+            cls._close_locked()
+
+    @classmethod
+    def get(cls) -> pymongo.MongoClient:
+        """
+        :return: the process wide client, created on first call
+        :rtype: pymongo.MongoClient
+        """
+        client = cls._client
+        if client is None:
+            with cls._lock:
+                if cls._client is None:
+                    client_settings = cls.settings()
+                    logger.info(
+                        f"Creating shared Mongo DB client "
+                        f"{ {key: value for key, value in client_settings.items() if key != 'host'} }")
+                    cls._client = pymongo.MongoClient(**client_settings)
+                client = cls._client
+        return client
+
+    @classmethod
+    def close(cls):
+        """
+        Closes the shared client, the next get() opens a new one
+        """
+        with cls._lock:
+            cls._close_locked()
+
+    @classmethod
+    def _close_locked(cls):
+        if cls._client is not None:
+            cls._client.close()
+            cls._client = None
+
+    @classmethod
+    def _forget_after_fork(cls):
+        """
+        A client is not fork safe, a child process has to build its own one
+        """
+        cls._client = None
+        cls._lock = threading.Lock()
+
+    def __repr__(self):
+        return "SharedMongoClient()"
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=SharedMongoClient._forget_after_fork)
@@ -0,0 +1,431 @@
+# Latency histograms of the ingest and serving stages, exposed in the Prometheus text format
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import (BaseHTTPRequestHandler,
+                         ThreadingHTTPServer,
+                         )
+from typing import (Callable,
+                    Dict,
+                    Iterator,
+                    List,
+                    Optional,
+                    Tuple,
+                    )
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import (log_context,
+                                                                      logger,
+                                                                      )
+
+# Upper bounds in seconds, from a cached response (~1 ms) to a slow EDGAR download
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    """
+    Cumulative histogram of durations per label values, the Prometheus histogram type.
+    Observations only add to a few counters under a lock so the hot paths pay
+    well under a microsecond for it
+    """
+
+    def __init__(self, name: str,
+                 documentation: str,
+                 label_names: Tuple[str, ...],
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        :param name: metric name e.g ci_stage_duration_seconds
+        :type name: str
+        :param documentation: HELP line of the metric
+        :type documentation: str
+        :param label_names: names of the labels, every observation gives all of them
+        :type label_names: Tuple[str, ...]
+        :param buckets: sorted upper bounds of the buckets, +Inf is implied
+        :type buckets: Tuple[float, ...]
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values to [bucket counts.., +Inf count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        try:
+            return tuple(str(labels[name]) for name in self.label_names)
+        except KeyError as err:
+            raise ValueError(f"{self.name} expects the labels {self.label_names}, missing {err}") from None
+
+    def observe(self, seconds: float, **labels: str):
+        """
+        Records one duration
+        :param seconds: duration of the stage
+        :type seconds: float
+        :param labels: value of every label of the histogram
+        """
+        label_values = self._label_values(labels)
+        # the first bucket whose upper bound holds the value, len(buckets) is +Inf
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bucket] += 1
+            series[-1] += seconds
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """
+        Observes the duration of the with block, also when it raises
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels: str) -> int:
+        """
+        :return: number of observations with these label values
+        :rtype: int
+        """
+        series = self._series.get(self._label_values(labels))
+        return int(sum(series[:-1])) if series is not None else 0
+
+    def drain(self) -> Dict[Tuple[str, ...], List[float]]:
+        """
+        :return: the series recorded so far, the histogram is empty afterwards
+        :rtype: dict
+        """
+        with self._lock:
+            series, self._series = self._series, {}
+        return series
+
+    def snapshot(self) -> Dict[Tuple[str, ...], List[float]]:
+        """
+        :return: a copy of the series recorded so far, the histogram keeps them
+        :rtype: dict
+        """
+        with self._lock:
+            return {label_values: list(values) for label_values, values in self._series.items()}
+
+    def merge(self, series: Dict[Tuple[str, ...], List[float]]):
+        """
+        Adds series drained from the same histogram of another process
+        :param series: drain() of the other histogram
+        :type series: dict
+        """
+        with self._lock:
+            for label_values, values in series.items():
+                own = self._series.setdefault(label_values, [0] * (len(self.buckets) + 1) + [0.0])
+                for index, value in enumerate(values):
+                    own[index] += value
+
+    @staticmethod
+    def _format_labels(pairs: List[Tuple[str, str]]) -> str:
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self) -> List[str]:
+        """
+        :return: lines of the metric in the Prometheus text exposition format
+        :rtype: List[str]
+        """
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((label_values, list(values)) for label_values, values in self._series.items())
+        for label_values, values in series:
+            pairs = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{self._format_labels(pairs + [("le", le)])} {int(cumulative)}')
+            lines.append(f'{self.name}_sum{self._format_labels(pairs)} {values[-1]!r}')
+            lines.append(f'{self.name}_count{self._format_labels(pairs)} {int(cumulative)}')
+        return lines
+
+    def __repr__(self):
+        return f"Histogram({self.name!r}, {len(self._series)} series)"
+
+
+class MetricsRegistry:
+    """
+    The histograms of a process. Worker processes (see ExtractParseForms.parse_files())
+    drain their registry into the result of each job and the parent merges it, so the
+    /metrics route also counts the work done in the process pool
+    """
+
+    def __init__(self):
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name: str,
+                  documentation: str,
+                  label_names: Tuple[str, ...],
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """
+        :return: the histogram of this name, created on first use
+        :rtype: Histogram
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(name, documentation, label_names, buckets)
+        return histogram
+
+    def drain(self) -> Dict[str, Dict[Tuple[str, ...], List[float]]]:
+        """
+        :return: the series of every histogram, the registry is empty afterwards
+        :rtype: dict
+        """
+        return {name: histogram.drain() for name, histogram in list(self._histograms.items())}
+
+    def merge(self, drained: Dict[str, Dict[Tuple[str, ...], List[float]]]):
+        """
+        Adds the drain() of the registry of another process
+        """
+        for name, series in drained.items():
+            histogram = self._histograms.get(name)
+            if histogram is not None:
+                histogram.merge(series)
+
+    def snapshot(self) -> Dict[str, List[list]]:
+        """
+        :return: the series of every histogram as [label values, values] pairs, ready
+                 for json, the registry keeps them
+        :rtype: dict
+        """
+        return {name: [[list(label_values), values] for label_values, values in histogram.snapshot().items()]
+                for name, histogram in list(self._histograms.items())}
+
+    def merged(self, snapshots: List[Dict[str, List[list]]]) -> 'MetricsRegistry':
+        """
+        Sums the snapshot() of the registries of many processes running the same code
+        :param snapshots: snapshot() of every registry, this one included
+        :type snapshots: List[dict]
+        :return: a registry with the histograms of this one holding the sums
+        :rtype: MetricsRegistry
+        """
+        registry = MetricsRegistry()
+        for name, histogram in list(self._histograms.items()):
+            registry.histogram(name, histogram.documentation, histogram.label_names, histogram.buckets)
+        for snapshot in snapshots:
+            registry.merge({name: {tuple(label_values): values for label_values, values in series}
+                            for name, series in snapshot.items()})
+        return registry
+
+    def render(self) -> str:
+        """
+        :return: every histogram in the Prometheus text exposition format
+        :rtype: str
+        """
+        lines = []
+        for name in sorted(self._histograms):
+            lines.extend(self._histograms[name].render())
+        return '\n'.join(lines) + '\n'
+
+    def __repr__(self):
+        return f"MetricsRegistry({sorted(self._histograms)})"
+
+
+class ProcessSnapshots:
+    """
+    Shares the metrics of the processes serving the same port, e.g the gunicorn workers
+    of the API which each have their own registry and response cache while a scrape
+    lands on any one of them. Every process writes a json snapshot of its sources in
+    a shared folder, every flush_seconds and when it exits, and a scrape sums the
+    snapshots of all the processes. The snapshots of the exited processes stay so the
+    totals never go back (the folder is emptied when the server starts, see
+    gunicorn.conf.py)
+    """
+
+    def __init__(self, directory: str,
+                 flush_seconds: float = 5.0):
+        """
+        :param directory: folder shared by the processes
+        :type directory: str
+        :param flush_seconds: time between two snapshots of a process
+        :type flush_seconds: float
+        """
+        self.directory = directory
+        self.flush_seconds = flush_seconds
+        self._sources: Dict[str, Callable[[], dict]] = {}
+        self._path: Optional[str] = None
+        self._pid = None
+        self._write_lock = threading.Lock()
+
+    def add_source(self, name: str,
+                   snapshot: Callable[[], dict]):
+        """
+        :param name: key of the snapshots of the source e.g metrics
+        :type name: str
+        :param snapshot: returns the current values of the process, json serializable
+        :type snapshot: Callable[[], dict]
+        """
+        self._sources[name] = snapshot
+
+    def write(self):
+        """
+        Replaces the snapshot of this process, readers never see a partial file
+        """
+        with self._write_lock:
+            if self._pid != os.getpid():
+                # a unique name per process, a reused pid must not overwrite the counts of an exited one
+                self._pid = os.getpid()
+                self._path = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex}.json")
+            snapshot = {name: source() for name, source in self._sources.items()}
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = self._path + '.tmp'
+            with open(temp_path, 'w') as file:
+                json.dump(snapshot, file)
+            os.replace(temp_path, self._path)
+
+    def read(self, name: str) -> List[dict]:
+        """
+        Writes the snapshot of this process first so that it is current
+        :param name: the source e.g metrics
+        :type name: str
+        :return: the snapshots of the source of every process
+        :rtype: List[dict]
+        """
+        self.write()
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as file:
+                    snapshots.append(json.load(file)[name])
+            except (OSError, ValueError, KeyError) as err:
+                logger.warning("Skipped the metrics snapshot %s err:%s", path, err)
+        return snapshots
+
+    def start(self):
+        """
+        Writes the snapshots of this process from a daemon thread, and a last one at exit
+        """
+        def flush():
+            while True:
+                time.sleep(self.flush_seconds)
+                try:
+                    self.write()
+                except Exception as err:
+                    logger.warning("Unable to write the metrics snapshot err:%s", err)
+        threading.Thread(target=flush, name='metrics_snapshots', daemon=True).start()
+        atexit.register(self.write)
+
+    def __repr__(self):
+        return f"ProcessSnapshots({self.directory!r}, sources={sorted(self._sources)})"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """
+    GET /metrics of the registry of the server, see serve_metrics()
+    """
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics scrape %s", format % args)
+
+
+def _parse_ticker_classes(value: str) -> Dict[str, str]:
+    """
+    :param value: classes of tickers e.g "mega=aapl,msft;watch=nvda"
+    :type value: str
+    :return: ticker to its class
+    :rtype: dict
+    """
+    classes = {}
+    for group in filter(None, value.split(';')):
+        name, _, tickers = group.partition('=')
+        for ticker in filter(None, tickers.split(',')):
+            classes[ticker.strip().lower()] = name.strip()
+    return classes
+
+
+# Tickers are not labels, there are thousands of them. They are grouped in classes set
+# with CI_METRICS_TICKER_CLASSES, the tickers not in a class count as "other"
+TICKER_CLASSES = _parse_ticker_classes(os.environ.get('CI_METRICS_TICKER_CLASSES', ''))
+
+METRICS = MetricsRegistry()
+# download, header, parse, db_push, db_read and serialize
+STAGE_SECONDS = METRICS.histogram('ci_stage_duration_seconds',
+                                  'Duration of the ingest and serving stages in seconds',
+                                  ('stage', 'form_type', 'ticker_class'))
+REQUEST_SECONDS = METRICS.histogram('ci_http_request_duration_seconds',
+                                    'Latency of the API requests in seconds',
+                                    ('endpoint', 'method', 'status', 'ticker_class'))
+
+
+def serve_metrics(port: int,
+                  host: str = '',
+                  registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """
+    Serves GET /metrics from a daemon thread, for the processes recording stages
+    without the API in front of them (IngestWorker, Backfill) so Prometheus scrapes
+    them like the /metrics route of the API
+    :param port: port to listen on, 0 picks a free one (see server_address)
+    :type port: int
+    :param host: address to listen on, all of them by default
+    :type host: str
+    :param registry: the histograms served, METRICS by default
+    :type registry: MetricsRegistry
+    :return: the running server, shutdown() stops it
+    :rtype: ThreadingHTTPServer
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry if registry is not None else METRICS
+    threading.Thread(target=server.serve_forever, name='metrics_server', daemon=True).start()
+    logger.info("Serving the metrics at http://%s:%s/metrics", host or '0.0.0.0', server.server_address[1])
+    return server
+
+
+def ticker_class(ticker: Optional[str]) -> str:
+    """
+    :param ticker: ticker symbol, None when the work is not about one ticker
+    :type ticker: str
+    :return: label value of the ticker, see TICKER_CLASSES
+    :rtype: str
+    """
+    if not ticker:
+        return 'none'
+    return TICKER_CLASSES.get(ticker.lower(), 'other')
+
+
+@contextmanager
+def time_stage(stage: str,
+               form_type: Optional[str],
+               ticker: Optional[str]) -> Iterator[None]:
+    """
+    Times a with block into STAGE_SECONDS e.g
+    with time_stage('parse', '10-K', 'aapl'):
+    the records logged by the block carry the stage, form type and ticker
+    :param stage: download, header, parse, db_push, db_read or serialize
+    :type stage: str
+    :param form_type: SEC form type, None when unknown
+    :type form_type: str
+    :param ticker: ticker symbol, reduced to its class
+    :type ticker: str
+    """
+    with log_context(stage=stage, form_type=form_type, ticker=ticker), \
+            STAGE_SECONDS.time(stage=stage,
+                               form_type=(form_type or 'unknown').upper(),
+                               ticker_class=ticker_class(ticker)):
+        yield
@@ -0,0 +1,155 @@
+# Where the records of the tickers live in Mongo DB, selected with CI_MONGO_STORAGE_LAYOUT
+import argparse
+import os
+import sys
+from typing import (List,
+                    Optional,
+                    )
+import pymongo
+
+
+class StorageLayout:
+    """
+    Every form type is a DB (10-K, 10-Q ...) and every year of a ticker a document
+    {'data': record}. The layout decides how the tickers are spread in the DB:
+    per_ticker: one collection per ticker, named after it (the original layout)
+    single_collection: one 'filings' collection per form type, each document also
+                       carries its lower case 'ticker' and a unique compound index on
+                       (ticker, filing year[, quarter]) serves the reads of one ticker
+                       as well as the queries across tickers
+    Thousands of tickers are thousands of collections and index files with the first
+    layout, two with the second. The read and write APIs are the same for both
+    """
+    PER_TICKER = 'per_ticker'
+    SINGLE_COLLECTION = 'single_collection'
+    LAYOUTS = (PER_TICKER, SINGLE_COLLECTION)
+    # Collection of all the tickers of a form type in the single_collection layout
+    FILINGS_COLLECTION = 'filings'
+    # Top level field of the ticker in the single_collection layout
+    TICKER_KEY = 'ticker'
+    _LAYOUT_ENV = 'CI_MONGO_STORAGE_LAYOUT'
+
+    def __init__(self, name: str = PER_TICKER):
+        """
+        :param name: per_ticker or single_collection
+        :type name: str
+        """
+        if name not in self.LAYOUTS:
+            raise ValueError(f"Unknown storage layout {name!r}, use one of {self.LAYOUTS}")
+        self.name = name
+
+    @classmethod
+    def from_env(cls) -> 'StorageLayout':
+        """
+        :return: the layout set by CI_MONGO_STORAGE_LAYOUT, per_ticker by default
+        :rtype: StorageLayout
+        """
+        return cls(os.environ.get(cls._LAYOUT_ENV) or cls.PER_TICKER)
+
+    @property
+    def single_collection(self) -> bool:
+        return self.name == self.SINGLE_COLLECTION
+
+    def collection_name(self, ticker: str) -> str:
+        """
+        :param ticker: ticker symbol
+        :type ticker: str
+        :return: name of the collection holding the records of the ticker
+        :rtype: str
+        """
+        return self.FILINGS_COLLECTION if self.single_collection else ticker
+
+    def ticker_filter(self, ticker: str) -> dict:
+        """
+        :param ticker: ticker symbol
+        :type ticker: str
+        :return: query selecting the documents of the ticker in its collection
+        :rtype: dict
+        """
+        return {self.TICKER_KEY: ticker.lower()} if self.single_collection else {}
+
+    def tickers_filter(self, tickers: List[str]) -> dict:
+        """
+        :param tickers: ticker symbols
+        :type tickers: List[str]
+        :return: query selecting the documents of all these tickers, single_collection only
+        :rtype: dict
+        """
+        return {self.TICKER_KEY: {'$in': [ticker.lower() for ticker in tickers]}}
+
+    def document_fields(self, ticker: str,
+                        record: dict) -> dict:
+        """
+        :param ticker: ticker symbol
+        :type ticker: str
+        :param record: extracted form data as a dict
+        :type record: dict
+        :return: fields of the document of the record
+        :rtype: dict
+        """
+        if self.single_collection:
+            return {self.TICKER_KEY: ticker.lower(), 'data': record}
+        return {'data': record}
+
+    def index_prefix(self) -> List[str]:
+        """
+        :return: keys in front of the filing year in the unique index of the records
+        :rtype: List[str]
+        """
+        return [self.TICKER_KEY] if self.single_collection else []
+
+    def tickers(self, client: pymongo.MongoClient,
+                db_name: str) -> List[str]:
+        """
+        :param client: Mongo DB client
+        :type client: pymongo.MongoClient
+        :param db_name: form type e.g 10-K
+        :type db_name: str
+        :return: the tickers with records in the DB of the form type
+        :rtype: List[str]
+        """
+        db = client[db_name.upper()]
+        if self.single_collection:
+            return sorted(db[self.FILINGS_COLLECTION].distinct(self.TICKER_KEY))
+        # the filings collection of the other layout is not a ticker, e.g during a migration
+        return sorted(name for name in db.list_collection_names()
+                      if name != self.FILINGS_COLLECTION and not name.startswith('system.'))
+
+    def __eq__(self, other):
+        return isinstance(other, StorageLayout) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def __repr__(self):
+        return f"StorageLayout({self.name!r})"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    One off migration of the records between layouts e.g
+    python -m ci_rest_api_server.support_libs.extractor.StorageLayout --to single_collection 10-K 10-Q
+    """
+    parser = argparse.ArgumentParser(description='Copies the records of every ticker to another storage layout')
+    parser.add_argument('form_types', nargs='+', help='DBs to migrate e.g 10-K 10-Q')
+    parser.add_argument('--from', dest='source', default=StorageLayout.PER_TICKER, choices=StorageLayout.LAYOUTS)
+    parser.add_argument('--to', dest='target', default=StorageLayout.SINGLE_COLLECTION, choices=StorageLayout.LAYOUTS)
+    parser.add_argument('--drop-source', action='store_true',
+                        help='drop the records in the old layout once they are all copied')
+    options = parser.parse_args(argv)
+    if options.source == options.target:
+        parser.error("--from and --to are the same layout")
+    # the read path imports this module, the ingestion stack is only loaded by the command
+    from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+    extractor = ExtractParseForms('None')
+    for form_type in options.form_types:
+        counts = extractor.migrate_storage_layout(form_type.upper(),
+                                                  StorageLayout(options.source),
+                                                  StorageLayout(options.target),
+                                                  drop_source=options.drop_source)
+        print(f"{form_type.upper()}: {counts}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,237 @@
+# Splits EDGAR full submission text files into their documents
+from typing import (Iterable,
+                    Iterator,
+                    NamedTuple,
+                    Optional,
+                    Union,
+                    )
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+
+
+class SubmissionDocument(NamedTuple):
+    """
+    One <DOCUMENT> of a full submission, start and end are byte offsets of the
+    content of the <TEXT> section in the submission buffer
+    """
+    type: str
+    filename: str
+    start: int
+    end: int
+
+
+class SubmissionSplitter:
+    """
+    A full submission .txt file saved from EDGAR is the SEC header followed by one
+    <DOCUMENT> section per file of the filing (primary html, exhibits, uuencoded
+    images and pdfs, the XBRL instance ...). Only the XBRL instance has the facts we
+    need, so the boundaries are scanned at the byte level and only that document is
+    handed over to the fact extractor, the rest of the bytes are never parsed
+    """
+    _DOCUMENT_START = b'\n<DOCUMENT>'
+    _DOCUMENT_END = b'</DOCUMENT>'
+    _TEXT_START = b'<TEXT>'
+    _TEXT_END = b'</TEXT>'
+    _TYPE_TAG = b'<TYPE>'
+    _FILENAME_TAG = b'<FILENAME>'
+    # Type of the XBRL instance document in pre inline XBRL filings
+    _INSTANCE_TYPE = 'EX-101.INS'
+    # Inline XBRL filings carry the extracted instance as an XML document
+    _INLINE_INSTANCE_SUFFIX = '_htm.xml'
+    _INLINE_MARKERS = (b'<ix:', b'<IX:')
+
+    def __init__(self, buffer: Union[bytes, bytearray, memoryview]):
+        """
+        :param buffer: raw bytes of the full submission, never copied
+        :type buffer: bytes like object
+        """
+        if isinstance(buffer, memoryview) and len(buffer) != len(buffer.obj):
+            # a partial view cannot be searched in place, take a copy of that part only
+            buffer = bytes(buffer)
+        self._buffer = buffer
+        # memoryview has no find, the object it wraps has
+        self._searchable = buffer.obj if isinstance(buffer, memoryview) else buffer
+
+    @staticmethod
+    def _read_line_value(buffer, tag: bytes, start: int, end: int) -> str:
+        """
+        Reads the value following a SGML tag up to the end of the line
+        :return: value of the tag or empty string if the tag is missing
+        :rtype: str
+        """
+        position = buffer.find(tag, start, end)
+        if position == -1:
+            return ''
+        position += len(tag)
+        line_end = buffer.find(b'\n', position, end)
+        if line_end == -1:
+            line_end = end
+        return bytes(buffer[position:line_end]).decode('ascii', 'replace').strip()
+
+    def documents(self) -> Iterator[SubmissionDocument]:
+        """
+        Yields every document of the submission in file order
+        :return: generator of the documents
+        :rtype: Iterator[SubmissionDocument]
+        """
+        buffer = self._searchable
+        position = buffer.find(self._DOCUMENT_START)
+        while position != -1:
+            document_end = buffer.find(self._DOCUMENT_END, position)
+            if document_end == -1:
+                document_end = len(buffer)
+            text_start = buffer.find(self._TEXT_START, position, document_end)
+            text_end = buffer.rfind(self._TEXT_END, position, document_end)
+            # the type and file name are in the document header before <TEXT>
+            header_end = text_start if text_start != -1 else document_end
+            text_start = header_end + len(self._TEXT_START) if text_start != -1 else header_end
+            if text_end == -1 or text_end < text_start:
+                text_end = document_end
+            yield SubmissionDocument(
+                type=self._read_line_value(buffer, self._TYPE_TAG, position, header_end),
+                filename=self._read_line_value(buffer, self._FILENAME_TAG, position, header_end),
+                start=text_start,
+                end=text_end)
+            position = buffer.find(self._DOCUMENT_START, document_end)
+
+    def xbrl_document(self, form_type: str) -> Optional[memoryview]:
+        """
+        Picks the document holding the XBRL facts, in order of preference
+        1. EX-101.INS instance document
+        2. instance extracted from an inline XBRL filing (*_htm.xml)
+        3. the primary document of the form when it is inline XBRL
+        A buffer without any <DOCUMENT> section is not a full submission and is
+        returned as it is
+        :param form_type: SEC form type of the submission e.g 10-K
+        :type form_type: str
+        :return: zero copy view of the document or None if there is no XBRL data
+        :rtype: memoryview
+        """
+        view = memoryview(self._buffer)
+        inline_instance, inline_primary = None, None
+        has_documents = False
+        for document in self.documents():
+            has_documents = True
+            if document.type == self._INSTANCE_TYPE:
+                return view[document.start:document.end]
+            if inline_instance is None and document.filename.lower().endswith(self._INLINE_INSTANCE_SUFFIX):
+                inline_instance = document
+            elif inline_primary is None and document.type == form_type:
+                inline_primary = document
+        if inline_instance is not None:
+            return view[inline_instance.start:inline_instance.end]
+        if inline_primary is not None:
+            for marker in self._INLINE_MARKERS:
+                if self._searchable.find(marker, inline_primary.start, inline_primary.end) != -1:
+                    return view[inline_primary.start:inline_primary.end]
+        if not has_documents:
+            return view
+        logger.debug("No XBRL document found for form type %s", form_type)
+        return None
+
+    @classmethod
+    def xbrl_document_from_stream(cls, chunks: Iterable[bytes],
+                                  form_type: str) -> Optional[memoryview]:
+        """
+        xbrl_document() over a submission read as a stream of chunks e.g while it is
+        decompressed. The documents are cut from the stream as they go by, only the
+        candidates for the XBRL data are kept in memory and the stream is not read
+        further once the EX-101.INS instance is complete
+        :param chunks: consecutive bytes of the submission
+        :type chunks: Iterable[bytes]
+        :param form_type: SEC form type of the submission e.g 10-K
+        :type form_type: str
+        :return: the document picked by the rules of xbrl_document() or None
+        :rtype: memoryview
+        """
+        chunks = iter(chunks)
+        pending = bytearray()
+        # 'between' documents, in the document 'header' or in its 'text'
+        state = 'between'
+        # text of the current document, None when it is skipped
+        document_text: Optional[bytearray] = None
+        document_kind = None
+        has_documents = False
+        inline_instance, inline_primary = None, None
+        exhausted = False
+        while True:
+            if state == 'between':
+                position = pending.find(cls._DOCUMENT_START)
+                if position != -1:
+                    has_documents = True
+                    del pending[:position + len(cls._DOCUMENT_START)]
+                    state = 'header'
+                    continue
+                if has_documents:
+                    # keep what could be the start of a marker split over two chunks
+                    del pending[:max(len(pending) - len(cls._DOCUMENT_START) + 1, 0)]
+            elif state == 'header':
+                # the type and file name are in the document header before <TEXT>
+                text_start = pending.find(cls._TEXT_START)
+                document_end = pending.find(cls._DOCUMENT_END)
+                if text_start != -1 and (document_end == -1 or text_start < document_end):
+                    document_type = cls._read_line_value(pending, cls._TYPE_TAG, 0, text_start)
+                    filename = cls._read_line_value(pending, cls._FILENAME_TAG, 0, text_start)
+                    if document_type == cls._INSTANCE_TYPE:
+                        document_kind = 'instance'
+                    elif inline_instance is None and filename.lower().endswith(cls._INLINE_INSTANCE_SUFFIX):
+                        document_kind = 'inline_instance'
+                    elif inline_primary is None and document_type == form_type:
+                        document_kind = 'inline_primary'
+                    else:
+                        document_kind = None
+                    del pending[:text_start + len(cls._TEXT_START)]
+                    document_text = bytearray() if document_kind else None
+                    state = 'text'
+                    continue
+                if document_end != -1 or exhausted:
+                    # a document without <TEXT> has nothing to offer
+                    del pending[:document_end + len(cls._DOCUMENT_END) if document_end != -1 else len(pending)]
+                    state = 'between'
+                    continue
+            else:
+                document_end = pending.find(cls._DOCUMENT_END)
+                if document_end != -1 or exhausted:
+                    if document_end == -1:
+                        document_end = len(pending)
+                    if document_text is not None:
+                        document_text += pending[:document_end]
+                        text_end = document_text.rfind(cls._TEXT_END)
+                        if text_end != -1:
+                            del document_text[text_end:]
+                        if document_kind == 'instance':
+                            return memoryview(document_text)
+                        if document_kind == 'inline_instance':
+                            inline_instance = document_text
+                        elif any(marker in document_text for marker in cls._INLINE_MARKERS):
+                            inline_primary = document_text
+                        else:
+                            # not inline XBRL, no need to hold it any longer
+                            inline_primary = b''
+                    del pending[:document_end + len(cls._DOCUMENT_END)]
+                    document_text = None
+                    state = 'between'
+                    continue
+                # move all but a possible split end marker out of the pending bytes
+                keep_from = max(len(pending) - len(cls._DOCUMENT_END) + 1, 0)
+                if document_text is not None:
+                    document_text += pending[:keep_from]
+                del pending[:keep_from]
+            if exhausted:
+                break
+            chunk = next(chunks, None)
+            if chunk is None:
+                exhausted = True
+            else:
+                pending += chunk
+        if inline_instance is not None:
+            return memoryview(inline_instance)
+        if inline_primary:
+            return memoryview(inline_primary)
+        if not has_documents:
+            # not a full submission, the whole stream was kept
+            return memoryview(pending)
+        logger.debug("No XBRL document found for form type %s", form_type)
+        return None
+
+    def __repr__(self):
+        return f"SubmissionSplitter({len(self._buffer)} bytes)"
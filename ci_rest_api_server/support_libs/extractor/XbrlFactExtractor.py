@@ -0,0 +1,351 @@
+# Single pass XBRL fact extraction engine shared by the form parsers
+from decimal import Decimal
+from typing import (Dict,
+                    Iterable,
+                    List,
+                    NamedTuple,
+                    Optional,
+                    Tuple,
+                    Union,
+                    )
+from lxml import etree
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+
+
+class XbrlContext(NamedTuple):
+    """
+    Period and dimensions of an xbrli:context, facts point to it with their contextRef
+    """
+    # ISO date of the instant or of the end of the duration e.g 2018-09-29
+    end: str
+    # ISO date of the start of the duration, None for an instant
+    start: Optional[str]
+    # the context has a segment or scenario, its facts are table (Member) values
+    dimensional: bool
+
+    @property
+    def year(self) -> int:
+        return int(self.end[:4])
+
+
+class _DocumentIndex:
+    """
+    What one pass over a document collects: its contexts and units by id and the
+    requested facts, buffered until the end of the document as the contexts are not
+    always defined before the facts pointing to them
+    """
+    __slots__ = ('contexts', 'units', 'facts', 'document_facts', 'period_context_ref')
+
+    def __init__(self):
+        self.contexts: Dict[str, XbrlContext] = {}
+        self.units: Dict[str, str] = {}
+        # field, contextRef, unitRef, value
+        self.facts: List[Tuple[str, str, str, int]] = []
+        self.document_facts: Dict[str, str] = {}
+        # context of dei:DocumentPeriodEndDate, the period the document reports
+        self.period_context_ref: Optional[str] = None
+
+
+class XbrlFactExtractor:
+    """
+    Walks an SEC filing once with an event based (pull) parser and routes every
+    closed element to the field it feeds through a dictionary lookup on the tag name.
+    Elements are cleared as soon as they are consumed so that the tree never holds
+    more than the element currently being parsed, which keeps parse time and memory
+    flat no matter how many fields are requested.
+    The xbrli:context and xbrli:unit definitions are indexed in the same pass and every
+    fact is resolved with one lookup of its contextRef: a fact counts for the period
+    the document reports when its context has no dimensions and ends on the period end
+    date, of the contexts ending that day the longest duration (the fiscal year of a
+    10-K) wins. The prior periods of the document (comparatives) resolve the same way
+    """
+    # Size of each block fed to the pull parser
+    _CHUNK_SIZE = 1 << 20
+    # Inline XBRL facts are html tags carrying the element name as an attribute
+    _INLINE_FACT_TAG = 'ix:nonfraction'
+    _INLINE_TEXT_TAG = 'ix:nonnumeric'
+    _CONTEXT_TAGS = frozenset(('xbrli:context', 'context'))
+    _UNIT_TAGS = frozenset(('xbrli:unit', 'unit'))
+    # Children of the contexts and units, read when their parent closes so kept until then
+    _DEFINITION_PART_TAGS = frozenset(prefix + name
+                                      for prefix in ('', 'xbrli:', 'xbrldi:')
+                                      for name in ('entity', 'identifier', 'segment', 'scenario',
+                                                   'explicitmember', 'typedmember', 'period', 'instant',
+                                                   'startdate', 'enddate', 'forever', 'measure', 'divide',
+                                                   'unitnumerator', 'unitdenominator'))
+    _PERIOD_END_TAG = 'dei:documentperiodenddate'
+
+    def __init__(self, fields: Iterable[str],
+                 prefix: str = 'us-gaap',
+                 document_fields: Iterable[str] = ()):
+        """
+        Build the tag to field lookup table once, it is reused for every filing
+        :param fields: names of the XBRL elements to extract (lower case, no prefix)
+        :type fields: Iterable[str]
+        :param prefix: taxonomy prefix of the elements e.g us-gaap
+        :type prefix: str
+        :param document_fields: qualified names of text facts describing the whole
+                                document e.g dei:DocumentFiscalPeriodFocus, they are
+                                returned as text under their lower case name without
+                                prefix whatever their context
+        :type document_fields: Iterable[str]
+        """
+        # the lxml html parser lower cases the tag names so keys are lower case too
+        self._tag_to_field = {f"{prefix}:{field}".lower(): field
+                              for field in fields}
+        self._document_tag_to_field = {name.lower(): name.split(':', 1)[-1].lower()
+                                       for name in document_fields}
+
+    @property
+    def fields(self) -> tuple:
+        """
+        :return: names of the fields this extractor fills
+        :rtype: tuple
+        """
+        return tuple(self._tag_to_field.values()) + tuple(self._document_tag_to_field.values())
+
+    def extract(self, source: Union[bytes, bytearray, memoryview],
+                year: int) -> Dict[str, Union[int, str]]:
+        """
+        Extracts the value of every requested field for the period the document
+        reports in one pass over the document
+        :param source: raw bytes of the filing
+        :type source: bytes like object
+        :param year: year for the data needed, the period ends in it or before
+        :type year: int
+        :return: field name to value for each field that was found
+        :rtype: dict
+        """
+        document_index = self._index_document(source)
+        periods = self._resolve_periods(document_index, year, 1)
+        extracted_facts = dict(periods[0][1]) if periods else {}
+        extracted_facts.update(document_index.document_facts)
+        return extracted_facts
+
+    def extract_periods(self, source: Union[bytes, bytearray, memoryview],
+                        year: int,
+                        periods: int = 2) -> List[Tuple[str, Dict[str, int]]]:
+        """
+        The period the document reports and the prior fiscal years it compares it
+        with, from the same single pass as extract()
+        :param source: raw bytes of the filing
+        :type source: bytes like object
+        :param year: year for the data needed, the period ends in it or before
+        :type year: int
+        :param periods: number of periods, the reported one first
+        :type periods: int
+        :return: (period end date, field name to value) newest first, at most periods
+        :rtype: List[Tuple[str, dict]]
+        """
+        return self._resolve_periods(self._index_document(source), year, periods)
+
+    def _index_document(self, source: Union[bytes, bytearray, memoryview]) -> _DocumentIndex:
+        """
+        :param source: raw bytes of the filing
+        :type source: bytes like object
+        :return: the contexts, units and requested facts of the document
+        :rtype: _DocumentIndex
+        """
+        document_index = _DocumentIndex()
+        parser = etree.HTMLPullParser(events=('end',))
+        with memoryview(source) as data:
+            for offset in range(0, len(data), self._CHUNK_SIZE):
+                parser.feed(bytes(data[offset:offset + self._CHUNK_SIZE]))
+                self._consume_events(parser, self._tag_to_field, self._document_tag_to_field,
+                                     document_index)
+        parser.close()
+        self._consume_events(parser, self._tag_to_field, self._document_tag_to_field,
+                             document_index)
+        return document_index
+
+    @staticmethod
+    def _consume_events(parser: 'etree.HTMLPullParser',
+                        tag_to_field: Dict[str, str],
+                        document_tag_to_field: Dict[str, str],
+                        document_index: _DocumentIndex):
+        """
+        Drains the parser events collected so far and clears every consumed element
+        :param parser: pull parser which has been fed some data
+        :type parser: etree.HTMLPullParser
+        :param tag_to_field: lookup table from tag name to field name
+        :type tag_to_field: dict
+        :param document_tag_to_field: lookup table from tag name to document field name
+        :type document_tag_to_field: dict
+        :param document_index: output, updated in place
+        :type document_index: _DocumentIndex
+        """
+        for _, element in parser.read_events():
+            tag = element.tag
+            parent = element.getparent()
+            document_field = None
+            if tag == XbrlFactExtractor._INLINE_FACT_TAG:
+                field = tag_to_field.get(element.get('name', '').lower())
+            elif tag == XbrlFactExtractor._INLINE_TEXT_TAG:
+                field = None
+                name = element.get('name', '').lower()
+                document_field = document_tag_to_field.get(name)
+                if name == XbrlFactExtractor._PERIOD_END_TAG:
+                    document_index.period_context_ref = element.get('contextref')
+            else:
+                field = tag_to_field.get(tag)
+                if field is None:
+                    if tag in XbrlFactExtractor._DEFINITION_PART_TAGS:
+                        continue
+                    if tag in XbrlFactExtractor._CONTEXT_TAGS:
+                        XbrlFactExtractor._index_context(element, document_index.contexts)
+                    elif tag in XbrlFactExtractor._UNIT_TAGS:
+                        XbrlFactExtractor._index_unit(element, document_index.units)
+                    elif tag == XbrlFactExtractor._PERIOD_END_TAG:
+                        document_index.period_context_ref = element.get('contextref')
+                    if document_tag_to_field:
+                        document_field = document_tag_to_field.get(tag)
+            if document_field is not None:
+                # document facts have a single value, the first one is kept
+                text = ''.join(element.itertext()).strip()
+                if text:
+                    document_index.document_facts.setdefault(document_field, text)
+            elif field is not None:
+                try:
+                    if tag == XbrlFactExtractor._INLINE_FACT_TAG:
+                        value = XbrlFactExtractor._inline_value(element)
+                    else:
+                        value = int(element.text)
+                except (TypeError, ValueError, ArithmeticError):
+                    logger.debug("Skipping non integer value %r for %s", element.text, tag)
+                else:
+                    document_index.facts.append((field, element.get('contextref', ''),
+                                                 element.get('unitref', ''), value))
+            elif parent is not None and parent.tag in (XbrlFactExtractor._INLINE_FACT_TAG,
+                                                       XbrlFactExtractor._INLINE_TEXT_TAG):
+                # formatting tags inside an inline fact hold its text, keep them
+                continue
+            # free the element and everything parsed before it, they are not needed anymore
+            element.clear()
+            if parent is not None:
+                while element.getprevious() is not None:
+                    del parent[0]
+
+    @staticmethod
+    def _index_context(element: 'etree._Element',
+                       contexts: Dict[str, XbrlContext]):
+        """
+        :param element: closed xbrli:context element with its children
+        :type element: etree._Element
+        :param contexts: context id to context, updated in place
+        :type contexts: dict
+        """
+        end = start = None
+        dimensional = False
+        for child in element.iter():
+            if not isinstance(child.tag, str):
+                # comments
+                continue
+            name = child.tag.rpartition(':')[2]
+            if name in ('instant', 'enddate'):
+                end = (child.text or '').strip()[:10]
+            elif name == 'startdate':
+                start = (child.text or '').strip()[:10]
+            elif name in ('segment', 'scenario'):
+                dimensional = True
+        context_id = element.get('id')
+        # forever contexts have no end, they hold no period values
+        if context_id and end:
+            contexts[context_id] = XbrlContext(end, start, dimensional)
+
+    @staticmethod
+    def _index_unit(element: 'etree._Element',
+                    units: Dict[str, str]):
+        """
+        :param element: closed xbrli:unit element with its children
+        :type element: etree._Element
+        :param units: unit id to measure e.g iso4217:USD or iso4217:USD/xbrli:shares, updated in place
+        :type units: dict
+        """
+        measures = [(child.text or '').strip() for child in element.iter()
+                    if isinstance(child.tag, str) and child.tag.rpartition(':')[2] == 'measure']
+        if element.get('id') and measures:
+            units[element.get('id')] = '/'.join(measures)
+
+    @staticmethod
+    def _resolve_periods(document_index: _DocumentIndex,
+                         year: int,
+                         periods: int) -> List[Tuple[str, Dict[str, int]]]:
+        """
+        :param document_index: contexts, units and facts of the document
+        :type document_index: _DocumentIndex
+        :param year: year for the data needed, the period ends in it or before
+        :type year: int
+        :param periods: number of periods, the reported one first
+        :type periods: int
+        :return: (period end date, field name to value) newest first
+        :rtype: List[Tuple[str, dict]]
+        """
+        contexts = document_index.contexts
+        if not contexts:
+            # fragments without context definitions, the year has to be in the context id
+            # and "Member" ids are table values
+            year_string = str(year)
+            facts = {field: value for field, context_ref, _, value in document_index.facts
+                     if year_string in context_ref and 'Member' not in context_ref}
+            return [(year_string, facts)] if facts else []
+        units = document_index.units
+        candidates: List[Tuple[XbrlContext, str, int]] = []
+        for field, context_ref, unit_ref, value in document_index.facts:
+            context = contexts.get(context_ref)
+            if context is None or context.dimensional or context.year > year:
+                continue
+            measure = units.get(unit_ref)
+            # the fields are amounts, share counts and per share values are other facts
+            if measure is not None and ('/' in measure or not measure.startswith('iso4217:')):
+                continue
+            candidates.append((context, field, value))
+        if not candidates:
+            return []
+        period_context = contexts.get(document_index.period_context_ref)
+        if period_context is not None and not period_context.dimensional and period_context.year <= year:
+            period_end = period_context.end
+        else:
+            period_end = max(context.end for context, _, _ in candidates)
+        period_ends = [period_end]
+        while len(period_ends) < periods:
+            # the comparatives are the latest period of each prior fiscal year
+            prior_year = int(period_ends[-1][:4]) - 1
+            prior_end = max((context.end for context, _, _ in candidates if context.year == prior_year),
+                            default=None)
+            if prior_end is None:
+                break
+            period_ends.append(prior_end)
+        resolved = []
+        for end in period_ends:
+            best: Dict[str, Tuple[str, int]] = {}
+            for context, field, value in candidates:
+                if context.end != end:
+                    continue
+                # an earlier start is a longer duration, an instant starts at its end
+                start = context.start or context.end
+                if field not in best or start < best[field][0]:
+                    best[field] = (start, value)
+            resolved.append((end, {field: value for field, (_, value) in best.items()}))
+        return resolved
+
+    @staticmethod
+    def _inline_value(element: 'etree._Element') -> int:
+        """
+        Converts the displayed value of an inline XBRL fact to the fact value using
+        the scale, sign and format attributes
+        :param element: ix:nonfraction element
+        :type element: etree._Element
+        :return: value of the fact
+        :rtype: int
+        """
+        if 'zero' in element.get('format', ''):
+            # ixt:fixed-zero and friends display a dash for 0
+            return 0
+        text = ''.join(element.itertext()).strip().replace(',', '').replace(' ', '')
+        value = Decimal(text).scaleb(int(element.get('scale', '0')))
+        if element.get('sign') == '-':
+            value = -value
+        return int(value)
+
+    def __repr__(self):
+        return f"XbrlFactExtractor({len(self._tag_to_field)} fields)"
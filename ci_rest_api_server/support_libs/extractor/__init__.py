@@ -1,17 +1,57 @@
-# exports the API's from the extractor
-from .IExtractDBPush import (
-    logger,
-    ExtractParseForms,
-)
-
-from .GFormParse import (
-    GeneralFormParser,
-)
-
-from .P10kParser import (
-    Parse10KForm,
-)
-
-from .P10QParser import (
-    Parse10QForm,
-)
\ No newline at end of file
+# exports the API's from the extractor, each one is imported on first use (see LazyExports)
+from ..LazyExports import LazyExports
+
+LazyExports.install(__name__, {
+    'logger': '.ExtractorLogger',
+    'log_context': '.ExtractorLogger',
+
+    'ExtractParseForms': '.IExtractDBPush',
+
+    'ExtractDBPull': '.ExtractDBPull',
+
+    'GeneralFormParser': '.GFormParse',
+
+    'Parse10KForm': '.P10kParser',
+
+    'Parse10QForm': '.P10QParser',
+
+    'XbrlFactExtractor': '.XbrlFactExtractor',
+
+    'SubmissionDocument': '.SubmissionSplitter',
+    'SubmissionSplitter': '.SubmissionSplitter',
+
+    'FilingHandle': '.FilingHandle',
+
+    'SharedMongoClient': '.SharedMongoClient',
+
+    'DownloadResult': '.EdgarDownloader',
+    'EdgarDownloader': '.EdgarDownloader',
+    'RequestsTransport': '.EdgarDownloader',
+    'TokenBucket': '.EdgarDownloader',
+    'TransportError': '.EdgarDownloader',
+
+    'FilingManifest': '.FilingManifest',
+
+    'FactSchema': '.FinancialFacts',
+    'FinancialFacts': '.FinancialFacts',
+
+    'FinancialRatios': '.FinancialRatios',
+
+    'Histogram': '.StageMetrics',
+    'MetricsRegistry': '.StageMetrics',
+    'ProcessSnapshots': '.StageMetrics',
+
+    'StorageLayout': '.StorageLayout',
+
+    'Predicate': '.ScreenQuery',
+    'ScreenQuery': '.ScreenQuery',
+
+    'IngestJobQueue': '.IngestJobQueue',
+    'LeaseLostError': '.IngestJobQueue',
+
+    'IngestWorker': '.IngestWorker',
+
+    'Backfill': '.Backfill',
+    'BackfillCheckpoint': '.Backfill',
+    'BackfillProgress': '.Backfill',
+})
\ No newline at end of file
@@ -0,0 +1,169 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from ci_rest_api_server.support_libs.extractor.Backfill import (Backfill,
+                                                                BackfillCheckpoint,
+                                                                BackfillProgress,
+                                                                read_tickers,
+                                                                )
+from ci_rest_api_server.support_libs.extractor.EdgarDownloader import (EdgarDownloader,
+                                                                      TransportError,
+                                                                      )
+from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+from ci_rest_api_server.support_libs.extractor.test_XbrlFactExtractor import SAMPLE_FILING
+
+# accession number to the filed as of date of the filing
+FILINGS = {
+    'aapl': {'0000320193-18-000145': b'20181105', '0000320193-17-000070': b'20171103'},
+    'msft': {'0000789019-18-000100': b'20181105'},
+}
+
+
+class StandInTransport:
+    """
+    Serves the company browse pages and filings like EDGAR does
+    """
+    def __init__(self):
+        self.filings = []
+
+    def get(self, url, params=None):
+        if params is not None:
+            if params['CIK'] not in FILINGS:
+                raise TransportError(f"{url} 404", 404)
+            return ''.join(f"<filingHREF>https://edgar/Archives/{params['CIK']}/{number}-index.htm</filingHREF>"
+                           for number in FILINGS[params['CIK']]).encode()
+        ticker, number = url.rsplit('/', 2)[1:]
+        self.filings.append(number)
+        return SAMPLE_FILING.replace(b'20181105', FILINGS[ticker][number[:-len('.txt')]])
+
+
+class TestBackfill(unittest.TestCase):
+    def setUp(self) -> None:
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.folder = folder.name
+        self.checkpoint_path = os.path.join(self.folder, 'backfill-10-k.json')
+        self.transport = StandInTransport()
+        self.pushed = []
+
+    def backfill(self, push_error=None, **workers):
+        extractor = ExtractParseForms(self.folder)
+
+        def push_to_db(records):
+            if push_error is not None:
+                raise push_error
+            self.pushed.append([(record['ticker'], record['filing-year']) for record in records])
+            return {'inserted': len(records), 'updated': 0, 'unchanged': 0}
+        extractor.push_to_db = mock.Mock(side_effect=push_to_db)
+        extractor.refresh_ratios = mock.Mock(return_value=['aapl', 'msft'])
+        self.extractor = extractor
+        return Backfill(self.folder,
+                        BackfillCheckpoint.load(self.checkpoint_path),
+                        downloader=EdgarDownloader(self.folder, transport=self.transport, requests_per_second=1000),
+                        extractor=extractor,
+                        **workers)
+
+    def test_read_tickers(self):
+        path = os.path.join(self.folder, 'tickers.txt')
+        with open(path, 'w') as file:
+            file.write("# S&P 500\nAAPL\nmsft, goog  amzn\n\naapl # again\n")
+        self.assertEqual(['aapl', 'msft', 'goog', 'amzn'], read_tickers(path))
+
+    def test_run_and_resume(self):
+        """
+        A failed ticker does not stop the others and is the only one run again
+        """
+        output = io.StringIO()
+        progress = self.backfill(download_workers=2, parse_workers=2).run(['aapl', 'random', 'msft'], output=output)
+        self.assertEqual((2, 1), (progress.done, progress.failed))
+        self.assertEqual({'downloaded': 3, 'inserted': 3, 'updated': 0, 'unchanged': 0, 'skipped': 0},
+                         progress.counts)
+        self.assertEqual({'download': 3, 'parse': 3, 'db_push': 3}, progress.filings)
+        self.assertEqual(progress.bytes['download'], progress.bytes['parse'])
+        self.assertEqual([[('aapl', 2017), ('aapl', 2018)], [('msft', 2018)]], sorted(self.pushed))
+        self.assertIn('Backfill of 3 tickers', output.getvalue())
+        self.assertIn('Ratios of 2 tickers refreshed', output.getvalue())
+        self.extractor.refresh_ratios.assert_called_once_with()
+        with open(self.checkpoint_path) as file:
+            entries = json.load(file)['10-K']
+        self.assertEqual({'aapl': 'done', 'msft': 'done', 'random': 'failed'},
+                         {ticker: entry['state'] for ticker, entry in entries.items()})
+        self.assertEqual({'download', 'parse', 'db_push'}, set(entries['aapl']['seconds']))
+        self.assertTrue(entries['random']['error'].startswith('download: TransportError'))
+
+        FILINGS['random'] = {'0000000001-18-000001': b'20181105'}
+        self.addCleanup(FILINGS.pop, 'random')
+        output = io.StringIO()
+        progress = self.backfill().run(['aapl', 'random', 'msft'], output=output)
+        self.assertEqual((1, 1, 0), (progress.tickers, progress.done, progress.failed))
+        self.assertIn('2 tickers already done', output.getvalue())
+        self.assertEqual([('random', 2018)], self.pushed[-1])
+        self.assertEqual(4, len(self.transport.filings))
+        self.assertEqual({}, BackfillCheckpoint.load(self.checkpoint_path).failed('10-K'))
+
+    def test_failed_push(self):
+        """
+        The filings of a failed push are parsed and pushed again by the next run, the
+        downloaded ones are not downloaded again
+        """
+        progress = self.backfill(push_error=RuntimeError('no primary')).run(['aapl'], output=io.StringIO())
+        self.assertEqual((0, 1), (progress.done, progress.failed))
+        self.extractor.refresh_ratios.assert_not_called()
+        self.assertEqual({'aapl': 'db_push: RuntimeError: no primary'},
+                         BackfillCheckpoint.load(self.checkpoint_path).failed('10-K'))
+        progress = self.backfill().run(['aapl'], output=io.StringIO())
+        self.assertEqual({'downloaded': 0, 'inserted': 2, 'updated': 0, 'unchanged': 0, 'skipped': 0},
+                         progress.counts)
+        self.assertEqual(2, len(self.transport.filings))
+        # a new backfill of the same filings has nothing to parse, the ratios are only
+        # refreshed when asked to
+        progress = self.backfill().run(['aapl'], output=io.StringIO())
+        self.assertEqual(0, progress.tickers)
+        self.extractor.refresh_ratios.assert_not_called()
+        backfill = self.backfill()
+        self.extractor.refresh_ratios.side_effect = RuntimeError('no primary')
+        output = io.StringIO()
+        backfill.run(['aapl'], output=output, refresh_ratios=True)
+        self.extractor.refresh_ratios.assert_called_once_with()
+        self.assertIn('Ratios refresh failed, run with --ratios to retry', output.getvalue())
+        os.remove(self.checkpoint_path)
+        progress = self.backfill().run(['aapl'], output=io.StringIO())
+        self.assertEqual((2, 0), (progress.counts['skipped'], progress.filings['parse']))
+
+    def test_stop(self):
+        """
+        The tickers not downloading yet stay out of the checkpoint
+        """
+        backfill = self.backfill()
+        backfill.stop()
+        progress = backfill.run(['aapl', 'msft'], output=io.StringIO())
+        self.assertEqual((0, 0), (progress.done, progress.failed))
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+
+class TestBackfillProgress(unittest.TestCase):
+    def test_rates(self):
+        now = [100.0]
+        test_obj = BackfillProgress(3, clock=lambda: now[0])
+        test_obj.add('download', 4, 8_000_000, 3.0)
+        now[0] = 102.0
+        self.assertIn('download 2.0 filings/s 4.00 MB/s', test_obj.line())
+        test_obj.add('download', 1, 1_000_000, 1.0)
+        test_obj.finish_ticker({'inserted': 5, 'other': 1})
+        test_obj.finish_ticker(failed=True)
+        now[0] = 104.0
+        line = test_obj.line()
+        self.assertIn('2/3 tickers (1 failed)', line)
+        self.assertIn('download 0.5 filings/s 0.50 MB/s', line)
+        summary = test_obj.summary()
+        self.assertIn('1 done, 1 failed', summary)
+        self.assertIn('inserted 5', summary)
+        self.assertIn('download: 5 filings 9.00 MB, 1.2 filings/s 2.25 MB/s overall, 4.0s busy', summary)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from http.server import (BaseHTTPRequestHandler,
+                         ThreadingHTTPServer,
+                         )
+from urllib.parse import (parse_qs,
+                          urlparse,
+                          )
+
+from ci_rest_api_server.support_libs.extractor.EdgarDownloader import (EdgarDownloader,
+                                                                      RequestsTransport,
+                                                                      TokenBucket,
+                                                                      TransportError,
+                                                                      )
+from ci_rest_api_server.support_libs.extractor.FilingHandle import FilingHandle
+
+ACCESSION_NUMBERS = {
+    'aapl': ['0000320193-18-000145', '0000320193-17-000070'],
+    'msft': ['0000789019-18-000100'],
+}
+
+
+class StandInEdgarHandler(BaseHTTPRequestHandler):
+    """
+    Serves the company browse pages and filings like EDGAR does
+    """
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/cgi-bin/browse-edgar':
+            ticker = parse_qs(url.query)['CIK'][0]
+            if ticker not in ACCESSION_NUMBERS:
+                self.send_error(404)
+                return
+            host = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+            body = ''.join(f"<filing><filingHREF>{host}/Archives/{number}-index.htm</filingHREF></filing>"
+                           for number in ACCESSION_NUMBERS[ticker]).encode()
+        else:
+            body = f"SEC filing {url.path}".encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FlakyTransport:
+    """
+    Fails every url a given number of times with a 503 before answering
+    """
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = {}
+
+    def get(self, url, params=None):
+        key = (url, (params or {}).get('CIK'))
+        self.calls[key] = self.calls.get(key, 0) + 1
+        if self.calls[key] <= self.failures:
+            raise TransportError('unavailable', status=503)
+        if params is not None:
+            return b"<filingHREF>https://www.sec.gov/Archives/0000320193-18-000145-index.htm</filingHREF>"
+        return b'filing'
+
+
+class TestEdgarDownloader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        """
+        Start the stand-in EDGAR server
+        """
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInEdgarHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self) -> None:
+        self.scratch_dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.scratch_dir)
+
+    def test_download_many_tickers(self):
+        """
+        Filings of every ticker are saved in the secedgar folder layout and a bad ticker
+        does not fail the others
+        """
+        test_obj = EdgarDownloader(self.scratch_dir,
+                                   transport=RequestsTransport(user_agent='test test@example.com'),
+                                   base_url=self.base_url,
+                                   requests_per_second=1000)
+        results = test_obj.download([('aapl', '10-K'), ('msft', '10-K'), ('random', '10-K')])
+        self.assertEqual(['0000320193-17-000070.txt', '0000320193-18-000145.txt'],
+                         sorted(os.listdir(self.scratch_dir + '/aapl/10-k')))
+        self.assertTrue(results[('aapl', '10-K')].ok)
+        self.assertEqual(1, len(results[('msft', '10-K')].paths))
+        self.assertEqual(404, results[('random', '10-K')].error.status)
+        with open(self.scratch_dir + '/aapl/10-k/0000320193-18-000145.txt', 'rb') as file:
+            self.assertEqual(b'SEC filing /Archives/0000320193-18-000145.txt', file.read())
+
+    def test_existing_files_skipped(self):
+        """
+        A second run does not download the files again
+        """
+        test_obj = EdgarDownloader(self.scratch_dir,
+                                   transport=RequestsTransport(user_agent='test test@example.com'),
+                                   base_url=self.base_url,
+                                   requests_per_second=1000)
+        test_obj.download([('aapl', '10-K')])
+        result = test_obj.download([('aapl', '10-K')])[('aapl', '10-K')]
+        self.assertEqual(([], 2), (result.paths, len(result.skipped)))
+
+    def test_compressed_storage(self):
+        """
+        Filings are stored compressed and the plain file counts as already downloaded
+        """
+        test_obj = EdgarDownloader(self.scratch_dir,
+                                   transport=RequestsTransport(user_agent='test test@example.com'),
+                                   base_url=self.base_url,
+                                   requests_per_second=1000,
+                                   compression='gzip')
+        test_obj.download([('aapl', '10-K')])
+        self.assertEqual(['0000320193-17-000070.txt.gz', '0000320193-18-000145.txt.gz'],
+                         sorted(os.listdir(self.scratch_dir + '/aapl/10-k')))
+        with FilingHandle(self.scratch_dir + '/aapl/10-k/0000320193-18-000145.txt.gz') as filing:
+            self.assertEqual(b'SEC filing /Archives/0000320193-18-000145.txt', filing.buffer)
+        plain_test_obj = EdgarDownloader(self.scratch_dir,
+                                         transport=RequestsTransport(user_agent='test test@example.com'),
+                                         base_url=self.base_url,
+                                         requests_per_second=1000)
+        result = plain_test_obj.download([('aapl', '10-K')])[('aapl', '10-K')]
+        self.assertEqual(([], 2), (result.paths, len(result.skipped)))
+        with self.assertRaises(ValueError):
+            EdgarDownloader(self.scratch_dir, compression='lzma')
+
+    def test_retry_with_backoff(self):
+        """
+        Retryable errors are retried until the request succeeds
+        """
+        transport = FlakyTransport(failures=2)
+        test_obj = EdgarDownloader(self.scratch_dir, transport=transport,
+                                   requests_per_second=1000, backoff_seconds=0.001)
+        result = test_obj.download([('aapl', '10-K')])[('aapl', '10-K')]
+        self.assertTrue(result.ok)
+        self.assertEqual([3, 3], list(transport.calls.values()))
+
+    def test_retries_exhausted(self):
+        """
+        The error is reported once the retries are used up
+        """
+        test_obj = EdgarDownloader(self.scratch_dir, transport=FlakyTransport(failures=10),
+                                   requests_per_second=1000, backoff_seconds=0.001, max_retries=2)
+        result = test_obj.download([('aapl', '10-K')])[('aapl', '10-K')]
+        self.assertEqual(503, result.error.status)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate_limit(self):
+        """
+        After the initial burst tokens are handed out at the configured rate
+        """
+        test_obj = TokenBucket(rate=100, capacity=1)
+        start = time.monotonic()
+        for _ in range(11):
+            test_obj.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    def test_first_second(self):
+        """
+        A fresh bucket hands out no more than the rate in its first second
+        """
+        clock = [0.0]
+        with mock.patch('time.monotonic', lambda: clock[0]), \
+                mock.patch('time.sleep', lambda seconds: clock.__setitem__(0, clock[0] + seconds)):
+            test_obj = TokenBucket(rate=10)
+            acquired_at = []
+            while clock[0] < 2:
+                test_obj.acquire()
+                acquired_at.append(clock[0])
+        self.assertLessEqual(len([at for at in acquired_at if at < 1]), 10)
+        self.assertLessEqual(len([at for at in acquired_at if 1 <= at < 2]), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import json
+import logging
+import threading
+import unittest
+from unittest import mock
+
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import (DebugSampler,
+                                                                      JsonFormatter,
+                                                                      LogContextFilter,
+                                                                      SampledLogger,
+                                                                      _ListenerQueueHandler,
+                                                                      log_context,
+                                                                      )
+from ci_rest_api_server.support_libs.extractor.StageMetrics import time_stage
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+        self.threads = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+        self.threads.append(threading.current_thread())
+
+
+class _FormattedIn:
+    """
+    Log argument recording the thread which formats it
+    """
+    def __init__(self):
+        self.threads = []
+
+    def __str__(self):
+        self.threads.append(threading.current_thread())
+        return 'argument'
+
+
+class TestExtractorLogger(unittest.TestCase):
+    def setUp(self) -> None:
+        self.test_logger = logging.getLogger('test_extractor_logger')
+        self.test_logger.setLevel(logging.DEBUG)
+        self.test_logger.propagate = False
+        self.output = _ListHandler()
+        self.output.setFormatter(JsonFormatter())
+        self.queue_handler = _ListenerQueueHandler(self.output)
+        self.queue_handler.addFilter(LogContextFilter())
+        self.test_logger.addHandler(self.queue_handler)
+        self.addCleanup(self.test_logger.removeHandler, self.queue_handler)
+
+    def test_written_by_listener(self):
+        """
+        The record is formatted and written by the listener thread, in JSON with the stage
+        """
+        argument = _FormattedIn()
+        with time_stage('parse', '10-K', 'aapl'):
+            self.test_logger.info("Parsed %s", argument)
+        self.test_logger.info("Done", extra={'ticker': 'msft'})
+        self.queue_handler.stop()
+        lines = [json.loads(line) for line in self.output.lines]
+        self.assertEqual({'message': 'Parsed argument', 'stage': 'parse', 'form_type': '10-K', 'ticker': 'aapl'},
+                         {key: lines[0][key] for key in ('message', 'stage', 'form_type', 'ticker')})
+        self.assertEqual('INFO', lines[0]['level'])
+        self.assertNotIn('stage', lines[1])
+        self.assertEqual('msft', lines[1]['ticker'])
+        # pytest also captures the records of the loggers which do not propagate
+        self.assertIn(self.output.threads[0], argument.threads)
+        self.assertNotIn(threading.current_thread(), self.output.threads)
+
+    def test_exception(self):
+        try:
+            raise ValueError('bad filing')
+        except ValueError:
+            self.test_logger.exception("Parse failed")
+        self.queue_handler.stop()
+        line = json.loads(self.output.lines[0])
+        self.assertEqual('ERROR', line['level'])
+        self.assertIn('ValueError: bad filing', line['exc'])
+
+    def test_debug_sampling(self):
+        """
+        A call site keeps rate debug records per second, the next one kept counts the dropped
+        """
+        sampled_logger = SampledLogger(self.test_logger, DebugSampler(rate=2))
+        with mock.patch('time.monotonic') as monotonic:
+            for now in (100.0, 100.0, 100.0, 100.0, 100.0, 101.0):
+                monotonic.return_value = now
+                sampled_logger.debug("per tag %s", now)
+                sampled_logger.info("per file")
+            sampled_logger.debug("other site")
+        self.queue_handler.stop()
+        lines = [json.loads(line) for line in self.output.lines]
+        self.assertEqual(6, sum(line['message'] == 'per file' for line in lines))
+        debug_lines = [line for line in lines if line['level'] == 'DEBUG']
+        self.assertEqual([None, None, 3, None], [line.get('dropped') for line in debug_lines])
+        self.assertEqual('per tag 101.0', debug_lines[2]['message'])
+        # attributed to the caller, not to the sampling logger
+        self.assertEqual('test_ExtractorLogger', debug_lines[0]['module'])
+
+    def test_nested_context(self):
+        with log_context(ticker='aapl'), log_context(stage='download'):
+            self.test_logger.warning("Retrying")
+        self.test_logger.warning("Retried")
+        self.queue_handler.stop()
+        line = json.loads(self.output.lines[0])
+        self.assertEqual(('aapl', 'download'), (line['ticker'], line['stage']))
+        self.assertNotIn('ticker', json.loads(self.output.lines[1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import gzip
+import os
+import unittest
+
+from ci_rest_api_server.support_libs.extractor.FilingHandle import FilingHandle
+from ci_rest_api_server.support_libs.extractor.GFormParse import GeneralFormParser
+from ci_rest_api_server.support_libs.extractor.P10kParser import Parse10KForm
+from ci_rest_api_server.support_libs.extractor.test_XbrlFactExtractor import SAMPLE_FILING
+
+TEST_FILE_LOCATION = "/tmp"
+FILE_TYPES = {
+    'test_filing': '/test_filing_handle.txt',
+    'test_empty_file': '/test_filing_handle_empty.txt',
+    'test_gzip_filing': '/test_filing_handle.txt.gz',
+    'test_zstd_filing': '/test_filing_handle.txt.zst',
+}
+
+
+class TestFilingHandle(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        """
+        Setups up files for testing cases
+        """
+        with open(TEST_FILE_LOCATION + FILE_TYPES['test_filing'], "wb") as file:
+            file.write(SAMPLE_FILING)
+        open(TEST_FILE_LOCATION + FILE_TYPES['test_empty_file'], "wb").close()
+        with open(TEST_FILE_LOCATION + FILE_TYPES['test_gzip_filing'], "wb") as file:
+            file.write(FilingHandle.compress(SAMPLE_FILING, 'gzip'))
+        with open(TEST_FILE_LOCATION + FILE_TYPES['test_zstd_filing'], "wb") as file:
+            file.write(FilingHandle.compress(SAMPLE_FILING, 'zstd'))
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Tear down file resources
+        """
+        for value in FILE_TYPES.values():
+            path = TEST_FILE_LOCATION + value
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_non_existent_file(self):
+        """
+        Opening a non existent file raises FileNotFoundError
+        """
+        with self.assertRaises(FileNotFoundError):
+            FilingHandle('tmp/text.txt')
+
+    def test_empty_file(self):
+        """
+        Empty files cannot be mapped but still give an empty buffer
+        """
+        with FilingHandle(TEST_FILE_LOCATION + FILE_TYPES['test_empty_file']) as filing:
+            self.assertEqual(0, len(filing))
+            self.assertEqual('', filing.header())
+
+    def test_header_is_bounded(self):
+        """
+        Only the requested prefix of the file is returned as the header
+        """
+        with FilingHandle(TEST_FILE_LOCATION + FILE_TYPES['test_filing']) as filing:
+            self.assertEqual(len(SAMPLE_FILING), len(filing))
+            self.assertEqual(SAMPLE_FILING[:20].decode(), filing.header(20))
+
+    def test_shared_between_sniffing_and_parsing(self):
+        """
+        The same handle is used to get the form type, year and the form data
+        """
+        path = TEST_FILE_LOCATION + FILE_TYPES['test_filing']
+        with FilingHandle(path) as filing:
+            self.assertEqual(('10-K', 2018),
+                             GeneralFormParser.get_form_type_and_filing_year(filing))
+            parsed_data_dict = GeneralFormParser().extract_form_data(path,
+                                                                     '10-K',
+                                                                     2018,
+                                                                     'aapl',
+                                                                     filing_handle=filing)
+        self.assertEqual(365725000000, parsed_data_dict['assets'])
+
+    def test_form_type_from_path(self):
+        """
+        A path is still accepted by the header sniffer
+        """
+        self.assertEqual(('10-K', 2018),
+                         GeneralFormParser.get_form_type_and_filing_year(
+                             TEST_FILE_LOCATION + FILE_TYPES['test_filing']))
+
+    def test_compressed_filings(self):
+        """
+        gzip and zstd filings read like the plain one, the header without
+        decompressing the whole file
+        """
+        parser = Parse10KForm()
+        with FilingHandle(TEST_FILE_LOCATION + FILE_TYPES['test_filing']) as filing:
+            expected_data = parser.get_form_data(file_path=filing.file_path, year=2018, ticker='aapl',
+                                                 filing_handle=filing)
+        for file_type in ('test_gzip_filing', 'test_zstd_filing'):
+            path = TEST_FILE_LOCATION + FILE_TYPES[file_type]
+            with FilingHandle(path) as filing:
+                self.assertIsNotNone(filing.compression)
+                self.assertEqual(SAMPLE_FILING[:100].decode('latin-1'), filing.header(100))
+                self.assertEqual(('10-K', 2018), GeneralFormParser.get_form_type_and_filing_year(filing))
+                self.assertEqual(dict(expected_data),
+                                 dict(parser.get_form_data(file_path=path, year=2018, ticker='aapl',
+                                                           filing_handle=filing)))
+                self.assertEqual(SAMPLE_FILING, bytes(filing.buffer))
+            self.assertEqual(dict(expected_data),
+                             dict(parser.get_form_data(file_path=path, year=2018, ticker='aapl')))
+
+    def test_compression_names(self):
+        self.assertEqual('.gz', FilingHandle.suffix_of('gzip'))
+        self.assertEqual('', FilingHandle.suffix_of(None))
+        self.assertEqual('zstd', FilingHandle.compression_of('/tmp/0000320193-18-000145.txt.zst'))
+        self.assertIsNone(FilingHandle.compression_of('/tmp/0000320193-18-000145.txt'))
+        self.assertEqual(SAMPLE_FILING, gzip.decompress(FilingHandle.compress(SAMPLE_FILING, 'gzip')))
+        with self.assertRaises(ValueError):
+            FilingHandle.compress(SAMPLE_FILING, 'lzma')
+
+
+if __name__ == '__main__':
+    unittest.main()
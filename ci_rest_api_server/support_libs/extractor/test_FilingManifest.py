@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ci_rest_api_server.support_libs.extractor.FilingManifest import FilingManifest
+
+
+class TestFilingManifest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.scratch_dir = tempfile.mkdtemp()
+        self.path = self.scratch_dir + '/0000320193-18-000145.txt'
+        with open(self.path, 'w') as file:
+            file.write('filing')
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.scratch_dir)
+
+    def test_unknown_filing(self):
+        """
+        A filing which was never recorded is not current and has no header
+        """
+        test_obj = FilingManifest.load(self.scratch_dir)
+        self.assertFalse(test_obj.is_current(self.path, 1))
+        self.assertIsNone(test_obj.header(self.path))
+
+    def test_recorded_filing_persisted(self):
+        """
+        A recorded filing is current, with its header, after a save and load
+        """
+        test_obj = FilingManifest.load(self.scratch_dir)
+        test_obj.record(self.path, '10-K', 2018, 1)
+        test_obj.save()
+        test_obj = FilingManifest.load(self.scratch_dir)
+        self.assertTrue(test_obj.is_current(self.path, 1))
+        self.assertEqual(('10-K', 2018), test_obj.header(self.path))
+        self.assertIn(self.path, test_obj)
+
+    def test_new_parser_version(self):
+        """
+        Filings parsed by an older parser are parsed again but keep their header
+        """
+        test_obj = FilingManifest(self.scratch_dir)
+        test_obj.record(self.path, '10-K', 2018, 1)
+        self.assertFalse(test_obj.is_current(self.path, 2))
+        self.assertEqual(('10-K', 2018), test_obj.header(self.path))
+
+    def test_changed_file(self):
+        """
+        A file changed on disk is parsed again and its header is not trusted
+        """
+        test_obj = FilingManifest(self.scratch_dir)
+        test_obj.record(self.path, '10-K', 2018, 1)
+        with open(self.path, 'a') as file:
+            file.write('more data')
+        self.assertFalse(test_obj.is_current(self.path, 1))
+        self.assertIsNone(test_obj.header(self.path))
+
+    def test_unreadable_manifest(self):
+        """
+        A corrupted manifest is treated as empty
+        """
+        with open(os.path.join(self.scratch_dir, FilingManifest.FILE_NAME), 'w') as file:
+            file.write('{not json')
+        self.assertEqual(0, len(FilingManifest.load(self.scratch_dir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
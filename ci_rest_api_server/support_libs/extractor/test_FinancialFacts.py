@@ -0,0 +1,89 @@
+import pickle
+import sys
+import unittest
+
+from ci_rest_api_server.support_libs.extractor.FinancialFacts import (FactSchema,
+                                                                     FinancialFacts,
+                                                                     )
+from ci_rest_api_server.support_libs.extractor.P10kParser import Parse10KForm
+
+
+class TestFinancialFacts(unittest.TestCase):
+    def setUp(self) -> None:
+        self.schema = FactSchema.get(('assets', 'liabilities'))
+        self.facts = FinancialFacts(self.schema, '10-K', 'aapl', 2018)
+        self.facts['assets'] = 365725000000
+
+    def test_reads_like_the_record_dict(self):
+        """
+        The record has the keys and values of the dict it replaces
+        """
+        self.assertEqual({'assets': 365725000000, 'filing-type': '10-K',
+                          'filing-year': 2018, 'ticker': 'aapl'},
+                         self.facts.to_dict())
+        self.assertEqual(self.facts.to_dict(), self.facts)
+        self.assertEqual(4, len(self.facts))
+        self.assertNotIn('filing-quarter', self.facts)
+        self.assertIsNone(self.facts.get('goodwill'))
+
+    def test_missing_field_is_not_zero(self):
+        """
+        A field the filing does not report is left out, a reported 0 is kept
+        """
+        self.assertNotIn('liabilities', self.facts)
+        with self.assertRaises(KeyError):
+            self.facts['liabilities']
+        self.facts['liabilities'] = 0
+        self.assertEqual(0, self.facts['liabilities'])
+        self.assertEqual(['assets', 'liabilities'], list(self.facts)[:2])
+        self.assertEqual(5, len(self.facts))
+
+    def test_only_schema_fields_settable(self):
+        """
+        Unknown fields are rejected instead of silently growing the record
+        """
+        with self.assertRaises(KeyError):
+            self.facts['goodwill'] = 1
+
+    def test_quarterly_record(self):
+        """
+        The fiscal quarter is part of quarterly records
+        """
+        facts = FinancialFacts(self.schema, '10-Q', 'aapl', 2018, 3)
+        self.assertEqual(3, facts['filing-quarter'])
+        self.assertEqual(4, len(facts))
+
+    def test_dict_round_trip(self):
+        """
+        A record read back from its dict form is equal to the original
+        """
+        record = self.facts.to_dict()
+        self.assertEqual(self.facts, FinancialFacts.from_dict(record))
+        facts = FinancialFacts.from_dict(record, self.schema)
+        self.assertEqual((self.facts, self.facts.present), (facts, facts.present))
+        self.assertIs(self.schema, facts.schema)
+
+    def test_schema_shared_after_pickle(self):
+        """
+        Records coming back from worker processes share the schema of this process
+        """
+        facts = pickle.loads(pickle.dumps(self.facts))
+        self.assertEqual(self.facts, facts)
+        self.assertNotIn('liabilities', facts)
+        self.assertIs(self.schema, facts.schema)
+
+    def test_smaller_than_dict(self):
+        """
+        A full 10-K record takes a fraction of the memory of its dict form
+        """
+        facts = FinancialFacts(FactSchema.get(Parse10KForm.FACT_FIELDS), '10-K', 'aapl', 2018)
+        facts.update((field, 365725000000 + index) for index, field in enumerate(facts.schema.fields))
+        record = facts.to_dict()
+        # a dict holds one int object per field, the record holds raw int64 values
+        dict_size = sys.getsizeof(record) + sum(sys.getsizeof(value) for value in record.values()
+                                                if isinstance(value, int))
+        self.assertLess(sys.getsizeof(facts) + sys.getsizeof(facts.values), dict_size / 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from ci_rest_api_server.support_libs.extractor.FinancialRatios import FinancialRatios
+from ci_rest_api_server.support_libs.extractor.P10kParser import Parse10KForm
+from ci_rest_api_server.support_libs.extractor.test_XbrlFactExtractor import SAMPLE_FILING
+
+
+def record(year, assets, equity, **facts):
+    """
+    10-K record with the given facts, the other fields are missing
+    """
+    data = {'filing-type': '10-K', 'filing-year': year, 'ticker': 'none',
+            'assets': assets, 'stockholdersequity': equity}
+    data.update(facts)
+    return data
+
+
+class TestFinancialRatios(unittest.TestCase):
+    def setUp(self) -> None:
+        self.data = {
+            'aapl': {'2017': record(2017, 100, 50, assetscurrent=40, liabilitiescurrent=20,
+                                    netincomeloss=10, longtermdebtnoncurrent=25),
+                     '2018': record(2018, 110, 55, assetscurrent=30, liabilitiescurrent=20)},
+            'msft': {'2017': record(2017, 200, 100, assetscurrent=30, liabilitiescurrent=30),
+                     '2018': record(2018, 300, 0, assetscurrent=60, liabilitiescurrent=0)},
+            'ibm': {'2018': record(2018, 90, 30, assetscurrent=10, liabilitiescurrent=20)},
+        }
+        self.ratios = FinancialRatios.from_records(self.data)
+
+    def test_ratios(self):
+        """
+        Every ratio is computed per ticker and year, missing data gives None
+        """
+        document = self.ratios.ticker_document('aapl')
+        self.assertEqual([2017, 2018], document['years'])
+        # tickers ranked per year: msft has no current ratio in 2018, nobody has a 2018 ROE
+        self.assertEqual([2, 2], document['peers']['current_ratio'])
+        self.assertEqual([1, 0], document['peers']['return_on_equity'])
+        self.assertEqual(document['peers'], self.ratios.ticker_document('ibm')['peers'])
+        self.assertEqual([2.0, 1.5], document['ratios']['current_ratio'])
+        self.assertEqual([0.5, 0.0], document['ratios']['debt_to_equity'])
+        self.assertEqual([0.2, None], document['ratios']['return_on_equity'])
+        self.assertEqual([None, 0.1], document['ratios']['assets_growth'])
+        # zero equity and zero denominators are missing values, not infinities
+        msft = self.ratios.ticker_document('msft')
+        self.assertEqual([0.0, None], msft['ratios']['debt_to_equity'])
+        self.assertEqual([1.0, None], msft['ratios']['current_ratio'])
+
+    def test_percentiles(self):
+        """
+        Percentiles rank the tickers having a value for the same ratio and year
+        """
+        # 2018 current ratios: aapl 1.5, ibm 0.5, msft missing
+        self.assertEqual([75.0, 75.0],
+                         self.ratios.ticker_document('aapl')['percentiles']['current_ratio'])
+        self.assertEqual([None, 25.0],
+                         self.ratios.ticker_document('ibm')['percentiles']['current_ratio'])
+        self.assertEqual([25.0, None],
+                         self.ratios.ticker_document('msft')['percentiles']['current_ratio'])
+
+    def test_reported_zero(self):
+        """
+        A reported 0 is a value, only a missing fact is missing
+        """
+        data = {'aapl': {'2018': record(2018, 100, 50, netincomeloss=0)}}
+        document = FinancialRatios.from_records(data).ticker_document('aapl')
+        self.assertEqual([0.0], document['ratios']['return_on_equity'])
+        self.assertEqual([0.0], document['ratios']['return_on_assets'])
+        self.assertEqual([None], document['ratios']['current_ratio'])
+
+    def test_parsed_records(self):
+        """
+        A fact the filing does not report stays missing from the parser to the ratios,
+        a reported 0 is ranked
+        """
+        equity_facts = (b'<us-gaap:StockholdersEquity contextRef="FI2018Q4" unitRef="usd" decimals="-6">'
+                        b'100000000000</us-gaap:StockholdersEquity>\n'
+                        b'<us-gaap:NetIncomeLoss contextRef="FI2018Q4" unitRef="usd" decimals="-6">'
+                        b'0</us-gaap:NetIncomeLoss>\n</xbrli:xbrl>')
+        filings = {'aapl': SAMPLE_FILING, 'msft': SAMPLE_FILING.replace(b'</xbrli:xbrl>', equity_facts)}
+        data = {}
+        with tempfile.TemporaryDirectory() as folder:
+            for ticker, filing in filings.items():
+                path = os.path.join(folder, ticker + '.txt')
+                with open(path, 'wb') as file:
+                    file.write(filing)
+                # the dict form is the document pushed to the DB
+                data[ticker] = {'2018': Parse10KForm().get_form_data(path, 2018, ticker).to_dict()}
+        self.assertNotIn('stockholdersequity', data['aapl']['2018'])
+        ratios = FinancialRatios.from_records(data)
+        aapl = ratios.ticker_document('aapl')
+        for name in ('current_ratio', 'liabilities_to_equity', 'return_on_equity', 'return_on_assets'):
+            self.assertEqual(([None], [None]), (aapl['ratios'][name], aapl['percentiles'][name]), msg=name)
+        msft = ratios.ticker_document('msft')
+        self.assertEqual([0.0], msft['ratios']['return_on_equity'])
+        self.assertEqual([2.58578], msft['ratios']['liabilities_to_equity'])
+        self.assertEqual([50.0], msft['percentiles']['return_on_equity'])
+        self.assertEqual([1], msft['peers']['return_on_equity'])
+
+    def test_percentiles_match_peer_ranks(self):
+        """
+        The vectorized ranking gives the mid rank of every value among its peers, ties
+        and missing values included
+        """
+        rng = np.random.default_rng(7)
+        ratios = rng.integers(0, 5, size=(3, 40, 6)).astype(float)
+        ratios[rng.random(ratios.shape) < 0.2] = np.nan
+        ratios[1, :, 2] = np.nan
+        percentiles, peers = FinancialRatios._compute_percentiles(ratios)
+        np.testing.assert_equal((~np.isnan(ratios)).sum(axis=1), peers)
+        for ratio_index in range(3):
+            for year_index in range(6):
+                column = ratios[ratio_index, :, year_index]
+                peers = column[~np.isnan(column)]
+                for ticker_index, value in enumerate(column):
+                    expected = (np.nan if np.isnan(value) else
+                                100 * (2 * (peers < value).sum() + (peers == value).sum()) / (2 * peers.size))
+                    np.testing.assert_equal(expected, percentiles[ratio_index, ticker_index, year_index])
+
+    def test_cagr(self):
+        """
+        The compound growth needs the value of CAGR_YEARS before
+        """
+        data = {'aapl': {str(year): record(year, assets, 1)
+                         for year, assets in ((2015, 100), (2016, 150), (2018, 800))}}
+        document = FinancialRatios.from_records(data).ticker_document('aapl')
+        self.assertEqual([2015, 2016, 2017, 2018], document['years'])
+        self.assertEqual([None, None, None, 1.0], document['ratios']['assets_cagr_3y'])
+
+    def test_empty_universe(self):
+        """
+        No records gives no ratios
+        """
+        self.assertEqual(0, len(FinancialRatios.from_records({})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,20 @@
+import json
 import unittest
 import shutil
 import os
+import tempfile
+from unittest import mock
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+from ci_rest_api_server.support_libs.extractor.ExtractDBPull import (PUSH_VERSIONS_COLLECTION,
+                                                                     PUSH_VERSIONS_DB,
+                                                                     )
 from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+from ci_rest_api_server.support_libs.extractor.FinancialRatios import FinancialRatios
+from ci_rest_api_server.support_libs.extractor.GFormParse import GeneralFormParser
+from ci_rest_api_server.support_libs.extractor.FilingHandle import FilingHandle
+from ci_rest_api_server.support_libs.extractor.test_XbrlFactExtractor import SAMPLE_FILING
+from ci_rest_api_server.support_libs.server.ResponseCache import ResponseCache
 
 TEST_FILE_LOCATION = "/tmp"
 
@@ -66,8 +79,416 @@ class TestExtractParseForms(unittest.TestCase):
             test_obj.prepare_list_of_files('aapl',
                                            '10-K')
 
-    # UT case for parse_form() is not written as it's a wrapper over extract_form_data()
-    # TODO : Write unit test cases for Mongo DB functions, currently do not know how to write
+
+class TestPushToDb(unittest.TestCase):
+    """
+    push_to_db() against a mocked collection, the DB itself is not needed
+    """
+    RECORDS = [{'filing-type': '10-K', 'ticker': 'aapl', 'filing-year': 2017, 'assets': 1},
+               {'filing-type': '10-K', 'ticker': 'aapl', 'filing-year': 2018, 'assets': 2}]
+
+    def setUp(self) -> None:
+        self.collection = mock.MagicMock()
+        self.collection.bulk_write.return_value = mock.Mock(upserted_count=1,
+                                                            modified_count=0,
+                                                            matched_count=1)
+        self.test_obj = ExtractParseForms('None')
+        self.test_obj.client_handle = mock.MagicMock()
+        self.test_obj.open_db_connection = mock.Mock(return_value=self.collection)
+
+    def test_single_bulk_upsert(self):
+        """
+        All the years go in one unordered bulk write of upserts keyed by year
+        """
+        push_counts = self.test_obj.push_to_db(self.RECORDS)
+        self.test_obj.open_db_connection.assert_called_once_with('10-K', 'aapl')
+        self.collection.bulk_write.assert_called_once_with(
+            [UpdateOne({'data.filing-year': record['filing-year']},
+                       {'$set': {'data': record}},
+                       upsert=True)
+             for record in self.RECORDS],
+            ordered=False)
+        self.assertEqual({'inserted': 1, 'updated': 0, 'unchanged': 1}, push_counts)
+
+    def test_unique_year_index(self):
+        """
+        The unique year index is created before writing
+        """
+        self.test_obj.push_to_db(self.RECORDS)
+        self.collection.create_index.assert_called_once_with([('data.filing-year', 1)],
+                                                             unique=True,
+                                                             name='unique_filing_year')
+
+    def test_duplicate_years_dropped(self):
+        """
+        Collections with duplicate years from older pushes are cleaned up and the
+        index creation is retried
+        """
+        self.collection.create_index.side_effect = [OperationFailure('dup key', code=11000), None]
+        self.collection.aggregate.return_value = [{'_id': 2017, 'ids': ['a', 'b', 'c']}]
+        self.test_obj.push_to_db(self.RECORDS)
+        self.collection.delete_many.assert_called_once_with({'_id': {'$in': ['a', 'b']}})
+        self.assertEqual(2, self.collection.create_index.call_count)
+        self.collection.bulk_write.assert_called_once()
+
+    def test_quarterly_records(self):
+        """
+        10-Q records are keyed and uniquely indexed by year and fiscal quarter
+        """
+        records = [{'filing-type': '10-Q', 'ticker': 'aapl', 'filing-year': 2018, 'filing-quarter': quarter}
+                   for quarter in (1, 2, 3)]
+        self.test_obj.push_to_db(records)
+        self.collection.bulk_write.assert_called_once_with(
+            [UpdateOne({'data.filing-year': 2018, 'data.filing-quarter': record['filing-quarter']},
+                       {'$set': {'data': record}},
+                       upsert=True)
+             for record in records],
+            ordered=False)
+        self.collection.create_index.assert_called_once_with([('data.filing-year', 1),
+                                                              ('data.filing-quarter', 1)],
+                                                             unique=True,
+                                                             name='unique_filing_year_quarter')
+
+    def test_push_listeners_called(self):
+        """
+        Listeners (e.g the API response cache) hear about every pushed ticker
+        """
+        listener = mock.Mock()
+        with mock.patch.object(ExtractParseForms, '_push_listeners', [listener]):
+            self.test_obj.push_to_db(self.RECORDS)
+        listener.assert_called_once_with('10-K', 'aapl')
+
+    def test_push_version_bumped(self):
+        """
+        The push version of the ticker is incremented for the other processes
+        """
+        self.test_obj.push_to_db(self.RECORDS)
+        versions = self.test_obj.client_handle[PUSH_VERSIONS_DB][PUSH_VERSIONS_COLLECTION]
+        versions.bulk_write.assert_called_once_with([UpdateOne({'_id': '10-K/aapl'},
+                                                               {'$inc': {'version': 1}},
+                                                               upsert=True)],
+                                                    ordered=False)
+
+    def test_push_version_error(self):
+        """
+        The push succeeds when its version can not be bumped
+        """
+        self.test_obj.client_handle.__getitem__.side_effect = ConnectionError('no db')
+        self.assertEqual({'inserted': 1, 'updated': 0, 'unchanged': 1}, self.test_obj.push_to_db(self.RECORDS))
+
+
+class _VersionsCollection:
+    """
+    The push versions collection, for the $inc upserts and reads of a version only
+    """
+    def __init__(self):
+        self.documents = {}
+
+    def bulk_write(self, requests, ordered=True):
+        for request in requests:
+            document = self.documents.setdefault(request._filter['_id'], {'version': 0})
+            document['version'] += request._doc['$inc']['version']
+
+    def find_one(self, query, projection=None):
+        return self.documents.get(query['_id'])
+
+
+class TestPushVersion(unittest.TestCase):
+    """
+    The API serves the data pushed by another process (e.g IngestWorker) once it sees
+    the new push version, no push listener runs in the API process then
+    """
+    def setUp(self) -> None:
+        from ci_rest_api_server import app as app_module
+        self.records = [{'data': {'filing-type': '10-K', 'ticker': 'aapl', 'filing-year': 2018, 'assets': 1}}]
+        self.filings = mock.MagicMock()
+        self.filings.find.side_effect = lambda query, projection: list(self.records)
+        database = mock.MagicMock()
+        database.__getitem__.return_value = self.filings
+        self.client = mock.MagicMock()
+        versions = {PUSH_VERSIONS_COLLECTION: _VersionsCollection()}
+        self.client.__getitem__.side_effect = lambda name: versions if name == PUSH_VERSIONS_DB else database
+        for patcher in (mock.patch('ci_rest_api_server.support_libs.extractor.SharedMongoClient.SharedMongoClient.get',
+                                   return_value=self.client),
+                        mock.patch.object(app_module, 'response_cache', ResponseCache(check_seconds=0)),
+                        mock.patch.object(ExtractParseForms, '_push_listeners', [])):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.test_client = app_module.app.test_client()
+
+    def assets(self) -> int:
+        response = self.test_client.get('/security/10-k/aapl/')
+        self.assertEqual(200, response.status_code)
+        return json.loads(response.data)['2018']['assets']
+
+    def test_push_of_other_process(self):
+        """
+        The cached response is served until another instance pushes the ticker
+        """
+        self.assertEqual(1, self.assets())
+        self.records[0]['data'] = dict(self.records[0]['data'], assets=2)
+        self.assertEqual(1, self.assets())
+        pusher = ExtractParseForms('None')
+        pusher.client_handle = self.client
+        pusher.push_to_db([self.records[0]['data']])
+        self.assertEqual(2, self.assets())
+
+
+class TestPullFromDb(unittest.TestCase):
+    """
+    pull_from_db() against a mocked client, the DB itself is not needed
+    """
+    def setUp(self) -> None:
+        self.collection = mock.MagicMock()
+        self.client = mock.MagicMock()
+        self.client.__getitem__.return_value.__getitem__.return_value = self.collection
+        self.test_obj = ExtractParseForms('None')
+        self.test_obj._client_handle_pull_db = self.client
+
+    def test_records_keyed_by_year(self):
+        """
+        Every year document is returned under its year and the collection is never validated
+        """
+        self.collection.find.return_value = [{'data': {'filing-year': 2017, 'assets': 1}},
+                                             {'data': {'filing-year': 2018, 'assets': 2}}]
+        self.assertEqual({'2017': {'filing-year': 2017, 'assets': 1},
+                          '2018': {'filing-year': 2018, 'assets': 2}},
+                         self.test_obj.pull_from_db(ticker='AAPL', db_name='10-k'))
+        self.client.__getitem__.assert_called_with('10-K')
+        self.client.__getitem__.return_value.__getitem__.assert_called_with('aapl')
+        self.client.__getitem__.return_value.validate_collection.assert_not_called()
+
+    def test_quarterly_records_keyed_by_quarter(self):
+        """
+        10-Q documents are returned under year-Qn
+        """
+        self.collection.find.return_value = [{'data': {'filing-year': 2018, 'filing-quarter': 1}},
+                                             {'data': {'filing-year': 2018, 'filing-quarter': 2}}]
+        self.assertEqual(['2018-Q1', '2018-Q2'],
+                         list(self.test_obj.pull_from_db(ticker='aapl', db_name='10-q')))
+
+    def test_projection_and_year_range_pushed_down(self):
+        """
+        The requested fields and years are part of the DB query
+        """
+        self.collection.find.return_value = [{'data': {'filing-year': 2018, 'assets': 2}}]
+        self.assertEqual({'2018': {'filing-year': 2018, 'assets': 2}},
+                         self.test_obj.pull_from_db(ticker='aapl', db_name='10-k',
+                                                    fields=['assets'], from_year=2016, to_year=2018))
+        self.collection.find.assert_called_once_with(
+            {'data.filing-year': {'$gte': 2016, '$lte': 2018}},
+            {'_id': 0, 'data.filing-year': 1, 'data.filing-quarter': 1, 'data.assets': 1})
+
+    def test_invalid_field(self):
+        """
+        Field names cannot smuggle operators or paths into the query
+        """
+        for field in ('$where', 'data.assets', 'Assets'):
+            with self.assertRaises(ValueError):
+                self.test_obj.pull_from_db(ticker='aapl', db_name='10-k', fields=[field])
+
+    def test_pull_many_isolates_errors(self):
+        """
+        Every ticker is pulled and a failing one is reported without failing the others
+        """
+        def collection_for(name):
+            collection = mock.MagicMock()
+            collection.find.return_value = [] if name == 'random' else [{'data': {'filing-year': 2018}}]
+            return collection
+
+        self.client.__getitem__.return_value.__getitem__.side_effect = collection_for
+        data_from_db, errors = self.test_obj.pull_many_from_db(['aapl', 'random', 'msft'], '10-k')
+        self.assertEqual(['aapl', 'msft'], sorted(data_from_db))
+        self.assertEqual(['random'], list(errors))
+
+    def test_unknown_ticker(self):
+        """
+        A ticker which was never pushed is an error
+        """
+        self.collection.find.return_value = []
+        with self.assertRaises(LookupError):
+            self.test_obj.pull_from_db(ticker='random', db_name='10-k')
+
+
+class TestRatios(unittest.TestCase):
+    """
+    refresh_ratios() and pull_ratios_from_db() against a mocked client
+    """
+    def setUp(self) -> None:
+        self.client = mock.MagicMock()
+        self.test_obj = ExtractParseForms('None')
+        self.test_obj.client_handle = self.client
+
+    def test_refresh_stores_one_document_per_ticker(self):
+        """
+        The ratios of every ticker of the 10-K DB are written in one bulk write and
+        the cached responses are invalidated
+        """
+        self.client['10-K'].list_collection_names.return_value = ['aapl', 'msft']
+        data = {'aapl': {'2018': {'filing-year': 2018, 'assets': 10, 'stockholdersequity': 5}},
+                'msft': {'2018': {'filing-year': 2018, 'assets': 20, 'stockholdersequity': 5}}}
+        self.test_obj.pull_many_from_db = mock.Mock(return_value=(data, {}))
+        listener = mock.Mock()
+        with mock.patch.object(ExtractParseForms, '_push_listeners', [listener]):
+            ratios = self.test_obj.refresh_ratios()
+        self.assertEqual(['aapl', 'msft'], ratios.tickers)
+        self.test_obj.pull_many_from_db.assert_called_once_with(['aapl', 'msft'], '10-K',
+                                                                fields=list(FinancialRatios.INPUT_FIELDS))
+        # the mocked client gives the same collection for the ratios and the push versions
+        ratio_requests, version_requests = [call[0][0] for call in
+                                            self.client['10-K-RATIOS']['ratios'].bulk_write.call_args_list]
+        self.assertEqual([{'ticker': 'aapl'}, {'ticker': 'msft'}], [request._filter for request in ratio_requests])
+        self.assertEqual([{'_id': '10-K-RATIOS/aapl'}, {'_id': '10-K-RATIOS/msft'}],
+                         [request._filter for request in version_requests])
+        self.assertEqual([mock.call('10-K-RATIOS', 'aapl'), mock.call('10-K-RATIOS', 'msft')],
+                         listener.call_args_list)
+
+    def test_pull_unknown_ticker(self):
+        """
+        A ticker without stored ratios is an error
+        """
+        self.test_obj._client_handle_pull_db = self.client
+        self.client['10-K-RATIOS']['ratios'].find_one.return_value = None
+        with self.assertRaises(LookupError):
+            self.test_obj.pull_ratios_from_db('random')
+
+
+class TestParseForms(unittest.TestCase):
+    """
+    parse_form() and parse_forms() on synthetic filings, serial and process pool modes
+    """
+    @classmethod
+    def setUpClass(cls) -> None:
+        """
+        Create two years of filings for two tickers in a scratch directory
+        """
+        cls.scratch_dir = tempfile.mkdtemp()
+        for ticker in ('aapl', 'msft'):
+            os.makedirs(cls.scratch_dir + '/' + ticker + '/10-k')
+            for file_name, filed_as_of in (('0000320193-18-000145.txt', b'20181105'),
+                                           ('0000320193-17-000070.txt', b'20171103')):
+                with open(cls.scratch_dir + '/' + ticker + '/10-k/' + file_name, "wb") as file:
+                    file.write(SAMPLE_FILING.replace(b'20181105', filed_as_of))
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Delete all allocated folder resources
+        """
+        shutil.rmtree(cls.scratch_dir)
+
+    def test_parse_form_year_order(self):
+        """
+        Records come back one per filing in year order
+        """
+        test_obj = ExtractParseForms(self.scratch_dir)
+        parsed_forms = test_obj.parse_form('aapl', '10-k')
+        self.assertEqual([2017, 2018], [record['filing-year'] for record in parsed_forms])
+        self.assertEqual([375319000000, 365725000000], [record['assets'] for record in parsed_forms])
+
+    def test_parse_forms_parallel_matches_serial(self):
+        """
+        The process pool mode gives the same records in the same order as the serial mode
+        """
+        test_obj = ExtractParseForms(self.scratch_dir)
+        serial = test_obj.parse_forms(['aapl', 'msft'], '10-k')
+        parallel = test_obj.parse_forms(['aapl', 'msft'], '10-k', workers=2)
+        self.assertEqual(serial, parallel)
+        self.assertEqual(['aapl', 'aapl'], [record['ticker'] for record in parallel['aapl']])
+        self.assertEqual(['msft', 'msft'], [record['ticker'] for record in parallel['msft']])
+
+    def test_parser_built_once(self):
+        """
+        The filings of a process share one parser, a pool worker builds its own once
+        """
+        with mock.patch.object(ExtractParseForms, '_form_parser', None), \
+                mock.patch('ci_rest_api_server.support_libs.extractor.IExtractDBPush.GeneralFormParser',
+                           wraps=GeneralFormParser) as parser_class:
+            ExtractParseForms(self.scratch_dir).parse_forms(['aapl', 'msft'], '10-k')
+            parser_class.assert_called_once_with()
+            ExtractParseForms._init_parse_worker()
+            self.assertEqual(2, parser_class.call_count)
+            self.assertIs(ExtractParseForms._form_parser, ExtractParseForms.form_parser())
+
+    def test_ingest_new_forms_only(self):
+        """
+        The first ingest pushes every filing, the next one only the new filing. The
+        ratios are refreshed after the pushes changing records
+        """
+        test_obj = ExtractParseForms(self.scratch_dir)
+        pushed = []
+        test_obj.push_to_db = mock.Mock(side_effect=lambda records: pushed.append(records) or
+                                        {'inserted': len(records), 'updated': 0, 'unchanged': 0})
+        test_obj.refresh_ratios = mock.Mock()
+        timings = {}
+        self.assertEqual({'inserted': 2, 'updated': 0, 'unchanged': 0, 'skipped': 0},
+                         test_obj.ingest_new_forms('aapl', '10-k', timings=timings, refresh_ratios=True))
+        self.assertEqual({'parse', 'db_push', 'ratios'}, set(timings))
+        test_obj.refresh_ratios.assert_called_once_with()
+        self.assertEqual({'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 2},
+                         test_obj.ingest_new_forms('aapl', '10-k', refresh_ratios=True))
+        test_obj.refresh_ratios.assert_called_once_with()
+        new_file = self.scratch_dir + '/aapl/10-k/0000320193-19-000119.txt'
+        with open(new_file, "wb") as file:
+            file.write(SAMPLE_FILING.replace(b'20181105', b'20191031'))
+        try:
+            self.assertEqual({'inserted': 1, 'updated': 0, 'unchanged': 0, 'skipped': 2},
+                             test_obj.ingest_new_forms('aapl', '10-k'))
+        finally:
+            os.remove(new_file)
+            os.remove(self.scratch_dir + '/aapl/10-k/manifest.json')
+        self.assertEqual([[2017, 2018], [2019]],
+                         [[record['filing-year'] for record in records] for records in pushed])
+        # only asked for by the first ingest
+        test_obj.refresh_ratios.assert_called_once_with()
+
+    def test_ingest_skipped_filing(self):
+        """
+        A filing the parser skips is neither pushed nor recorded, the next ingest
+        tries it again
+        """
+        test_obj = ExtractParseForms(self.scratch_dir)
+        test_obj.push_to_db = mock.Mock(return_value={'inserted': 1, 'updated': 0, 'unchanged': 0})
+        test_obj.refresh_ratios = mock.Mock()
+        parse_filing = ExtractParseForms.parse_filing
+
+        def skip_2017(file_path, ticker, header=None):
+            return None if '-17-' in file_path else parse_filing(file_path, ticker, header)
+        self.addCleanup(os.remove, self.scratch_dir + '/msft/10-k/manifest.json')
+        with mock.patch.object(ExtractParseForms, 'parse_filing', side_effect=skip_2017):
+            self.assertEqual({'inserted': 1, 'updated': 0, 'unchanged': 0, 'skipped': 0},
+                             test_obj.ingest_new_forms('msft', '10-k'))
+            self.assertEqual([2018], [record['filing-year'] for record in test_obj.push_to_db.call_args[0][0]])
+            self.assertEqual(1, len(test_obj.new_forms('msft', '10-k')[1]))
+            self.assertEqual([2018], [record['filing-year'] for record in test_obj.parse_form('msft', '10-k')])
+
+    def test_compressed_filings(self):
+        """
+        Compressed filings are listed in year order with the plain ones and parse the
+        same, a filing kept both ways is parsed once
+        """
+        test_obj = ExtractParseForms(self.scratch_dir)
+        folder = self.scratch_dir + '/msft/10-k/'
+        self.assertEqual(19, test_obj.file_sort_year_wise('0000320193-19-000119.txt.zst'))
+        compressed_files = {'0000320193-16-000090.txt.gz': SAMPLE_FILING.replace(b'20181105', b'20161026'),
+                            '0000320193-17-000070.txt.zst': SAMPLE_FILING.replace(b'20181105', b'20171103')}
+        for file_name, data in compressed_files.items():
+            with open(folder + file_name, "wb") as file:
+                file.write(FilingHandle.compress(data, FilingHandle.compression_of(file_name)))
+        try:
+            self.assertEqual([folder + '0000320193-16-000090.txt.gz',
+                              folder + '0000320193-17-000070.txt',
+                              folder + '0000320193-18-000145.txt'],
+                             test_obj.prepare_list_of_files('msft', '10-k'))
+            os.rename(folder + '0000320193-17-000070.txt', folder + '0000320193-17-000070.plain')
+            parsed_forms = test_obj.parse_form('msft', '10-k')
+            os.rename(folder + '0000320193-17-000070.plain', folder + '0000320193-17-000070.txt')
+            self.assertEqual([2016, 2017, 2018], [record['filing-year'] for record in parsed_forms])
+            self.assertEqual(dict(parsed_forms[1]), dict(test_obj.parse_form('msft', '10-k')[1]))
+        finally:
+            for file_name in compressed_files:
+                os.remove(folder + file_name)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,144 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from ci_rest_api_server.support_libs.extractor.IngestJobQueue import (IngestJobQueue,
+                                                                     DONE,
+                                                                     FAILED,
+                                                                     QUEUED,
+                                                                     RUNNING,
+                                                                     )
+
+
+class TestIngestJobQueue(unittest.TestCase):
+    def setUp(self) -> None:
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.path = os.path.join(folder.name, 'jobs.sqlite')
+        self.test_obj = IngestJobQueue(self.path)
+
+    def test_enqueue_coalesces_active_jobs(self):
+        """
+        A ticker and form type has one active job, done jobs do not count
+        """
+        job, created = self.test_obj.enqueue('AAPL', '10-k')
+        self.assertTrue(created)
+        self.assertEqual(('aapl', '10-K', QUEUED, 10), (job['ticker'], job['form_type'], job['state'], job['years']))
+        same_job, created = self.test_obj.enqueue('aapl', '10-K', years=5)
+        self.assertFalse(created)
+        self.assertEqual((job['id'], 2), (same_job['id'], same_job['requests']))
+        self.assertTrue(self.test_obj.enqueue('aapl', '10-Q')[1])
+        self.test_obj.claim('worker')
+        self.assertEqual(job['id'], self.test_obj.enqueue('aapl', '10-K')[0]['id'])
+        self.assertTrue(self.test_obj.finish(job['id'], 'worker', counts={'inserted': 1}))
+        self.assertTrue(self.test_obj.enqueue('aapl', '10-K')[1])
+
+    def test_concurrent_enqueue(self):
+        """
+        Requests for the same ticker racing from many connections queue one job
+        """
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            jobs = list(executor.map(lambda _: IngestJobQueue(self.path).enqueue('msft', '10-K'), range(16)))
+        self.assertEqual(1, sum(created for _, created in jobs))
+        self.assertEqual(1, len({job['id'] for job, _ in jobs}))
+        self.assertEqual(16, self.test_obj.get(jobs[0][0]['id'])['requests'])
+
+    def test_claim_and_stages(self):
+        first, _ = self.test_obj.enqueue('aapl', '10-K')
+        second, _ = self.test_obj.enqueue('msft', '10-K')
+        job = self.test_obj.claim('worker-1')
+        self.assertEqual((first['id'], RUNNING, 'worker-1', 1), (job['id'], job['state'], job['worker'], job['attempts']))
+        self.assertEqual(second['id'], self.test_obj.claim('worker-2')['id'])
+        self.assertIsNone(self.test_obj.claim('worker-3'))
+        self.assertTrue(self.test_obj.record_stage(job['id'], 'worker-1', 'download', 1.5))
+        self.assertTrue(self.test_obj.record_stage(job['id'], 'worker-1', 'download', 0.5))
+        self.assertFalse(self.test_obj.record_stage(job['id'], 'worker-2', 'parse', 1.0))
+        self.assertFalse(self.test_obj.finish(job['id'], 'worker-2'))
+        self.assertTrue(self.test_obj.finish(job['id'], 'worker-1', error='CIKError: unknown'))
+        job = self.test_obj.get(job['id'])
+        self.assertEqual((FAILED, {'download': 2.0}, 'CIKError: unknown'), (job['state'], job['stages'], job['error']))
+        self.assertEqual([second['id'], first['id']], [job['id'] for job in self.test_obj.jobs()])
+        self.assertEqual([first['id']], [job['id'] for job in self.test_obj.jobs(FAILED)])
+        self.assertIsNone(self.test_obj.get(1000))
+        with self.assertRaises(ValueError):
+            self.test_obj.jobs('lost')
+
+    def test_heartbeat(self):
+        """
+        Only the worker running the job renews its lease
+        """
+        job, _ = self.test_obj.enqueue('aapl', '10-K')
+        self.assertFalse(self.test_obj.heartbeat(job['id'], 'worker'))
+        with mock.patch('time.time', return_value=1000.0):
+            self.test_obj.claim('worker')
+        with mock.patch('time.time', return_value=1500.0):
+            self.assertTrue(self.test_obj.heartbeat(job['id'], 'worker'))
+            self.assertFalse(self.test_obj.heartbeat(job['id'], 'other'))
+        self.assertEqual((1000.0, 1500.0), (self.test_obj.get(job['id'])['started'],
+                                            self.test_obj.get(job['id'])['heartbeat']))
+        # the renewed lease is not expired for another worker
+        with mock.patch('time.time', return_value=1500.0 + self.test_obj.lease_seconds - 1):
+            self.assertIsNone(self.test_obj.claim('other'))
+        self.test_obj.finish(job['id'], 'worker')
+        self.assertFalse(self.test_obj.heartbeat(job['id'], 'worker'))
+
+    def test_expired_lease(self):
+        """
+        The job of a dead worker is claimed again, until it used all its attempts
+        """
+        job, _ = self.test_obj.enqueue('aapl', '10-K')
+        with mock.patch('time.time') as now:
+            for attempt in range(IngestJobQueue.MAX_ATTEMPTS):
+                now.return_value = 1000.0 + attempt * 1000
+                claimed = self.test_obj.claim(f'worker-{attempt}')
+                self.assertEqual((job['id'], attempt + 1), (claimed['id'], claimed['attempts']))
+                self.assertIsNone(self.test_obj.claim('other'))
+            now.return_value += 1000
+            self.assertIsNone(self.test_obj.claim('other'))
+        job = self.test_obj.get(job['id'])
+        self.assertEqual(FAILED, job['state'])
+        self.assertIn('lease expired', job['error'])
+        # the late worker does not overwrite the state
+        self.assertFalse(self.test_obj.finish(job['id'], 'worker-2', counts={}))
+
+
+class TestJobRoutes(unittest.TestCase):
+    def setUp(self) -> None:
+        import ci_rest_api_server.app as app_module
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        patcher = mock.patch.object(app_module, '_job_queue', IngestJobQueue(os.path.join(folder.name, 'jobs.sqlite')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = app_module._job_queue
+        self.test_client = app_module.app.test_client()
+
+    def test_enqueue_and_poll(self):
+        response = self.test_client.post('/jobs/10-k/AAPL/?years=5')
+        self.assertEqual(202, response.status_code)
+        job = response.get_json()
+        self.assertEqual(f"/jobs/{job['id']}/", response.headers['Location'].rsplit('localhost', 1)[-1])
+        self.assertEqual(('aapl', '10-K', 5, QUEUED), (job['ticker'], job['form_type'], job['years'], job['state']))
+        response = self.test_client.post('/jobs/10-k/aapl/')
+        self.assertEqual((200, job['id']), (response.status_code, response.get_json()['id']))
+        self.queue.claim('worker')
+        self.queue.record_stage(job['id'], 'worker', 'download', 2.0)
+        self.queue.finish(job['id'], 'worker', counts={'inserted': 5})
+        job = self.test_client.get(f"/jobs/{job['id']}/").get_json()
+        self.assertEqual((DONE, {'download': 2.0}, {'inserted': 5}), (job['state'], job['stages'], job['counts']))
+        jobs = self.test_client.get('/jobs/?state=done').get_json()['jobs']
+        self.assertEqual([job['id']], [listed['id'] for listed in jobs])
+
+    def test_bad_requests(self):
+        for url in ('/jobs/10-k/aapl/?years=0', '/jobs/10-k/aapl/?years=x', '/jobs/10-k/aa$pl/'):
+            self.assertEqual(400, self.test_client.post(url).status_code, msg=url)
+        self.assertEqual(404, self.test_client.post('/jobs/8-k/aapl/').status_code)
+        self.assertEqual(404, self.test_client.get('/jobs/1000/').status_code)
+        self.assertEqual(400, self.test_client.get('/jobs/?state=lost').status_code)
+        self.assertEqual([], self.queue.jobs())
+
+
+if __name__ == '__main__':
+    unittest.main()
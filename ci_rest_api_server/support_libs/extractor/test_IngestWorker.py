@@ -0,0 +1,225 @@
+import os
+import re
+import tempfile
+import threading
+import time
+import unittest
+import urllib.request
+from unittest import mock
+
+from ci_rest_api_server.support_libs.extractor.EdgarDownloader import DownloadResult
+from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+from ci_rest_api_server.support_libs.extractor.IngestJobQueue import (IngestJobQueue,
+                                                                     DONE,
+                                                                     FAILED,
+                                                                     RUNNING,
+                                                                     )
+from ci_rest_api_server.support_libs.extractor.IngestWorker import IngestWorker
+from ci_rest_api_server.support_libs.extractor.StageMetrics import serve_metrics
+from ci_rest_api_server.support_libs.extractor.test_XbrlFactExtractor import SAMPLE_FILING
+
+
+class TestIngestWorker(unittest.TestCase):
+    def setUp(self) -> None:
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        self.queue = IngestJobQueue(os.path.join(folder.name, 'jobs.sqlite'))
+        self.results = {}
+        self.downloader = mock.Mock()
+        self.downloader.download.side_effect = lambda pairs, count: {pair: self.results.get(pair, DownloadResult(*pair))
+                                                                     for pair in pairs}
+        self.folder = folder.name
+        self.test_obj = IngestWorker(self.queue, folder.name, downloader=self.downloader, name='worker')
+
+    def download_result(self, ticker, form_type, paths=(), error=None):
+        result = DownloadResult(ticker, form_type)
+        result.paths.extend(paths)
+        result.error = error
+        self.results[(ticker, form_type)] = result
+
+    def save_filing(self):
+        os.makedirs(os.path.join(self.folder, 'aapl', '10-k'))
+        with open(os.path.join(self.folder, 'aapl', '10-k', '0000320193-18-000145.txt'), 'wb') as file:
+            file.write(SAMPLE_FILING)
+
+    def test_run_pending(self):
+        """
+        Every queued job is downloaded, parsed and pushed with the time of each stage
+        """
+        job, _ = self.queue.enqueue('aapl', '10-K', years=3)
+        self.download_result('aapl', '10-K', paths=['a.txt', 'b.txt'])
+
+        def ingest_new_forms(ticker, form_type, workers=1, timings=None, before_push=None, executor=None):
+            timings.update(parse=1.5, db_push=0.25)
+            return {'inserted': 2, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+        with mock.patch.object(ExtractParseForms, 'ingest_new_forms', side_effect=ingest_new_forms) as ingest, \
+                mock.patch.object(ExtractParseForms, 'refresh_ratios') as refresh_ratios:
+            self.assertEqual(1, self.test_obj.run_pending())
+        refresh_ratios.assert_called_once_with()
+        self.downloader.download.assert_called_once_with([('aapl', '10-K')], count=3)
+        ingest.assert_called_once_with('aapl', '10-K', workers=1, timings=mock.ANY, before_push=mock.ANY,
+                                       executor=None)
+        job = self.queue.get(job['id'])
+        self.assertEqual(DONE, job['state'])
+        self.assertEqual({'parse', 'db_push', 'download'}, set(job['stages']))
+        self.assertEqual(1.5, job['stages']['parse'])
+        self.assertEqual({'inserted': 2, 'updated': 0, 'unchanged': 0, 'skipped': 0, 'downloaded': 2}, job['counts'])
+
+    def test_shared_parse_pool(self):
+        """
+        Every job parses in the one pool forked before the threads start
+        """
+        test_obj = IngestWorker(self.queue, self.folder, downloader=self.downloader, name='worker', parse_workers=2)
+        self.assertTrue(test_obj.start_parse_pool())
+        self.addCleanup(test_obj.shutdown_parse_pool)
+        executor = test_obj._executor
+        self.assertFalse(test_obj.start_parse_pool())
+        self.queue.enqueue('aapl', '10-K')
+        self.queue.enqueue('msft', '10-K')
+        with mock.patch.object(ExtractParseForms, 'ingest_new_forms', return_value={}) as ingest:
+            self.assertEqual(2, test_obj.run_pending())
+        self.assertEqual([executor, executor], [call.kwargs['executor'] for call in ingest.call_args_list])
+        test_obj.shutdown_parse_pool()
+        self.assertIsNone(test_obj._executor)
+
+    def test_failed_download(self):
+        """
+        The error of the download fails the job, the next job still runs
+        """
+        failed, _ = self.queue.enqueue('random', '10-K')
+        self.queue.enqueue('msft', '10-K')
+        self.download_result('random', '10-K', error=ValueError('No filings available.'))
+        with mock.patch.object(ExtractParseForms, 'ingest_new_forms', return_value={}) as ingest:
+            self.assertEqual(2, self.test_obj.run_pending())
+        failed = self.queue.get(failed['id'])
+        self.assertEqual((FAILED, 'ValueError: No filings available.'), (failed['state'], failed['error']))
+        self.assertEqual(['download'], list(failed['stages']))
+        ingest.assert_called_once()
+
+    def test_stage_metrics_served(self):
+        """
+        The stages run by the worker are scraped from its own metrics server
+        """
+        server = serve_metrics(0, host='127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        def scrape(stage):
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+                match = re.search(r'^ci_stage_duration_seconds_count\{stage="%s",form_type="10-K",'
+                                  r'ticker_class="other"\} (\d+)$' % stage, response.read().decode(), re.M)
+            return int(match.group(1)) if match else 0
+        scraped = {stage: scrape(stage) for stage in ('parse', 'db_push')}
+        self.save_filing()
+        job, _ = self.queue.enqueue('aapl', '10-K')
+        mongo_client = mock.MagicMock()
+        mongo_client.__getitem__.return_value.__getitem__.return_value.bulk_write.return_value = mock.Mock(
+            upserted_count=1, modified_count=0, matched_count=0)
+        with mock.patch('ci_rest_api_server.support_libs.extractor.IExtractDBPush.SharedMongoClient.get',
+                        return_value=mongo_client), \
+                mock.patch.object(ExtractParseForms, 'refresh_ratios'):
+            self.assertEqual(1, self.test_obj.run_pending())
+        self.assertEqual(DONE, self.queue.get(job['id'])['state'])
+        self.assertEqual({'parse': scraped['parse'] + 1, 'db_push': scraped['db_push'] + 1},
+                         {stage: scrape(stage) for stage in scraped})
+
+    def test_ratios_refreshed_once_drained(self):
+        """
+        The jobs changing 10-K records share one refresh of the ratios, a failed
+        refresh is run again after the next drain
+        """
+        for ticker in ('aapl', 'msft', 'ibm'):
+            self.queue.enqueue(ticker, '10-K')
+        self.queue.enqueue('aapl', '10-Q')
+        changed = {'aapl': 1, 'msft': 1, 'ibm': 0}
+
+        def ingest_new_forms(ticker, form_type, workers=1, timings=None, before_push=None, executor=None):
+            return {'inserted': changed[ticker], 'updated': 0, 'unchanged': 0, 'skipped': 0}
+        with mock.patch.object(ExtractParseForms, 'ingest_new_forms', side_effect=ingest_new_forms), \
+                mock.patch.object(ExtractParseForms, 'refresh_ratios',
+                                  side_effect=[RuntimeError('no primary'), None]) as refresh_ratios:
+            self.assertEqual(4, self.test_obj.run_pending())
+            self.assertEqual(1, refresh_ratios.call_count)
+            self.assertEqual(0, self.test_obj.run_pending())
+            self.assertEqual(2, refresh_ratios.call_count)
+            self.queue.enqueue('ibm', '10-K')
+            self.assertEqual(1, self.test_obj.run_pending())
+        self.assertEqual(2, refresh_ratios.call_count)
+
+    def test_heartbeat(self):
+        """
+        The lease is renewed while a long stage runs, not only when a stage ends
+        """
+        job, _ = self.queue.enqueue('aapl', '10-K')
+        test_obj = IngestWorker(self.queue, self.folder, downloader=self.downloader, name='worker',
+                                heartbeat_seconds=0.01)
+        renewed = threading.Event()
+
+        def ingest_new_forms(ticker, form_type, workers=1, timings=None, before_push=None, executor=None):
+            started = self.queue.get(job['id'])['heartbeat']
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline and not renewed.is_set():
+                if self.queue.get(job['id'])['heartbeat'] > started:
+                    renewed.set()
+                time.sleep(0.01)
+            return {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+        with mock.patch.object(ExtractParseForms, 'ingest_new_forms', side_effect=ingest_new_forms):
+            self.assertEqual(1, test_obj.run_pending())
+        self.assertTrue(renewed.is_set())
+        self.assertEqual(DONE, self.queue.get(job['id'])['state'])
+
+    def test_lease_lost_before_push(self):
+        """
+        A job claimed by another worker while it parsed is neither pushed nor ended
+        by the worker which lost it, the filings stay new for the other one
+        """
+        self.save_filing()
+        job, _ = self.queue.enqueue('aapl', '10-K')
+        parse_files = ExtractParseForms.parse_files
+
+        def stalled_parse(extractor, jobs, workers, executor=None):
+            # the lease of the worker expires, another worker claims the job
+            with mock.patch('time.time', return_value=time.time() + 2 * self.queue.lease_seconds):
+                self.assertEqual(job['id'], self.queue.claim('other')['id'])
+            return parse_files(extractor, jobs, workers, executor)
+        with mock.patch.object(ExtractParseForms, 'parse_files', autospec=True, side_effect=stalled_parse), \
+                mock.patch.object(ExtractParseForms, 'push_to_db') as push_to_db:
+            self.assertEqual(1, self.test_obj.run_pending())
+        push_to_db.assert_not_called()
+        job = self.queue.get(job['id'])
+        self.assertEqual((RUNNING, 'other', None), (job['state'], job['worker'], job['error']))
+        self.assertEqual(1, len(ExtractParseForms(self.folder).new_forms('aapl', '10-K')[1]))
+
+    def test_lease_lost_before_finish(self):
+        """
+        The counts of a job pushed after its lease was lost do not end the job of the
+        other worker
+        """
+        job, _ = self.queue.enqueue('aapl', '10-K')
+
+        def ingest_new_forms(ticker, form_type, workers=1, timings=None, before_push=None, executor=None):
+            before_push()
+            with mock.patch('time.time', return_value=time.time() + 2 * self.queue.lease_seconds):
+                self.queue.claim('other')
+            return {'inserted': 1, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+        with mock.patch.object(ExtractParseForms, 'ingest_new_forms', side_effect=ingest_new_forms):
+            self.assertFalse(self.test_obj.run_job(self.queue.claim('worker'), 'worker'))
+        job = self.queue.get(job['id'])
+        self.assertEqual((RUNNING, 'other', None), (job['state'], job['worker'], job['counts']))
+
+    def test_lost_job(self):
+        """
+        A job claimed again by another worker (expired lease) is left to it
+        """
+        job, _ = self.queue.enqueue('aapl', '10-K')
+        job = self.queue.claim('worker')
+        self.queue.finish(job['id'], 'worker', error='stolen')
+        self.download_result('aapl', '10-K')
+        with mock.patch.object(ExtractParseForms, 'ingest_new_forms') as ingest:
+            self.assertFalse(self.test_obj.run_job(job, 'worker'))
+        ingest.assert_not_called()
+        self.assertEqual('stolen', self.queue.get(job['id'])['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+import os
+import unittest
+
+from ci_rest_api_server.support_libs.extractor.P10QParser import Parse10QForm
+from ci_rest_api_server.support_libs.extractor.GFormParse import GeneralFormParser
+
+TEST_FILE_LOCATION = "/tmp"
+TEST_FILE_NAME = "/test_p10q_parser.txt"
+
+SAMPLE_10Q_FILING = b"""<SEC-DOCUMENT>0000320193-18-000100.txt : 20180801
+<SEC-HEADER>0000320193-18-000100.hdr.sgml : 20180801
+CONFORMED SUBMISSION TYPE:\t10-Q
+CONFORMED PERIOD OF REPORT:\t20180630
+FILED AS OF DATE:\t\t20180801
+</SEC-HEADER>
+<DOCUMENT>
+<TYPE>EX-101.INS
+<TEXT>
+<XBRL>
+<xbrli:xbrl>
+<dei:DocumentFiscalYearFocus contextRef="FD2018Q3YTD">2018</dei:DocumentFiscalYearFocus>
+<dei:DocumentFiscalPeriodFocus contextRef="FD2018Q3YTD">Q3</dei:DocumentFiscalPeriodFocus>
+<us-gaap:Assets contextRef="FI2017Q4" unitRef="usd" decimals="-6">375319000000</us-gaap:Assets>
+<us-gaap:Assets contextRef="FI2018Q3" unitRef="usd" decimals="-6">349197000000</us-gaap:Assets>
+<us-gaap:InventoryNet contextRef="FI2018Q3" unitRef="usd" decimals="-6">5936000000</us-gaap:InventoryNet>
+</xbrli:xbrl>
+</XBRL>
+</TEXT>
+</DOCUMENT>
+</SEC-DOCUMENT>
+"""
+
+
+class TestParse10QForm(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        """
+        Write the sample filing to disk for the form parser test
+        """
+        with open(TEST_FILE_LOCATION + TEST_FILE_NAME, "wb") as file:
+            file.write(SAMPLE_10Q_FILING)
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Tear down file resources
+        """
+        path = TEST_FILE_LOCATION + TEST_FILE_NAME
+        if os.path.exists(path):
+            os.remove(path)
+
+    def test_get_form_data(self):
+        """
+        The 10Q record holds the same fields as the 10K plus the fiscal quarter
+        """
+        test_obj = Parse10QForm()
+        parsed_data_dict = test_obj.get_form_data(file_path=TEST_FILE_LOCATION + TEST_FILE_NAME,
+                                                  year=2018,
+                                                  ticker='aapl')
+        self.assertEqual(349197000000, parsed_data_dict['assets'])
+        self.assertEqual(5936000000, parsed_data_dict['inventorynet'])
+        self.assertNotIn('goodwill', parsed_data_dict)
+        self.assertEqual('10-Q', parsed_data_dict['filing-type'])
+        self.assertEqual(2018, parsed_data_dict['filing-year'])
+        self.assertEqual(3, parsed_data_dict['filing-quarter'])
+        self.assertNotIn('documentfiscalperiodfocus', parsed_data_dict)
+        self.assertNotIn('documentfiscalyearfocus', parsed_data_dict)
+
+    def test_fiscal_year_of_the_report(self):
+        """
+        The record is keyed by the fiscal year of the report, not the year it was filed
+        """
+        path = TEST_FILE_LOCATION + '/test_p10q_fiscal_year.txt'
+        with open(path, "wb") as file:
+            # fiscal Q1 2019 of a company whose year ends in september, filed in 2019
+            file.write(SAMPLE_10Q_FILING.replace(b'>2018</dei', b'>2019</dei').replace(b'>Q3<', b'>Q1<'))
+        self.addCleanup(os.remove, path)
+        parsed_data_dict = Parse10QForm().get_form_data(file_path=path, year=2018, ticker='aapl')
+        self.assertEqual((2019, 1), (parsed_data_dict['filing-year'], parsed_data_dict['filing-quarter']))
+
+    def test_unresolved_period_skipped(self):
+        """
+        A report without its fiscal year or period gives no record instead of one
+        keyed by the bare year
+        """
+        path = TEST_FILE_LOCATION + '/test_p10q_no_period.txt'
+        self.addCleanup(os.remove, path)
+        for tag in (b'dei:DocumentFiscalYearFocus', b'dei:DocumentFiscalPeriodFocus'):
+            with open(path, "wb") as file:
+                file.write(SAMPLE_10Q_FILING.replace(tag, b'dei:Other'))
+            with self.assertLogs(level='WARNING'):
+                self.assertIsNone(Parse10QForm().get_form_data(file_path=path, year=2018, ticker='aapl'))
+
+    def test_routed_by_general_parser(self):
+        """
+        10-Q filings are routed to Parse10QForm by the header form type
+        """
+        test_obj = GeneralFormParser()
+        form_type, year = test_obj.get_form_type_and_filing_year(TEST_FILE_LOCATION + TEST_FILE_NAME)
+        self.assertEqual(('10-Q', 2018), (form_type, year))
+        parsed_data_dict = test_obj.extract_form_data(TEST_FILE_LOCATION + TEST_FILE_NAME,
+                                                      form_type, year, 'aapl')
+        self.assertEqual(3, parsed_data_dict['filing-quarter'])
+
+    def test_resolve_fiscal_period(self):
+        """
+        Year and quarter both come from the dei facts, there is no calendar fallback
+        """
+        self.assertEqual((2019, 1), Parse10QForm.resolve_fiscal_period('2019', 'Q1'))
+        self.assertEqual((2018, 2), Parse10QForm.resolve_fiscal_period(' 2018 ', 'q2'))
+        self.assertIsNone(Parse10QForm.resolve_fiscal_period(None, 'Q1'))
+        self.assertIsNone(Parse10QForm.resolve_fiscal_period('2019', None))
+        self.assertIsNone(Parse10QForm.resolve_fiscal_period('2019', 'FY'))
+        self.assertIsNone(Parse10QForm.resolve_fiscal_period('FY19', 'Q1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import json
+import unittest
+from unittest import mock
+
+from ci_rest_api_server.support_libs.extractor.ScreenQuery import (Predicate,
+                                                                  ScreenQuery,
+                                                                  )
+from ci_rest_api_server.support_libs.extractor.StorageLayout import StorageLayout
+from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+
+
+class TestScreenQuery(unittest.TestCase):
+    def test_parse(self):
+        screen = ScreenQuery.parse(['goodwill > 0.3*assets', 'assets>=1e9', 'liabilities<equity'],
+                                   from_year=2021, to_year=2021)
+        self.assertEqual([Predicate('goodwill', '$gt', 0.3, 'assets'),
+                          Predicate('assets', '$gte', 1e9),
+                          Predicate('liabilities', '$lt', 1.0, 'equity')],
+                         screen.predicates)
+        self.assertEqual(['goodwill', 'assets', 'liabilities', 'equity'], screen.fields)
+        for where in (['goodwill'], ['goodwill>'], ['$where>1'], ['data.assets>1'], ['assets>1;drop']):
+            with self.assertRaises(ValueError, msg=where):
+                ScreenQuery.parse(where)
+        with self.assertRaises(ValueError):
+            ScreenQuery.parse([], fields=['$where'])
+        with self.assertRaises(ValueError):
+            ScreenQuery.parse([], from_year=2021, to_year=2020)
+
+    def test_pipeline(self):
+        """
+        Years and predicates are one $match, sorted like the unique index and cut after the cursor
+        """
+        screen = ScreenQuery.parse(['goodwill>0.3*assets', 'assets>=1e9'], from_year=2021, to_year=2021)
+        pipeline = screen.pipeline(11, ticker_key='ticker', after=('aapl', 2021, None))
+        self.assertEqual({'$match': {'$and': [
+            {'data.filing-year': {'$gte': 2021, '$lte': 2021}},
+            {'data.goodwill': {'$type': 'number'},
+             'data.assets': {'$type': 'number'},
+             '$expr': {'$gt': ['$data.goodwill', {'$multiply': [0.3, '$data.assets']}]}},
+            {'data.assets': {'$type': 'number', '$gte': 1e9}},
+            {'$or': [{'ticker': {'$gt': 'aapl'}},
+                     {'ticker': 'aapl', 'data.filing-year': {'$gt': 2021}}]},
+        ]}}, pipeline[0])
+        self.assertEqual({'$sort': {'ticker': 1, 'data.filing-year': 1}}, pipeline[1])
+        self.assertEqual({'$limit': 11}, pipeline[2])
+        self.assertEqual({'_id': 0, 'ticker': 1, 'data.filing-year': 1, 'data.filing-quarter': 1,
+                          'data.goodwill': 1, 'data.assets': 1}, pipeline[3]['$project'])
+        quarterly = ScreenQuery([]).pipeline(5, quarterly=True, after=('aapl', 2021, 2))
+        self.assertEqual({'$match': {'$and': [{'$or': [
+            {'data.filing-year': {'$gt': 2021}},
+            {'data.filing-year': 2021, 'data.filing-quarter': {'$gt': 2}}]}]}}, quarterly[0])
+        self.assertEqual({'$match': {}}, ScreenQuery([]).pipeline(5)[0])
+
+    def test_cursor(self):
+        self.assertEqual(('brk-b', 2018, None), ScreenQuery.parse_cursor('BRK-B:2018'))
+        self.assertEqual(('aapl', 2018, 3), ScreenQuery.parse_cursor('aapl:2018-Q3'))
+        self.assertEqual('aapl:2018-Q3', ScreenQuery.cursor_of({'ticker': 'aapl', 'filing-year': 2018,
+                                                                'filing-quarter': 3}))
+        for after in ('aapl', ':2018', 'aapl:x'):
+            with self.assertRaises(ValueError):
+                ScreenQuery.parse_cursor(after)
+
+
+class TestScreenFromDb(unittest.TestCase):
+    """
+    screen_from_db() against a mocked client, the DB itself is not needed
+    """
+    def setUp(self) -> None:
+        self.client = mock.MagicMock()
+        self.db = self.client['10-K']
+        self.screen = ScreenQuery.parse(['assets>1'])
+
+    def test_single_collection(self):
+        """
+        One aggregation on the filings collection answers the screen
+        """
+        filings = self.db['filings']
+        filings.aggregate.return_value = [{'ticker': 'aapl', 'data': {'filing-year': 2018, 'assets': 2}}]
+        test_obj = ExtractParseForms('None', StorageLayout(StorageLayout.SINGLE_COLLECTION))
+        test_obj._client_handle_pull_db = self.client
+        rows = list(test_obj.screen_from_db('10-k', self.screen, 3, after='aapl:2017'))
+        self.assertEqual([{'ticker': 'aapl', 'filing-year': 2018, 'assets': 2}], rows)
+        filings.aggregate.assert_called_once_with(self.screen.pipeline(3, ticker_key='ticker',
+                                                                       after=('aapl', 2017, None)))
+
+    def test_per_ticker(self):
+        """
+        The ticker collections are screened in ticker order from the cursor on, until the limit
+        """
+        collections = {name: mock.MagicMock() for name in ('aapl', 'csco', 'msft', 'nvda')}
+        for name, collection in collections.items():
+            collection.aggregate.return_value = [{'data': {'filing-year': year, 'assets': 2}}
+                                                 for year in (2018, 2019)]
+        self.db.__getitem__.side_effect = collections.__getitem__
+        self.db.list_collection_names.return_value = list(collections)
+        test_obj = ExtractParseForms('None', StorageLayout(StorageLayout.PER_TICKER))
+        test_obj._client_handle_pull_db = self.client
+        rows = list(test_obj.screen_from_db('10-k', self.screen, 3, after='csco:2018'))
+        self.assertEqual(['csco:2018', 'csco:2019', 'msft:2018', 'msft:2019'],
+                         [ScreenQuery.cursor_of(row) for row in rows])
+        collections['aapl'].aggregate.assert_not_called()
+        collections['csco'].aggregate.assert_called_once_with(self.screen.pipeline(3, after=('csco', 2018, None)))
+        collections['msft'].aggregate.assert_called_once_with(self.screen.pipeline(1))
+        collections['nvda'].aggregate.assert_not_called()
+
+
+class TestScreenRoute(unittest.TestCase):
+    def setUp(self) -> None:
+        from ci_rest_api_server.app import app
+        self.filings = mock.MagicMock()
+        client = mock.MagicMock()
+        client.__getitem__.return_value.__getitem__.return_value = self.filings
+        patcher = mock.patch('ci_rest_api_server.support_libs.extractor.SharedMongoClient.SharedMongoClient.get',
+                             return_value=client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict('os.environ', {'CI_MONGO_STORAGE_LAYOUT': 'single_collection'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.test_client = app.test_client()
+
+    def test_pages(self):
+        """
+        The matches are streamed one per line, the last line holds the cursor of the next page
+        """
+        self.filings.aggregate.return_value = [{'ticker': ticker, 'data': {'filing-year': 2021, 'goodwill': 5}}
+                                               for ticker in ('aapl', 'msft', 'nvda')]
+        response = self.test_client.get('/screen/10-k/?where=goodwill>0.3*assets&from_year=2021&limit=2')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('application/x-ndjson', response.mimetype)
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([{'ticker': 'aapl', 'filing-year': 2021, 'goodwill': 5},
+                          {'ticker': 'msft', 'filing-year': 2021, 'goodwill': 5},
+                          {'next': 'msft:2021'}], lines)
+        self.assertEqual({'$limit': 3}, self.filings.aggregate.call_args[0][0][2])
+
+    def test_bad_requests(self):
+        for query in ('where=goodwill', 'limit=0', 'after=aapl', 'from_year=x'):
+            self.assertEqual(400, self.test_client.get(f'/screen/10-k/?{query}').status_code, msg=query)
+        self.assertEqual(404, self.test_client.get('/screen/8-k/').status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
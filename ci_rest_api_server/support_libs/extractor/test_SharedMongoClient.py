@@ -0,0 +1,61 @@
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from ci_rest_api_server.support_libs.extractor.SharedMongoClient import SharedMongoClient
+from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+
+
+class TestSharedMongoClient(unittest.TestCase):
+    """
+    MongoClient connects lazily in the background so no DB is needed for these cases
+    """
+    def tearDown(self) -> None:
+        SharedMongoClient.configure()
+        SharedMongoClient.close()
+
+    def test_one_client_per_process(self):
+        """
+        Every caller, from any thread, gets the same client
+        """
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda _: SharedMongoClient.get(), range(32)))
+        self.assertTrue(all(client is clients[0] for client in clients))
+
+    def test_read_and_write_paths_share_client(self):
+        """
+        from_db() and open_db_connection() use the shared client
+        """
+        reader = ExtractParseForms.from_db()
+        writer = ExtractParseForms('None')
+        writer.open_db_connection('10-K', 'aapl')
+        self.assertIs(SharedMongoClient.get(), reader._client_handle_pull_db)
+        self.assertIs(SharedMongoClient.get(), writer.client_handle)
+        # releasing the push connection must not close the shared client
+        writer.close_db_connection()
+        self.assertIs(SharedMongoClient.get(), ExtractParseForms.from_db()._client_handle_pull_db)
+
+    def test_settings_from_environment(self):
+        """
+        Pool sizing and timeouts are read from the environment
+        """
+        with mock.patch.dict(os.environ, {'CI_MONGO_MAX_POOL_SIZE': '7',
+                                          'CI_MONGO_URI': 'mongodb://db:27017/'}):
+            settings = SharedMongoClient.settings()
+        self.assertEqual(7, settings['maxPoolSize'])
+        self.assertEqual('mongodb://db:27017/', settings['host'])
+
+    def test_configure_rebuilds_client(self):
+        """
+        configure() drops the existing client and applies the overrides
+        """
+        first_client = SharedMongoClient.get()
+        SharedMongoClient.configure(maxPoolSize=3)
+        second_client = SharedMongoClient.get()
+        self.assertIsNot(first_client, second_client)
+        self.assertEqual(3, second_client.max_pool_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
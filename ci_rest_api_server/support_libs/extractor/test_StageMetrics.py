@@ -0,0 +1,164 @@
+import json
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+from ci_rest_api_server.support_libs.extractor import StageMetrics
+from ci_rest_api_server.support_libs.extractor.StageMetrics import (Histogram,
+                                                                   MetricsRegistry,
+                                                                   ProcessSnapshots,
+                                                                   )
+from ci_rest_api_server.support_libs.extractor.GFormParse import GeneralFormParser
+from ci_rest_api_server.support_libs.extractor.test_P10QParser import SAMPLE_10Q_FILING
+
+TEST_FILE_LOCATION = "/tmp"
+TEST_FILE_NAME = "/test_stage_metrics.txt"
+
+
+class TestHistogram(unittest.TestCase):
+    def setUp(self) -> None:
+        self.histogram = Histogram('test_seconds', 'Test durations', ('stage', 'form_type'),
+                                   buckets=(0.01, 0.1, 1.0))
+
+    def test_render(self):
+        """
+        Buckets are cumulative and end with +Inf, one block of lines per label values
+        """
+        self.histogram.observe(0.005, stage='parse', form_type='10-K')
+        self.histogram.observe(0.05, stage='parse', form_type='10-K')
+        self.histogram.observe(5, stage='parse', form_type='10-K')
+        self.histogram.observe(0.1, stage='db_read', form_type='10-K')
+        lines = self.histogram.render()
+        self.assertEqual(lines[:2], ['# HELP test_seconds Test durations',
+                                     '# TYPE test_seconds histogram'])
+        self.assertIn('test_seconds_bucket{stage="parse",form_type="10-K",le="0.01"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="parse",form_type="10-K",le="0.1"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="parse",form_type="10-K",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{stage="parse",form_type="10-K",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{stage="parse",form_type="10-K"} 5.055', lines)
+        self.assertIn('test_seconds_count{stage="parse",form_type="10-K"} 3', lines)
+        # the upper bound is inclusive
+        self.assertIn('test_seconds_bucket{stage="db_read",form_type="10-K",le="0.1"} 1', lines)
+
+    def test_labels(self):
+        with self.assertRaises(ValueError):
+            self.histogram.observe(0.1, stage='parse')
+        self.histogram.observe(0.1, stage='a"b\\c', form_type='10-K')
+        self.assertIn('test_seconds_count{stage="a\\"b\\\\c",form_type="10-K"} 1', self.histogram.render())
+
+    def test_time(self):
+        """
+        The duration is recorded also when the block raises
+        """
+        with self.assertRaises(KeyError):
+            with self.histogram.time(stage='parse', form_type='10-K'):
+                raise KeyError('assets')
+        self.assertEqual(self.histogram.count(stage='parse', form_type='10-K'), 1)
+
+    def test_drain_merge(self):
+        self.histogram.observe(0.05, stage='parse', form_type='10-K')
+        other = Histogram('test_seconds', 'Test durations', ('stage', 'form_type'),
+                          buckets=(0.01, 0.1, 1.0))
+        other.observe(0.5, stage='parse', form_type='10-K')
+        other.merge(self.histogram.drain())
+        other.merge({})
+        self.assertEqual(self.histogram.count(stage='parse', form_type='10-K'), 0)
+        self.assertEqual(other.count(stage='parse', form_type='10-K'), 2)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    def test_registry(self):
+        registry = MetricsRegistry()
+        histogram = registry.histogram('b_seconds', 'B', ('stage',))
+        self.assertIs(histogram, registry.histogram('b_seconds', 'B', ('stage',)))
+        registry.histogram('a_seconds', 'A', ('stage',)).observe(1, stage='parse')
+        rendered = registry.render()
+        self.assertLess(rendered.index('# HELP a_seconds'), rendered.index('# HELP b_seconds'))
+        self.assertTrue(rendered.endswith('\n'))
+        worker_registry = MetricsRegistry()
+        worker_registry.histogram('b_seconds', 'B', ('stage',)).observe(1, stage='parse')
+        registry.merge(worker_registry.drain())
+        self.assertEqual(histogram.count(stage='parse'), 1)
+
+    def test_process_snapshots(self):
+        """
+        A scrape of any process sums the snapshots of all the processes of the folder
+        """
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        registries = []
+        for seconds in (0.5, 2.0):
+            registry = MetricsRegistry()
+            registry.histogram('a_seconds', 'A', ('stage',)).observe(seconds, stage='parse')
+            snapshots = ProcessSnapshots(folder.name)
+            snapshots.add_source('metrics', registry.snapshot)
+            snapshots.write()
+            registries.append(registry)
+        registries[-1].histogram('a_seconds', 'A', ('stage',)).observe(0.5, stage='parse')
+        merged = registries[-1].merged(snapshots.read('metrics'))
+        self.assertEqual(3, merged.histogram('a_seconds', 'A', ('stage',)).count(stage='parse'))
+        self.assertIn('a_seconds_sum{stage="parse"} 3.0', merged.render())
+        # the registries of the processes are unchanged
+        self.assertEqual(1, registries[0].histogram('a_seconds', 'A', ('stage',)).count(stage='parse'))
+
+    def test_cache_stats_of_workers(self):
+        """
+        /cache/stats/ sums the response caches of the workers sharing CI_METRICS_DIR
+        """
+        from ci_rest_api_server import app as app_module
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        other_worker = ProcessSnapshots(folder.name)
+        other_worker.add_source('cache', lambda: {'hits': 3, 'misses': 1})
+        other_worker.write()
+        snapshots = ProcessSnapshots(folder.name)
+        snapshots.add_source('cache', lambda: {'hits': 2, 'misses': 0})
+        with mock.patch.object(app_module, 'metrics_snapshots', snapshots):
+            response = app_module.app.test_client().get('/cache/stats/')
+        self.assertEqual({'hits': 5, 'misses': 1, 'workers': 2}, json.loads(response.data))
+
+    def test_ticker_class(self):
+        classes = StageMetrics._parse_ticker_classes('mega=AAPL,msft; watch=nvda;')
+        self.assertEqual(classes, {'aapl': 'mega', 'msft': 'mega', 'nvda': 'watch'})
+        with mock.patch.dict(StageMetrics.TICKER_CLASSES, classes, clear=True):
+            self.assertEqual(StageMetrics.ticker_class('aapl'), 'mega')
+            self.assertEqual(StageMetrics.ticker_class('csco'), 'other')
+            self.assertEqual(StageMetrics.ticker_class(None), 'none')
+
+    def test_serve_metrics(self):
+        """
+        The processes without the API serve their histograms to Prometheus themselves
+        """
+        registry = MetricsRegistry()
+        registry.histogram('a_seconds', 'A', ('stage',)).observe(0.5, stage='db_push')
+        server = StageMetrics.serve_metrics(0, host='127.0.0.1', registry=registry)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(url + '/metrics') as response:
+            self.assertEqual('text/plain; version=0.0.4; charset=utf-8', response.headers['Content-Type'])
+            self.assertEqual(registry.render(), response.read().decode())
+        with self.assertRaises(urllib.error.HTTPError) as raised:
+            urllib.request.urlopen(url + '/')
+        self.assertEqual(404, raised.exception.code)
+
+    def test_parse_stages_recorded(self):
+        """
+        Sniffing the header and parsing a filing are both timed
+        """
+        with open(TEST_FILE_LOCATION + TEST_FILE_NAME, "wb") as file:
+            file.write(SAMPLE_10Q_FILING)
+        stages = StageMetrics.STAGE_SECONDS
+        header_count = stages.count(stage='header', form_type='10-Q', ticker_class='none')
+        parse_count = stages.count(stage='parse', form_type='10-Q', ticker_class='other')
+        parser = GeneralFormParser()
+        form_type, year = parser.get_form_type_and_filing_year(TEST_FILE_LOCATION + TEST_FILE_NAME)
+        parser.extract_form_data(TEST_FILE_LOCATION + TEST_FILE_NAME, form_type, year, 'aapl')
+        self.assertEqual(stages.count(stage='header', form_type='10-Q', ticker_class='none'), header_count + 1)
+        self.assertEqual(stages.count(stage='parse', form_type='10-Q', ticker_class='other'), parse_count + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import importlib
+import io
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from ci_rest_api_server.support_libs.extractor.StorageLayout import StorageLayout
+from ci_rest_api_server.support_libs.extractor.IExtractDBPush import ExtractParseForms
+
+# the package exports the class under the name of its module
+storage_layout_module = importlib.import_module('ci_rest_api_server.support_libs.extractor.StorageLayout')
+
+PER_TICKER = StorageLayout(StorageLayout.PER_TICKER)
+SINGLE_COLLECTION = StorageLayout(StorageLayout.SINGLE_COLLECTION)
+
+
+class TestStorageLayout(unittest.TestCase):
+    def test_layouts(self):
+        self.assertEqual(PER_TICKER.collection_name('aapl'), 'aapl')
+        self.assertEqual(PER_TICKER.ticker_filter('AAPL'), {})
+        self.assertEqual(PER_TICKER.document_fields('AAPL', {'assets': 1}), {'data': {'assets': 1}})
+        self.assertEqual(PER_TICKER.index_prefix(), [])
+        self.assertEqual(SINGLE_COLLECTION.collection_name('aapl'), 'filings')
+        self.assertEqual(SINGLE_COLLECTION.ticker_filter('AAPL'), {'ticker': 'aapl'})
+        self.assertEqual(SINGLE_COLLECTION.document_fields('AAPL', {'assets': 1}),
+                         {'ticker': 'aapl', 'data': {'assets': 1}})
+        self.assertEqual(SINGLE_COLLECTION.index_prefix(), ['ticker'])
+        with self.assertRaises(ValueError):
+            StorageLayout('sharded')
+
+    def test_from_env(self):
+        with mock.patch.dict('os.environ', {'CI_MONGO_STORAGE_LAYOUT': 'single_collection'}):
+            self.assertEqual(StorageLayout.from_env(), SINGLE_COLLECTION)
+            self.assertEqual(ExtractParseForms('None').storage_layout, SINGLE_COLLECTION)
+        with mock.patch.dict('os.environ', {'CI_MONGO_STORAGE_LAYOUT': ''}):
+            self.assertEqual(StorageLayout.from_env(), PER_TICKER)
+
+    def test_tickers(self):
+        """
+        The filings collection and the system collections are not tickers
+        """
+        client = mock.MagicMock()
+        client['10-K'].list_collection_names.return_value = ['msft', 'filings', 'aapl', 'system.views']
+        client['10-K']['filings'].distinct.return_value = ['msft', 'aapl']
+        self.assertEqual(PER_TICKER.tickers(client, '10-k'), ['aapl', 'msft'])
+        self.assertEqual(SINGLE_COLLECTION.tickers(client, '10-k'), ['aapl', 'msft'])
+        client['10-K']['filings'].distinct.assert_called_once_with('ticker')
+
+
+class TestSingleCollection(unittest.TestCase):
+    """
+    push_to_db() and the pulls of the single_collection layout against a mocked DB
+    """
+    RECORDS = [{'filing-type': '10-K', 'ticker': 'AAPL', 'filing-year': 2017, 'assets': 1},
+               {'filing-type': '10-K', 'ticker': 'AAPL', 'filing-year': 2018, 'assets': 2}]
+
+    def setUp(self) -> None:
+        self.collection = mock.MagicMock()
+        self.collection.bulk_write.return_value = mock.Mock(upserted_count=2,
+                                                            modified_count=0,
+                                                            matched_count=0)
+        self.client = mock.MagicMock()
+        self.client.__getitem__.return_value.__getitem__.return_value = self.collection
+        self.test_obj = ExtractParseForms('None', SINGLE_COLLECTION)
+        self.test_obj.open_db_connection = mock.Mock(return_value=self.collection)
+        self.test_obj._client_handle_pull_db = self.client
+
+    def test_push(self):
+        """
+        The records of every ticker are upserted into the filings collection keyed by
+        ticker and year, under the compound unique index
+        """
+        self.test_obj.push_to_db(self.RECORDS)
+        self.test_obj.open_db_connection.assert_called_once_with('10-K', 'filings')
+        self.collection.bulk_write.assert_called_once_with(
+            [UpdateOne({'ticker': 'aapl', 'data.filing-year': record['filing-year']},
+                       {'$set': {'ticker': 'aapl', 'data': record}},
+                       upsert=True)
+             for record in self.RECORDS],
+            ordered=False)
+        self.collection.create_index.assert_called_once_with([('ticker', 1), ('data.filing-year', 1)],
+                                                             unique=True,
+                                                             name='unique_ticker_filing_year')
+
+    def test_duplicate_years_grouped_by_ticker(self):
+        self.collection.create_index.side_effect = [OperationFailure('dup key', code=11000), None]
+        self.collection.aggregate.return_value = []
+        self.test_obj.push_to_db(self.RECORDS)
+        pipeline = self.collection.aggregate.call_args[0][0]
+        self.assertEqual({'ticker': '$ticker', 'year': '$data.filing-year'},
+                         pipeline[1]['$group']['_id'])
+
+    def test_pull(self):
+        self.collection.find.return_value = [{'data': {'filing-year': 2018, 'assets': 2}}]
+        self.assertEqual({'2018': {'filing-year': 2018, 'assets': 2}},
+                         self.test_obj.pull_from_db(ticker='AAPL', db_name='10-k',
+                                                    fields=['assets'], from_year=2016))
+        self.client.__getitem__.return_value.__getitem__.assert_called_with('filings')
+        self.collection.find.assert_called_once_with(
+            {'data.filing-year': {'$gte': 2016}, 'ticker': 'aapl'},
+            {'_id': 0, 'data.filing-year': 1, 'data.filing-quarter': 1, 'data.assets': 1})
+
+    def test_pull_unknown_ticker(self):
+        self.collection.find.return_value = []
+        with self.assertRaises(LookupError):
+            self.test_obj.pull_from_db(ticker='random', db_name='10-k')
+
+    def test_pull_many_one_query(self):
+        """
+        All the tickers are read with one query, the ones without records are errors
+        """
+        self.collection.find.return_value = [
+            {'ticker': 'aapl', 'data': {'filing-year': 2018, 'assets': 1}},
+            {'ticker': 'msft', 'data': {'filing-year': 2018, 'assets': 2}},
+            {'ticker': 'msft', 'data': {'filing-year': 2017, 'assets': 3}}]
+        data_from_db, errors = self.test_obj.pull_many_from_db(['AAPL', 'msft', 'random'], '10-k',
+                                                               fields=['assets'])
+        self.collection.find.assert_called_once_with(
+            {'ticker': {'$in': ['aapl', 'msft', 'random']}},
+            {'_id': 0, 'data.filing-year': 1, 'data.filing-quarter': 1, 'data.assets': 1, 'ticker': 1})
+        self.assertEqual({'2018': {'filing-year': 2018, 'assets': 1}}, data_from_db['AAPL'])
+        self.assertEqual(['2018', '2017'], list(data_from_db['msft']))
+        self.assertEqual(['random'], list(errors))
+
+
+class TestMigration(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = mock.MagicMock()
+        self.db = self.client['10-K']
+        self.collections = {name: mock.MagicMock() for name in ('aapl', 'msft', 'filings')}
+        self.db.__getitem__.side_effect = self.collections.__getitem__
+        self.db.list_collection_names.return_value = ['aapl', 'msft']
+        for ticker in ('aapl', 'msft'):
+            self.collections[ticker].find.return_value = [{'data': {'filing-year': year, 'ticker': ticker}}
+                                                          for year in (2017, 2018)]
+        filings = self.collections['filings']
+        filings.bulk_write.return_value = mock.Mock(upserted_count=2, modified_count=0, matched_count=0)
+        filings.count_documents.return_value = 2
+        self.test_obj = ExtractParseForms('None')
+        self.test_obj.client_handle = self.client
+
+    def test_migrate_to_single_collection(self):
+        counts = self.test_obj.migrate_storage_layout('10-K', PER_TICKER, SINGLE_COLLECTION, drop_source=True)
+        self.assertEqual({'tickers': 2, 'records': 4, 'inserted': 4, 'updated': 0, 'unchanged': 0}, counts)
+        requests = self.collections['filings'].bulk_write.call_args_list[0][0][0]
+        self.assertEqual(UpdateOne({'ticker': 'aapl', 'data.filing-year': 2017},
+                                   {'$set': {'ticker': 'aapl', 'data': {'filing-year': 2017, 'ticker': 'aapl'}}},
+                                   upsert=True),
+                         requests[0])
+        self.assertEqual([mock.call('aapl'), mock.call('msft')], self.db.drop_collection.call_args_list)
+
+    def test_incomplete_copy_keeps_source(self):
+        self.collections['filings'].count_documents.return_value = 1
+        with self.assertRaises(RuntimeError):
+            self.test_obj.migrate_storage_layout('10-K', PER_TICKER, SINGLE_COLLECTION, drop_source=True)
+        self.db.drop_collection.assert_not_called()
+
+    def test_command(self):
+        with mock.patch.object(ExtractParseForms, 'migrate_storage_layout',
+                               return_value={'tickers': 2}) as migrate:
+            with redirect_stdout(io.StringIO()) as output:
+                self.assertEqual(0, storage_layout_module.main(['10-k', '10-q']))
+        self.assertEqual([mock.call('10-K', PER_TICKER, SINGLE_COLLECTION, drop_source=False),
+                          mock.call('10-Q', PER_TICKER, SINGLE_COLLECTION, drop_source=False)],
+                         migrate.call_args_list)
+        self.assertIn("10-Q: {'tickers': 2}", output.getvalue())
+        with self.assertRaises(SystemExit), redirect_stdout(io.StringIO()), mock.patch('sys.stderr'):
+            storage_layout_module.main(['10-k', '--to', 'per_ticker'])
+
+
+if __name__ == '__main__':
+    unittest.main()
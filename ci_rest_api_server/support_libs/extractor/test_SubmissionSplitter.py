@@ -0,0 +1,150 @@
+import unittest
+
+from ci_rest_api_server.support_libs.extractor.SubmissionSplitter import SubmissionSplitter
+from ci_rest_api_server.support_libs.extractor.XbrlFactExtractor import XbrlFactExtractor
+
+SEC_HEADER = b"""<SEC-DOCUMENT>0000320193-18-000145.txt : 20181105
+<SEC-HEADER>0000320193-18-000145.hdr.sgml : 20181105
+CONFORMED SUBMISSION TYPE:\t10-K
+FILED AS OF DATE:\t\t20181105
+</SEC-HEADER>
+"""
+
+PRIMARY_DOCUMENT = b"""<DOCUMENT>
+<TYPE>10-K
+<SEQUENCE>1
+<FILENAME>a10-k20189292018.htm
+<TEXT>
+<html><body><p>Total assets 365,725</p></body></html>
+</TEXT>
+</DOCUMENT>
+"""
+
+IMAGE_DOCUMENT = b"""<DOCUMENT>
+<TYPE>GRAPHIC
+<SEQUENCE>2
+<FILENAME>chart.jpg
+<TEXT>
+begin 644 chart.jpg
+M_]C_X``02D9)1@`!`0```0`!``#_VP!#``,\"`@("`@#`@(\"`P,#`P0'!00$
+end
+</TEXT>
+</DOCUMENT>
+"""
+
+INSTANCE_DOCUMENT = b"""<DOCUMENT>
+<TYPE>EX-101.INS
+<SEQUENCE>3
+<FILENAME>aapl-20180929.xml
+<TEXT>
+<XBRL>
+<us-gaap:Assets contextRef="FI2018Q4" unitRef="usd">365725000000</us-gaap:Assets>
+</XBRL>
+</TEXT>
+</DOCUMENT>
+"""
+
+INLINE_PRIMARY_DOCUMENT = b"""<DOCUMENT>
+<TYPE>10-K
+<SEQUENCE>1
+<FILENAME>aapl-20210925.htm
+<TEXT>
+<html><body>
+<ix:nonFraction name="us-gaap:Assets" contextRef="FY2021" scale="6" decimals="-6">351,<b>002</b></ix:nonFraction>
+<ix:nonFraction name="us-gaap:Goodwill" contextRef="FY2021" format="ixt:fixed-zero" scale="6">-</ix:nonFraction>
+<ix:nonFraction name="us-gaap:Liabilities" contextRef="FY2021" scale="6" sign="-">10</ix:nonFraction>
+</body></html>
+</TEXT>
+</DOCUMENT>
+"""
+
+
+class TestSubmissionSplitter(unittest.TestCase):
+    def test_documents(self):
+        """
+        Every document of the submission is found with its type and file name
+        """
+        submission = SEC_HEADER + PRIMARY_DOCUMENT + IMAGE_DOCUMENT + INSTANCE_DOCUMENT + b"</SEC-DOCUMENT>\n"
+        test_obj = SubmissionSplitter(submission)
+        self.assertEqual([('10-K', 'a10-k20189292018.htm'),
+                          ('GRAPHIC', 'chart.jpg'),
+                          ('EX-101.INS', 'aapl-20180929.xml')],
+                         [(document.type, document.filename)
+                          for document in test_obj.documents()])
+
+    def test_instance_document_selected(self):
+        """
+        The EX-101.INS document is the only part handed to the extractor
+        """
+        submission = SEC_HEADER + PRIMARY_DOCUMENT + IMAGE_DOCUMENT + INSTANCE_DOCUMENT + b"</SEC-DOCUMENT>\n"
+        xbrl_document = bytes(SubmissionSplitter(submission).xbrl_document('10-K'))
+        self.assertTrue(xbrl_document.strip().startswith(b'<XBRL>'))
+        self.assertTrue(xbrl_document.strip().endswith(b'</XBRL>'))
+        self.assertNotIn(b'chart.jpg', xbrl_document)
+
+    def test_inline_primary_document_selected(self):
+        """
+        Inline XBRL filings without an instance document use the primary document
+        """
+        submission = SEC_HEADER + INLINE_PRIMARY_DOCUMENT + IMAGE_DOCUMENT
+        xbrl_document = SubmissionSplitter(submission).xbrl_document('10-K')
+        self.assertIn(b'ix:nonFraction', bytes(xbrl_document))
+        test_obj = XbrlFactExtractor(['assets', 'goodwill', 'liabilities'])
+        self.assertEqual({'assets': 351002000000,
+                          'goodwill': 0,
+                          'liabilities': -10000000},
+                         test_obj.extract(xbrl_document, 2021))
+
+    def test_no_xbrl_document(self):
+        """
+        Old filings without any XBRL data give None
+        """
+        submission = SEC_HEADER + PRIMARY_DOCUMENT + IMAGE_DOCUMENT
+        self.assertIsNone(SubmissionSplitter(submission).xbrl_document('10-K'))
+
+    def test_not_a_submission(self):
+        """
+        A buffer without documents is returned as it is
+        """
+        instance = b'<us-gaap:Assets contextRef="FI2018Q4">1</us-gaap:Assets>'
+        self.assertEqual(instance, bytes(SubmissionSplitter(instance).xbrl_document('10-K')))
+
+    def test_xbrl_document_from_stream(self):
+        """
+        Reading the submission as a stream picks the same document, also when the
+        markers are split over chunks
+        """
+        submissions = [
+            SEC_HEADER + PRIMARY_DOCUMENT + IMAGE_DOCUMENT + INSTANCE_DOCUMENT + b"</SEC-DOCUMENT>\n",
+            SEC_HEADER + INLINE_PRIMARY_DOCUMENT + IMAGE_DOCUMENT,
+            SEC_HEADER + PRIMARY_DOCUMENT + IMAGE_DOCUMENT,
+            b'<us-gaap:Assets contextRef="FI2018Q4">1</us-gaap:Assets>',
+        ]
+        for submission in submissions:
+            expected = SubmissionSplitter(submission).xbrl_document('10-K')
+            for chunk_size in (1, 5, 64, len(submission)):
+                chunks = (submission[offset:offset + chunk_size]
+                          for offset in range(0, len(submission), chunk_size))
+                xbrl_document = SubmissionSplitter.xbrl_document_from_stream(chunks, '10-K')
+                if expected is None:
+                    self.assertIsNone(xbrl_document)
+                else:
+                    self.assertEqual(bytes(expected), bytes(xbrl_document), msg=f'chunk size {chunk_size}')
+
+    def test_stream_stops_at_instance(self):
+        """
+        The rest of the stream is not read once the instance document is complete
+        """
+        read = []
+
+        def chunks():
+            for document in (SEC_HEADER, INSTANCE_DOCUMENT, IMAGE_DOCUMENT, PRIMARY_DOCUMENT):
+                read.append(document)
+                yield document
+
+        SubmissionSplitter.xbrl_document_from_stream(chunks(), '10-K')
+        self.assertLessEqual(len(read), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,174 @@
+import os
+import unittest
+
+from ci_rest_api_server.support_libs.extractor.XbrlFactExtractor import XbrlFactExtractor
+from ci_rest_api_server.support_libs.extractor.P10kParser import Parse10KForm
+
+TEST_FILE_LOCATION = "/tmp"
+TEST_FILE_NAME = "/test_xbrl_fact_extractor.txt"
+
+SAMPLE_FILING = b"""<SEC-DOCUMENT>0000320193-18-000145.txt : 20181105
+<SEC-HEADER>0000320193-18-000145.hdr.sgml : 20181105
+CONFORMED SUBMISSION TYPE:\t10-K
+FILED AS OF DATE:\t\t20181105
+</SEC-HEADER>
+<DOCUMENT>
+<TYPE>EX-101.INS
+<TEXT>
+<XBRL>
+<xbrli:xbrl>
+<us-gaap:Assets contextRef="FI2017Q4" unitRef="usd" decimals="-6">375319000000</us-gaap:Assets>
+<us-gaap:Assets contextRef="FI2018Q4" unitRef="usd" decimals="-6">365725000000</us-gaap:Assets>
+<us-gaap:Goodwill contextRef="FI2018Q4_us-gaap_SegmentsAxis_AmericasMember" decimals="-6">1</us-gaap:Goodwill>
+<us-gaap:Liabilities contextRef="FI2018Q4" unitRef="usd" decimals="-6">258578000000</us-gaap:Liabilities>
+<us-gaap:InventoryNet contextRef="FI2018Q4" unitRef="usd" decimals="-6">3956000000</us-gaap:InventoryNet>
+<us-gaap:OtherAssetsCurrent contextRef="FI2018Q4" unitRef="usd" decimals="INF">not-a-number</us-gaap:OtherAssetsCurrent>
+</xbrli:xbrl>
+</XBRL>
+</TEXT>
+</DOCUMENT>
+</SEC-DOCUMENT>
+"""
+
+# Opaque context ids like the filings since 2019, the facts come before the contexts
+CONTEXT_FILING = b"""<xbrli:xbrl>
+<dei:DocumentPeriodEndDate contextRef="c-1">2021-12-31</dei:DocumentPeriodEndDate>
+<us-gaap:NetIncomeLoss contextRef="c-4" unitRef="usd">25000000</us-gaap:NetIncomeLoss>
+<us-gaap:NetIncomeLoss contextRef="c-1" unitRef="usd">94680000000</us-gaap:NetIncomeLoss>
+<us-gaap:NetIncomeLoss contextRef="c-3" unitRef="usd">57411000000</us-gaap:NetIncomeLoss>
+<us-gaap:Assets contextRef="c-2" unitRef="usd">351002000000</us-gaap:Assets>
+<us-gaap:Assets contextRef="c-5" unitRef="usd">323888000000</us-gaap:Assets>
+<us-gaap:Assets contextRef="c-6" unitRef="usd">1</us-gaap:Assets>
+<us-gaap:Assets contextRef="c-7" unitRef="usd">2</us-gaap:Assets>
+<us-gaap:Goodwill contextRef="c-2" unitRef="shares">3</us-gaap:Goodwill>
+<xbrli:context id="c-1"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier>
+</xbrli:entity><xbrli:period><xbrli:startDate>2021-01-01</xbrli:startDate><xbrli:endDate>2021-12-31</xbrli:endDate>
+</xbrli:period></xbrli:context>
+<xbrli:context id="c-2"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier>
+</xbrli:entity><xbrli:period><xbrli:instant>2021-12-31</xbrli:instant></xbrli:period></xbrli:context>
+<xbrli:context id="c-3"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier>
+</xbrli:entity><xbrli:period><xbrli:startDate>2020-01-01</xbrli:startDate><xbrli:endDate>2020-12-31</xbrli:endDate>
+</xbrli:period></xbrli:context>
+<xbrli:context id="c-4"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier>
+</xbrli:entity><xbrli:period><xbrli:startDate>2021-10-01</xbrli:startDate><xbrli:endDate>2021-12-31</xbrli:endDate>
+</xbrli:period></xbrli:context>
+<xbrli:context id="c-5"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier>
+</xbrli:entity><xbrli:period><xbrli:instant>2020-12-31</xbrli:instant></xbrli:period></xbrli:context>
+<xbrli:context id="c-6"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier>
+<xbrli:segment><xbrldi:explicitMember dimension="us-gaap:StatementBusinessSegmentsAxis">aapl:AmericasSegmentMember</xbrldi:explicitMember></xbrli:segment>
+</xbrli:entity><xbrli:period><xbrli:instant>2021-12-31</xbrli:instant></xbrli:period></xbrli:context>
+<xbrli:context id="c-7"><xbrli:entity><xbrli:identifier scheme="http://www.sec.gov/CIK">0000320193</xbrli:identifier>
+</xbrli:entity><xbrli:period><xbrli:instant>2022-01-28</xbrli:instant></xbrli:period></xbrli:context>
+<xbrli:unit id="usd"><xbrli:measure>iso4217:USD</xbrli:measure></xbrli:unit>
+<xbrli:unit id="shares"><xbrli:measure>xbrli:shares</xbrli:measure></xbrli:unit>
+</xbrli:xbrl>
+"""
+
+
+class TestXbrlFactExtractor(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        """
+        Write the sample filing to disk for the form parser test
+        """
+        with open(TEST_FILE_LOCATION + TEST_FILE_NAME, "wb") as file:
+            file.write(SAMPLE_FILING)
+
+    @classmethod
+    def tearDownClass(cls):
+        """
+        Tear down file resources
+        """
+        path = TEST_FILE_LOCATION + TEST_FILE_NAME
+        if os.path.exists(path):
+            os.remove(path)
+
+    def test_extracts_current_year_facts(self):
+        """
+        Only the facts of the requested year are returned and table (Member) values
+        as well as non numeric values are ignored
+        """
+        test_obj = XbrlFactExtractor(['assets', 'goodwill', 'liabilities',
+                                      'inventorynet', 'otherassetscurrent'])
+        self.assertEqual({'assets': 365725000000,
+                          'liabilities': 258578000000,
+                          'inventorynet': 3956000000},
+                         test_obj.extract(SAMPLE_FILING, 2018))
+
+    def test_only_requested_fields(self):
+        """
+        Tags which are not requested are never returned
+        """
+        test_obj = XbrlFactExtractor(['assets'])
+        self.assertEqual({'assets': 375319000000},
+                         test_obj.extract(SAMPLE_FILING, 2017))
+
+    def test_small_chunks(self):
+        """
+        Feeding the document in tiny blocks must give the same result as one block
+        """
+        test_obj = XbrlFactExtractor(['assets', 'liabilities'])
+        test_obj._CHUNK_SIZE = 7
+        self.assertEqual({'assets': 365725000000,
+                          'liabilities': 258578000000},
+                         test_obj.extract(SAMPLE_FILING, 2018))
+
+    def test_document_fields(self):
+        """
+        Document facts are returned as text whatever their context, plain or inline
+        """
+        test_obj = XbrlFactExtractor(['assets'],
+                                     document_fields=['dei:DocumentFiscalPeriodFocus'])
+        filing = SAMPLE_FILING.replace(b'<xbrli:xbrl>',
+                                       b'<xbrli:xbrl><dei:DocumentFiscalPeriodFocus contextRef="D2018">'
+                                       b'FY</dei:DocumentFiscalPeriodFocus>')
+        self.assertEqual({'assets': 365725000000, 'documentfiscalperiodfocus': 'FY'},
+                         test_obj.extract(filing, 2018))
+        inline_filing = (b'<html><body><ix:nonNumeric name="dei:DocumentFiscalPeriodFocus" contextRef="c-1">'
+                         b'<span>Q2</span></ix:nonNumeric></body></html>')
+        self.assertEqual({'documentfiscalperiodfocus': 'Q2'},
+                         test_obj.extract(inline_filing, 2018))
+
+    def test_context_resolution(self):
+        """
+        Facts resolve through their context: the document period end date, no
+        dimensions, the fiscal year over the quarter ending the same day and amounts only,
+        whatever the order of the facts and the context ids
+        """
+        test_obj = XbrlFactExtractor(['assets', 'goodwill', 'netincomeloss'])
+        expected = {'assets': 351002000000, 'netincomeloss': 94680000000}
+        # filed in 2022, the cover page instant of 2022 is not the reported period
+        self.assertEqual(expected, test_obj.extract(CONTEXT_FILING, 2022))
+        test_obj._CHUNK_SIZE = 7
+        self.assertEqual(expected, test_obj.extract(CONTEXT_FILING, 2022))
+
+    def test_comparatives(self):
+        """
+        The prior fiscal year comes from the same pass
+        """
+        test_obj = XbrlFactExtractor(['assets', 'netincomeloss'])
+        self.assertEqual([('2021-12-31', {'assets': 351002000000, 'netincomeloss': 94680000000}),
+                          ('2020-12-31', {'assets': 323888000000, 'netincomeloss': 57411000000})],
+                         test_obj.extract_periods(CONTEXT_FILING, 2022, periods=3))
+        # without the dei period end the latest period ending in the year is the reported one
+        filing = CONTEXT_FILING.replace(b'dei:DocumentPeriodEndDate', b'dei:Other')
+        self.assertEqual(['2021-12-31'], [end for end, _ in test_obj.extract_periods(filing, 2021, periods=1)])
+
+    def test_parse_10k_form_uses_extractor(self):
+        """
+        Parse10KForm fills its fields from the extractor and leaves out the fields
+        which are not in the filing
+        """
+        test_obj = Parse10KForm()
+        parsed_data_dict = test_obj.get_form_data(file_path=TEST_FILE_LOCATION + TEST_FILE_NAME,
+                                                  year=2018,
+                                                  ticker='aapl')
+        self.assertEqual(365725000000, parsed_data_dict['assets'])
+        self.assertNotIn('goodwill', parsed_data_dict)
+        self.assertEqual(2018, parsed_data_dict['filing-year'])
+        self.assertEqual('aapl', parsed_data_dict['ticker'])
+        self.assertEqual('10-K', parsed_data_dict['filing-type'])
+
+
+if __name__ == '__main__':
+    unittest.main()
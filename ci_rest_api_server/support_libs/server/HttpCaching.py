@@ -0,0 +1,60 @@
+# Conditional GET and content negotiation for cached API responses
+from typing import Optional
+from flask import (Request,
+                   Response,
+                   make_response,
+                   )
+from ci_rest_api_server.support_libs.server.ResponseCache import CacheEntry
+
+# Preferred first when the client accepts both with the same quality
+SUPPORTED_ENCODINGS = ('br', 'gzip')
+
+
+def negotiate_encoding(entry: CacheEntry,
+                       request: Request) -> Optional[str]:
+    """
+    Picks the best compressed form of the entry the client accepts
+    :param entry: cached response
+    :type entry: CacheEntry
+    :param request: current request
+    :type request: flask.Request
+    :return: content coding to send or None for the identity body
+    :rtype: str
+    """
+    offered = [encoding for encoding in SUPPORTED_ENCODINGS
+               if encoding in entry.encoded_bodies]
+    if not offered:
+        return None
+    return request.accept_encodings.best_match(offered)
+
+
+def make_cached_response(entry: CacheEntry,
+                         request: Request) -> Response:
+    """
+    Builds the response of a cached entry. Requests whose If-None-Match matches get
+    an empty 304, others get the body in the best accepted encoding. Each encoding is
+    its own representation so it has its own strong ETag.
+    There is no Last-Modified: the load time of the entry is not the time the data
+    changed and has a one second resolution, so a date validator could answer 304
+    with stale data. The ETag is derived from the body itself
+    :param entry: cached response
+    :type entry: CacheEntry
+    :param request: current request
+    :type request: flask.Request
+    :return: the response to send
+    :rtype: flask.Response
+    """
+    encoding = negotiate_encoding(entry, request)
+    etag = entry.etag if encoding is None else f"{entry.etag}-{encoding}"
+    if request.if_none_match and request.if_none_match.contains_weak(etag):
+        response = make_response(b'', 304)
+    else:
+        response = make_response(entry.body if encoding is None else entry.encoded_bodies[encoding],
+                                 200)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    # clients keep the body but check it is still current before using it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
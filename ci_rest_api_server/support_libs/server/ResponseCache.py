@@ -0,0 +1,300 @@
+# In process cache of serialized API responses
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import (Callable,
+                    Dict,
+                    Hashable,
+                    Optional,
+                    Tuple,
+                    )
+from ci_rest_api_server.support_libs.extractor.ExtractorLogger import logger
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional, gzip is always offered
+    brotli = None
+
+
+class CacheEntry:
+    """
+    Serialized response body held by the cache, with its validator (ETag) and its
+    compressed forms, all computed once when the body is loaded so that requests
+    never hash or compress. The version is the version of the data the body was
+    loaded from, see ResponseCache.get_or_load()
+    """
+    __slots__ = ('body', 'expires_at', 'etag', 'encoded_bodies', 'version', 'checked_at')
+    # Bodies smaller than this are not worth compressing
+    MIN_COMPRESS_SIZE = 256
+
+    def __init__(self, body: bytes,
+                 ttl_seconds: float,
+                 version: Optional[Hashable] = None):
+        self.body = body
+        self.checked_at = time.monotonic()
+        self.expires_at = self.checked_at + ttl_seconds
+        self.version = version
+        # strong validator, the same data always gives the same tag
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self.encoded_bodies: Dict[str, bytes] = {}
+        if len(body) >= self.MIN_COMPRESS_SIZE:
+            self.encoded_bodies['gzip'] = gzip.compress(body, compresslevel=6)
+            if brotli is not None:
+                self.encoded_bodies['br'] = brotli.compress(body, quality=5)
+
+    def __len__(self) -> int:
+        return len(self.body) + sum(len(encoded) for encoded in self.encoded_bodies.values())
+
+    def __repr__(self):
+        return f"CacheEntry({len(self.body)} bytes, etag={self.etag})"
+
+
+class _Flight:
+    """
+    A load in progress, concurrent misses of the same key wait on it instead of
+    sending their own query to the DB
+    """
+    __slots__ = ('done', 'entry', 'error', 'stale')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry: Optional[CacheEntry] = None
+        self.error: Optional[BaseException] = None
+        # set when the key is invalidated while loading, the result is not cached
+        self.stale = False
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache with a TTL for the serialized responses of the API. Filings
+    change at most once a quarter so a response can be served from memory until its
+    ticker is pushed again or its TTL runs out. A push of this process drops the
+    response (see invalidate()), the pushes of other processes are seen by comparing
+    the version of the data with the one of the response, at most every check_seconds
+    (see get_or_load()). Entries are evicted least recently used first when either
+    the entry count or the total body size goes over its limit. Misses of the same
+    key are coalesced into a single load
+    """
+
+    def __init__(self, max_entries: int = 1024,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 3600,
+                 check_seconds: float = 1.0):
+        """
+        :param max_entries: max number of responses held
+        :type max_entries: int
+        :param max_bytes: max total size of the bodies held
+        :type max_bytes: int
+        :param ttl_seconds: time after which a response is loaded again
+        :type ttl_seconds: float
+        :param check_seconds: time after which the version of a response is checked
+                              again, the longest a response outlives a push of another
+                              process
+        :type check_seconds: float
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl_seconds = ttl_seconds
+        self._check_seconds = check_seconds
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+            'outdated': 0,
+        }
+
+    @staticmethod
+    def key(form_type: str,
+            ticker: str) -> Tuple[str, str]:
+        """
+        :return: cache key of a (form, ticker) response, independent of the case used
+        :rtype: Tuple[str, str]
+        """
+        return form_type.upper(), ticker.lower()
+
+    def get_or_load(self, key: Hashable,
+                    loader: Callable[[], bytes],
+                    version: Optional[Callable[[], Hashable]] = None) -> CacheEntry:
+        """
+        Returns the cached response or loads it, only one loader runs at a time per key
+        and the other callers wait for its result
+        :param key: cache key, see key()
+        :type key: Hashable
+        :param loader: builds the serialized response on a miss
+        :type loader: Callable[[], bytes]
+        :param version: reads the current version of the data of the key, read before
+                        each load and at most every check_seconds on the hits: a
+                        response of another version is loaded again
+        :type version: Callable[[], Hashable]
+        :return: the cached entry
+        :rtype: CacheEntry
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    if version is None or entry.checked_at + self._check_seconds > now:
+                        self._counters['hits'] += 1
+                        return entry
+                    # one caller checks the version, the others serve the entry meanwhile
+                    entry.checked_at = now
+                else:
+                    self._remove_locked(key)
+                    self._counters['expirations'] += 1
+                    entry = None
+        if entry is not None:
+            if self._read_version(version) in (entry.version, None):
+                with self._lock:
+                    self._counters['hits'] += 1
+                return entry
+            with self._lock:
+                if self._entries.get(key) is entry:
+                    self._remove_locked(key)
+                self._counters['outdated'] += 1
+        return self._load(key, loader, version)
+
+    @staticmethod
+    def _read_version(version: Optional[Callable[[], Hashable]]) -> Optional[Hashable]:
+        """
+        :return: the current version, None when it is unknown or could not be read
+        :rtype: Hashable
+        """
+        if version is None:
+            return None
+        try:
+            return version()
+        except Exception as err:
+            # the cached response is served, it is checked again after check_seconds
+            logger.warning("Unable to read the version of a cached response err:%s", err)
+            return None
+
+    def _load(self, key: Hashable,
+              loader: Callable[[], bytes],
+              version: Optional[Callable[[], Hashable]]) -> CacheEntry:
+        """
+        Loads the response of a miss, or waits for the load of another caller
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._counters['coalesced'] += 1
+                leader = False
+            else:
+                self._counters['misses'] += 1
+                flight = self._flights[key] = _Flight()
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.entry
+
+        try:
+            # read first, a push during the load leaves the entry at the older version
+            loaded_version = self._read_version(version)
+            flight.entry = self._new_entry(loader(), loaded_version)
+        except BaseException as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                if flight.entry is not None and not flight.stale:
+                    self._store_locked(key, flight.entry)
+            flight.done.set()
+        return flight.entry
+
+    def _new_entry(self, body: bytes,
+                   version: Optional[Hashable] = None) -> CacheEntry:
+        """
+        :return: entry for a freshly loaded body
+        :rtype: CacheEntry
+        """
+        return CacheEntry(body, self._ttl_seconds, version)
+
+    def _store_locked(self, key: Hashable,
+                      entry: CacheEntry):
+        """
+        Adds the entry and evicts the least recently used ones over the limits
+        """
+        if key in self._entries:
+            self._remove_locked(key)
+        if len(entry) > self._max_bytes:
+            # bigger than the whole cache, serve it without caching
+            return
+        self._entries[key] = entry
+        self._size_bytes += len(entry)
+        while len(self._entries) > self._max_entries or self._size_bytes > self._max_bytes:
+            evicted_key, _ = next(iter(self._entries.items()))
+            self._remove_locked(evicted_key)
+            self._counters['evictions'] += 1
+
+    def _remove_locked(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self._size_bytes -= len(entry)
+
+    def invalidate(self, form_type: str,
+                   ticker: str):
+        """
+        Drops the response of a ticker, called when the ticker is pushed to the DB.
+        A load running at that moment is not cached as it may hold the old data
+        :param form_type: SEC form type e.g 10-K
+        :type form_type: str
+        :param ticker: ticker symbol
+        :type ticker: str
+        """
+        key = self.key(form_type, ticker)
+        with self._lock:
+            if key in self._entries:
+                self._remove_locked(key)
+                self._counters['invalidations'] += 1
+            flight = self._flights.pop(key, None)
+            if flight is not None:
+                flight.stale = True
+        logger.debug("Invalidated cached response %s", key)
+
+    def clear(self):
+        """
+        Drops every cached response, the counters are kept
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+            for flight in self._flights.values():
+                flight.stale = True
+            self._flights.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: hit, miss, eviction ... counters and the current size of the cache
+        :rtype: dict
+        """
+        with self._lock:
+            cache_stats = dict(self._counters)
+            cache_stats['entries'] = len(self._entries)
+            cache_stats['bytes'] = self._size_bytes
+            cache_stats['max_entries'] = self._max_entries
+            cache_stats['max_bytes'] = self._max_bytes
+        return cache_stats
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self):
+        return (f"ResponseCache(max_entries={self._max_entries}, "
+                f"max_bytes={self._max_bytes}, ttl_seconds={self._ttl_seconds}, "
+                f"check_seconds={self._check_seconds})")
@@ -0,0 +1,10 @@
+# exports the API's from the server side helpers, each one is imported on first use (see LazyExports)
+from ..LazyExports import LazyExports
+
+LazyExports.install(__name__, {
+    'CacheEntry': '.ResponseCache',
+    'ResponseCache': '.ResponseCache',
+
+    'make_cached_response': '.HttpCaching',
+    'negotiate_encoding': '.HttpCaching',
+})
\ No newline at end of file
@@ -0,0 +1,79 @@
+import gzip
+import time
+import unittest
+
+from flask import (Flask,
+                   request,
+                   )
+from werkzeug.http import http_date
+
+from ci_rest_api_server.support_libs.server.HttpCaching import make_cached_response
+from ci_rest_api_server.support_libs.server.ResponseCache import CacheEntry
+
+TEST_APP = Flask(__name__)
+BODY = b'{"2018": {"assets": 365725000000}}' * 20
+
+
+class TestHttpCaching(unittest.TestCase):
+    def setUp(self) -> None:
+        self.entry = CacheEntry(BODY, ttl_seconds=60)
+
+    def test_identity_body_with_validators(self):
+        """
+        Without Accept-Encoding the plain body is sent with its ETag
+        """
+        with TEST_APP.test_request_context('/'):
+            response = make_cached_response(self.entry, request)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(BODY, response.get_data())
+        self.assertEqual(f'"{self.entry.etag}"', response.headers['ETag'])
+        self.assertNotIn('Last-Modified', response.headers)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_same_body_same_etag(self):
+        """
+        The ETag only depends on the content
+        """
+        self.assertEqual(self.entry.etag, CacheEntry(BODY, ttl_seconds=1).etag)
+        self.assertNotEqual(self.entry.etag, CacheEntry(BODY + b' ', ttl_seconds=1).etag)
+
+    def test_gzip_negotiated(self):
+        """
+        The precomputed gzip body is sent to clients accepting it
+        """
+        with TEST_APP.test_request_context('/', headers={'Accept-Encoding': 'gzip'}):
+            response = make_cached_response(self.entry, request)
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual(BODY, gzip.decompress(response.get_data()))
+        self.assertEqual(f'"{self.entry.etag}-gzip"', response.headers['ETag'])
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+
+    def test_if_none_match(self):
+        """
+        A matching If-None-Match is answered with an empty 304
+        """
+        with TEST_APP.test_request_context('/', headers={'If-None-Match': f'"{self.entry.etag}"'}):
+            response = make_cached_response(self.entry, request)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.get_data())
+
+    def test_if_none_match_stale(self):
+        """
+        An old ETag gets the full body
+        """
+        with TEST_APP.test_request_context('/', headers={'If-None-Match': '"old"'}):
+            response = make_cached_response(self.entry, request)
+        self.assertEqual(200, response.status_code)
+
+    def test_if_modified_since_ignored(self):
+        """
+        Only the ETag validates a cached body, a date never gives a 304
+        """
+        with TEST_APP.test_request_context('/', headers={'If-Modified-Since': http_date(time.time() + 3600)}):
+            response = make_cached_response(self.entry, request)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(BODY, response.get_data())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from ci_rest_api_server.support_libs.server.ResponseCache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_hit_after_miss(self):
+        """
+        The loader only runs on the first access
+        """
+        test_obj = ResponseCache()
+        calls = []
+        for _ in range(3):
+            entry = test_obj.get_or_load(('10-K', 'aapl'), lambda: calls.append(1) or b'body')
+        self.assertEqual(b'body', entry.body)
+        self.assertEqual(1, len(calls))
+        self.assertEqual((2, 1), (test_obj.stats()['hits'], test_obj.stats()['misses']))
+
+    def test_key_is_case_insensitive(self):
+        """
+        Form and ticker are normalised in the key
+        """
+        self.assertEqual(ResponseCache.key('10-k', 'AAPL'), ResponseCache.key('10-K', 'aapl'))
+
+    def test_ttl_expiry(self):
+        """
+        Entries older than the TTL are loaded again
+        """
+        test_obj = ResponseCache(ttl_seconds=0.01)
+        test_obj.get_or_load('key', lambda: b'old')
+        time.sleep(0.02)
+        self.assertEqual(b'new', test_obj.get_or_load('key', lambda: b'new').body)
+        self.assertEqual(1, test_obj.stats()['expirations'])
+
+    def test_outdated_version(self):
+        """
+        A hit whose data has another version is loaded again
+        """
+        test_obj = ResponseCache(check_seconds=0)
+        versions = [1]
+        test_obj.get_or_load('key', lambda: b'old', lambda: versions[-1])
+        self.assertEqual(b'old', test_obj.get_or_load('key', lambda: b'new', lambda: versions[-1]).body)
+        versions.append(2)
+        self.assertEqual(b'new', test_obj.get_or_load('key', lambda: b'new', lambda: versions[-1]).body)
+        self.assertEqual((1, 1), (test_obj.stats()['hits'], test_obj.stats()['outdated']))
+
+    def test_version_checked_every_check_seconds(self):
+        """
+        The hits within check_seconds of the last check do not read the version
+        """
+        test_obj = ResponseCache(check_seconds=60)
+        reads = []
+        test_obj.get_or_load('key', lambda: b'old', lambda: reads.append(1) or len(reads))
+        for _ in range(3):
+            entry = test_obj.get_or_load('key', lambda: b'new', lambda: reads.append(1) or len(reads))
+        self.assertEqual((b'old', 1), (entry.body, len(reads)))
+
+    def test_unreadable_version(self):
+        """
+        The cached response is served when the version can not be read
+        """
+        test_obj = ResponseCache(check_seconds=0)
+        test_obj.get_or_load('key', lambda: b'old', lambda: 1)
+
+        def version():
+            raise ConnectionError('no db')
+        self.assertEqual(b'old', test_obj.get_or_load('key', lambda: b'new', version).body)
+
+    def test_lru_eviction_by_count(self):
+        """
+        The least recently used entry goes first when over the entry limit
+        """
+        test_obj = ResponseCache(max_entries=2)
+        test_obj.get_or_load('a', lambda: b'a')
+        test_obj.get_or_load('b', lambda: b'b')
+        # touch a so that b is the least recently used
+        test_obj.get_or_load('a', lambda: b'a')
+        test_obj.get_or_load('c', lambda: b'c')
+        self.assertEqual(b'a', test_obj.get_or_load('a', lambda: b'reloaded').body)
+        self.assertEqual(b'reloaded', test_obj.get_or_load('b', lambda: b'reloaded').body)
+        self.assertEqual(2, test_obj.stats()['evictions'])
+
+    def test_eviction_by_size(self):
+        """
+        The total body size is kept under its limit
+        """
+        test_obj = ResponseCache(max_bytes=10)
+        test_obj.get_or_load('a', lambda: b'x' * 6)
+        test_obj.get_or_load('b', lambda: b'x' * 6)
+        self.assertEqual(1, len(test_obj))
+        self.assertEqual(6, test_obj.stats()['bytes'])
+
+    def test_invalidate(self):
+        """
+        An invalidated ticker is loaded again
+        """
+        test_obj = ResponseCache()
+        test_obj.get_or_load(ResponseCache.key('10-K', 'aapl'), lambda: b'old')
+        test_obj.invalidate('10-k', 'AAPL')
+        self.assertEqual(b'new', test_obj.get_or_load(ResponseCache.key('10-K', 'aapl'), lambda: b'new').body)
+        self.assertEqual(1, test_obj.stats()['invalidations'])
+
+    def test_single_flight(self):
+        """
+        Concurrent misses of the same key run the loader once
+        """
+        test_obj = ResponseCache()
+        calls, release = [], threading.Event()
+
+        def slow_loader():
+            calls.append(1)
+            release.wait()
+            return b'body'
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(test_obj.get_or_load, 'key', slow_loader) for _ in range(8)]
+            while test_obj.stats()['coalesced'] < 7:
+                time.sleep(0.001)
+            release.set()
+            bodies = [future.result().body for future in futures]
+        self.assertEqual([b'body'] * 8, bodies)
+        self.assertEqual(1, len(calls))
+
+    def test_loader_error_not_cached(self):
+        """
+        A failing load raises and the next access tries again
+        """
+        test_obj = ResponseCache()
+
+        def failing_loader():
+            raise LookupError('not found')
+
+        with self.assertRaises(LookupError):
+            test_obj.get_or_load('key', failing_loader)
+        self.assertEqual(b'body', test_obj.get_or_load('key', lambda: b'body').body)
+
+    def test_invalidated_while_loading(self):
+        """
+        A load racing with an invalidation is served but not cached
+        """
+        test_obj = ResponseCache()
+
+        def loader():
+            test_obj.invalidate('10-K', 'aapl')
+            return b'old'
+
+        key = ResponseCache.key('10-K', 'aapl')
+        self.assertEqual(b'old', test_obj.get_or_load(key, loader).body)
+        self.assertEqual(0, len(test_obj))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+import unittest
+
+import ci_rest_api_server.support_libs.extractor as extractor
+
+# never imported by an API process, only by the ingestion (IExtractDBPush and the parsers)
+INGESTION_MODULES = ('secedgar', 'bs4', 'lxml', 'numpy', 'requests',
+                     'ci_rest_api_server.support_libs.extractor.IExtractDBPush')
+
+
+class TestLazyExports(unittest.TestCase):
+    def test_app_import_graph(self):
+        """
+        Importing the app loads the read path only, in a fresh interpreter
+        """
+        script = ('import sys, ci_rest_api_server.app\n'
+                  f'print(",".join(name for name in {INGESTION_MODULES!r} if name in sys.modules))')
+        output = subprocess.run([sys.executable, '-c', script], check=True,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout
+        self.assertEqual('', output.strip())
+
+    def test_exports(self):
+        """
+        An export is its class even when the module of the same name is loaded first
+        """
+        from ci_rest_api_server.support_libs.extractor.StorageLayout import StorageLayout
+        from ci_rest_api_server.support_libs.extractor import ExtractDBPull
+        self.assertIs(StorageLayout, extractor.StorageLayout)
+        self.assertEqual('ExtractDBPull', ExtractDBPull.__name__)
+        self.assertIn('ScreenQuery', dir(extractor))
+        with self.assertRaises(AttributeError):
+            extractor.NotExported
+        with self.assertRaises(ImportError):
+            from ci_rest_api_server.support_libs.extractor import NotExported
+
+
+if __name__ == '__main__':
+    unittest.main()